@@ -0,0 +1,70 @@
+"""add chat hot query indexes
+
+Revision ID: 489a457bf5a1
+Revises: ae4bf9509a19
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '489a457bf5a1'
+down_revision: Union[str, Sequence[str], None] = 'ae4bf9509a19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_table(name: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции,
+    # зато он не блокирует запись в таблицы на время построения индекса
+    with op.get_context().autocommit_block():
+        # Поиск персонажа по имени без учёта регистра на каждом запросе чата/генерации
+        op.create_index(
+            'ix_characters_name_lower', 'characters', [sa.text('lower(name)')],
+            unique=False, postgresql_concurrently=True,
+        )
+
+        # Загрузка истории сессии: WHERE session_id = ? ORDER BY timestamp
+        op.create_index(
+            'ix_chat_messages_session_id_timestamp', 'chat_messages', ['session_id', 'timestamp'],
+            unique=False, postgresql_concurrently=True,
+        )
+        # Одноколоночный индекс покрывается составным
+        op.drop_index(
+            op.f('ix_chat_messages_session_id'), table_name='chat_messages', postgresql_concurrently=True,
+        )
+
+        # Таблица chat_history создаётся моделями приложения, а не миграциями
+        if _has_table('chat_history'):
+            op.create_index(
+                'ix_chat_history_user_character_session_created',
+                'chat_history', ['user_id', 'character_name', 'session_id', 'created_at'],
+                unique=False, postgresql_concurrently=True, if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        if _has_table('chat_history'):
+            op.drop_index(
+                'ix_chat_history_user_character_session_created', table_name='chat_history',
+                postgresql_concurrently=True, if_exists=True,
+            )
+        op.create_index(
+            op.f('ix_chat_messages_session_id'), 'chat_messages', ['session_id'],
+            unique=False, postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'ix_chat_messages_session_id_timestamp', table_name='chat_messages', postgresql_concurrently=True,
+        )
+        op.drop_index('ix_characters_name_lower', table_name='characters', postgresql_concurrently=True)
@@ -0,0 +1,85 @@
+"""refresh token indexes
+
+Revision ID: 5b2e7c91d4a3
+Revises: 88938a032d5f
+Create Date: 2026-10-19 12:10:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b2e7c91d4a3'
+down_revision: Union[str, Sequence[str], None] = '88938a032d5f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _has_table(name: str) -> bool:
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Таблица refresh_tokens создаётся моделями приложения, а не миграциями
+    if not _has_table('refresh_tokens'):
+        return
+
+    # Совпадение хешей случайных токенов практически невозможно, но дубль
+    # оставил бы невалидный индекс после неудачного CREATE INDEX CONCURRENTLY
+    op.execute("""
+        DELETE FROM refresh_tokens AS t
+        USING refresh_tokens AS d
+        WHERE t.token_hash = d.token_hash AND t.id > d.id
+    """)
+
+    with op.get_context().autocommit_block():
+        # Поиск при обновлении и logout: WHERE token_hash = ?
+        op.create_index(
+            'uq_refresh_tokens_token_hash', 'refresh_tokens', ['token_hash'],
+            unique=True, postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index(
+            op.f('ix_refresh_tokens_token_hash'), table_name='refresh_tokens',
+            postgresql_concurrently=True, if_exists=True,
+        )
+        # Отзыв всех токенов пользователя при повторном использовании токена.
+        # now() нельзя использовать в условии индекса, поэтому индекс частичный
+        # по is_active, а истёкшие строки убирает фоновая очистка
+        op.create_index(
+            'ix_refresh_tokens_active_user_id', 'refresh_tokens', ['user_id', 'expires_at'],
+            unique=False, postgresql_concurrently=True, if_not_exists=True,
+            postgresql_where=sa.text('is_active'),
+        )
+        # Фоновая очистка: WHERE expires_at < now() LIMIT batch
+        op.create_index(
+            'ix_refresh_tokens_expires_at', 'refresh_tokens', ['expires_at'],
+            unique=False, postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if not _has_table('refresh_tokens'):
+        return
+
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            'ix_refresh_tokens_expires_at', table_name='refresh_tokens',
+            postgresql_concurrently=True, if_exists=True,
+        )
+        op.drop_index(
+            'ix_refresh_tokens_active_user_id', table_name='refresh_tokens',
+            postgresql_concurrently=True, if_exists=True,
+        )
+        op.create_index(
+            op.f('ix_refresh_tokens_token_hash'), 'refresh_tokens', ['token_hash'],
+            unique=False, postgresql_concurrently=True, if_not_exists=True,
+        )
+        op.drop_index(
+            'uq_refresh_tokens_token_hash', table_name='refresh_tokens',
+            postgresql_concurrently=True, if_exists=True,
+        )
@@ -0,0 +1,65 @@
+"""unique chat session per character and user
+
+Revision ID: 88938a032d5f
+Revises: 489a457bf5a1
+Create Date: 2026-10-19 12:05:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '88938a032d5f'
+down_revision: Union[str, Sequence[str], None] = '489a457bf5a1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Для каждой пары (character_id, user_id) оставляем самую раннюю сессию
+DUPLICATE_SESSIONS = """
+    SELECT id, min(id) OVER (PARTITION BY character_id, user_id) AS keep_id
+    FROM chat_sessions
+    WHERE user_id IS NOT NULL
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Параллельный get-or-create мог создать дубли сессий: переносим их
+    # сообщения в сохраняемую сессию и удаляем лишние записи
+    op.execute(f"""
+        UPDATE chat_messages AS m
+        SET session_id = d.keep_id
+        FROM ({DUPLICATE_SESSIONS}) AS d
+        WHERE m.session_id = d.id AND d.id <> d.keep_id
+    """)
+    op.execute(f"""
+        DELETE FROM chat_sessions AS s
+        USING ({DUPLICATE_SESSIONS}) AS d
+        WHERE s.id = d.id AND d.id <> d.keep_id
+    """)
+
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'uq_chat_sessions_character_id_user_id', 'chat_sessions', ['character_id', 'user_id'],
+            unique=True, postgresql_concurrently=True,
+        )
+        # Поиск по character_id покрывается уникальным составным индексом
+        op.drop_index(
+            op.f('ix_chat_sessions_character_id'), table_name='chat_sessions', postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.create_index(
+            op.f('ix_chat_sessions_character_id'), 'chat_sessions', ['character_id'],
+            unique=False, postgresql_concurrently=True,
+        )
+        op.drop_index(
+            'uq_chat_sessions_character_id_user_id', table_name='chat_sessions', postgresql_concurrently=True,
+        )
@@ -3,18 +3,22 @@
 """
 
 from datetime import datetime, timedelta, timezone
-from fastapi import APIRouter, HTTPException, Request, Depends
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request, Depends
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.schemas.auth import (
     UserCreate, UserLogin, UserResponse, 
     TokenResponse, RefreshTokenRequest, Message
 )
+from app.database.db import async_session_maker
 from app.database.db_depends import get_db
-from app.models.user import Users, RefreshToken, EmailVerificationCode
+from app.models.user import Users, EmailVerificationCode
 from app.auth.utils import (
-    hash_password, verify_password, hash_token, 
-    create_refresh_token, get_token_expiry, generate_verification_code, send_verification_email
+    hash_password, verify_password, get_token_expiry, generate_verification_code, send_verification_email
+)
+from app.auth.token_store import (
+    InvalidRefreshTokenError,
+    issue_refresh_token, revoke_refresh_token, rotate_refresh_token
 )
 from app.auth.rate_limiter import get_rate_limiter, RateLimiter
 from app.auth.dependencies import get_current_user
@@ -28,7 +32,6 @@ auth_router = APIRouter()
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
-REFRESH_TOKEN_EXPIRE_DAYS = 7
 
 
 def create_jwt_token(data: dict, expires_delta: timedelta) -> str:
@@ -52,6 +55,23 @@ async def activate_base_subscription(user_id: int, db: AsyncSession) -> None:
         # Не прерываем регистрацию из-за ошибки подписки
 
 
+async def ensure_base_subscription(user_id: int) -> None:
+    """
+    Активирует подписку Base, если у пользователя её нет.
+    Выполняется после ответа на логин в отдельной сессии БД.
+    """
+    try:
+        async with async_session_maker() as db:
+            subscription_service = SubscriptionService(db)
+            if await subscription_service.get_user_subscription(user_id):
+                return
+            print(f"[DEBUG] У пользователя {user_id} нет подписки, активируем Base")
+            await subscription_service.create_subscription(user_id, "base")
+            print(f"[OK] Подписка Base активирована для пользователя {user_id}")
+    except Exception as e:
+        print(f"[ERROR] Ошибка проверки/активации подписки для пользователя {user_id}: {e}")
+
+
 @auth_router.post("/auth/register/", response_model=UserResponse)
 async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     """
@@ -122,6 +142,7 @@ async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
 @auth_router.post("/auth/login/", response_model=TokenResponse)
 async def login_user(
     user_credentials: UserLogin, 
+    background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db),
     rate_limiter: RateLimiter = Depends(get_rate_limiter)
 ):
@@ -130,6 +151,7 @@ async def login_user(
 
     Parameters:
     - user_credentials: User login credentials.
+    - background_tasks: Post-response tasks (base subscription check).
     - db: Database session.
     - rate_limiter: Rate limiter instance.
 
@@ -186,29 +208,10 @@ async def login_user(
         expires_delta=access_token_expires
     )
     
-    refresh_token = create_refresh_token()
-    refresh_token_hash = hash_token(refresh_token)
-    refresh_expires = get_token_expiry(REFRESH_TOKEN_EXPIRE_DAYS)
-    
-    # Save refresh token
-    db_refresh_token = RefreshToken(
-        user_id=user.id,
-        token_hash=refresh_token_hash,
-        expires_at=refresh_expires
-    )
-    db.add(db_refresh_token)
-    await db.commit()
+    refresh_token = await issue_refresh_token(db, user.id)
     
-    # Проверяем и активируем подписку Base, если её нет
-    try:
-        subscription_service = SubscriptionService(db)
-        existing_subscription = await subscription_service.get_user_subscription(user.id)
-        if not existing_subscription:
-            print(f"[DEBUG] У пользователя {user.email} нет подписки, активируем Base")
-            await subscription_service.create_subscription(user.id, "base")
-            print(f"[OK] Подписка Base активирована для пользователя {user.email}")
-    except Exception as e:
-        print(f"[ERROR] Ошибка проверки/активации подписки для пользователя {user.email}: {e}")
+    # Проверка подписки Base не задерживает ответ на логин
+    background_tasks.add_task(ensure_base_subscription, user.id)
     
     print(f"User {user.email} logged in successfully")
     
@@ -234,24 +237,17 @@ async def refresh_token(
     Returns:
     - TokenResponse: New access and refresh tokens.
     """
-    refresh_token_hash = hash_token(refresh_request.refresh_token)
-    
-    # Find refresh token
-    result = await db.execute(select(RefreshToken).filter(
-        RefreshToken.token_hash == refresh_token_hash,
-        RefreshToken.is_active == True,
-        RefreshToken.expires_at > datetime.now(timezone.utc).replace(tzinfo=None)
-    ))
-    db_refresh_token = result.scalar_one_or_none()
-    
-    if not db_refresh_token:
+    # Rotate refresh token; reuse of a rotated token revokes all user's tokens
+    try:
+        user_id, new_refresh_token = await rotate_refresh_token(db, refresh_request.refresh_token)
+    except InvalidRefreshTokenError:
         raise HTTPException(
             status_code=401,
             detail="Invalid or expired refresh token"
         )
     
     # Get user
-    result = await db.execute(select(Users).filter(Users.id == db_refresh_token.user_id))
+    result = await db.execute(select(Users).filter(Users.id == user_id))
     user = result.scalar_one_or_none()
     if not user or not user.is_active:
         raise HTTPException(
@@ -259,29 +255,13 @@ async def refresh_token(
             detail="User not found or inactive"
         )
     
-    # Deactivate old refresh token
-    db_refresh_token.is_active = False
-    
-    # Create new tokens
+    # Create new access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_jwt_token(
         data={"sub": user.email}, 
         expires_delta=access_token_expires
     )
     
-    new_refresh_token = create_refresh_token()
-    new_refresh_token_hash = hash_token(new_refresh_token)
-    refresh_expires = get_token_expiry(REFRESH_TOKEN_EXPIRE_DAYS)
-    
-    # Save new refresh token
-    new_db_refresh_token = RefreshToken(
-        user_id=user.id,
-        token_hash=new_refresh_token_hash,
-        expires_at=refresh_expires
-    )
-    db.add(new_db_refresh_token)
-    await db.commit()
-    
     return TokenResponse(
         access_token=access_token,
         refresh_token=new_refresh_token,
@@ -304,18 +284,7 @@ async def logout_user(
     Returns:
     - Message: Logout confirmation.
     """
-    refresh_token_hash = hash_token(refresh_request.refresh_token)
-    
-    # Find and deactivate refresh token
-    result = await db.execute(select(RefreshToken).filter(
-        RefreshToken.token_hash == refresh_token_hash,
-        RefreshToken.is_active == True
-    ))
-    db_refresh_token = result.scalar_one_or_none()
-    
-    if db_refresh_token:
-        db_refresh_token.is_active = False
-        await db.commit()
+    await revoke_refresh_token(db, refresh_request.refresh_token)
     
     return Message(message="Successfully logged out")
 
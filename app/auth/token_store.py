@@ -0,0 +1,202 @@
+"""
+Хранилище refresh-токенов.
+
+В базе хранится только SHA-256 токена, поиск идёт по уникальному индексу
+token_hash. При обновлении токен ротируется: старая запись деактивируется,
+но остаётся в таблице до истечения срока, чтобы повторное предъявление уже
+использованного токена распознавалось как утечка — в этом случае отзываются
+все активные токены пользователя. Истёкшие записи удаляет фоновая задача
+пачками, не блокируя таблицу надолго.
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Tuple
+
+from sqlalchemy import any_, delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.auth.utils import create_refresh_token, get_token_expiry, hash_token
+from app.config.settings import settings
+from app.models.user import RefreshToken
+
+logger = logging.getLogger(__name__)
+
+REFRESH_TOKEN_EXPIRE_DAYS = 7
+
+
+class InvalidRefreshTokenError(Exception):
+    """Токен не найден или истёк."""
+
+
+class RefreshTokenReuseError(InvalidRefreshTokenError):
+    """Предъявлен уже ротированный или отозванный токен."""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        super().__init__(f"Повторное использование refresh-токена пользователя {user_id}")
+
+
+def _utcnow() -> datetime:
+    # Колонки expires_at хранятся без часового пояса (см. get_token_expiry)
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+async def issue_refresh_token(
+    db: AsyncSession, user_id: int, days: int = REFRESH_TOKEN_EXPIRE_DAYS, commit: bool = True
+) -> str:
+    """Создаёт refresh-токен пользователя и возвращает его открытое значение."""
+    token = create_refresh_token()
+    db.add(RefreshToken(user_id=user_id, token_hash=hash_token(token), expires_at=get_token_expiry(days)))
+    if commit:
+        await db.commit()
+    return token
+
+
+async def revoke_user_tokens(db: AsyncSession, user_id: int, commit: bool = True) -> int:
+    """Отзывает все активные refresh-токены пользователя."""
+    result = await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.user_id == user_id, RefreshToken.is_active == True)  # noqa: E712
+        .values(is_active=False)
+    )
+    if commit:
+        await db.commit()
+    return result.rowcount or 0
+
+
+async def rotate_refresh_token(
+    db: AsyncSession, token: str, days: int = REFRESH_TOKEN_EXPIRE_DAYS
+) -> Tuple[int, str]:
+    """
+    Меняет refresh-токен на новый и возвращает (user_id, новый токен).
+
+    Строка блокируется на время ротации, поэтому из двух параллельных
+    запросов с одним токеном успешен только первый.
+    """
+    result = await db.execute(
+        select(RefreshToken).where(RefreshToken.token_hash == hash_token(token)).with_for_update()
+    )
+    stored: Optional[RefreshToken] = result.scalar_one_or_none()
+    if stored is None or stored.expires_at <= _utcnow():
+        await db.rollback()
+        raise InvalidRefreshTokenError("Invalid or expired refresh token")
+
+    if not stored.is_active:
+        revoked = await revoke_user_tokens(db, stored.user_id)
+        logger.warning(
+            f"[WARNING] Повторно предъявлен ротированный refresh-токен пользователя {stored.user_id}, "
+            f"отозвано активных токенов: {revoked}"
+        )
+        raise RefreshTokenReuseError(stored.user_id)
+
+    stored.is_active = False
+    new_token = await issue_refresh_token(db, stored.user_id, days, commit=False)
+    await db.commit()
+    return stored.user_id, new_token
+
+
+async def revoke_refresh_token(db: AsyncSession, token: str) -> bool:
+    """Деактивирует токен (logout). Возвращает False, если активного токена не было."""
+    result = await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.token_hash == hash_token(token), RefreshToken.is_active == True)  # noqa: E712
+        .values(is_active=False)
+    )
+    await db.commit()
+    return bool(result.rowcount)
+
+
+async def compact_refresh_tokens(
+    session_maker: async_sessionmaker, batch_size: int = 1000, pause: float = 0.05
+) -> int:
+    """
+    Удаляет истёкшие токены (в том числе ротированные и отозванные) пачками
+    по batch_size, каждая пачка — в своей короткой транзакции.
+    """
+    deleted = 0
+    while True:
+        async with session_maker() as db:
+            # ORDER BY expires_at читает пачку по индексу, а id = ANY(ARRAY(...))
+            # удаляет её по первичному ключу; с IN (подзапрос) PostgreSQL
+            # сканирует всю таблицу на каждую пачку
+            expired_ids = (
+                select(RefreshToken.id)
+                .where(RefreshToken.expires_at < _utcnow())
+                .order_by(RefreshToken.expires_at)
+                .limit(batch_size)
+                .scalar_subquery()
+            )
+            result = await db.execute(
+                delete(RefreshToken).where(RefreshToken.id == any_(func.array(expired_ids))).execution_options(
+                    synchronize_session=False
+                )
+            )
+            await db.commit()
+        count = result.rowcount or 0
+        deleted += count
+        if count < batch_size:
+            return deleted
+        # Даём пройти конкурирующим запросам между пачками
+        await asyncio.sleep(pause)
+
+
+class RefreshTokenCompactor:
+    """Периодическая очистка таблицы refresh-токенов."""
+
+    def __init__(self, session_maker: Optional[async_sessionmaker] = None, interval: float = 3600.0,
+                 batch_size: int = 1000):
+        self.session_maker = session_maker
+        self.interval = interval
+        self.batch_size = batch_size
+        self.last_deleted = 0
+        self.last_run: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        if self.session_maker is None:
+            from app.database.db import async_session_maker
+            self.session_maker = async_session_maker
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"[OK] Очистка refresh-токенов запущена: каждые {self.interval:.0f} сек")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def run_once(self) -> int:
+        self.last_deleted = await compact_refresh_tokens(self.session_maker, self.batch_size)
+        self.last_run = datetime.now(timezone.utc).timestamp()
+        if self.last_deleted:
+            logger.info(f"[OK] Удалено истёкших refresh-токенов: {self.last_deleted}")
+        return self.last_deleted
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"[ERROR] Ошибка очистки refresh-токенов: {e}")
+            await asyncio.sleep(self.interval)
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "last_run": self.last_run,
+            "last_deleted": self.last_deleted,
+        }
+
+
+refresh_token_compactor = RefreshTokenCompactor(
+    interval=settings.REFRESH_TOKEN_COMPACTION_INTERVAL,
+    batch_size=settings.REFRESH_TOKEN_COMPACTION_BATCH,
+)
@@ -2,6 +2,7 @@
 Утилиты для аутентификации.
 """
 
+import asyncio
 import hashlib
 import secrets
 import random
@@ -41,16 +42,24 @@ def generate_verification_code() -> str:
 
 async def send_verification_email(email: str, code: str) -> None:
     """
-    Отправляет код верификации на email.
+    Ставит письмо с кодом верификации в очередь отправки.
+    Если очередь не запущена (скрипты, тесты), письмо отправляется в потоке.
     """
     try:
+        from app.mail_service.messages import verification_email
+        from app.mail_service.queue import email_queue
+
+        if email_queue.running:
+            email_queue.enqueue(verification_email(email, code))
+            return
+
         from app.mail_service.sender import EmailSender
         email_sender = EmailSender()
-        success = email_sender.send_verification_email(email, code)
+        success = await asyncio.to_thread(email_sender.send_verification_email, email, code)
         
         if not success:
             print(f"Verification code {code} for {email} (real sending disabled)")
             
     except Exception as e:
         print(f"Error sending email: {e}")
-        print(f"Verification code {code} for {email} (email sending disabled)")
\ No newline at end of file
+        print(f"Verification code {code} for {email} (email sending disabled)")
@@ -1,131 +1,282 @@
 """
 Система реестра персонажей для автоматического подключения.
+
+Реестр не импортирует все модули персонажей при старте. Он строит
+компактный манифест (имя -> файл, mtime, размер, хэш) и сохраняет его на
+диск вместе с результатом валидации и полями для списка персонажей.
+Модуль персонажа загружается и валидируется при первом обращении, а в
+памяти держатся только последние использованные персонажи (LRU).
+При перезагрузке файлы с прежними mtime и размером не перечитываются.
 """
-import os
-import importlib
+import hashlib
+import importlib.util
+import json
 import logging
-from typing import Dict, List, Any, Optional
+import os
+from collections import OrderedDict
 from pathlib import Path
+from typing import Dict, List, Any, Optional, Tuple
+
+from app.config.settings import settings
 
 logger = logging.getLogger(__name__)
 
+MANIFEST_VERSION = 1
+
+
+def _file_hash(path: Path) -> str:
+    return hashlib.sha1(path.read_bytes()).hexdigest()
+
 
 class CharacterRegistry:
     """Реестр персонажей для автоматического подключения."""
-    
-    def __init__(self):
+
+    def __init__(self, characters_dir: Optional[Path] = None, cache_size: int = 64,
+                 manifest_path: Optional[Path] = None):
         """Инициализация реестра персонажей."""
-        self.characters: Dict[str, Dict[str, Any]] = {}
-        self.characters_dir = Path(__file__).parent.parent / "models" / "characters"
-        self._load_characters()
-    
-    def _load_characters(self) -> None:
-        """Загружает всех персонажей из папки characters."""
+        self.characters_dir = Path(characters_dir) if characters_dir else Path(__file__).parent.parent / "models" / "characters"
+        self.cache_size = cache_size
+        self.manifest_path = Path(manifest_path) if manifest_path else None
+        # Ключ — имя в нижнем регистре
+        self._manifest: Dict[str, Dict[str, Any]] = {}
+        self._resident: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Добавленные вручную: ключ -> (имя, данные); не вытесняются
+        self._manual: Dict[str, Tuple[str, Dict[str, Any]]] = {}
+        self._scanned = False
+        self.loads = 0
+
+    # --- Манифест ------------------------------------------------------------
+
+    def _read_saved_manifest(self) -> Dict[str, Dict[str, Any]]:
+        if self.manifest_path is None or not self.manifest_path.exists():
+            return {}
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"[WARNING] Манифест персонажей повреждён, будет пересобран: {e}")
+            return {}
+        if data.get("version") != MANIFEST_VERSION or data.get("dir") != str(self.characters_dir):
+            return {}
+        return data.get("characters", {})
+
+    def _save_manifest(self) -> None:
+        if self.manifest_path is None:
+            return
+        try:
+            self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.manifest_path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": MANIFEST_VERSION, "dir": str(self.characters_dir),
+                           "characters": self._manifest}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            logger.warning(f"[WARNING] Не удалось сохранить манифест персонажей: {e}")
+
+    def _scan(self) -> None:
+        """Строит манифест; хэш пересчитывается только у файлов с новыми mtime или размером."""
+        previous = self._manifest or self._read_saved_manifest()
+        manifest: Dict[str, Dict[str, Any]] = {}
+        self._scanned = True
+
+        if not self.characters_dir.exists():
+            logger.error(f"[ERROR] Папка персонажей не найдена: {self.characters_dir}")
+            self._manifest = manifest
+            return
+
+        for entry in os.scandir(self.characters_dir):
+            if not entry.name.endswith(".py") or entry.name.startswith("__") or not entry.is_file():
+                continue
+            name = entry.name[:-3]
+            stat = entry.stat()
+            old = previous.get(name.lower())
+            if old and old["file"] == entry.name and old["mtime_ns"] == stat.st_mtime_ns and old["size"] == stat.st_size:
+                manifest[name.lower()] = old
+                continue
+            try:
+                file_hash = _file_hash(Path(entry.path))
+            except OSError as e:
+                logger.error(f"[ERROR] Не удалось прочитать файл персонажа '{name}': {e}")
+                continue
+            if old and old["hash"] == file_hash:
+                manifest[name.lower()] = dict(old, file=entry.name, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                continue
+            # valid=None — персонаж ещё не загружался
+            manifest[name.lower()] = {
+                "name": name, "file": entry.name, "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size, "hash": file_hash, "valid": None,
+            }
+
+        # Загруженные персонажи, файл которых изменился или удалён, выгружаем
+        for key in list(self._resident):
+            if key not in manifest or manifest[key]["hash"] != previous.get(key, {}).get("hash"):
+                del self._resident[key]
+
+        self._manifest = manifest
+        if manifest != previous:
+            self._save_manifest()
+        logger.info(f"📚 Персонажей в манифесте: {len(manifest)}")
+
+    def _ensure_scanned(self) -> None:
+        if not self._scanned:
+            self._scan()
+
+    # --- Загрузка ------------------------------------------------------------
+
+    def _load(self, key: str, save: bool = True) -> Optional[Dict[str, Any]]:
+        """Импортирует и валидирует персонажа; модуль не остаётся в sys.modules."""
+        entry = self._manifest[key]
+        character_name = entry["name"]
+        character_data = None
         try:
-            if not self.characters_dir.exists():
-                logger.error(f"[ERROR] Папка персонажей не найдена: {self.characters_dir}")
-                return
-            
-            # Сканируем папку на предмет Python файлов
-            for file_path in self.characters_dir.glob("*.py"):
-                if file_path.name == "__init__.py":
-                    continue
-                
-                character_name = file_path.stem
-                try:
-                    # Импортируем модуль персонажа
-                    module_name = f"app.chat_bot.models.characters.{character_name}"
-                    module = importlib.import_module(module_name)
-                    
-                    # Получаем функцию get_character_data
-                    if hasattr(module, 'get_character_data'):
-                        character_data = module.get_character_data()
-                        
-                        # Валидируем данные персонажа
-                        if self._validate_character_data(character_data, character_name):
-                            self.characters[character_name] = character_data
-                            logger.info(f"[OK] Персонаж '{character_name}' загружен успешно")
-                        else:
-                            logger.warning(f"[WARNING] Персонаж '{character_name}' не прошел валидацию")
-                    else:
-                        logger.warning(f"[WARNING] В файле {file_path.name} нет функции get_character_data")
-                        
-                except Exception as e:
-                    logger.error(f"[ERROR] Ошибка загрузки персонажа '{character_name}': {e}")
-            
-            logger.info(f"📚 Загружено персонажей: {len(self.characters)}")
-            
+            file_path = self.characters_dir / entry["file"]
+            spec = importlib.util.spec_from_file_location(
+                f"app.chat_bot.models.characters.{character_name}", file_path
+            )
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            self.loads += 1
+
+            # Получаем функцию get_character_data
+            if hasattr(module, 'get_character_data'):
+                character_data = module.get_character_data()
+                if not self._validate_character_data(character_data, character_name):
+                    logger.warning(f"[WARNING] Персонаж '{character_name}' не прошел валидацию")
+                    character_data = None
+            else:
+                logger.warning(f"[WARNING] В файле {entry['file']} нет функции get_character_data")
         except Exception as e:
-            logger.error(f"[ERROR] Ошибка загрузки персонажей: {e}")
-    
+            logger.error(f"[ERROR] Ошибка загрузки персонажа '{character_name}': {e}")
+
+        # Результат валидации и поля для списка запоминаются в манифесте
+        valid = character_data is not None
+        listing = {
+            "valid": valid,
+            "description": character_data.get('description', '') if valid else '',
+            "display_name": character_data.get('display_name', character_name.title()) if valid else '',
+        }
+        if any(entry.get(field) != value for field, value in listing.items()):
+            entry.update(listing)
+            if save:
+                self._save_manifest()
+
+        if valid:
+            self._resident[key] = character_data
+            self._resident.move_to_end(key)
+            while len(self._resident) > self.cache_size:
+                self._resident.popitem(last=False)
+        return character_data
+
     def _validate_character_data(self, data: Dict[str, Any], name: str) -> bool:
         """Валидирует данные персонажа с упрощенной структурой."""
         required_fields = ['name', 'character_appearance', 'location']
-        
+
         for field in required_fields:
             if field not in data:
                 logger.warning(f"[WARNING] У персонажа '{name}' отсутствует поле '{field}'")
                 return False
-        
+
         if not isinstance(data['name'], str) or not data['name'].strip():
             logger.warning(f"[WARNING] У персонажа '{name}' некорректное имя")
             return False
-        
+
         if not isinstance(data['character_appearance'], str) or not data['character_appearance'].strip():
             logger.warning(f"[WARNING] У персонажа '{name}' некорректное описание внешности")
             return False
-        
+
         if not isinstance(data['location'], str) or not data['location'].strip():
             logger.warning(f"[WARNING] У персонажа '{name}' некорректное описание локации")
             return False
-        
+
         return True
-    
+
+    # --- Запросы -------------------------------------------------------------
+
     def get_character(self, name: str) -> Optional[Dict[str, Any]]:
         """Получает данные персонажа по имени (нечувствительно к регистру)."""
-        # Сначала пробуем точное совпадение
-        if name in self.characters:
-            return self.characters[name]
-        
-        # Затем пробуем нечувствительный к регистру поиск
-        for char_name, char_data in self.characters.items():
-            if char_name.lower() == name.lower():
-                return char_data
-        
-        return None
-    
+        key = name.lower()
+        if key in self._manual:
+            return self._manual[key][1]
+
+        self._ensure_scanned()
+        if key in self._resident:
+            self._resident.move_to_end(key)
+            return self._resident[key]
+
+        entry = self._manifest.get(key)
+        if entry is None or entry["valid"] is False:
+            return None
+        return self._load(key)
+
+    def get_character_names(self) -> List[str]:
+        """Имена персонажей из манифеста, без загрузки модулей."""
+        self._ensure_scanned()
+        return [entry["name"] for entry in self._manifest.values()]
+
     def get_all_characters(self) -> Dict[str, Dict[str, Any]]:
-        """Получает всех персонажей."""
-        return self.characters.copy()
-    
+        """Получает всех персонажей (загружает каждого)."""
+        characters = {}
+        for name in self.get_character_names():
+            data = self.get_character(name)
+            if data is not None:
+                characters[name] = data
+        for name, data in self._manual.values():
+            characters[name] = data
+        return characters
+
     def get_character_list(self) -> List[Dict[str, str]]:
         """Получает список персонажей для API."""
-        return [
-            {
+        self._ensure_scanned()
+        characters = []
+        loaded = False
+        for key, entry in self._manifest.items():
+            # Модуль импортируется только если персонаж ни разу не загружался
+            if entry["valid"] is None and key not in self._manual:
+                self._load(key, save=False)
+                loaded = True
+            if entry["valid"] and key not in self._manual:
+                characters.append({
+                    'name': entry["name"],
+                    'description': entry["description"],
+                    'display_name': entry["display_name"],
+                })
+        if loaded:
+            self._save_manifest()
+        for name, data in self._manual.values():
+            characters.append({
                 'name': name,
                 'description': data.get('description', ''),
                 'display_name': data.get('display_name', name.title())
-            }
-            for name, data in self.characters.items()
-        ]
-    
+            })
+        return characters
+
     def reload_characters(self) -> None:
-        """Перезагружает всех персонажей."""
+        """Перечитывает манифест: изменённые и удалённые персонажи выгружаются из памяти."""
         logger.info("🔄 Перезагрузка персонажей...")
-        self.characters.clear()
-        self._load_characters()
-    
+        self._scan()
+
     def add_character_manually(self, name: str, data: Dict[str, Any]) -> bool:
         """Добавляет персонажа вручную (для тестирования)."""
         if self._validate_character_data(data, name):
-            self.characters[name] = data
+            self._manual[name.lower()] = (name, data)
             logger.info(f"[OK] Персонаж '{name}' добавлен вручную")
             return True
         return False
 
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "characters": len(self._manifest),
+            "resident": len(self._resident),
+            "cache_size": self.cache_size,
+            "loads": self.loads,
+        }
+
 
 # Глобальный экземпляр реестра
-character_registry = CharacterRegistry()
+character_registry = CharacterRegistry(
+    cache_size=settings.CHARACTER_CACHE_SIZE,
+    manifest_path=Path(settings.CHARACTER_MANIFEST_PATH),
+)
 
 
 def get_character_registry() -> CharacterRegistry:
@@ -8,6 +8,7 @@ from fastapi.responses import JSONResponse
 
 from .character_registry import get_character_data
 from app.chat_bot.services.textgen_webui_service import textgen_webui_service
+from app.chat_bot.services.llm_backend_pool import llm_backend_pool
 from app.chat_bot.config.chat_config import chat_config
 
 logger = logging.getLogger(__name__)
@@ -47,8 +48,8 @@ async def universal_chat(request: Dict[str, Any]):
         
         logger.info(f"[CHAT] Чат с {character_data['name']}: {message[:50]}...")
         
-        # Проверяем подключение к text-generation-webui
-        if not await textgen_webui_service.check_connection():
+        # Кэшированный статус text-generation-webui (без запроса к серверу)
+        if not llm_backend_pool.is_available():
             raise HTTPException(
                 status_code=503, 
                 detail="text-generation-webui недоступен. Запустите сервер text-generation-webui."
@@ -91,7 +92,8 @@ async def universal_chat(request: Dict[str, Any]):
             top_k=chat_config.DEFAULT_TOP_K,
             min_p=chat_config.DEFAULT_MIN_P,
             repeat_penalty=chat_config.DEFAULT_REPEAT_PENALTY,
-            presence_penalty=chat_config.DEFAULT_PRESENCE_PENALTY
+            presence_penalty=chat_config.DEFAULT_PRESENCE_PENALTY,
+            session_id=f"{character_name}:{session_id}"
         )
         
         if not response:
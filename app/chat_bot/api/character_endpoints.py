@@ -4,6 +4,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.chat_bot.schemas.chat import CharacterCreate, CharacterUpdate, CharacterInDB, UserCharacterCreate
 from app.chat_bot.utils.character_importer import character_importer
+from app.chat_bot.services.hot_prefixes import export_hot_prefixes
 from app.database.db_depends import get_db
 from app.auth.dependencies import get_current_user
 from app.models.user import Users
@@ -94,6 +95,7 @@ async def create_character(character: CharacterCreate, db: AsyncSession = Depend
         db.add(db_char)
         await db.commit()
         await db.refresh(db_char)
+        await export_hot_prefixes()
         return db_char
         
     except Exception as e:
@@ -182,6 +184,8 @@ async def update_character(
         
         await db.commit()
         await db.refresh(db_char)
+        if character.prompt is not None or character.name is not None:
+            await export_hot_prefixes()
         return db_char
         
     except HTTPException:
@@ -212,6 +216,7 @@ async def delete_character(
         
         await db.delete(db_char)
         await db.commit()
+        await export_hot_prefixes()
         return db_char
         
     except HTTPException:
@@ -270,6 +275,7 @@ async def import_character_from_file(
             character_name, db, overwrite
         )
         if db_char:
+            await export_hot_prefixes()
             return {
                 "message": f"Персонаж {character_name} успешно импортирован",
                 "character": {
@@ -300,6 +306,8 @@ async def import_all_characters(
     """
     try:
         imported = await character_importer.import_all_characters(db, overwrite)
+        if imported:
+            await export_hot_prefixes()
         return {
             "message": f"Импортировано {len(imported)} персонажей",
             "characters": [
@@ -422,6 +430,7 @@ IMPORTANT: Always end your answers with the correct punctuation (. ! ?). Never l
         
         await db.commit()
         await db.refresh(db_char)
+        await export_hot_prefixes()
         
         logger.info(f"Character {character.name} created successfully for user {current_user.email}")
         return db_char
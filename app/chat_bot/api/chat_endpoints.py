@@ -9,11 +9,13 @@ from typing import List, Dict, Optional
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
 
 from app.chat_bot.config.chat_config import chat_config
 from app.chat_bot.schemas.chat import SimpleChatRequest, ChatMessage
 from app.chat_bot.services.textgen_webui_service import textgen_webui_service
+from app.chat_bot.services.llm_backend_pool import llm_backend_pool
 from app.chat_bot.schemas.chat import CharacterConfig
 from app.database.db_depends import get_db
 from app.chat_bot.models.models import CharacterDB, ChatSession, ChatMessageDB
@@ -47,10 +49,11 @@ router = APIRouter(prefix="/api/v1/chat", tags=["Chat"])
 async def get_chat_status():
     """Проверка статуса чата."""
     try:
-        is_connected = await textgen_webui_service.check_connection()
+        is_connected = llm_backend_pool.is_available()
         return {
             "status": "ok" if is_connected else "error",
             "textgen_webui_connected": is_connected,
+            "textgen_webui": llm_backend_pool.snapshot(),
             "message": "Сервис чата работает" if is_connected else "Сервис генерации недоступен"
         }
     except Exception as e:
@@ -62,6 +65,32 @@ async def get_chat_status():
         }
 
 
+async def _get_or_create_session(db: AsyncSession, character_id: int, user_id: str) -> ChatSession:
+    """Возвращает сессию пары (персонаж, пользователь), создавая её при отсутствии.
+
+    Уникальный индекс uq_chat_sessions_character_id_user_id не даёт параллельным
+    запросам создать дубль: проигравший гонку получает IntegrityError и
+    перечитывает сессию, созданную победителем.
+    """
+    query = select(ChatSession).where(
+        (ChatSession.character_id == character_id)
+        & (ChatSession.user_id == user_id)
+    )
+    session = (await db.execute(query)).scalar_one_or_none()
+    if session is not None:
+        return session
+
+    session = ChatSession(character_id=character_id, user_id=user_id)
+    db.add(session)
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        return (await db.execute(query)).scalar_one()
+    await db.refresh(session)
+    return session
+
+
 # Эндпоинт генерации удален - используется только /api/v1/generate-image/ в main.py
 
 
@@ -79,8 +108,10 @@ async def chat_with_character_stream_by_name(
     - Если request.session_id не задан → работаем статически (ephemeral):
       БД не читаем и не пишем, история берётся только из request.history.
     """
-    # Персонаж -> конфиг по имени (поиск без учета регистра)
-    result = await db.execute(select(CharacterDB).where(CharacterDB.name.ilike(character_name)))
+    # Персонаж -> конфиг по имени (поиск без учета регистра по индексу ix_characters_name_lower)
+    result = await db.execute(
+        select(CharacterDB).where(func.lower(CharacterDB.name) == character_name.lower())
+    )
     db_character = result.scalar_one_or_none()
     if not db_character:
         raise HTTPException(status_code=404, detail="Персонаж не найден")
@@ -94,18 +125,7 @@ async def chat_with_character_stream_by_name(
 
     if request.session_id:
         # По указанному session_id используем существующую persistent-сессию или создаём новую
-        result = await db.execute(
-            select(ChatSession).where(
-                (ChatSession.character_id == character_id)
-                & (ChatSession.user_id == request.session_id)
-            )
-        )
-        session = result.scalar_one_or_none()
-        if session is None:
-            session = ChatSession(character_id=character_id, user_id=request.session_id)
-            db.add(session)
-            await db.commit()
-            await db.refresh(session)
+        session = await _get_or_create_session(db, character_id, request.session_id)
 
         # Грузим историю только для persistent-сессии
         if session:
@@ -141,8 +161,8 @@ async def chat_with_character_stream_by_name(
         history=history
     )
 
-    # Проверяем подключение к text-generation-webui
-    if not await textgen_webui_service.check_connection():
+    # Кэшированный статус text-generation-webui (без запроса к серверу)
+    if not llm_backend_pool.is_available():
         fallback_response = f"Привет! Я {character_config.name}. К сожалению, сервер генерации текста недоступен."
         
         # Сохраняем fallback-ответ в БД если есть сессия
@@ -202,7 +222,8 @@ async def chat_with_character_stream_by_name(
                 top_p=request.top_p or chat_config.DEFAULT_TOP_P,
                 top_k=request.top_k or chat_config.DEFAULT_TOP_K,
                 repeat_penalty=request.repeat_penalty or chat_config.DEFAULT_REPEAT_PENALTY,
-                presence_penalty=chat_config.DEFAULT_PRESENCE_PENALTY
+                presence_penalty=chat_config.DEFAULT_PRESENCE_PENALTY,
+                session_id=f"{character_name}:{request.session_id or ''}"
             ):
                 if chunk:
                     full_response += chunk
@@ -32,6 +32,22 @@ class ChatConfig(BaseSettings):
         default="Gryphe-MythoMax-L2-13b.Q4_K_S.gguf", 
         description="MythoMax-L2-13B Q4_K_S - Gryphe's модель для ролевых игр и творческого письма (~7.4GB)"
     )
+    TEXTGEN_WEBUI_URLS: str = Field(
+        default="", 
+        description="Дополнительные серверы text-generation-webui через запятую (пул бэкендов)"
+    )
+    TEXTGEN_AFFINITY_SLACK: int = Field(
+        default=2, 
+        description="На сколько запросов закреплённый за сессией сервер может быть загружен сильнее наименее загруженного"
+    )
+    TEXTGEN_MAX_RETRIES: int = Field(
+        default=1, 
+        description="Сколько раз повторить генерацию на другом сервере при его отказе"
+    )
+    TEXTGEN_HOT_PREFIXES_PATH: str = Field(
+        default="", 
+        description="JSON-файл с префиксами промптов персонажей для text-generation-webui (--hot-prefixes); пусто — не экспортировать"
+    )
     
     # --- Параметры генерации для L3-DARKEST-PLANET-16.5B ---
     # Оптимизированы для LLaMA 3 + Brainstorm 40x и креативного письма
@@ -400,6 +416,16 @@ class ChatConfig(BaseSettings):
 
     # ----------------- helper utilities -----------------
     
+    def get_textgen_urls(self) -> List[str]:
+        """Все серверы text-generation-webui: основной и дополнительные без повторов."""
+        urls = [self.TEXTGEN_WEBUI_URL] + self.TEXTGEN_WEBUI_URLS.split(",")
+        result = []
+        for url in urls:
+            url = url.strip().rstrip("/")
+            if url and url not in result:
+                result.append(url)
+        return result
+
     def sample_generation_params(
         self, 
         seed: Optional[int] = None,
@@ -0,0 +1,61 @@
+"""
+Экспорт префиксов промптов персонажей для text-generation-webui.
+
+Каждый запрос к персонажу начинается с его CharacterDB.prompt, но после
+перезапуска llama-server (смена модели, выгрузка по простою, падение) кэш
+этих префиксов пуст, и первое сообщение каждому персонажу платит полное
+вычисление промпта. Сервис записывает префиксы в JSON-файл
+(TEXTGEN_HOT_PREFIXES_PATH), который text-generation-webui читает через
+--hot-prefixes: каждый новый llama-server восстанавливает их из снимков
+слотов (--slot-cache-dir) или вычисляет заново и сохраняет.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+from sqlalchemy import select
+
+from app.chat_bot.config.chat_config import chat_config
+from app.chat_bot.services.textgen_webui_service import TextGenWebUIService
+
+logger = logging.getLogger(__name__)
+
+
+def write_hot_prefixes(path: Path, prompts: Dict[str, Optional[str]]) -> int:
+    """Атомарно записывает префиксы {имя персонажа: префикс}; возвращает их число."""
+    prefixes = {
+        name: TextGenWebUIService.character_prompt_prefix(prompt)
+        for name, prompt in sorted(prompts.items())
+        if prompt and prompt.strip()
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(prefixes, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return len(prefixes)
+
+
+async def export_hot_prefixes(session_maker=None) -> int:
+    """Выгружает промпты всех персонажей из БД в файл горячих префиксов; ошибки только логируются."""
+    if not chat_config.TEXTGEN_HOT_PREFIXES_PATH:
+        return 0
+    try:
+        from app.chat_bot.models.models import CharacterDB
+        if session_maker is None:
+            from app.database.db import async_session_maker
+            session_maker = async_session_maker
+
+        async with session_maker() as db:
+            rows = (await db.execute(select(CharacterDB.name, CharacterDB.prompt))).all()
+        count = write_hot_prefixes(Path(chat_config.TEXTGEN_HOT_PREFIXES_PATH), dict(rows))
+    except Exception as e:
+        logger.warning(f"[WARNING] Не удалось выгрузить префиксы промптов персонажей: {e}")
+        return 0
+
+    logger.info(f"[OK] Префиксы промптов персонажей выгружены: {count}")
+    return count
@@ -0,0 +1,259 @@
+"""
+Пул серверов text-generation-webui.
+
+Генерация распределяется между несколькими серверами:
+- запрос уходит на сервер с наименьшим числом незавершённых запросов;
+- запросы одной сессии по возможности идут на тот же сервер, чтобы
+  prompt cache llama.cpp оставался тёплым;
+- сервер с разомкнутым circuit breaker (см. backend_health) или выведенный
+  на обслуживание (drain) не получает новых запросов;
+- при сетевой ошибке или 5xx генерация повторяется на другом сервере.
+"""
+
+import asyncio
+import contextlib
+import itertools
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional
+
+import aiohttp
+
+from app.chat_bot.config.chat_config import chat_config
+from app.services.backend_health import (
+    BackendHealthMonitor,
+    BackendUnavailableError,
+    CircuitState,
+    TEXTGEN_BACKEND,
+    backend_health,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BackendResponseError(Exception):
+    """Сервер ответил ошибкой 5xx — запрос можно повторить на другом сервере."""
+
+    def __init__(self, status: int, text: str = ""):
+        self.status = status
+        self.text = text
+        super().__init__(f"HTTP {status}: {text[:200]}")
+
+
+RETRYABLE_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError, BackendResponseError)
+
+
+def textgen_backend_name(index: int) -> str:
+    """Имя сервера в мониторинге: основной — textgen, остальные — textgen-2, textgen-3..."""
+    return TEXTGEN_BACKEND if index == 0 else f"{TEXTGEN_BACKEND}-{index + 1}"
+
+
+@dataclass
+class LLMBackend:
+    """Сервер text-generation-webui и его нагрузка с точки зрения API."""
+
+    name: str
+    url: str
+    in_flight: int = 0
+    total_requests: int = 0
+    failed_requests: int = 0
+    draining: bool = False
+
+
+class LLMBackendPool:
+    """Маршрутизация генерации между серверами text-generation-webui."""
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        monitor: BackendHealthMonitor = backend_health,
+        affinity_slack: int = 2,
+        max_retries: int = 1,
+        max_sessions: int = 10_000,
+    ):
+        self.monitor = monitor
+        self.affinity_slack = affinity_slack
+        self.max_retries = max_retries
+        self.max_sessions = max_sessions
+        self.backends: List[LLMBackend] = []
+        for index, url in enumerate(urls):
+            name = textgen_backend_name(index)
+            if name not in monitor.names():
+                monitor.register(name, url, "/v1/models")
+            self.backends.append(LLMBackend(name=name, url=url.rstrip("/")))
+        if not self.backends:
+            raise ValueError("Пул text-generation-webui пуст")
+        self._affinity: "OrderedDict[str, str]" = OrderedDict()
+        self._round_robin = itertools.count()
+
+    @property
+    def primary(self) -> LLMBackend:
+        return self.backends[0]
+
+    def get(self, name: str) -> LLMBackend:
+        for backend in self.backends:
+            if backend.name == name:
+                return backend
+        raise KeyError(name)
+
+    # --- Состояние -----------------------------------------------------------
+
+    def _state(self, backend: LLMBackend) -> CircuitState:
+        return self.monitor.get(backend.name).breaker.state
+
+    def is_available(self) -> bool:
+        """Есть ли сервер, готовый принять запрос (без сетевых запросов)."""
+        return any(
+            not backend.draining and self._state(backend) != CircuitState.OPEN
+            for backend in self.backends
+        )
+
+    def retry_after(self) -> float:
+        return min(self.monitor.get(backend.name).breaker.retry_after for backend in self.backends)
+
+    def drain(self, name: str, draining: bool = True) -> None:
+        """Выводит сервер из ротации: новые запросы не назначаются, текущие завершаются."""
+        backend = self.get(name)
+        backend.draining = draining
+        if draining:
+            self._forget_backend(backend)
+        logger.info(f"[INFO] Сервер {name} ({backend.url}) {'выведен из ротации' if draining else 'возвращён в ротацию'}")
+
+    # --- Выбор сервера --------------------------------------------------------
+
+    def select(self, session_id: Optional[str] = None, exclude: Iterable[str] = ()) -> Optional[LLMBackend]:
+        """Выбирает сервер: закреплённый за сессией, если он не перегружен, иначе наименее загруженный."""
+        excluded = set(exclude)
+        candidates = [
+            backend for backend in self.backends
+            if backend.name not in excluded and not backend.draining
+            and self._state(backend) == CircuitState.CLOSED
+        ]
+        if not candidates:
+            # Все доступные серверы в half-open: пробный запрос получает первый, кто его разрешит
+            for backend in self.backends:
+                if backend.name in excluded or backend.draining:
+                    continue
+                if self._state(backend) == CircuitState.HALF_OPEN and self.monitor.is_available(backend.name):
+                    return backend
+            return None
+
+        least_loaded = min(backend.in_flight for backend in candidates)
+        if session_id:
+            pinned = self._affinity.get(session_id)
+            for backend in candidates:
+                if backend.name == pinned and backend.in_flight <= least_loaded + self.affinity_slack:
+                    self._affinity.move_to_end(session_id)
+                    return backend
+
+        # Среди одинаково загруженных — по кругу, чтобы не перегружать первый сервер
+        idle = [backend for backend in candidates if backend.in_flight == least_loaded]
+        return idle[next(self._round_robin) % len(idle)]
+
+    def _bind(self, session_id: Optional[str], backend: LLMBackend) -> None:
+        if not session_id:
+            return
+        self._affinity[session_id] = backend.name
+        self._affinity.move_to_end(session_id)
+        while len(self._affinity) > self.max_sessions:
+            self._affinity.popitem(last=False)
+
+    def _forget_backend(self, backend: LLMBackend) -> None:
+        for session_id in [s for s, name in self._affinity.items() if name == backend.name]:
+            del self._affinity[session_id]
+
+    def _next_backend(self, session_id: Optional[str], tried: List[str]) -> LLMBackend:
+        backend = self.select(session_id, exclude=tried)
+        if backend is None:
+            raise BackendUnavailableError(TEXTGEN_BACKEND, self.retry_after())
+        tried.append(backend.name)
+        return backend
+
+    def _on_failure(self, backend: LLMBackend, error: Exception) -> None:
+        backend.failed_requests += 1
+        self.monitor.record_failure(backend.name, f"{type(error).__name__}: {error}")
+        self._forget_backend(backend)
+        logger.warning(f"[WARNING] Сервер {backend.name} ({backend.url}) не ответил: {error}")
+
+    @contextlib.asynccontextmanager
+    async def _lease(self, backend: LLMBackend):
+        backend.in_flight += 1
+        backend.total_requests += 1
+        try:
+            yield backend
+        finally:
+            backend.in_flight -= 1
+
+    # --- Выполнение запросов ---------------------------------------------------
+
+    async def run(
+        self,
+        operation: Callable[[LLMBackend], Awaitable[Any]],
+        session_id: Optional[str] = None,
+    ) -> Any:
+        """Выполняет запрос на выбранном сервере, повторяя его на другом при отказе."""
+        tried: List[str] = []
+        while True:
+            backend = self._next_backend(session_id, tried)
+            async with self._lease(backend):
+                try:
+                    result = await operation(backend)
+                except RETRYABLE_ERRORS as e:
+                    self._on_failure(backend, e)
+                    if len(tried) > self.max_retries:
+                        raise
+                    continue
+            self.monitor.record_success(backend.name)
+            self._bind(session_id, backend)
+            return result
+
+    async def stream(
+        self,
+        operation: Callable[[LLMBackend], AsyncIterator[Any]],
+        session_id: Optional[str] = None,
+    ) -> AsyncIterator[Any]:
+        """Потоковый запрос. Повтор на другом сервере возможен только до первого чанка."""
+        tried: List[str] = []
+        while True:
+            backend = self._next_backend(session_id, tried)
+            started = False
+            async with self._lease(backend):
+                try:
+                    async with contextlib.aclosing(operation(backend)) as chunks:
+                        async for chunk in chunks:
+                            if not started:
+                                started = True
+                                self.monitor.record_success(backend.name)
+                                self._bind(session_id, backend)
+                            yield chunk
+                except RETRYABLE_ERRORS as e:
+                    self._on_failure(backend, e)
+                    if started or len(tried) > self.max_retries:
+                        raise
+                    continue
+            return
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        pinned: Dict[str, int] = {}
+        for name in self._affinity.values():
+            pinned[name] = pinned.get(name, 0) + 1
+        return {
+            backend.name: {
+                "url": backend.url,
+                "in_flight": backend.in_flight,
+                "total_requests": backend.total_requests,
+                "failed_requests": backend.failed_requests,
+                "draining": backend.draining,
+                "circuit": self._state(backend).value,
+                "sessions": pinned.get(backend.name, 0),
+            }
+            for backend in self.backends
+        }
+
+
+llm_backend_pool = LLMBackendPool(
+    chat_config.get_textgen_urls(),
+    affinity_slack=chat_config.TEXTGEN_AFFINITY_SLACK,
+    max_retries=chat_config.TEXTGEN_MAX_RETRIES,
+)
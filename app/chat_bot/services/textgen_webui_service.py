@@ -6,14 +6,17 @@
 
 import asyncio
 import aiohttp
+import contextlib
 import json
 import logging
 from typing import Dict, List, Optional, Any, AsyncGenerator
 from pydantic import BaseModel, Field
 from app.chat_bot.config.chat_config import chat_config
-from app.utils.logger import logger
+from app.chat_bot.services.llm_backend_pool import BackendResponseError, LLMBackend, llm_backend_pool
 from app.chat_bot.config.chat_config import ChatConfig
 
+logger = logging.getLogger(__name__)
+
 class TextGenWebUIService:
     """Сервис для работы с text-generation-webui API."""
     
@@ -81,6 +84,29 @@ class TextGenWebUIService:
             self._connector = None
             self._is_connected = False
             
+    async def _post_completion(self, backend: LLMBackend, payload: Dict[str, Any]) -> aiohttp.ClientResponse:
+        """Отправляет запрос генерации на сервер пула. Ответ 5xx повторяется на другом сервере."""
+        response = await self._session.post(f"{backend.url}/v1/chat/completions", json=payload)
+        if response.status >= 500:
+            error_text = await response.text()
+            response.close()
+            raise BackendResponseError(response.status, error_text)
+        return response
+
+    async def _stream_completion(self, backend: LLMBackend, payload: Dict[str, Any]) -> AsyncGenerator[bytes, None]:
+        """Строки SSE-ответа сервера пула."""
+        response = await self._post_completion(backend, payload)
+        try:
+            if response.status != 200:
+                error_text = await response.text()
+                logger.error(f"[ERROR] HTTP ошибка при потоковой генерации: {response.status}, ответ: {error_text}")
+                return
+            logger.info(f"[OK] Получен ответ от {backend.name} ({backend.url}), начинаем обработку стрима")
+            async for line in response.content:
+                yield line
+        finally:
+            response.close()
+
     # ============================================================================
     # [WARNING]  КРИТИЧЕСКИ ВАЖНЫЙ КОД - НЕ ИЗМЕНЯТЬ! [WARNING]
     # ============================================================================
@@ -247,6 +273,16 @@ class TextGenWebUIService:
             # Возвращаем простой fallback промпт в случае ошибки
             return f"{system_message}\n\n### Instruction:\n{user_message}\n\n### Response:\n"
 
+    @staticmethod
+    def character_prompt_prefix(character_prompt: str) -> str:
+        """
+        Общее начало всех промптов персонажа до истории диалога. Его кэш
+        text-generation-webui держит прогретым (см. hot_prefixes).
+        """
+        if "{user_message}" in character_prompt:
+            return character_prompt.split("{user_message}", 1)[0]
+        return f"{character_prompt}\n\n"
+
     def build_character_prompt(
         self,
         character_data: Dict[str, Any],
@@ -272,7 +308,7 @@ class TextGenWebUIService:
             return character_prompt.replace("{user_message}", user_message)
         
         # Если нет placeholder, строим стандартный Alpaca промпт
-        prompt = f"{character_prompt}\n\n"
+        prompt = self.character_prompt_prefix(character_prompt)
         
         # История диалога для MythoMax
         history_to_use = history or chat_history
@@ -448,7 +484,7 @@ class TextGenWebUIService:
         # Добавляем стоп-токены для времени, если они настроены
         if chat_config and hasattr(chat_config, 'TIME_STOP_TOKENS'):
             enhanced_tokens.extend(chat_config.TIME_STOP_TOKENS)
-            logger.info(f"🕒 Добавлено {len(chat_config.TIME_STOP_TOKENS)} стоп-токенов для времени")
+            logger.debug("🕒 Добавлено %d стоп-токенов для времени", len(chat_config.TIME_STOP_TOKENS))
         
         return enhanced_tokens
 
@@ -563,7 +599,8 @@ class TextGenWebUIService:
         min_p: Optional[float] = None,  # ДОБАВЛЕНО: min_p
         repeat_penalty: Optional[float] = None,
         presence_penalty: Optional[float] = None,
-        force_completion: bool = False
+        force_completion: bool = False,
+        session_id: Optional[str] = None
     ) -> Optional[str]:
         """
         Генерирует текст через text-generation-webui API.
@@ -576,6 +613,7 @@ class TextGenWebUIService:
             top_k: Top-k параметр
             repeat_penalty: Штраф за повторения
             presence_penalty: Presence penalty
+            session_id: Сессия чата для закрепления за сервером пула
             
         Returns:
             Сгенерированный текст или None при ошибке
@@ -623,23 +661,20 @@ class TextGenWebUIService:
                 "stop": self._get_enhanced_stop_tokens(generation_params.get("stop", []), chat_config)  # Используем из конфигурации + время
             }
             
-            # 🔍 ЛОГИРОВАНИЕ: Проверяем, что передается в API
-            logger.info(f"🔍 API Payload - max_tokens: {openai_payload['max_tokens']}")
-            if "stop" in openai_payload and openai_payload["stop"]:
-                logger.info(f"🔍 API Payload - stop tokens: {openai_payload['stop']}")
-            else:
-                logger.info(f"🔍 API Payload - stop tokens: НЕТ (это хорошо!)")
-            logger.info(f"🔍 API Payload - min_tokens: {openai_payload.get('min_tokens', 'НЕТ')}")
-            logger.info(f"🔍 API Payload - ban_eos_token: {openai_payload.get('ban_eos_token', False)}")
             # ИСПРАВЛЕНО: НЕ передаем min_tokens - он может вызывать преждевременную остановку
             # if chat_config.ENFORCE_MIN_TOKENS and chat_config.MIN_NEW_TOKENS > 0:
             #     openai_payload["min_tokens"] = chat_config.MIN_NEW_TOKENS
             # ИСПРАВЛЕНО: Отключаем ban_eos_token для естественного завершения
             openai_payload["ban_eos_token"] = False
             
-            logger.info(f"🚀 БЫСТРЫЙ запрос на генерацию (промпт: {len(prompt)} символов)")
+            # Параметры запроса — одной структурной записью; промпт обрезается форматтером
+            logger.debug("API payload", extra={"payload": openai_payload})
+            logger.info("🚀 БЫСТРЫЙ запрос на генерацию (промпт: %d символов)", len(prompt))
             
-            response = await self._session.post(f"{self.base_url}/v1/chat/completions", json=openai_payload)
+            response = await llm_backend_pool.run(
+                lambda backend: self._post_completion(backend, openai_payload),
+                session_id=session_id
+            )
             if response.status == 200:
                 result = await response.json()
                 # OpenAI API возвращает результат в choices[0].message.content
@@ -649,23 +684,12 @@ class TextGenWebUIService:
                 else:
                     generated_text = ""
                 
-                # 🔍 ЛОГИРОВАНИЕ: Проверяем сырой ответ от API
-                logger.info(f"🔍 Raw API Response: {generated_text[-100:]}...")  # Последние 100 символов
-                
-                # 🔍 ЛОГИРОВАНИЕ: Проверяем полный промпт, отправленный модели
-                logger.info(f"🔍 Full Prompt Sent to Model: {prompt[-500:]}...")  # Последние 500 символов промпта
-                
-                # 🔍 КРИТИЧЕСКОЕ ЛОГИРОВАНИЕ: Полный промпт для отладки
-                logger.info("=" * 80)
-                logger.info("🔍 ПОЛНЫЙ ПРОМПТ, ОТПРАВЛЕННЫЙ МОДЕЛИ:")
-                logger.info("=" * 80)
-                logger.info(prompt)
-                logger.info("=" * 80)
+                # 🔍 ЛОГИРОВАНИЕ: промпт и сырой ответ модели (только на уровне DEBUG)
+                logger.debug("Prompt sent to model", extra={"prompt": prompt, "response": generated_text})
                 
                 if generated_text:
                     # ПРЯМОЙ ОТВЕТ ОТ МОДЕЛИ БЕЗ ПОСТ-ОБРАБОТКИ
-                    logger.info(f"[OK] Генерация завершена ({len(generated_text)} символов)")
-                    logger.info(f"🔍 Raw Response: {generated_text[-100:]}...")  # Последние 100 символов
+                    logger.info("[OK] Генерация завершена (%d символов)", len(generated_text))
                     return generated_text.strip()
                 else:
                     logger.warning("[WARNING] Пустой ответ от OpenAI API")
@@ -709,7 +733,8 @@ class TextGenWebUIService:
         top_k: Optional[int] = None,
         repeat_penalty: Optional[float] = None,
         presence_penalty: Optional[float] = None,
-        force_completion: bool = False
+        force_completion: bool = False,
+        session_id: Optional[str] = None
     ) -> AsyncGenerator[str, None]:
         """
         Генерирует текст потоком через text-generation-webui API.
@@ -722,6 +747,7 @@ class TextGenWebUIService:
             top_k: Top-k параметр
             repeat_penalty: Штраф за повторения
             presence_penalty: Presence penalty
+            session_id: Сессия чата для закрепления за сервером пула
             
         Yields:
             Части сгенерированного текста
@@ -777,76 +803,56 @@ class TextGenWebUIService:
             # Убираем None значения из payload
             openai_payload = {k: v for k, v in openai_payload.items() if v is not None}
             
-            # 🔍 ЛОГИРОВАНИЕ: Проверяем streaming payload
-            logger.info(f"🚀 STREAMING API Payload - max_tokens: {openai_payload.get('max_tokens', 'НЕТ')}")
-            if "stop" in openai_payload and openai_payload["stop"]:
-                logger.info(f"🔍 STREAMING API Payload - stop tokens: {openai_payload['stop']}")
-            else:
-                logger.info(f"🔍 STREAMING API Payload - stop tokens: НЕТ (это хорошо!)")
-            logger.info(f"🔍 STREAMING API Payload - min_tokens: {openai_payload.get('min_tokens', 'НЕТ')}")
-            logger.info(f"🔍 STREAMING API Payload - ban_eos_token: {openai_payload.get('ban_eos_token', False)}")
-            
-            logger.info(f"🚀 Отправляем запрос на генерацию текста (промпт: {len(prompt)} символов)")
+            # 🔍 ЛОГИРОВАНИЕ: streaming payload одной структурной записью
+            logger.debug("STREAMING API payload", extra={"payload": openai_payload})
+            logger.info("🚀 Отправляем запрос на генерацию текста (промпт: %d символов)", len(prompt))
             
-            # Используем try-finally для гарантированного закрытия ресурсов
-            response = None
-            try:
-                response = await self._session.post(f"{self.base_url}/v1/chat/completions", json=openai_payload)
-                
-                if response.status == 200:
-                    logger.info("[OK] Получен ответ от text-generation-webui, начинаем обработку стрима")
-                    buffer = ""
-                    
-                    async for line in response.content:
-                        if line:
-                            try:
-                                # Декодируем и добавляем к буферу
-                                buffer += line.decode('utf-8')
-                                
-                                # Обрабатываем полные строки
-                                lines = buffer.split('\n')
-                                buffer = lines.pop() or ""  # Оставляем неполную строку в буфере
-                                
-                                for line_text in lines:
-                                    line_text = line_text.strip()
-                                    if not line_text or not line_text.startswith('data: '):
-                                        continue
-                                        
-                                    data_str = line_text[6:]  # Убираем 'data: '
-                                    if data_str == '[DONE]':
-                                        logger.info("🏁 Получен сигнал завершения стрима")
-                                        return
-                                        
-                                    try:
-                                        data = json.loads(data_str)
-                                        if 'choices' in data and len(data['choices']) > 0:
-                                            delta = data['choices'][0].get('delta', {})
-                                            if 'content' in delta and delta['content']:
-                                                # Очищаем каждый чанк от времени
-                                                original_chunk = delta['content']
-                                                cleaned_chunk = self._clean_generation_artifacts(delta['content'])
-                                                if original_chunk != cleaned_chunk:
-                                                    logger.info(f"🕒 STREAMING: Удалено время из '{original_chunk}' -> '{cleaned_chunk}'")
-                                                yield cleaned_chunk
-                                                
-                                    except json.JSONDecodeError as json_err:
-                                        logger.warning(f"[WARNING] Ошибка парсинга JSON в стриме: {json_err}, данные: {data_str}")
-                                        continue
-                                        
-                            except Exception as e:
-                                logger.warning(f"[WARNING] Ошибка обработки стрима: {e}")
-                                continue
-                else:
-                    error_text = await response.text()
-                    logger.error(f"[ERROR] HTTP ошибка при потоковой генерации: {response.status}, ответ: {error_text}")
-                    
-            finally:
-                # Гарантированно закрываем response
-                if response:
-                    try:
-                        response.close()
-                    except Exception as e:
-                        logger.warning(f"[WARNING] Ошибка при закрытии response: {e}")
+            # Сервер выбирается пулом; при отказе до первого чанка запрос повторяется на другом
+            buffer = ""
+            lines_stream = llm_backend_pool.stream(
+                lambda backend: self._stream_completion(backend, openai_payload),
+                session_id=session_id
+            )
+            async with contextlib.aclosing(lines_stream):
+                async for line in lines_stream:
+                    if line:
+                        try:
+                            # Декодируем и добавляем к буферу
+                            buffer += line.decode('utf-8')
+                            
+                            # Обрабатываем полные строки
+                            lines = buffer.split('\n')
+                            buffer = lines.pop() or ""  # Оставляем неполную строку в буфере
+                            
+                            for line_text in lines:
+                                line_text = line_text.strip()
+                                if not line_text or not line_text.startswith('data: '):
+                                    continue
+                                    
+                                data_str = line_text[6:]  # Убираем 'data: '
+                                if data_str == '[DONE]':
+                                    logger.info("🏁 Получен сигнал завершения стрима")
+                                    return
+                                    
+                                try:
+                                    data = json.loads(data_str)
+                                    if 'choices' in data and len(data['choices']) > 0:
+                                        delta = data['choices'][0].get('delta', {})
+                                        if 'content' in delta and delta['content']:
+                                            # Очищаем каждый чанк от времени
+                                            original_chunk = delta['content']
+                                            cleaned_chunk = self._clean_generation_artifacts(delta['content'])
+                                            if original_chunk != cleaned_chunk:
+                                                logger.debug("🕒 STREAMING: Удалено время из %r -> %r", original_chunk, cleaned_chunk)
+                                            yield cleaned_chunk
+                                            
+                                except json.JSONDecodeError as json_err:
+                                    logger.warning(f"[WARNING] Ошибка парсинга JSON в стриме: {json_err}, данные: {data_str}")
+                                    continue
+                                    
+                        except Exception as e:
+                            logger.warning(f"[WARNING] Ошибка обработки стрима: {e}")
+                            continue
                         
         except Exception as e:
             logger.error(f"[ERROR] Ошибка потоковой генерации текста: {e}")
@@ -1,11 +1,11 @@
 """
 Утилита для импорта персонажей из файлов в базу данных.
 """
-import os
-import importlib.util
-from typing import Dict, Any, Optional, List
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Set
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
+from app.chat_bot.add_character.character_registry import CharacterRegistry, get_character_registry
 from app.chat_bot.models.models import CharacterDB
 from app.utils.logger import logger
 
@@ -14,15 +14,13 @@ class CharacterImporter:
     """Импортер персонажей из файлов в базу данных."""
     
     def __init__(self, characters_dir: str = None):
+        # Файлы персонажей читаются через реестр: список берётся из манифеста,
+        # загруженные персонажи кэшируются
         if characters_dir is None:
-            # Автоматически определяем путь к директории персонажей
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            self.characters_dir = os.path.join(
-                os.path.dirname(os.path.dirname(current_dir)), 
-                "chat_bot", "models", "characters"
-            )
+            self.registry = get_character_registry()
         else:
-            self.characters_dir = characters_dir
+            self.registry = CharacterRegistry(Path(characters_dir))
+        self.characters_dir = str(self.registry.characters_dir)
     
     def load_character_from_file(self, character_name: str) -> Optional[Dict[str, Any]]:
         """
@@ -34,48 +32,14 @@ class CharacterImporter:
         Returns:
             Словарь с данными персонажа или None
         """
-        try:
-            file_path = os.path.join(self.characters_dir, f"{character_name}.py")
-            
-            if not os.path.exists(file_path):
-                logger.warning(f"Файл персонажа не найден: {file_path}")
-                return None
-            
-            # Динамически импортируем модуль
-            spec = importlib.util.spec_from_file_location(character_name, file_path)
-            module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(module)
-            
-            if not hasattr(module, 'get_character_data'):
-                logger.error(f"Функция get_character_data() не найдена в {character_name}.py")
-                return None
-            
-            character_data = module.get_character_data()
-            logger.info(f"Персонаж {character_name} успешно загружен из файла")
-            return character_data
-            
-        except Exception as e:
-            logger.error(f"Ошибка загрузки персонажа {character_name}: {str(e)}")
-            return None
+        character_data = self.registry.get_character(character_name)
+        if character_data is None:
+            logger.warning(f"Персонаж {character_name} не найден или не прошёл валидацию в {self.characters_dir}")
+        return character_data
     
     def list_available_characters(self) -> List[str]:
         """Возвращает список доступных персонажей в файлах."""
-        try:
-            if not os.path.exists(self.characters_dir):
-                logger.warning(f"Директория персонажей не найдена: {self.characters_dir}")
-                return []
-            
-            characters = []
-            for filename in os.listdir(self.characters_dir):
-                if filename.endswith('.py') and not filename.startswith('__'):
-                    character_name = filename[:-3]  # Убираем .py
-                    characters.append(character_name)
-            
-            return characters
-            
-        except Exception as e:
-            logger.error(f"Ошибка получения списка персонажей: {str(e)}")
-            return []
+        return self.registry.get_character_names()
     
     async def import_character_to_db(
         self, 
@@ -135,25 +99,7 @@ class CharacterImporter:
         db: AsyncSession
     ) -> CharacterDB:
         """Создает нового персонажа в БД с упрощенной структурой."""
-        
-        # Получаем обязательные поля
-        name = character_data.get('name', 'Unknown')
-        character_appearance = character_data.get('character_appearance', '')
-        location = character_data.get('location', '')
-        
-        # Создаем базовый промпт из внешности и локации
-        prompt = f"Character: {name}"
-        if character_appearance:
-            prompt += f"\nAppearance: {character_appearance}"
-        if location:
-            prompt += f"\nLocation: {location}"
-        
-        db_char = CharacterDB(
-            name=name,
-            prompt=prompt,
-            character_appearance=character_appearance,
-            location=location
-        )
+        db_char = CharacterDB(**self._character_fields(character_data, 'Unknown'))
         
         db.add(db_char)
         await db.commit()
@@ -167,34 +113,51 @@ class CharacterImporter:
         db: AsyncSession
     ) -> CharacterDB:
         """Обновляет существующего персонажа в БД с упрощенной структурой."""
+        self._apply_fields(existing_char, self._character_fields(character_data, existing_char.name))
         
-        # Получаем обязательные поля
-        name = character_data.get('name', existing_char.name)
+        await db.commit()
+        await db.refresh(existing_char)
+        return existing_char
+    
+
+    
+    @staticmethod
+    def _character_fields(character_data: Dict[str, Any], default_name: str) -> Dict[str, Any]:
+        """Поля CharacterDB из данных персонажа; базовый промпт собирается из внешности и локации."""
+        name = character_data.get('name', default_name)
         character_appearance = character_data.get('character_appearance', '')
         location = character_data.get('location', '')
         
-        # Создаем базовый промпт из внешности и локации
         prompt = f"Character: {name}"
         if character_appearance:
             prompt += f"\nAppearance: {character_appearance}"
         if location:
             prompt += f"\nLocation: {location}"
         
-        # Обновляем поля
-        existing_char.name = name
-        existing_char.prompt = prompt
-        existing_char.character_appearance = character_appearance
-        existing_char.location = location
-        
-        await db.commit()
-        await db.refresh(existing_char)
-        return existing_char
+        return {
+            "name": name,
+            "prompt": prompt,
+            "character_appearance": character_appearance,
+            "location": location,
+        }
     
-
+    @staticmethod
+    def _apply_fields(db_char: CharacterDB, fields: Dict[str, Any]) -> None:
+        for field, value in fields.items():
+            setattr(db_char, field, value)
+    
+    async def _find_existing(self, db: AsyncSession, names: Set[str]) -> Dict[str, CharacterDB]:
+        if not names:
+            return {}
+        result = await db.execute(select(CharacterDB).where(CharacterDB.name.in_(names)))
+        return {char.name: char for char in result.scalars().all()}
     
     async def import_all_characters(self, db: AsyncSession, overwrite: bool = False) -> List[CharacterDB]:
         """
-        Импортирует всех персонажей из файлов в БД.
+        Импортирует всех персонажей из файлов в БД одной транзакцией.
+        
+        Существующие персонажи ищутся двумя запросами (по именам файлов и по
+        именам из данных персонажей), новые и изменённые сохраняются одним commit.
         
         Args:
             db: Сессия базы данных
@@ -204,15 +167,53 @@ class CharacterImporter:
             Список импортированных персонажей
         """
         characters = self.list_available_characters()
-        imported = []
+        existing = await self._find_existing(db, {
+            variant for name in characters for variant in (name, name.capitalize(), name.lower())
+        })
         
+        imported = []
+        pending = []
         for character_name in characters:
-            try:
-                db_char = await self.import_character_to_db(character_name, db, overwrite)
-                if db_char:
-                    imported.append(db_char)
-            except Exception as e:
-                logger.error(f"Ошибка импорта персонажа {character_name}: {str(e)}")
+            existing_char = (
+                existing.get(character_name)
+                or existing.get(character_name.capitalize())
+                or existing.get(character_name.lower())
+            )
+            if existing_char and not overwrite:
+                imported.append(existing_char)
+                continue
+            character_data = self.load_character_from_file(character_name)
+            if character_data:
+                pending.append((character_name, existing_char, self._character_fields(character_data, 'Unknown')))
+        
+        # Персонаж мог быть сохранён под именем из данных, отличным от имени файла
+        existing.update(await self._find_existing(db, {
+            fields["name"] for _, existing_char, fields in pending if existing_char is None
+        }))
+        
+        seen = {char.name for char in imported}
+        for character_name, existing_char, fields in pending:
+            existing_char = existing_char or existing.get(fields["name"])
+            if fields["name"] in seen:
+                logger.warning(f"Персонаж {character_name}: имя {fields['name']} уже импортировано из другого файла")
+                continue
+            seen.add(fields["name"])
+            if existing_char is None:
+                db_char = CharacterDB(**fields)
+                db.add(db_char)
+            elif overwrite:
+                db_char = existing_char
+                self._apply_fields(db_char, fields)
+            else:
+                db_char = existing_char
+            imported.append(db_char)
+        
+        try:
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"Ошибка импорта персонажей: {str(e)}")
+            raise
         
         logger.info(f"Импортировано {len(imported)} персонажей из {len(characters)} файлов")
         return imported
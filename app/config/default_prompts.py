@@ -98,19 +98,17 @@ def get_enhanced_prompts(base_prompt: str, use_defaults: bool = True) -> tuple[s
     if not use_defaults:
         return base_prompt, ""
     
-    # Добавляем дефолтные промпты к базовому
-    enhanced_positive = f"{get_default_positive_prompts()}, {base_prompt}"
-    enhanced_negative = get_default_negative_prompts()
-    
-    # Удаляем дубликаты
-    enhanced_positive = deduplicate_prompt(enhanced_positive)
-    enhanced_negative = deduplicate_prompt(enhanced_negative)
+    # Добавляем дефолтные промпты к базовому: дубли убираются, а дефолтные теги,
+    # не помещающиеся в бюджет кусков CLIP, отбрасываются
+    from app.services.prompt_compiler import prompt_compiler
+    enhanced_positive = prompt_compiler.compile(user=base_prompt, defaults=get_default_positive_prompts()).prompt
+    enhanced_negative = deduplicate_prompt(get_default_negative_prompts())
     
     return enhanced_positive, enhanced_negative
 
 def deduplicate_prompt(prompt: str) -> str:
     """
-    Удаляет дублирующиеся слова из промпта
+    Удаляет дублирующиеся теги из промпта
     
     Args:
         prompt: Промпт для обработки
@@ -121,15 +119,6 @@ def deduplicate_prompt(prompt: str) -> str:
     if not prompt:
         return prompt
     
-    # Разбиваем на слова, убираем пробелы
-    words = [word.strip() for word in prompt.split(",") if word.strip()]
-    
-    # Удаляем дубликаты, сохраняя порядок
-    seen = set()
-    unique_words = []
-    for word in words:
-        if word not in seen:
-            seen.add(word)
-            unique_words.append(word)
-    
-    return ", ".join(unique_words) 
\ No newline at end of file
+    # Теги сравниваются по смыслу: без учёта регистра, подчёркиваний и скобок весов
+    from app.services.prompt_compiler import prompt_compiler
+    return prompt_compiler.dedupe(prompt)
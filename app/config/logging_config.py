@@ -1,27 +1,280 @@
+"""
+Настройка логирования приложения.
+
+Обработчики запросов только кладут запись в очередь (QueueHandler), а
+форматирование в JSON, редактирование больших полей и запись в консоль и
+файл выполняет фоновый поток QueueListener. Уровни задаются отдельно для
+модулей, массовые DEBUG-записи прореживаются, промпты и base64 обрезаются
+по размеру, секреты маскируются. Записи loguru (app.utils.logger)
+перенаправляются в этот же конвейер.
+"""
+
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
 import os
-from datetime import datetime
+import queue
+import re
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+# Атрибуты LogRecord, которые не считаются структурными полями из extra
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {
+    "message", "asctime", "taskName", "sample_every",
+}
+
+SECRET_KEYS = {"password", "password_hash", "token", "access_token", "refresh_token", "api_key", "authorization"}
+BASE64_RE = re.compile(r"(?:data:[\w/+.-]+;base64,)?[A-Za-z0-9+/]{256,}={0,2}")
+MAX_LIST_ITEMS = 20
+
+
+def _base64_placeholder(match: "re.Match") -> str:
+    data = match.group(0)
+    # Длинная строка из одного символа или слова без цифр — не base64
+    if not data.startswith("data:") and not (
+        any(c.isdigit() for c in data) and any(c.isupper() for c in data) and any(c.islower() for c in data)
+    ):
+        return data
+    return f"<base64 {len(data)} chars>"
+
+
+def redact(value: Any, max_chars: int) -> Any:
+    """Обрезает длинные строки, заменяет base64 на его размер и маскирует секреты."""
+    if isinstance(value, str):
+        if len(value) >= 256:
+            value = BASE64_RE.sub(_base64_placeholder, value)
+        if len(value) > max_chars:
+            value = f"{value[:max_chars]}... <{len(value)} chars>"
+        return value
+    if isinstance(value, dict):
+        return {
+            key: "***" if str(key).lower() in SECRET_KEYS else redact(item, max_chars)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        items = [redact(item, max_chars) for item in value[:MAX_LIST_ITEMS]]
+        if len(value) > MAX_LIST_ITEMS:
+            items.append(f"... {len(value) - MAX_LIST_ITEMS} more")
+        return items
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return redact(repr(value), max_chars)
+
+
+def record_extra(record: logging.LogRecord) -> Dict[str, Any]:
+    """Поля, переданные через extra=..."""
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, логгер, сообщение и поля extra."""
+
+    def __init__(self, max_field_chars: int = 2000):
+        super().__init__()
+        self.max_field_chars = max_field_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage(), self.max_field_chars),
+            "module": record.module,
+            "line": record.lineno,
+        }
+        for key, value in record_extra(record).items():
+            entry[key] = "***" if key.lower() in SECRET_KEYS else redact(value, self.max_field_chars)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class RedactingFormatter(logging.Formatter):
+    """Текстовый формат для разработки с той же обрезкой больших полей."""
+
+    def __init__(self, fmt: str, max_field_chars: int = 2000):
+        super().__init__(fmt)
+        self.max_field_chars = max_field_chars
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = redact(record.message, self.max_field_chars)
+        line = super().formatMessage(record)
+        extra = record_extra(record)
+        if extra:
+            fields = {key: "***" if key.lower() in SECRET_KEYS else value for key, value in extra.items()}
+            line += " " + json.dumps(redact(fields, self.max_field_chars), ensure_ascii=False, default=str)
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает каждую N-ю запись с одного места вызова (логгер + строка).
+    По умолчанию прореживаются только DEBUG-записи; для отдельного вызова
+    N задаётся через extra={"sample_every": N}.
+    """
+
+    def __init__(self, debug_every: int = 10):
+        super().__init__()
+        self.debug_every = max(1, debug_every)
+        self._counters: Dict[tuple, int] = {}
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = getattr(record, "sample_every", None)
+        if every is None:
+            every = self.debug_every if record.levelno <= logging.DEBUG else 1
+        if every <= 1:
+            return True
+        key = (record.name, record.lineno)
+        count = self._counters.get(key, 0)
+        self._counters[key] = count + 1
+        if count % every == 0:
+            return True
+        self.dropped += 1
+        return False
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler, который не ждёт при переполнении очереди, а отбрасывает
+    запись. В вызывающем потоке выполняется только подстановка аргументов.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        # Аргументы и traceback могут ссылаться на изменяемые объекты вызывающего кода
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def parse_module_levels(spec: str) -> Dict[str, str]:
+    """'app.chat_bot=DEBUG,uvicorn.access=WARNING' -> {'app.chat_bot': 'DEBUG', ...}"""
+    levels = {}
+    for item in spec.split(","):
+        name, sep, level = item.partition("=")
+        if sep and name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def _route_loguru() -> None:
+    """Перенаправляет записи loguru в стандартный logging (и, значит, в очередь)."""
+    try:
+        from loguru import logger as loguru_logger
+    except ImportError:
+        return
+
+    def sink(message) -> None:
+        record = message.record
+        std_logger = logging.getLogger(record["name"])
+        level = record["level"].no
+        if not std_logger.isEnabledFor(level):
+            return
+        exception = record["exception"]
+        exc_info = (exception.type, exception.value, exception.traceback) if exception else None
+        std_logger.handle(std_logger.makeRecord(
+            record["name"], level, record["file"].path, record["line"], record["message"],
+            None, exc_info, record["function"],
+        ))
+
+    loguru_logger.remove()
+    loguru_logger.add(sink, level=0, format="{message}")
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+
+
+def setup_logging(
+    level: str = "INFO",
+    module_levels: Optional[Dict[str, str]] = None,
+    json_format: bool = True,
+    log_file: Optional[str] = "logs/app.log",
+    max_field_chars: int = 2000,
+    debug_sample_every: int = 10,
+    queue_size: int = 10_000,
+    max_bytes: int = 50 * 1024 * 1024,
+    backup_count: int = 5,
+) -> logging.handlers.QueueListener:
+    """Настраивает корневой логгер. Повторный вызов заменяет прежнюю конфигурацию."""
+    global _listener, _queue_handler
+    shutdown_logging()
+
+    if json_format:
+        formatter = JsonFormatter(max_field_chars)
+    else:
+        formatter = RedactingFormatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s", max_field_chars)
+
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True,
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    _queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    _queue_handler.addFilter(SamplingFilter(debug_sample_every))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(_queue_handler)
+    root.setLevel(level.upper())
+    for name, module_level in (module_levels or {}).items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _route_loguru()
+    return _listener
+
+
+def shutdown_logging() -> None:
+    """Дописывает оставшиеся в очереди записи и закрывает обработчики."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = None
 
-# Создаем директорию для логов, если её нет
-log_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "logs")
-os.makedirs(log_dir, exist_ok=True)
 
-# Настройка форматирования логов
-log_format = logging.Formatter(
-    '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+def logging_stats() -> Dict[str, int]:
+    if _queue_handler is None:
+        return {}
+    sampling = next((f for f in _queue_handler.filters if isinstance(f, SamplingFilter)), None)
+    return {
+        "queued": _queue_handler.queue.qsize(),
+        "dropped_queue_full": _queue_handler.dropped,
+        "dropped_sampled": sampling.dropped if sampling else 0,
+    }
 
-# Создаем файловый обработчик
-log_file = os.path.join(log_dir, f"generation_{datetime.now().strftime('%Y%m%d')}.log")
-file_handler = logging.FileHandler(log_file, encoding='utf-8')
-file_handler.setFormatter(log_format)
 
-# Создаем консольный обработчик
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(log_format)
+atexit.register(shutdown_logging)
 
-# Настраиваем корневой логгер
+# Логгер генерации изображений; обработчики настраивает setup_logging
 logger = logging.getLogger("generation")
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
-logger.addHandler(console_handler) 
\ No newline at end of file
@@ -39,6 +39,58 @@ class Settings(BaseSettings):
     SD_API_URL: str = Field(default="http://127.0.0.1:7860", description="URL для Stable Diffusion WebUI API")
     WEBUI_URL: str = Field(default="http://127.0.0.1:7860", description="URL для Stable Diffusion WebUI")
     SD_API_TIMEOUT: float = Field(default=600.0, description="Таймаут для API запросов в секундах")
+    SD_MODEL_REFRESH_INTERVAL: float = Field(default=15.0, description="Интервал проверки смены модели SD и файлов моделей в секундах")
+    
+    # --- Мониторинг бэкендов ---
+    HEALTH_PROBE_INTERVAL: float = Field(default=10.0, description="Интервал фоновой проверки бэкендов в секундах")
+    HEALTH_PROBE_TIMEOUT: float = Field(default=5.0, description="Таймаут проверки бэкенда в секундах")
+    CIRCUIT_FAILURE_THRESHOLD: int = Field(default=3, description="Ошибок подряд до размыкания circuit breaker")
+    CIRCUIT_RESET_TIMEOUT: float = Field(default=30.0, description="Время до пробного запроса (half-open) в секундах")
+
+    # --- Сжатие ответов ---
+    COMPRESSION_MIN_SIZE: int = Field(default=1024, description="Минимальный размер ответа в байтах для сжатия gzip/brotli")
+
+    # --- Очередь писем ---
+    EMAIL_QUEUE_WORKERS: int = Field(default=2, description="Число воркеров (постоянных SMTP-соединений) очереди писем")
+    EMAIL_QUEUE_BATCH_SIZE: int = Field(default=20, description="Максимум писем, отправляемых за один проход воркера")
+    EMAIL_MAX_ATTEMPTS: int = Field(default=5, description="Попыток отправки письма до переноса в dead-letter")
+    EMAIL_DEAD_LETTER_PATH: str = Field(default="logs/email_dead_letter.jsonl", description="Файл неотправленных писем")
+
+    # --- Логирование ---
+    LOG_LEVEL: str = Field(default="INFO", description="Уровень логирования по умолчанию")
+    LOG_MODULE_LEVELS: str = Field(default="", description="Уровни для модулей: 'app.chat_bot=DEBUG,uvicorn.access=WARNING'")
+    LOG_JSON: bool = Field(default=True, description="Писать логи в формате JSON (одна запись на строку)")
+    LOG_FILE: str = Field(default="logs/app.log", description="Файл логов (ротируется по размеру)")
+    LOG_MAX_FIELD_CHARS: int = Field(default=2000, description="Длина, до которой обрезаются сообщения и поля логов")
+    LOG_DEBUG_SAMPLE_EVERY: int = Field(default=10, description="Писать каждую N-ю DEBUG-запись с одного места вызова")
+
+    # --- Refresh-токены ---
+    REFRESH_TOKEN_COMPACTION_INTERVAL: float = Field(default=3600.0, description="Интервал удаления истёкших refresh-токенов в секундах")
+    REFRESH_TOKEN_COMPACTION_BATCH: int = Field(default=1000, description="Сколько истёкших refresh-токенов удалять за одну транзакцию")
+
+    # --- Кэш изображений ---
+    IMAGE_CACHE_ENABLED: bool = Field(default=True, description="Кэшировать результаты генерации с фиксированным seed")
+    IMAGE_CACHE_DIR: str = Field(default="cache/images", description="Каталог дискового кэша изображений")
+    IMAGE_CACHE_MAX_MB: int = Field(default=1024, description="Максимальный размер кэша изображений в МБ (LRU)")
+    GALLERY_INDEX_DIR: str = Field(default="cache/gallery_index", description="Каталог индексов перцептивных хэшей галерей персонажей")
+    GALLERY_DUPLICATE_SIMILARITY: float = Field(default=0.95, description="Схожесть, с которой новое изображение отмечается в логе как почти-дубликат изображения галереи")
+
+    # --- Потоковая генерация изображений ---
+    IMAGE_PROGRESS_POLL_INTERVAL: float = Field(default=1.0, description="Интервал опроса прогресса SD в секундах")
+    IMAGE_PREVIEW_INTERVAL: float = Field(default=2.0, description="Минимальный интервал между превью в секундах")
+    IMAGE_PREVIEW_MAX_SIDE: int = Field(default=256, description="Максимальная сторона превью в пикселях")
+
+    # --- Адаптивное качество ---
+    QUALITY_DEGRADE_QUEUE: int = Field(default=3, description="Длина очереди SD, с которой качество понижается на уровень")
+    QUALITY_DRAFT_QUEUE: int = Field(default=6, description="Длина очереди SD, с которой качество понижается на два уровня")
+    
+    # --- Реестр персонажей ---
+    CHARACTER_CACHE_SIZE: int = Field(default=64, description="Сколько загруженных персонажей держать в памяти (LRU)")
+    CHARACTER_MANIFEST_PATH: str = Field(default="cache/character_manifest.json", description="Файл манифеста персонажей")
+    
+    # --- Компилятор промптов ---
+    CLIP_TOKENIZER: str = Field(default="openai/clip-vit-large-patch14", description="Токенизатор CLIP (имя или путь, только локальные файлы)")
+    PROMPT_MAX_CHUNKS: int = Field(default=2, description="Бюджет кусков CLIP по 75 токенов для позитивного промпта")
     
     # --- Default Prompts ---
     USE_DEFAULT_PROMPTS: bool = Field(default=True, description="Использовать дефолтные промпты")
@@ -0,0 +1,198 @@
+"""
+ASGI middleware приложения.
+
+Middleware написаны на чистом ASGI, а не через @app.middleware("http"):
+BaseHTTPMiddleware заворачивает каждый ответ в отдельную задачу и поток
+в памяти, что особенно заметно на SSE-стримах чата.
+"""
+
+import logging
+import re
+import zlib
+from typing import Iterable, Optional
+
+from starlette.datastructures import URL, Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli необязателен: без него ответы сжимаются gzip
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Потоковые ответы и уже сжатые форматы: сжатие либо ломает доставку по мере
+# генерации (SSE), либо только тратит CPU
+EXCLUDED_CONTENT_TYPES = (
+    "text/event-stream",
+    "image/",
+    "video/",
+    "audio/",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/octet-stream",
+    "font/woff",
+)
+
+
+class RequestLoggingMiddleware:
+    """Логирует метод, URL и статус каждого HTTP-запроса."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        logger.info(f"Request: {scope['method']} {URL(scope=scope)}")
+
+        async def send_with_logging(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                logger.info(f"Response: {message['status']}")
+            await send(message)
+
+        await self.app(scope, receive, send_with_logging)
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    """Кодировки из Accept-Encoding с ненулевым q."""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        match = re.search(r"q=([0-9.]+)", params)
+        if not name or (match and float(match.group(1)) == 0):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+class _GzipCompressor:
+    encoding = "gzip"
+
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    encoding = "br"
+
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    """
+    Сжатие ответов brotli (если установлен пакет brotli) или gzip.
+
+    Не трогает SSE, изображения и другие уже сжатые форматы, ответы с
+    Content-Encoding/Content-Range и ответы меньше minimum_size.
+    Потоковые ответы сжимаются по частям без буферизации всего тела.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        excluded_content_types: Iterable[str] = EXCLUDED_CONTENT_TYPES,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.excluded_content_types = tuple(excluded_content_types)
+
+    def _choose_compressor(self, scope: Scope):
+        accepted = _accepted_encodings(Headers(scope=scope).get("accept-encoding", ""))
+        if brotli is not None and "br" in accepted:
+            return _BrotliCompressor(self.brotli_quality)
+        if "gzip" in accepted:
+            return _GzipCompressor(self.gzip_level)
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        compressor = self._choose_compressor(scope) if scope["type"] == "http" else None
+        if compressor is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, compressor, send)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    """Состояние сжатия одного ответа."""
+
+    def __init__(self, middleware: CompressionMiddleware, compressor, send: Send):
+        self.middleware = middleware
+        self.compressor = compressor
+        self.downstream = send
+        self.start_message: Optional[Message] = None
+        # None — решение ещё не принято, False — ответ отдаётся как есть
+        self.compressing: Optional[bool] = None
+
+    def _should_skip(self, headers: Headers) -> bool:
+        content_type = headers.get("content-type", "").lower()
+        return (
+            "content-encoding" in headers
+            or "content-range" in headers
+            or content_type.startswith(self.middleware.excluded_content_types)
+        )
+
+    async def send(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            self.start_message = message
+            if self._should_skip(Headers(raw=message["headers"])):
+                self.compressing = False
+                await self.downstream(message)
+            return
+
+        if message["type"] != "http.response.body" or self.compressing is False:
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressing is None:
+            if not more_body and len(body) < self.middleware.minimum_size:
+                self.compressing = False
+                await self.downstream(self.start_message)
+                await self.downstream(message)
+                return
+
+            self.compressing = True
+            headers = MutableHeaders(raw=list(self.start_message["headers"]))
+            headers["Content-Encoding"] = self.compressor.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                body = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(body))
+            await self.downstream({**self.start_message, "headers": headers.raw})
+            if not more_body:
+                await self.downstream({"type": "http.response.body", "body": body, "more_body": False})
+                return
+
+        chunk = self.compressor.compress(body)
+        if not more_body:
+            chunk += self.compressor.finish()
+        await self.downstream({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
@@ -0,0 +1,31 @@
+"""
+Шаблоны писем.
+"""
+
+from app.mail_service.queue import OutgoingEmail
+
+VERIFICATION_SUBJECT = "Email Verification - Art Generation API"
+
+
+def verification_body(verification_code: str) -> str:
+    return f"""Email Verification - Art Generation API
+
+Hello!
+
+To verify your email address, use the following code:
+
+{verification_code}
+
+Important:
+- Code is valid for 24 hours
+- Do not share the code with third parties
+- If you did not register in Art Generation API, ignore this email
+
+Best regards,
+Art Generation API Team
+
+This is an automatic email, please do not reply"""
+
+
+def verification_email(to_email: str, verification_code: str) -> OutgoingEmail:
+    return OutgoingEmail(to=to_email, subject=VERIFICATION_SUBJECT, body=verification_body(verification_code))
@@ -0,0 +1,315 @@
+"""
+Асинхронная очередь исходящих писем.
+
+Обработчики запросов только ставят письмо в очередь и сразу возвращают
+управление. Воркеры держат постоянные SMTP-соединения (по одному на воркер),
+забирают письма пачками и отправляют их в потоке, не блокируя event loop.
+Временные ошибки повторяются с экспоненциальной задержкой, письма, которые
+так и не удалось отправить, дописываются в dead-letter файл (JSON Lines).
+"""
+
+import asyncio
+import json
+import logging
+import smtplib
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from email.message import EmailMessage
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SMTPSettings:
+    host: str
+    port: int
+    username: Optional[str] = None
+    password: Optional[str] = None
+    use_tls: bool = True
+    from_email: Optional[str] = None
+    timeout: float = 30.0
+
+
+@dataclass
+class OutgoingEmail:
+    to: str
+    subject: str
+    body: str
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    attempts: int = 0
+    last_error: Optional[str] = None
+
+    def to_message(self, from_email: Optional[str]) -> EmailMessage:
+        message = EmailMessage()
+        if from_email:
+            message["From"] = from_email
+        message["To"] = self.to
+        message["Subject"] = self.subject
+        message.set_content(self.body, charset="utf-8")
+        return message
+
+
+class PermanentEmailError(Exception):
+    """Ошибка, при которой повторная отправка бессмысленна (адрес отклонён и т.п.)."""
+
+
+class SMTPConnection:
+    """Постоянное SMTP-соединение: переподключается при обрыве и по истечении idle_timeout."""
+
+    def __init__(self, settings: SMTPSettings, idle_timeout: float = 60.0):
+        self.settings = settings
+        self.idle_timeout = idle_timeout
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self.connections_opened = 0
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.settings.host, self.settings.port, timeout=self.settings.timeout)
+        try:
+            if self.settings.use_tls:
+                server.starttls()
+            if self.settings.username and self.settings.password:
+                server.login(self.settings.username, self.settings.password)
+        except Exception:
+            server.close()
+            raise
+        self.connections_opened += 1
+        return server
+
+    def _ensure_connected(self) -> smtplib.SMTP:
+        if self._server is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            # Сервер мог закрыть простаивавшее соединение — проверяем его
+            try:
+                self._server.noop()
+            except smtplib.SMTPException:
+                self.close()
+        if self._server is None:
+            self._server = self._connect()
+        return self._server
+
+    def send(self, email: OutgoingEmail) -> None:
+        """Отправляет письмо. Бросает PermanentEmailError для неисправимых ошибок."""
+        message = email.to_message(self.settings.from_email or self.settings.username)
+        for attempt in range(2):
+            server = self._ensure_connected()
+            try:
+                server.send_message(message)
+                self._last_used = time.monotonic()
+                return
+            except smtplib.SMTPServerDisconnected:
+                # Соединение закрыто сервером — одна попытка на новом соединении
+                self.close()
+                if attempt:
+                    raise
+            except smtplib.SMTPRecipientsRefused as e:
+                self._reset()
+                codes = [code for code, _ in e.recipients.values()]
+                if all(code >= 500 for code in codes):
+                    raise PermanentEmailError(f"Адрес отклонён: {e.recipients}") from e
+                raise
+            except smtplib.SMTPResponseException as e:
+                self._reset()
+                if e.smtp_code >= 500:
+                    raise PermanentEmailError(f"SMTP {e.smtp_code}: {e.smtp_error!r}") from e
+                raise
+
+    def _reset(self) -> None:
+        try:
+            if self._server is not None:
+                self._server.rset()
+        except smtplib.SMTPException:
+            self.close()
+
+    def close(self) -> None:
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                self._server.close()
+            self._server = None
+
+
+class EmailQueue:
+    """Очередь писем с пулом SMTP-соединений, повторами и dead-letter файлом."""
+
+    def __init__(
+        self,
+        settings_factory: Callable[[], SMTPSettings],
+        workers: int = 2,
+        batch_size: int = 20,
+        max_attempts: int = 5,
+        backoff_base: float = 2.0,
+        backoff_max: float = 300.0,
+        dead_letter_path: str = "logs/email_dead_letter.jsonl",
+        max_size: int = 10_000,
+    ):
+        self.settings_factory = settings_factory
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.dead_letter_path = Path(dead_letter_path)
+        self.max_size = max_size
+        self.sent = 0
+        self.failed = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._retries: Dict[str, Tuple[asyncio.TimerHandle, OutgoingEmail]] = {}
+        self._connections: List[SMTPConnection] = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        settings = self.settings_factory()
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._connections = [SMTPConnection(settings) for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(connection)) for connection in self._connections]
+        logger.info(f"[OK] Очередь писем запущена: {self.workers} SMTP-соединений с {settings.host}:{settings.port}")
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Дожидается отправки поставленных писем (не дольше timeout) и закрывает соединения."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"[WARNING] Очередь писем не опустела за {timeout} сек, осталось {self.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        # Неотправленные письма не теряются: сохраняем их в dead-letter
+        for handle, email in self._retries.values():
+            handle.cancel()
+            self._dead_letter(email, f"очередь остановлена до повтора ({email.last_error})")
+        self._retries.clear()
+        while not self._queue.empty():
+            self._dead_letter(self._queue.get_nowait(), "очередь остановлена")
+        for connection in self._connections:
+            await asyncio.to_thread(connection.close)
+        self._connections = []
+
+    def enqueue(self, email: OutgoingEmail) -> None:
+        """Ставит письмо в очередь без ожидания. Переполнение — сразу в dead-letter."""
+        if not self.running:
+            raise RuntimeError("Очередь писем не запущена")
+        try:
+            self._queue.put_nowait(email)
+        except asyncio.QueueFull:
+            self._dead_letter(email, "очередь переполнена")
+
+    def _next_batch(self, first: OutgoingEmail) -> List[OutgoingEmail]:
+        batch = [first]
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _worker(self, connection: SMTPConnection) -> None:
+        while True:
+            batch = self._next_batch(await self._queue.get())
+            try:
+                results = await asyncio.to_thread(self._send_batch, connection, batch)
+                for email, error in zip(batch, results):
+                    self._handle_result(email, error)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[ERROR] Ошибка воркера очереди писем: {e}")
+                for email in batch:
+                    self._handle_result(email, e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    @staticmethod
+    def _send_batch(connection: SMTPConnection, batch: List[OutgoingEmail]) -> List[Optional[Exception]]:
+        """Отправляет пачку по одному соединению. Выполняется в потоке."""
+        results: List[Optional[Exception]] = []
+        for email in batch:
+            try:
+                connection.send(email)
+                results.append(None)
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def _handle_result(self, email: OutgoingEmail, error: Optional[Exception]) -> None:
+        email.attempts += 1
+        if error is None:
+            self.sent += 1
+            logger.info(f"[OK] Письмо {email.id} отправлено на {email.to}")
+            return
+
+        email.last_error = f"{type(error).__name__}: {error}"
+        if isinstance(error, PermanentEmailError) or email.attempts >= self.max_attempts:
+            self._dead_letter(email, email.last_error)
+            return
+
+        delay = min(self.backoff_max, self.backoff_base ** email.attempts)
+        logger.warning(
+            f"[WARNING] Письмо {email.id} не отправлено (попытка {email.attempts}): "
+            f"{email.last_error}; повтор через {delay:.0f} сек"
+        )
+        handle = asyncio.get_running_loop().call_later(delay, self._requeue, email)
+        self._retries[email.id] = (handle, email)
+
+    def _requeue(self, email: OutgoingEmail) -> None:
+        self._retries.pop(email.id, None)
+        self.enqueue(email)
+
+    def _dead_letter(self, email: OutgoingEmail, reason: Optional[str]) -> None:
+        self.failed += 1
+        logger.error(f"[ERROR] Письмо {email.id} на {email.to} перемещено в dead-letter: {reason}")
+        record = {**asdict(email), "reason": reason, "failed_at": time.time()}
+        try:
+            self.dead_letter_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error(f"[ERROR] Не удалось записать dead-letter {self.dead_letter_path}: {e}")
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self.running,
+            "queued": self.qsize(),
+            "scheduled_retries": len(self._retries),
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+
+def load_smtp_settings() -> SMTPSettings:
+    """Настройки SMTP из .env (app/mail_service/config.py)."""
+    from app.mail_service import config
+
+    return SMTPSettings(
+        host=config.EMAIL_HOST,
+        port=config.EMAIL_PORT,
+        username=config.EMAIL_HOST_USER,
+        password=config.EMAIL_HOST_PASSWORD,
+        use_tls=config.EMAIL_USE_TLS,
+        from_email=config.DEFAULT_FROM_EMAIL,
+    )
+
+
+email_queue = EmailQueue(
+    load_smtp_settings,
+    workers=settings.EMAIL_QUEUE_WORKERS,
+    batch_size=settings.EMAIL_QUEUE_BATCH_SIZE,
+    max_attempts=settings.EMAIL_MAX_ATTEMPTS,
+    dead_letter_path=settings.EMAIL_DEAD_LETTER_PATH,
+)
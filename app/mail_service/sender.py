@@ -5,6 +5,7 @@ Email sender для отправки уведомлений.
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from .messages import VERIFICATION_SUBJECT, verification_body
 from .config import (
     EMAIL_HOST, EMAIL_PORT, EMAIL_USE_TLS,
     EMAIL_HOST_USER, EMAIL_HOST_PASSWORD, DEFAULT_FROM_EMAIL
@@ -50,26 +51,10 @@ class EmailSender:
             msg = MIMEMultipart()
             msg['From'] = self.username
             msg['To'] = to_email
-            msg['Subject'] = "Email Verification - Art Generation API"
+            msg['Subject'] = VERIFICATION_SUBJECT
             
             # Create simple text body
-            text_body = f"""Email Verification - Art Generation API
-
-Hello!
-
-To verify your email address, use the following code:
-
-{verification_code}
-
-Important:
-- Code is valid for 24 hours
-- Do not share the code with third parties
-- If you did not register in Art Generation API, ignore this email
-
-Best regards,
-Art Generation API Team
-
-This is an automatic email, please do not reply"""
+            text_body = verification_body(verification_code)
             
             msg.attach(MIMEText(text_body, 'plain', 'utf-8'))
             
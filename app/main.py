@@ -75,8 +75,21 @@ from typing import Optional
 # Импорты для генерации изображений
 from app.chat_bot.add_character import get_character_data
 from app.services.face_refinement import FaceRefinementService
+from app.services.backend_health import backend_health, SD_BACKEND
+from app.services.image_analysis import schedule_gallery_indexing
+from app.services.image_cache import image_result_cache
+from app.services.image_progress import new_task_id, stream_image_job
+from app.services.prompt_compiler import prompt_compiler
+from app.services.quality_policy import quality_policy, sd_queue
+from app.services.sd_model_registry import sd_model_registry
+from app.core.middleware import CompressionMiddleware, RequestLoggingMiddleware
+from app.mail_service.queue import email_queue
+from app.auth.token_store import refresh_token_compactor
+from app.chat_bot.services.llm_backend_pool import llm_backend_pool
+from app.chat_bot.services.hot_prefixes import export_hot_prefixes
 from app.schemas.generation import GenerationSettings
 from app.config.settings import settings
+from app.config.logging_config import logging_stats, parse_module_levels, setup_logging
 
 # Импорты моделей для Alembic
 from app.models.chat_history import ChatHistory
@@ -94,19 +107,17 @@ class ImageGenerationRequest(BaseModel):
     sampler_name: Optional[str] = None
     character: Optional[str] = None
     user_id: Optional[int] = None  # ID пользователя для проверки подписки
-
-# Создаем папку для логов, если её нет
-os.makedirs('logs', exist_ok=True)
-
-# Настраиваем логирование с правильной кодировкой
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('logs/app.log', encoding='utf-8')
-    ],
-    force=True  # Принудительно перезаписываем конфигурацию
+    use_cache: bool = True  # False — перерисовать даже при фиксированном seed
+    quality: Optional[str] = None  # Подсказка уровня качества: draft, standard, premium
+
+# Логирование через очередь: запись в консоль и файл выполняет фоновый поток
+setup_logging(
+    level=settings.LOG_LEVEL,
+    module_levels=parse_module_levels(settings.LOG_MODULE_LEVELS),
+    json_format=settings.LOG_JSON,
+    log_file=settings.LOG_FILE,
+    max_field_chars=settings.LOG_MAX_FIELD_CHARS,
+    debug_sample_every=settings.LOG_DEBUG_SAMPLE_EVERY,
 )
 logger = logging.getLogger(__name__)
 
@@ -122,35 +133,36 @@ async def lifespan(app: FastAPI):
     """Управление жизненным циклом приложения"""
     logger.info("[START] Запуск приложения...")
     
-    # Логируем информацию о модели при запуске
-    try:
-        import sys
-        from pathlib import Path
-        webui_path = Path(__file__).parent.parent / "stable-diffusion-webui"
-        sys.path.insert(0, str(webui_path))
-        from model_config import get_model_info, check_model_files
-        model_info = get_model_info()
-        model_available = check_model_files()
-        
-        if model_info and model_available:
-            logger.info(f"[TARGET] Загружена модель: {model_info['name']} ({model_info['size_mb']} MB)")
-            if model_info["vae_name"]:
-                logger.info(f"[ART] VAE: {model_info['vae_name']}")
-            else:
-                logger.info("[ART] VAE: Встроенный")
-        else:
-            logger.warning("[WARNING] Модель не найдена или недоступна")
-    except Exception as e:
-        logger.warning(f"[WARNING] Не удалось получить информацию о модели: {e}")
+    # Информация о модели SD: собирается один раз и обновляется фоновой задачей
+    await sd_model_registry.start()
     
     # Синхронизация персонажей отключена - используем character_importer
     logger.info("[INFO] Синхронизация персонажей отключена - используйте character_importer")
     
+    # Префиксы промптов персонажей, которые text-generation-webui держит в кэше
+    await export_hot_prefixes()
+    
+    # Фоновая проверка text-generation-webui и Stable Diffusion
+    await backend_health.start()
+    
+    # Очередь исходящих писем с постоянными SMTP-соединениями
+    try:
+        await email_queue.start()
+    except ValueError as e:
+        logger.warning(f"[WARNING] Очередь писем не запущена, SMTP не настроен: {e}")
+    
+    # Удаление истёкших refresh-токенов
+    await refresh_token_compactor.start()
+    
     logger.info("🎉 Приложение готово к работе!")
     yield
     
     # Завершение работы приложения
     logger.info("🛑 Останавливаем приложение...")
+    await refresh_token_compactor.stop()
+    await sd_model_registry.stop()
+    await email_queue.stop()
+    await backend_health.stop()
     logger.info("[OK] Приложение остановлено")
 
 # Создаем приложение с lifespan
@@ -175,38 +187,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Middleware для правильной обработки Unicode
-@app.middleware("http")
-async def unicode_middleware(request: Request, call_next):
-    """Middleware для правильной обработки Unicode в запросах."""
-    try:
-        # Логируем все запросы для отладки
-        logger.info(f"Request: {request.method} {request.url}")
-        
-        # Устанавливаем правильную кодировку для запроса
-        if hasattr(request, '_body'):
-            # Если есть тело запроса, убеждаемся что оно правильно декодировано
-            pass
-        
-        response = await call_next(request)
-        logger.info(f"Response: {response.status_code}")
-        return response
-    except UnicodeError as e:
-        logger.error(f"Unicode error in middleware: {e}")
-        return JSONResponse(
-            status_code=400,
-            content={"detail": f"Unicode processing error: {str(e)}"}
-        )
-    except Exception as e:
-        logger.error(f"Error in middleware: {e}")
-        return JSONResponse(
-            status_code=500,
-            content={"detail": f"Internal server error: {str(e)}"}
-        )
+# Логирование запросов (чистый ASGI: не оборачивает SSE-стримы в отдельную задачу)
+app.add_middleware(RequestLoggingMiddleware)
 
 # Настройка сессий для OAuth
 app.add_middleware(SessionMiddleware, secret_key="your-secret-key-change-in-production")
 
+# Сжатие ответов (brotli/gzip); SSE и изображения отдаются без сжатия
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
+
 # Обработчик ошибок для Unicode
 @app.exception_handler(UnicodeEncodeError)
 async def unicode_encode_handler(request: Request, exc: UnicodeEncodeError):
@@ -226,6 +215,15 @@ async def unicode_decode_handler(request: Request, exc: UnicodeDecodeError):
         content={"detail": f"Unicode decoding error: {str(exc)}"}
     )
 
+@app.exception_handler(UnicodeError)
+async def unicode_error_handler(request: Request, exc: UnicodeError):
+    """Обработчик остальных ошибок Unicode."""
+    logger.error(f"Unicode error: {exc}")
+    return JSONResponse(
+        status_code=400,
+        content={"detail": f"Unicode processing error: {str(exc)}"}
+    )
+
 # Добавляем статические файлы
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
@@ -494,19 +492,9 @@ async def chat_page():
 async def health():
     """Проверка здоровья основного приложения."""
     try:
-        # Получаем информацию о модели
-        try:
-            import sys
-            from pathlib import Path
-            webui_path = Path(__file__).parent.parent / "stable-diffusion-webui"
-            sys.path.insert(0, str(webui_path))
-            from model_config import get_model_info, check_model_files
-            model_info = get_model_info()
-            model_available = check_model_files()
-        except Exception as e:
-            logger.warning(f"Не удалось получить информацию о модели: {e}")
-            model_info = None
-            model_available = False
+        # Информация о модели из реестра, без обращения к SD и диску
+        model_info = sd_model_registry.get_model_info()
+        model_available = sd_model_registry.is_model_available()
         
         # Общий статус приложения
         app_status = {
@@ -520,8 +508,14 @@ async def health():
                 "available": model_available,
                 "vae": model_info["vae_name"] if model_info and model_info["vae_name"] else "Built-in"
             },
-            "services": {}
+            "services": backend_health.snapshot(),
+            "textgen_pool": llm_backend_pool.snapshot(),
+            "logging": logging_stats(),
+            "image_cache": image_result_cache.snapshot(),
+            "sd_models": sd_model_registry.snapshot()
         }
+        if any(service["circuit"] != "closed" for service in app_status["services"].values()):
+            app_status["status"] = "degraded"
         
         # Логируем информацию о модели
         if model_info:
@@ -786,11 +780,12 @@ async def chat_endpoint(request: dict):
         from app.database.db import async_session_maker
         import json
         
-        # Проверяем подключение к text-generation-webui
-        if not await textgen_webui_service.check_connection():
+        # Кэшированный статус text-generation-webui (без запроса к серверу)
+        if not llm_backend_pool.is_available():
             raise HTTPException(
                 status_code=503, 
-                detail="text-generation-webui недоступен. Запустите сервер text-generation-webui."
+                detail="text-generation-webui недоступен. Запустите сервер text-generation-webui.",
+                headers={"Retry-After": str(int(llm_backend_pool.retry_after()) + 1)}
             )
         
         # Простая валидация запроса
@@ -824,14 +819,14 @@ async def chat_endpoint(request: dict):
         # Получаем данные персонажа из базы данных
         from app.database.db import async_session_maker
         from app.chat_bot.models.models import CharacterDB
-        from sqlalchemy import select
+        from sqlalchemy import select, func
         
         character_data = None
         try:
             async with async_session_maker() as db:
-                # Поиск без учета регистра
+                # Поиск без учета регистра (использует индекс ix_characters_name_lower)
                 result = await db.execute(
-                    select(CharacterDB).where(CharacterDB.name.ilike(character_name))
+                    select(CharacterDB).where(func.lower(CharacterDB.name) == character_name.lower())
                 )
                 db_character = result.scalar_one_or_none()
                 
@@ -899,7 +894,9 @@ async def chat_endpoint(request: dict):
             top_k=chat_config.DEFAULT_TOP_K,
             min_p=chat_config.DEFAULT_MIN_P,
             repeat_penalty=chat_config.DEFAULT_REPEAT_PENALTY,
-            presence_penalty=chat_config.DEFAULT_PRESENCE_PENALTY
+            presence_penalty=chat_config.DEFAULT_PRESENCE_PENALTY,
+            # Один персонаж и сессия — один сервер: prompt cache llama.cpp остаётся тёплым
+            session_id=f"{character_name}:{session_id}"
         )
         
         if not response:
@@ -934,12 +931,12 @@ async def chat_endpoint(request: dict):
                 
                 # Проверяем, может ли пользователь генерировать фото
                 if user_id:
-                    logger.info(f"[DEBUG] DEBUG: Проверка монет для генерации фото пользователя {user_id}")
+                    logger.debug("[DEBUG] Проверка монет для генерации фото пользователя %s", user_id)
                     async with async_session_maker() as db:
                         from app.services.coins_service import CoinsService
                         coins_service = CoinsService(db)
                         can_generate_photo = await coins_service.can_user_generate_photo(user_id)
-                        logger.info(f"[DEBUG] DEBUG: Может генерировать фото: {can_generate_photo}")
+                        logger.debug("[DEBUG] Может генерировать фото: %s", can_generate_photo)
                         if not can_generate_photo:
                             coins = await coins_service.get_user_coins(user_id)
                             logger.error(f"[ERROR] DEBUG: Недостаточно монет для генерации фото! У пользователя {user_id}: {coins} монет, нужно 30")
@@ -948,7 +945,7 @@ async def chat_endpoint(request: dict):
                                 detail="Недостаточно монет для генерации фото! Нужно 30 монет."
                             )
                         else:
-                            logger.info(f"[OK] DEBUG: Пользователь {user_id} может генерировать фото")
+                            logger.debug("[OK] Пользователь %s может генерировать фото", user_id)
                 else:
                     logger.warning(f"[WARNING] DEBUG: user_id не передан, пропускаем проверку монет")
                 
@@ -1044,6 +1041,263 @@ async def chat_endpoint(request: dict):
 
 # Импорт уже есть выше в файле
 
+async def _prepare_image_generation(request: ImageGenerationRequest):
+    """
+    Проверки и подготовка генерации для персонажа: монеты пользователя,
+    данные персонажа, итоговый промпт. Возвращает сервис и настройки генерации.
+    """
+    # Проверяем подписку пользователя (если авторизован)
+    user_id = getattr(request, 'user_id', None)
+    logger.debug("[DEBUG] Эндпоинт generate-image, user_id: %s", user_id)
+    if user_id:
+        logger.debug("[DEBUG] Проверка монет для генерации фото пользователя %s", user_id)
+        from app.services.coins_service import CoinsService
+        from app.database.db import async_session_maker
+        
+        async with async_session_maker() as db:
+            coins_service = CoinsService(db)
+            can_generate_photo = await coins_service.can_user_generate_photo(user_id)
+            logger.debug("[DEBUG] Может генерировать фото: %s", can_generate_photo)
+            if not can_generate_photo:
+                coins = await coins_service.get_user_coins(user_id)
+                logger.error(f"[ERROR] DEBUG: Недостаточно монет для генерации фото! У пользователя {user_id}: {coins} монет, нужно 30")
+                raise HTTPException(
+                    status_code=403, 
+                    detail="Недостаточно монет для генерации фото! Нужно 30 монет."
+                )
+            else:
+                logger.debug("[OK] Пользователь %s может генерировать фото", user_id)
+    else:
+        logger.warning(f"[WARNING] DEBUG: user_id не передан в эндпоинте generate-image")
+    # Логируем информацию о модели перед генерацией
+    model_info = sd_model_registry.get_model_info()
+    if model_info:
+        logger.info(f"[TARGET] Генерация изображения с моделью: {model_info['name']} ({model_info['size_mb']} MB)")
+    else:
+        logger.warning("[WARNING] Информация о модели недоступна")
+    
+    logger.info("[TARGET] Генерация изображения", extra={"prompt": request.prompt})
+
+    # Создаем сервис для генерации
+    face_refinement_service = FaceRefinementService(settings.SD_API_URL)
+
+    # Получаем данные персонажа для внешности
+    character_name = request.character or "anna"
+    
+    # Сначала пытаемся получить данные из базы данных
+    character_appearance = None
+    character_location = None
+    
+    try:
+        from app.database.db import async_session_maker
+        from app.chat_bot.models.models import CharacterDB
+        from sqlalchemy import select, func
+        
+        async with async_session_maker() as db:
+            # Поиск без учета регистра (использует индекс ix_characters_name_lower)
+            result = await db.execute(
+                select(CharacterDB).where(func.lower(CharacterDB.name) == character_name.lower())
+            )
+            db_character = result.scalar_one_or_none()
+            
+            if db_character:
+                character_appearance = db_character.character_appearance
+                character_location = db_character.location
+                logger.info(f"[OK] Данные персонажа '{character_name}' получены из БД")
+            else:
+                # Если в БД нет, пытаемся получить из файлов
+                character_data = get_character_data(character_name)
+                if character_data:
+                    character_appearance = character_data.get("character_appearance")
+                    character_location = character_data.get("location")
+                    logger.info(f"[OK] Данные персонажа '{character_name}' получены из файлов")
+                else:
+                    logger.error(f"[ERROR] Персонаж '{character_name}' не найден ни в БД, ни в файлах")
+                    raise HTTPException(status_code=404, detail=f"Персонаж '{character_name}' не найден")
+                    
+    except Exception as e:
+        logger.error(f"[ERROR] Ошибка получения данных персонажа: {e}")
+        # Fallback к файлам
+        character_data = get_character_data(character_name)
+        if character_data:
+            character_appearance = character_data.get("character_appearance")
+            character_location = character_data.get("location")
+            logger.info(f"[OK] Fallback: данные персонажа '{character_name}' получены из файлов")
+        else:
+            logger.error(f"[ERROR] Персонаж '{character_name}' не найден")
+            raise HTTPException(status_code=404, detail=f"Персонаж '{character_name}' не найден")
+    # Импортируем настройки по умолчанию
+    from app.config.generation_defaults import get_generation_params
+    
+    # Получаем настройки по умолчанию
+    default_params = get_generation_params("default")
+    logger.debug("🚨 ДИАГНОСТИКА: default_params['steps'] = %s", default_params.get('steps'))
+    
+    # Создаем настройки генерации с использованием значений по умолчанию
+    generation_settings = GenerationSettings(
+        prompt=request.prompt,
+        negative_prompt=request.negative_prompt,
+        use_default_prompts=request.use_default_prompts,
+        character=character_name,
+        seed=request.seed or default_params.get("seed", -1),
+        steps=default_params.get("steps"),  # ИСПРАВЛЕНО: всегда используем значение из конфигурации
+        width=request.width or default_params.get("width"),
+        height=request.height or default_params.get("height"),
+        cfg_scale=request.cfg_scale or default_params.get("cfg_scale"),
+        sampler_name=request.sampler_name or default_params.get("sampler_name"),
+        batch_size=default_params.get("batch_size", 1),
+        n_iter=default_params.get("n_iter", 1),
+        save_grid=default_params.get("save_grid", False),
+        use_adetailer=default_params.get("use_adetailer", False),
+        enable_hr=default_params.get("enable_hr", True),
+        denoising_strength=default_params.get("denoising_strength", 0.5),
+        hr_scale=default_params.get("hr_scale", 1.5),
+        hr_upscaler=default_params.get("hr_upscaler", "R-ESRGAN 4x+ Anime6B"),
+        hr_second_pass_steps=default_params.get("hr_second_pass_steps", 10),
+        hr_prompt=default_params.get("hr_prompt", ""),
+        hr_negative_prompt=default_params.get("hr_negative_prompt", ""),
+        restore_faces=default_params.get("restore_faces", False),
+        clip_skip=default_params.get("clip_skip", 2),
+        lora_models=default_params.get("lora_models", []),
+        alwayson_scripts=default_params.get("alwayson_scripts", {}),
+        use_cache=request.use_cache
+    )
+    
+    # Создаем полные настройки для логирования (включая все значения по умолчанию)
+    full_settings_for_logging = default_params.copy()
+    full_settings_for_logging.update({
+        "prompt": request.prompt,
+        "negative_prompt": request.negative_prompt,
+        "use_default_prompts": request.use_default_prompts,
+        "character": character_name,
+        "seed": request.seed or default_params.get("seed", -1),
+        "steps": request.steps or default_params.get("steps", 35),
+        "width": request.width or default_params.get("width", 512),
+        "height": request.height or default_params.get("height", 853),
+        "cfg_scale": request.cfg_scale or default_params.get("cfg_scale", 12),
+        "sampler_name": request.sampler_name or default_params.get("sampler_name", "DPM++ 2M Karras"),
+    })
+    
+    # Добавляем внешность и локацию персонажа в промпт если есть
+    prompt_parts = []
+    
+    if character_appearance:
+        logger.debug("[ART] Добавляем внешность персонажа: %.100s...", character_appearance)
+        prompt_parts.append(character_appearance)
+        full_settings_for_logging["character_appearance"] = character_appearance
+    
+    if character_location:
+        logger.debug("🏠 Добавляем локацию персонажа: %.100s...", character_location)
+        prompt_parts.append(character_location)
+        full_settings_for_logging["character_location"] = character_location
+    
+    # Получаем стандартный промпт из default_prompts.py
+    from app.config.default_prompts import get_default_positive_prompts
+    default_positive_prompts = get_default_positive_prompts()
+    logger.debug("[NOTE] Добавляем стандартный промпт: %.100s...", default_positive_prompts)
+    
+    # Формируем финальный промпт: данные персонажа + пользовательский промпт + стандартный промпт.
+    # Компилятор убирает дубли и не даёт дефолтным тегам вывести промпт за бюджет кусков CLIP
+    compiled = prompt_compiler.compile(
+        character=", ".join(prompt_parts),
+        user=generation_settings.prompt,
+        defaults=default_positive_prompts,
+    )
+    logger.info(
+        f"[OK] Промпт: {compiled.tokens} токенов CLIP, кусков: {compiled.chunks}, "
+        f"дублей убрано: {compiled.duplicates}, дефолтных тегов отброшено: {len(compiled.dropped)}"
+    )
+    enhanced_prompt = compiled.prompt
+    generation_settings.prompt = enhanced_prompt
+    
+    # Обновляем промпт в настройках для логирования
+    full_settings_for_logging["prompt"] = enhanced_prompt
+    full_settings_for_logging["prompt_tokens"] = compiled.tokens
+    full_settings_for_logging["prompt_chunks"] = compiled.chunks
+    full_settings_for_logging["default_positive_prompts"] = default_positive_prompts
+
+    # Уровень качества: очередь к SD, подписка пользователя и подсказка клиента
+    subscription_type = None
+    if user_id:
+        from app.services.subscription_service import SubscriptionService
+        from app.database.db import async_session_maker
+        async with async_session_maker() as db:
+            subscription = await SubscriptionService(db).get_user_subscription(user_id)
+            if subscription and subscription.is_active:
+                subscription_type = subscription.subscription_type.value
+    decision = quality_policy.choose(sd_queue.length, subscription_type, request.quality)
+    generation_settings.quality_tier = decision.tier.value
+    full_settings_for_logging["quality_tier"] = decision.tier.value
+    logger.info(f"[OK] Уровень качества: {decision.tier.value} ({decision.reason})")
+
+    return face_refinement_service, generation_settings, full_settings_for_logging
+
+
+async def _finish_image_generation(request: ImageGenerationRequest, result) -> dict:
+    """Сохраняет сгенерированное изображение в галерею персонажа и списывает монеты."""
+    user_id = getattr(request, 'user_id', None)
+
+    if not result.image_data or len(result.image_data) == 0:
+        raise HTTPException(status_code=500, detail="Не удалось сгенерировать изображение")
+    
+    # Берем первое изображение
+    image_data = result.image_data[0]
+    
+    # Сохраняем изображение
+    from app.utils.image_saver import save_image
+    import time
+    
+    # Создаем папку для персонажа
+    character_name = request.character or "character"
+    character_photos_dir = f"paid_gallery/main_photos/{character_name.lower()}"
+    os.makedirs(character_photos_dir, exist_ok=True)
+    
+    # Сохраняем изображение
+    filename = f"generated_{int(time.time())}.png"
+    filepath = os.path.join(character_photos_dir, filename)
+    
+    with open(filepath, 'wb') as f:
+        f.write(image_data)
+    
+    # Индекс почти-дубликатов галереи обновляется в фоне и на ответ не влияет
+    schedule_gallery_indexing(
+        character_name, filename, image_data, Path(character_photos_dir),
+        storage_dir=Path(settings.GALLERY_INDEX_DIR),
+        similarity_threshold=settings.GALLERY_DUPLICATE_SIMILARITY,
+    )
+    
+    # Возвращаем URL изображения в правильном формате
+    image_url = f"/static/photos/{character_name.lower()}/{filename}"
+    
+    # Проверяем, что файл действительно существует
+    if os.path.exists(filepath):
+        logger.info(f"[OK] Изображение сохранено: {filepath}")
+        logger.info(f"[OK] URL изображения: {image_url}")
+    else:
+        logger.error(f"[ERROR] Файл не найден после сохранения: {filepath}")
+        image_url = None
+    
+    # Тратим монеты за генерацию фото (если пользователь авторизован)
+    if user_id:
+        logger.info(f"💰 Тратим 30 монет за генерацию фото для пользователя {user_id}")
+        from app.database.db import async_session_maker
+        async with async_session_maker() as db:
+            from app.services.coins_service import CoinsService
+            coins_service = CoinsService(db)
+            coins_spent = await coins_service.spend_coins_for_photo(user_id)
+            if coins_spent:
+                coins_left = await coins_service.get_user_coins(user_id)
+                logger.info(f"[OK] Потрачено 30 монет за генерацию фото для пользователя {user_id}. Осталось: {coins_left}")
+            else:
+                logger.warning(f"[WARNING] Не удалось потратить монеты за генерацию фото для пользователя {user_id}")
+    
+    return {
+        "image_url": image_url,
+        "filename": filename,
+        "message": "Изображение успешно сгенерировано"
+    }
+
+
 @app.post("/api/v1/generate-image/")
 async def generate_image(request: ImageGenerationRequest):
     """
@@ -1055,245 +1309,62 @@ async def generate_image(request: ImageGenerationRequest):
     Returns:
         dict: Результат генерации изображения.
     """
-    try:
-        # Проверяем подписку пользователя (если авторизован)
-        user_id = getattr(request, 'user_id', None)
-        logger.info(f"[DEBUG] DEBUG: Эндпоинт generate-image, user_id: {user_id}")
-        if user_id:
-            logger.info(f"[DEBUG] DEBUG: Проверка монет для генерации фото пользователя {user_id}")
-            from app.services.coins_service import CoinsService
-            from app.database.db import async_session_maker
-            
-            async with async_session_maker() as db:
-                coins_service = CoinsService(db)
-                can_generate_photo = await coins_service.can_user_generate_photo(user_id)
-                logger.info(f"[DEBUG] DEBUG: Может генерировать фото: {can_generate_photo}")
-                if not can_generate_photo:
-                    coins = await coins_service.get_user_coins(user_id)
-                    logger.error(f"[ERROR] DEBUG: Недостаточно монет для генерации фото! У пользователя {user_id}: {coins} монет, нужно 30")
-                    raise HTTPException(
-                        status_code=403, 
-                        detail="Недостаточно монет для генерации фото! Нужно 30 монет."
-                    )
-                else:
-                    logger.info(f"[OK] DEBUG: Пользователь {user_id} может генерировать фото")
-        else:
-            logger.warning(f"[WARNING] DEBUG: user_id не передан в эндпоинте generate-image")
-        # Логируем информацию о модели перед генерацией
-        try:
-            import sys
-            from pathlib import Path
-            webui_path = Path(__file__).parent.parent / "stable-diffusion-webui"
-            sys.path.insert(0, str(webui_path))
-            from model_config import get_model_info
-            model_info = get_model_info()
-            if model_info:
-                logger.info(f"[TARGET] Генерация изображения с моделью: {model_info['name']} ({model_info['size_mb']} MB)")
-            else:
-                logger.warning("[WARNING] Информация о модели недоступна")
-        except Exception as e:
-            logger.warning(f"[WARNING] Не удалось получить информацию о модели: {e}")
-        
-        logger.info(f"[TARGET] Генерация изображения: {request.prompt}")
+    # Circuit breaker Stable Diffusion разомкнут — отвечаем сразу, не дожидаясь таймаута
+    if not backend_health.is_available(SD_BACKEND):
+        raise HTTPException(
+            status_code=503,
+            detail="Stable Diffusion WebUI недоступен, попробуйте позже",
+            headers={"Retry-After": str(int(backend_health.get(SD_BACKEND).breaker.retry_after) + 1)}
+        )
 
-        # Создаем сервис для генерации
-        face_refinement_service = FaceRefinementService(settings.SD_API_URL)
+    try:
+        face_refinement_service, generation_settings, full_settings_for_logging = await _prepare_image_generation(request)
 
-        # Получаем данные персонажа для внешности
-        character_name = request.character or "anna"
-        
-        # Сначала пытаемся получить данные из базы данных
-        character_appearance = None
-        character_location = None
-        
-        try:
-            from app.database.db import async_session_maker
-            from app.chat_bot.models.models import CharacterDB
-            from sqlalchemy import select
-            
-            async with async_session_maker() as db:
-                # Поиск без учета регистра
-                result = await db.execute(
-                    select(CharacterDB).where(CharacterDB.name.ilike(character_name))
-                )
-                db_character = result.scalar_one_or_none()
-                
-                if db_character:
-                    character_appearance = db_character.character_appearance
-                    character_location = db_character.location
-                    logger.info(f"[OK] Данные персонажа '{character_name}' получены из БД")
-                else:
-                    # Если в БД нет, пытаемся получить из файлов
-                    character_data = get_character_data(character_name)
-                    if character_data:
-                        character_appearance = character_data.get("character_appearance")
-                        character_location = character_data.get("location")
-                        logger.info(f"[OK] Данные персонажа '{character_name}' получены из файлов")
-                    else:
-                        logger.error(f"[ERROR] Персонаж '{character_name}' не найден ни в БД, ни в файлах")
-                        raise HTTPException(status_code=404, detail=f"Персонаж '{character_name}' не найден")
-                        
-        except Exception as e:
-            logger.error(f"[ERROR] Ошибка получения данных персонажа: {e}")
-            # Fallback к файлам
-            character_data = get_character_data(character_name)
-            if character_data:
-                character_appearance = character_data.get("character_appearance")
-                character_location = character_data.get("location")
-                logger.info(f"[OK] Fallback: данные персонажа '{character_name}' получены из файлов")
-            else:
-                logger.error(f"[ERROR] Персонаж '{character_name}' не найден")
-                raise HTTPException(status_code=404, detail=f"Персонаж '{character_name}' не найден")
-        # Импортируем настройки по умолчанию
-        from app.config.generation_defaults import get_generation_params
-        
-        # Получаем настройки по умолчанию
-        default_params = get_generation_params("default")
-        logger.info(f"🚨 ДИАГНОСТИКА: default_params['steps'] = {default_params.get('steps')}")
-        
-        # Создаем настройки генерации с использованием значений по умолчанию
-        generation_settings = GenerationSettings(
-            prompt=request.prompt,
-            negative_prompt=request.negative_prompt,
-            use_default_prompts=request.use_default_prompts,
-            character=character_name,
-            seed=request.seed or default_params.get("seed", -1),
-            steps=default_params.get("steps"),  # ИСПРАВЛЕНО: всегда используем значение из конфигурации
-            width=request.width or default_params.get("width"),
-            height=request.height or default_params.get("height"),
-            cfg_scale=request.cfg_scale or default_params.get("cfg_scale"),
-            sampler_name=request.sampler_name or default_params.get("sampler_name"),
-            batch_size=default_params.get("batch_size", 1),
-            n_iter=default_params.get("n_iter", 1),
-            save_grid=default_params.get("save_grid", False),
-            use_adetailer=default_params.get("use_adetailer", False),
-            enable_hr=default_params.get("enable_hr", True),
-            denoising_strength=default_params.get("denoising_strength", 0.5),
-            hr_scale=default_params.get("hr_scale", 1.5),
-            hr_upscaler=default_params.get("hr_upscaler", "R-ESRGAN 4x+ Anime6B"),
-            hr_second_pass_steps=default_params.get("hr_second_pass_steps", 10),
-            hr_prompt=default_params.get("hr_prompt", ""),
-            hr_negative_prompt=default_params.get("hr_negative_prompt", ""),
-            restore_faces=default_params.get("restore_faces", False),
-            clip_skip=default_params.get("clip_skip", 2),
-            lora_models=default_params.get("lora_models", []),
-            alwayson_scripts=default_params.get("alwayson_scripts", {})
-        )
-        
-        # Создаем полные настройки для логирования (включая все значения по умолчанию)
-        full_settings_for_logging = default_params.copy()
-        full_settings_for_logging.update({
-            "prompt": request.prompt,
-            "negative_prompt": request.negative_prompt,
-            "use_default_prompts": request.use_default_prompts,
-            "character": character_name,
-            "seed": request.seed or default_params.get("seed", -1),
-            "steps": request.steps or default_params.get("steps", 35),
-            "width": request.width or default_params.get("width", 512),
-            "height": request.height or default_params.get("height", 853),
-            "cfg_scale": request.cfg_scale or default_params.get("cfg_scale", 12),
-            "sampler_name": request.sampler_name or default_params.get("sampler_name", "DPM++ 2M Karras"),
-        })
-        
-        # Добавляем внешность и локацию персонажа в промпт если есть
-        prompt_parts = []
-        
-        if character_appearance:
-            logger.info(f"[ART] Добавляем внешность персонажа: {character_appearance[:100]}...")
-            prompt_parts.append(character_appearance)
-            full_settings_for_logging["character_appearance"] = character_appearance
-        
-        if character_location:
-            logger.info(f"🏠 Добавляем локацию персонажа: {character_location[:100]}...")
-            prompt_parts.append(character_location)
-            full_settings_for_logging["character_location"] = character_location
-        
-        # Получаем стандартный промпт из default_prompts.py
-        from app.config.default_prompts import get_default_positive_prompts
-        default_positive_prompts = get_default_positive_prompts()
-        logger.info(f"[NOTE] Добавляем стандартный промпт: {default_positive_prompts[:100]}...")
-        
-        # Формируем финальный промпт: данные персонажа + пользовательский промпт + стандартный промпт
-        final_prompt_parts = []
-        
-        # 1. Данные персонажа (если есть)
-        if prompt_parts:
-            final_prompt_parts.extend(prompt_parts)
-        
-        # 2. Пользовательский промпт
-        final_prompt_parts.append(generation_settings.prompt)
-        
-        # 3. Стандартный промпт
-        final_prompt_parts.append(default_positive_prompts)
-        
-        # Объединяем все части
-        enhanced_prompt = ", ".join(final_prompt_parts)
-        generation_settings.prompt = enhanced_prompt
-        
-        # Обновляем промпт в настройках для логирования
-        full_settings_for_logging["prompt"] = enhanced_prompt
-        full_settings_for_logging["default_positive_prompts"] = default_positive_prompts
-        
         # Генерируем изображение
         result = await face_refinement_service.generate_image(generation_settings, full_settings_for_logging)
-        
-        if not result.image_data or len(result.image_data) == 0:
-            raise HTTPException(status_code=500, detail="Не удалось сгенерировать изображение")
-        
-        # Берем первое изображение
-        image_data = result.image_data[0]
-        
-        # Сохраняем изображение
-        from app.utils.image_saver import save_image
-        import time
-        
-        # Создаем папку для персонажа
-        character_name = request.character or "character"
-        character_photos_dir = f"paid_gallery/main_photos/{character_name.lower()}"
-        os.makedirs(character_photos_dir, exist_ok=True)
-        
-        # Сохраняем изображение
-        filename = f"generated_{int(time.time())}.png"
-        filepath = os.path.join(character_photos_dir, filename)
-        
-        with open(filepath, 'wb') as f:
-            f.write(image_data)
-        
-        # Возвращаем URL изображения в правильном формате
-        image_url = f"/static/photos/{character_name.lower()}/{filename}"
-        
-        # Проверяем, что файл действительно существует
-        if os.path.exists(filepath):
-            logger.info(f"[OK] Изображение сохранено: {filepath}")
-            logger.info(f"[OK] URL изображения: {image_url}")
-        else:
-            logger.error(f"[ERROR] Файл не найден после сохранения: {filepath}")
-            image_url = None
-        
-        # Тратим монеты за генерацию фото (если пользователь авторизован)
-        if user_id:
-            logger.info(f"💰 Тратим 30 монет за генерацию фото для пользователя {user_id}")
-            async with async_session_maker() as db:
-                from app.services.coins_service import CoinsService
-                coins_service = CoinsService(db)
-                coins_spent = await coins_service.spend_coins_for_photo(user_id)
-                if coins_spent:
-                    coins_left = await coins_service.get_user_coins(user_id)
-                    logger.info(f"[OK] Потрачено 30 монет за генерацию фото для пользователя {user_id}. Осталось: {coins_left}")
-                else:
-                    logger.warning(f"[WARNING] Не удалось потратить монеты за генерацию фото для пользователя {user_id}")
-        
-        return {
-            "image_url": image_url,
-            "filename": filename,
-            "message": "Изображение успешно сгенерировано"
-        }
-        
+        return await _finish_image_generation(request, result)
+
     except Exception as e:
         logger.error(f"[ERROR] Ошибка генерации изображения: {e}")
         raise HTTPException(status_code=500, detail=f"Ошибка генерации изображения: {str(e)}")
 
 
+@app.post("/api/v1/generate-image/stream/")
+async def generate_image_stream(request: ImageGenerationRequest, http_request: Request):
+    """
+    Генерация изображения с потоковой выдачей хода (Server-Sent Events).
+
+    Пока SD рисует, клиент получает события progress (доля и ETA) и preview
+    (уменьшенный кадр), в конце — done с тем же телом, что у /generate-image/,
+    или error. Отключение клиента прерывает генерацию.
+    """
+    if not backend_health.is_available(SD_BACKEND):
+        raise HTTPException(
+            status_code=503,
+            detail="Stable Diffusion WebUI недоступен, попробуйте позже",
+            headers={"Retry-After": str(int(backend_health.get(SD_BACKEND).breaker.retry_after) + 1)}
+        )
+
+    # Проверки монет и персонажа выполняются до начала потока, чтобы вернуть обычный HTTP-статус
+    face_refinement_service, generation_settings, full_settings_for_logging = await _prepare_image_generation(request)
+
+    task_id = new_task_id()
+    events = stream_image_job(
+        face_refinement_service,
+        face_refinement_service.generate_image(generation_settings, full_settings_for_logging, task_id=task_id),
+        http_request,
+        on_result=lambda result: _finish_image_generation(request, result),
+        task_id=task_id,
+        poll_interval=settings.IMAGE_PROGRESS_POLL_INTERVAL,
+        preview_interval=settings.IMAGE_PREVIEW_INTERVAL,
+        preview_max_side=settings.IMAGE_PREVIEW_MAX_SIDE,
+    )
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "Connection": "keep-alive", "X-Accel-Buffering": "no"}
+    )
+
 
 if __name__ == "__main__":
     logger.info("Запуск основного приложения...")
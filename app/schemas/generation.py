@@ -65,6 +65,8 @@ class GenerationSettings(BaseModel):
     save_grid: Optional[bool] = Field(None, description="Сохранять сетку изображений")
     use_vae: Optional[bool] = Field(None, description="Использовать VAE")
     vae_model: Optional[str] = Field(None, description="Название VAE модели")
+    use_cache: bool = Field(True, description="Брать результат из кэша, если seed фиксирован")
+    quality_tier: Optional[str] = Field(None, description="Уровень качества: draft, standard, premium (None — выбрать по нагрузке)")
     
     # IP-Adapter удален
     
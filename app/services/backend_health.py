@@ -0,0 +1,286 @@
+"""
+Мониторинг доступности внешних бэкендов (text-generation-webui, Stable Diffusion WebUI).
+
+Состояние бэкендов проверяется фоновой задачей и кэшируется, поэтому
+обработчики запросов не делают лишний HTTP-запрос перед каждой генерацией.
+Для каждого бэкенда работает circuit breaker: после серии ошибок подряд
+запросы сразу отклоняются, а через reset_timeout пропускается пробный
+запрос (half-open), успешный результат которого снова открывает доступ.
+"""
+
+import asyncio
+import enum
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from app.config.settings import settings
+from app.chat_bot.config.chat_config import chat_config
+
+logger = logging.getLogger(__name__)
+
+TEXTGEN_BACKEND = "textgen"
+SD_BACKEND = "stable_diffusion"
+
+
+class BackendUnavailableError(Exception):
+    """Бэкенд недоступен: circuit breaker разомкнут."""
+
+    def __init__(self, backend: str, retry_after: float = 0.0):
+        self.backend = backend
+        self.retry_after = retry_after
+        super().__init__(f"Бэкенд {backend} недоступен, повторите через {retry_after:.0f} сек")
+
+
+class CircuitState(str, enum.Enum):
+    CLOSED = "closed"        # запросы проходят
+    OPEN = "open"            # запросы отклоняются без обращения к бэкенду
+    HALF_OPEN = "half_open"  # пропускается один пробный запрос
+
+
+class CircuitBreaker:
+    """Circuit breaker с автоматическим переходом в half-open."""
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = CircuitState.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_progress = False
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state == CircuitState.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._state = CircuitState.HALF_OPEN
+            self._trial_in_progress = False
+        return self._state
+
+    @property
+    def consecutive_failures(self) -> int:
+        return self._consecutive_failures
+
+    @property
+    def retry_after(self) -> float:
+        if self._state != CircuitState.OPEN:
+            return 0.0
+        return max(0.0, self.reset_timeout - (self._clock() - self._opened_at))
+
+    def allow_request(self) -> bool:
+        """Можно ли отправить запрос. В half-open пропускает один пробный запрос."""
+        state = self.state
+        if state == CircuitState.CLOSED:
+            return True
+        if state == CircuitState.HALF_OPEN and not self._trial_in_progress:
+            self._trial_in_progress = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self._state != CircuitState.CLOSED:
+            logger.info("[OK] Circuit breaker замкнут: бэкенд снова отвечает")
+        self._state = CircuitState.CLOSED
+        self._consecutive_failures = 0
+        self._trial_in_progress = False
+
+    def record_failure(self) -> None:
+        self._consecutive_failures += 1
+        if self.state == CircuitState.HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+            if self._state != CircuitState.OPEN:
+                logger.warning(
+                    f"[WARNING] Circuit breaker разомкнут после {self._consecutive_failures} ошибок подряд"
+                )
+            self._state = CircuitState.OPEN
+            self._opened_at = self._clock()
+            self._trial_in_progress = False
+
+
+@dataclass
+class BackendStatus:
+    """Кэшированное состояние одного бэкенда."""
+
+    name: str
+    url: str
+    probe_path: str
+    breaker: CircuitBreaker
+    healthy: Optional[bool] = None
+    last_checked: Optional[float] = None
+    last_latency: Optional[float] = None
+    last_error: Optional[str] = None
+    details: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.breaker.state.value,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "retry_after": round(self.breaker.retry_after, 1),
+            "last_checked": self.last_checked,
+            "latency_ms": round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+            "last_error": self.last_error,
+            **self.details,
+        }
+
+
+class BackendHealthMonitor:
+    """Фоновая проверка бэкендов и circuit breaker для каждого из них."""
+
+    def __init__(
+        self,
+        interval: float = 10.0,
+        probe_timeout: float = 5.0,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30.0,
+    ):
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._backends: Dict[str, BackendStatus] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, url: str, probe_path: str) -> BackendStatus:
+        status = BackendStatus(
+            name=name,
+            url=url.rstrip("/"),
+            probe_path=probe_path,
+            breaker=CircuitBreaker(self.failure_threshold, self.reset_timeout),
+        )
+        self._backends[name] = status
+        return status
+
+    def get(self, name: str) -> BackendStatus:
+        return self._backends[name]
+
+    def names(self) -> List[str]:
+        return list(self._backends)
+
+    # --- Проверка перед запросом -------------------------------------------
+
+    def is_available(self, name: str) -> bool:
+        """Можно ли обращаться к бэкенду (без сетевого запроса)."""
+        status = self._backends.get(name)
+        return status is None or status.breaker.allow_request()
+
+    def ensure_available(self, name: str) -> None:
+        """Бросает BackendUnavailableError, если circuit breaker разомкнут."""
+        if not self.is_available(name):
+            raise BackendUnavailableError(name, self._backends[name].breaker.retry_after)
+
+    # --- Пассивные сигналы от реальных запросов -----------------------------
+
+    def record_success(self, name: str) -> None:
+        status = self._backends.get(name)
+        if status is not None:
+            status.healthy = True
+            status.last_error = None
+            status.breaker.record_success()
+
+    def record_failure(self, name: str, error: Any = None) -> None:
+        status = self._backends.get(name)
+        if status is not None:
+            status.healthy = False
+            status.last_error = str(error) if error is not None else status.last_error
+            status.breaker.record_failure()
+
+    # --- Фоновая проверка ---------------------------------------------------
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.probe_timeout))
+        # Первая проверка до приёма запросов, чтобы /health сразу был заполнен
+        await self.probe_all()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"[OK] Мониторинг бэкендов запущен: {', '.join(self._backends)}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self._next_delay())
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error(f"[ERROR] Ошибка фоновой проверки бэкендов: {e}")
+
+    def _next_delay(self) -> float:
+        # Разомкнутый breaker проверяем сразу по истечении reset_timeout
+        delays = [self.interval]
+        for status in self._backends.values():
+            if status.breaker.state == CircuitState.OPEN:
+                delays.append(status.breaker.retry_after)
+        return max(0.5, min(delays))
+
+    async def probe_all(self) -> None:
+        await asyncio.gather(*(self.probe(name) for name in self._backends))
+
+    async def probe(self, name: str) -> bool:
+        status = self._backends[name]
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.probe_timeout))
+
+        started = time.monotonic()
+        try:
+            async with self._session.get(status.url + status.probe_path) as response:
+                if response.status >= 500:
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history, status=response.status
+                    )
+                healthy = response.status == 200
+                if healthy and status.probe_path == "/v1/models":
+                    data = await response.json(content_type=None)
+                    status.details["models"] = len(data.get("data", []))
+        except Exception as e:
+            was_healthy = status.healthy
+            status.last_checked = time.time()
+            status.last_latency = None
+            self.record_failure(name, f"{type(e).__name__}: {e}")
+            if was_healthy is not False:
+                logger.warning(f"[WARNING] Бэкенд {name} ({status.url}) недоступен: {status.last_error}")
+            return False
+
+        status.last_checked = time.time()
+        status.last_latency = time.monotonic() - started
+        if healthy:
+            if status.healthy is not True:
+                logger.info(f"[OK] Бэкенд {name} ({status.url}) доступен")
+            self.record_success(name)
+        else:
+            self.record_failure(name, f"HTTP {response.status}")
+        return healthy
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {name: status.to_dict() for name, status in self._backends.items()}
+
+
+def create_default_monitor() -> BackendHealthMonitor:
+    monitor = BackendHealthMonitor(
+        interval=settings.HEALTH_PROBE_INTERVAL,
+        probe_timeout=settings.HEALTH_PROBE_TIMEOUT,
+        failure_threshold=settings.CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout=settings.CIRCUIT_RESET_TIMEOUT,
+    )
+    monitor.register(TEXTGEN_BACKEND, chat_config.TEXTGEN_WEBUI_URL, "/v1/models")
+    # progress отвечает даже во время генерации и не возвращает превью
+    monitor.register(SD_BACKEND, settings.SD_API_URL, "/sdapi/v1/progress?skip_current_image=true")
+    return monitor
+
+
+backend_health = create_default_monitor()
@@ -2,6 +2,7 @@
 Исправленный сервис для улучшения лиц на сгенерированных изображениях
 Устранена проблема дублирования изображений
 """
+import asyncio
 import httpx
 import json
 import base64
@@ -15,6 +16,12 @@ from typing import Dict, Any, Optional
 import logging
 import os
 from app.utils.generation_logger import GenerationLogger
+from app.services.backend_health import backend_health, SD_BACKEND
+from app.services.image_cache import (
+    image_result_cache, is_deterministic, payload_cache_key, payload_checkpoint, response_checkpoint,
+)
+from app.services.quality_policy import apply_quality_tier, parse_tier, quality_policy, sd_queue
+from app.services.sd_model_registry import sd_model_registry
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 from app.schemas.generation import GenerationSettings, GenerationResponse, FaceRefinementSettings
@@ -139,10 +146,18 @@ class FaceRefinementService:
             logger.info(f"[REQUEST-{request_id}] ПОЛНЫЙ PAYLOAD:")
             logger.info(f"[REQUEST-{request_id}] {json.dumps(payload, indent=2, ensure_ascii=False)}")
             
-            response = await self.client.post(
-                f"{self.api_url}/sdapi/v1/txt2img",
-                json=payload
-            )
+            try:
+                response = await self.client.post(
+                    f"{self.api_url}/sdapi/v1/txt2img",
+                    json=payload
+                )
+            except (httpx.ConnectError, httpx.TimeoutException) as e:
+                backend_health.record_failure(SD_BACKEND, f"{type(e).__name__}: {e}")
+                raise
+            if response.status_code >= 500:
+                backend_health.record_failure(SD_BACKEND, f"HTTP {response.status_code}")
+            else:
+                backend_health.record_success(SD_BACKEND)
             
             request_time = time.time()
             logger.info(f"[REQUEST-{request_id}] Время завершения запроса: {request_time}")
@@ -288,7 +303,7 @@ class FaceRefinementService:
         settings_dict = settings.dict()
         safe_settings = {}
         for k, v in settings_dict.items():
-            if k not in ['n_samples', 'batch_size', 'n_iter', 'save_grid']:
+            if k not in ['n_samples', 'batch_size', 'n_iter', 'save_grid', 'use_cache', 'quality_tier']:
                 safe_settings[k] = v
         
         # ИСПРАВЛЕНО: Обновляем только те параметры, которые есть в settings и не None
@@ -344,29 +359,28 @@ class FaceRefinementService:
         
         return payload
 
-    async def generate_image(self, settings: GenerationSettings, full_settings_for_logging: dict = None) -> GenerationResponse:
-        """ИСПРАВЛЕННАЯ: Генерация изображения с предотвращением дублирования"""
+    async def generate_image(self, settings: GenerationSettings, full_settings_for_logging: dict = None,
+                             task_id: Optional[str] = None) -> GenerationResponse:
+        """
+        ИСПРАВЛЕННАЯ: Генерация изображения с предотвращением дублирования
+
+        task_id — идентификатор задачи в SD (force_task_id), по которому
+        потоковый эндпоинт запрашивает прогресс именно этой задачи.
+        """
         start_time = time.time()
         logger.info("🎯 НАЧИНАЕМ ГЕНЕРАЦИЮ ИЗОБРАЖЕНИЯ (ИСПРАВЛЕННАЯ ВЕРСИЯ)")
+        cache_hit = False
         
         # Логируем информацию о модели
-        try:
-            import sys
-            from pathlib import Path
-            webui_path = Path(__file__).parent.parent.parent / "stable-diffusion-webui"
-            sys.path.insert(0, str(webui_path))
-            from model_config import get_model_info
-            model_info = get_model_info()
-            if model_info:
-                logger.info(f"🤖 Используемая модель: {model_info['name']} ({model_info['size_mb']} MB)")
-                if model_info["vae_name"]:
-                    logger.info(f"🎨 VAE: {model_info['vae_name']}")
-                else:
-                    logger.info("🎨 VAE: Встроенный")
+        model_info = sd_model_registry.get_model_info()
+        if model_info:
+            logger.info(f"🤖 Используемая модель: {model_info['name']} ({model_info['size_mb']} MB)")
+            if model_info["vae_name"]:
+                logger.info(f"🎨 VAE: {model_info['vae_name']}")
             else:
-                logger.warning("[WARNING] Информация о модели недоступна")
-        except Exception as e:
-            logger.warning(f"[WARNING] Не удалось получить информацию о модели: {e}")
+                logger.info("🎨 VAE: Встроенный")
+        else:
+            logger.warning("[WARNING] Информация о модели недоступна")
         
         try:
             # Сохраняем оригинальные промпты пользователя для логирования
@@ -389,6 +403,15 @@ class FaceRefinementService:
             payload = self._prepare_payload(settings)
             logger.info("[OK] Payload подготовлен")
             
+            # Уровень качества выбирает эндпоинт (подписка, подсказка клиента), иначе — по нагрузке
+            tier = parse_tier(settings.quality_tier)
+            if tier is None:
+                decision = quality_policy.choose(sd_queue.length)
+                tier = decision.tier
+                logger.info(f"[OK] Уровень качества: {tier.value} ({decision.reason})")
+            settings.quality_tier = tier.value
+            apply_quality_tier(payload, tier)
+            
             # ИСПРАВЛЕНО: Сохраняем payload для логирования
             self._last_payload = payload
             
@@ -397,30 +420,51 @@ class FaceRefinementService:
                 logger.error(f"[ERROR] КРИТИЧЕСКАЯ ОШИБКА: n_samples = {payload.get('n_samples')}")
                 raise ValueError(f"Неправильное значение n_samples: {payload.get('n_samples')}")
             
-            # Выполняем запрос к API
-            api_response = await self._make_api_request(payload)
-            logger.info("[OK] API запрос выполнен")
-            
-            # НОВОЕ: Проверяем количество изображений в ответе
-            received_images = len(api_response.get("images", []))
-            if received_images != 1:
-                # ИСПРАВЛЕНИЕ: Если получили больше одного изображения, берем только первое
-                if received_images > 1:
-                    logger.warning("🔧 ИСПРАВЛЯЕМ: Берем только первое изображение")
-                    api_response["images"] = [api_response["images"][0]]
-                    logger.info("[OK] Оставлено только одно изображение")
+            if task_id:
+                payload["force_task_id"] = task_id
+            
+            # С фиксированным seed результат детерминирован — сначала смотрим в кэш.
+            # Чекпоинт спрашиваем у SD: реестр обновляется периодически и после смены модели отстаёт
+            cache_key = None
+            if settings.use_cache and is_deterministic(payload):
+                checkpoint = payload_checkpoint(payload) or await sd_model_registry.current_checkpoint()
+                cache_key = payload_cache_key(payload, checkpoint)
+            api_response = await asyncio.to_thread(image_result_cache.get, cache_key)
+            cache_hit = api_response is not None
+            if cache_hit:
+                logger.info(f"[OK] Результат взят из кэша изображений (seed={payload.get('seed')})")
+            else:
+                # Выполняем запрос к API
+                async with sd_queue.slot():
+                    api_response = await self._make_api_request(payload)
+                logger.info("[OK] API запрос выполнен")
+                
+                # НОВОЕ: Проверяем количество изображений в ответе
+                received_images = len(api_response.get("images", []))
+                if received_images != 1:
+                    # ИСПРАВЛЕНИЕ: Если получили больше одного изображения, берем только первое
+                    if received_images > 1:
+                        logger.warning("🔧 ИСПРАВЛЯЕМ: Берем только первое изображение")
+                        api_response["images"] = [api_response["images"][0]]
+                        logger.info("[OK] Оставлено только одно изображение")
+                
+                # Сохраняем под чекпоинтом, которым SD отрисовал изображение на самом деле
+                if cache_key is not None:
+                    stored_key = payload_cache_key(payload, response_checkpoint(api_response))
+                    await asyncio.to_thread(image_result_cache.put, stored_key, api_response)
             
             # Создаем ответ
             result = GenerationResponse.from_api_response(api_response)
             logger.info("[OK] GenerationResponse создан")
             
-            # Записываем статистику
             execution_time = time.time() - start_time
-            self._save_generation_stats(settings, api_response, execution_time)
-            logger.info(f"[OK] Генерация завершена за {execution_time:.2f} секунд")
+            if not cache_hit:
+                # Записываем статистику
+                self._save_generation_stats(settings, api_response, execution_time)
+                logger.info(f"[OK] Генерация завершена за {execution_time:.2f} секунд")
 
-            # Очищаем память
-            await unload_sd_memory(self.api_url)
+                # Очищаем память
+                await unload_sd_memory(self.api_url)
             
             # Логируем генерацию
             execution_time = time.time() - start_time
@@ -473,8 +517,9 @@ class FaceRefinementService:
             
             raise
         finally:
-            # Очищаем память в любом случае
-            await unload_sd_memory(self.api_url)
+            # Очищаем память в любом случае (если запрос к SD был)
+            if not cache_hit:
+                await unload_sd_memory(self.api_url)
 
     def _save_generation_stats(self, settings: GenerationSettings, result: Dict[str, Any], execution_time: float) -> None:
         """Сохранение статистики генерации (без изменений)"""
@@ -492,7 +537,8 @@ class FaceRefinementService:
             
             # Обеспечиваем наличие ключей для статистики
             settings_dict["sampler_name"] = settings.sampler_name or info.get("sampler_name", "unknown")
-            settings_dict["steps"] = settings.steps or DEFAULT_GENERATION_PARAMS.get("steps", 10)
+            # Шаги берём из отправленного payload: уровень качества мог их изменить
+            settings_dict["steps"] = getattr(self, '_last_payload', {}).get("steps") or settings.steps or DEFAULT_GENERATION_PARAMS.get("steps", 10)
             settings_dict["width"] = settings.width or int(info.get("width", 0))
             settings_dict["height"] = settings.height or int(info.get("height", 0))
             settings_dict["cfg_scale"] = settings.cfg_scale or float(info.get("cfg_scale", 0))
@@ -516,6 +562,24 @@ class FaceRefinementService:
         except Exception as e:
             logger.error(f"Ошибка при сохранении статистики: {str(e)}")
 
+    async def get_progress(self, task_id: str, live_preview: bool = False, id_live_preview: int = -1) -> Dict[str, Any]:
+        """
+        Прогресс задачи SD с данным task_id: active, queued, completed, progress,
+        eta и (опционально) live_preview — превью новее id_live_preview в виде data URL
+        """
+        response = await self.client.post(
+            f"{self.api_url}/internal/progress",
+            json={"id_task": task_id, "live_preview": live_preview, "id_live_preview": id_live_preview},
+            timeout=10.0
+        )
+        response.raise_for_status()
+        return response.json()
+
+    async def interrupt(self) -> None:
+        """Прерывает задачу, которую SD выполняет сейчас (любую — проверка task_id на вызывающей стороне)"""
+        response = await self.client.post(f"{self.api_url}/sdapi/v1/interrupt", timeout=10.0)
+        response.raise_for_status()
+
     # Остальные методы без изменений...
     async def close(self):
         """Закрывает клиент"""
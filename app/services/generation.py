@@ -1,5 +1,6 @@
 import sys
 import copy
+import asyncio
 import json
 import time
 import traceback
@@ -22,6 +23,11 @@ from app.config.default_prompts import (
 )
 from app.utils.generation_stats import generation_stats
 from app.utils.image_saver import save_image
+from app.services.image_cache import (
+    image_result_cache, is_deterministic, payload_cache_key, payload_checkpoint, response_checkpoint,
+)
+from app.services.quality_policy import sd_queue
+from app.services.sd_model_registry import sd_model_registry
 from app.config.paths import IMAGES_DIR
 from app.config.cuda_config import optimize_memory, get_gpu_memory_info
 
@@ -62,10 +68,6 @@ class GenerationService:
         
         # Создаем пул потоков для сохранения изображений
         self.save_executor = ThreadPoolExecutor(max_workers=2)
-        
-        # Кэш отключен для экономии памяти
-        self._result_cache = {}
-        self._cache_size = 0  # Отключено кэширование
 
     def _process_logs(self):
         """Обработка логов в отдельном потоке"""
@@ -83,23 +85,10 @@ class GenerationService:
         """Добавляет сообщение в очередь логов"""
         self.log_queue.put((level, message))
 
-    def _update_cache(self, key: str, value: Any):
-        """Обновляет кэш результатов"""
-        if len(self._result_cache) >= self._cache_size:
-            # Удаляем самый старый элемент
-            self._result_cache.pop(next(iter(self._result_cache)))
-        self._result_cache[key] = value
-
     async def generate(self, settings: GenerationSettings) -> GenerationResponse:
         """Генерация изображения с заданными параметрами"""
         start_time = time.time()
         try:
-            # Кэш отключен для экономии памяти
-            # cache_key = f"{settings.dict()}"
-            # if cache_key in self._result_cache:
-            #     self._log("INFO", "Используем кэшированный результат")
-            #     return self._result_cache[cache_key]
-
             # Оптимизируем память перед генерацией
             optimize_memory()
             
@@ -120,7 +109,7 @@ class GenerationService:
             self._log("INFO", f"User params: steps={user_params.get('steps')}, cfg_scale={user_params.get('cfg_scale')}")
             
             for key, value in user_params.items():
-                if key != "negative_prompt":
+                if key not in ("negative_prompt", "use_cache", "quality_tier"):
                     request_params[key] = value
             
             request_params["negative_prompt"] = negative_prompt
@@ -152,78 +141,90 @@ class GenerationService:
             n_samples = request_params.get("n_samples", "NOT_SET")
             self._log("INFO", f"Используемый seed: {seed}, n_samples: {n_samples}")
             
-            # Отправляем запрос к API
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.api_url}/sdapi/v1/txt2img",
-                    json=request_params,
-                    timeout=300.0
-                )
-                response.raise_for_status()
-                result = response.json()
-                
-                # Синхронизируем CUDA перед сохранением
-                if torch.cuda.is_available():
-                    torch.cuda.synchronize()
-                
-                # Используем результат как есть
-                processed_result = result
-                
-                # Получаем информацию о сиде
-                info = processed_result.get("info", "{}")
+            # С фиксированным seed результат детерминирован — сначала смотрим в кэш
+            # Ключ включает чекпоинт: после смены модели старые результаты не подходят.
+            # Его спрашиваем у SD, т.к. реестр обновляется периодически и отстаёт
+            cache_key = None
+            if settings.use_cache and is_deterministic(request_params):
+                checkpoint = payload_checkpoint(request_params) or await sd_model_registry.current_checkpoint()
+                cache_key = payload_cache_key(request_params, checkpoint)
+            result = await asyncio.to_thread(image_result_cache.get, cache_key)
+            if result is not None:
+                self._log("INFO", f"Результат взят из кэша изображений (seed={seed})")
+            else:
+                # Отправляем запрос к API
+                async with httpx.AsyncClient() as client, sd_queue.slot():
+                    response = await client.post(
+                        f"{self.api_url}/sdapi/v1/txt2img",
+                        json=request_params,
+                        timeout=300.0
+                    )
+                    response.raise_for_status()
+                    result = response.json()
+                # Сохраняем под чекпоинтом, которым SD отрисовал изображение на самом деле
+                if cache_key is not None:
+                    stored_key = payload_cache_key(request_params, response_checkpoint(result))
+                    await asyncio.to_thread(image_result_cache.put, stored_key, result)
+            
+            # Синхронизируем CUDA перед сохранением
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            
+            # Используем результат как есть
+            processed_result = result
+            
+            # Получаем информацию о сиде
+            info = processed_result.get("info", "{}")
+            try:
+                info_dict = json.loads(info)
+                actual_seed = info_dict.get("seed", -1)
+            except Exception:
+                actual_seed = -1
+            
+            # Сохраняем изображения в отдельном потоке
+            saved_paths = []
+            images = processed_result.get("images", [])
+            
+            def save_image_task(image_data, index):
                 try:
-                    info_dict = json.loads(info)
-                    actual_seed = info_dict.get("seed", -1)
-                except Exception:
-                    actual_seed = -1
-                
-                # Сохраняем изображения в отдельном потоке
-                saved_paths = []
-                images = processed_result.get("images", [])
-                
-                def save_image_task(image_data, index):
-                    try:
-                        prefix = f"gen_{actual_seed}_{index}"
-                        saved_path = save_image(image_data, prefix=prefix)
-                        return saved_path
-                    except Exception as e:
-                        self._log("ERROR", f"Ошибка при сохранении изображения {index}: {str(e)}")
-                        return None
-                
-                # Запускаем сохранение в пуле потоков
-                futures = []
-                for i, image_base64 in enumerate(images):
-                    if image_base64:
-                        future = self.save_executor.submit(save_image_task, image_base64, i)
-                        futures.append(future)
-                
-                # Собираем результаты
-                for future in futures:
-                    path = future.result()
-                    if path:
-                        saved_paths.append(path)
-                
-                # Создаем ответ
-                generation_response = GenerationResponse.from_api_response(processed_result)
-                generation_response.saved_paths = saved_paths
-                generation_response.seed = actual_seed
-                
-                # Обновляем статистику
-                execution_time = time.time() - start_time
-                await self.update_generation_stats(settings, generation_response, execution_time)
-                
-                # Кэш отключен для экономии памяти
-                # self._update_cache(cache_key, generation_response)
-                
-                # Оптимизируем память после генерации
-                optimize_memory()
-                
-                # Получаем информацию о памяти GPU после генерации
-                memory_info = get_gpu_memory_info()
-                if memory_info:
-                    self._log("INFO", f"GPU Memory after generation: {memory_info}")
-                
-                return generation_response
+                    prefix = f"gen_{actual_seed}_{index}"
+                    saved_path = save_image(image_data, prefix=prefix)
+                    return saved_path
+                except Exception as e:
+                    self._log("ERROR", f"Ошибка при сохранении изображения {index}: {str(e)}")
+                    return None
+            
+            # Запускаем сохранение в пуле потоков
+            futures = []
+            for i, image_base64 in enumerate(images):
+                if image_base64:
+                    future = self.save_executor.submit(save_image_task, image_base64, i)
+                    futures.append(future)
+            
+            # Собираем результаты
+            for future in futures:
+                path = future.result()
+                if path:
+                    saved_paths.append(path)
+            
+            # Создаем ответ
+            generation_response = GenerationResponse.from_api_response(processed_result)
+            generation_response.saved_paths = saved_paths
+            generation_response.seed = actual_seed
+            
+            # Обновляем статистику
+            execution_time = time.time() - start_time
+            await self.update_generation_stats(settings, generation_response, execution_time)
+            
+            # Оптимизируем память после генерации
+            optimize_memory()
+            
+            # Получаем информацию о памяти GPU после генерации
+            memory_info = get_gpu_memory_info()
+            if memory_info:
+                self._log("INFO", f"GPU Memory after generation: {memory_info}")
+            
+            return generation_response
                 
         except Exception as e:
             self._log("ERROR", f"Ошибка при генерации: {str(e)}")
@@ -0,0 +1,491 @@
+"""
+Анализ изображений: однократное декодирование, перцептивные хэши
+(pHash/dHash), признаки качества и индекс поиска почти-дубликатов.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from loguru import logger
+from PIL import Image
+
+HASH_BITS = 64
+
+# Размер, к которому приводится изображение для pHash (DCT 32x32 -> 8x8)
+_PHASH_SIZE = 32
+_PHASH_LOW_FREQ = 8
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    """Матрица DCT-II размера n x n (ортонормированная)."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+
+_DCT_32 = _dct_matrix(_PHASH_SIZE)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8)).tobytes(), "big")
+
+
+def compute_phash(gray: Image.Image) -> int:
+    """
+    Перцептивный хэш: низкочастотные коэффициенты DCT сравниваются с медианой.
+
+    :param gray: Изображение в оттенках серого
+    :return: 64-битный хэш
+    """
+    pixels = np.asarray(gray.resize((_PHASH_SIZE, _PHASH_SIZE), Image.BILINEAR), dtype=np.float64)
+    dct = _DCT_32 @ pixels @ _DCT_32.T
+    low_freq = dct[:_PHASH_LOW_FREQ, :_PHASH_LOW_FREQ].flatten()
+    # DC-коэффициент не учитываем при расчёте медианы: он отражает только яркость
+    return _bits_to_int(low_freq > np.median(low_freq[1:]))
+
+
+def compute_dhash(gray: Image.Image) -> int:
+    """
+    Разностный хэш: знак горизонтального градиента на сетке 9x8.
+
+    :param gray: Изображение в оттенках серого
+    :return: 64-битный хэш
+    """
+    pixels = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def hash_similarity(phash_a: int, dhash_a: int, phash_b: int, dhash_b: int) -> float:
+    """Схожесть 0-1 по pHash и dHash вместе."""
+    return 1.0 - (hamming_distance(phash_a, phash_b) + hamming_distance(dhash_a, dhash_b)) / (2 * HASH_BITS)
+
+
+def compute_quality_features(img: Image.Image, file_size: int) -> Dict[str, Any]:
+    """
+    Признаки качества изображения (совпадают с прежними проверками
+    ImageQualityControl), рассчитанные за один проход NumPy.
+
+    :param img: PIL Image объект
+    :param file_size: Размер исходных байтов изображения
+    :return: Словарь с результатами проверок
+    """
+    checks = {}
+    img_array = np.asarray(img)
+
+    checks["is_empty"] = bool(np.all(img_array == 0) or np.all(img_array == 255))
+
+    if img.mode in ['L', 'LA'] or img_array.ndim != 3:
+        checks["is_monochrome"] = True
+    else:
+        color_variance = np.var(img_array, axis=(0, 1))
+        checks["is_monochrome"] = bool(np.all(color_variance < 100))
+
+    checks["file_size_reasonable"] = 1000 < file_size < 10000000  # 1KB - 10MB
+    checks["resolution_ok"] = img.size[0] >= 64 and img.size[1] >= 64
+
+    if img_array.ndim == 3:
+        gray = img_array.mean(axis=2)
+        grad_y, grad_x = np.gradient(gray)
+        gradient_magnitude = np.sqrt(grad_y ** 2 + grad_x ** 2)
+        checks["has_artifacts"] = bool(gradient_magnitude.max() > 100)
+        # Дисперсия лапласиана — грубая оценка резкости
+        laplacian = gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4 * gray[1:-1, 1:-1]
+        checks["sharpness"] = float(laplacian.var()) if laplacian.size else 0.0
+    else:
+        checks["has_artifacts"] = False
+        checks["sharpness"] = 0.0
+
+    return checks
+
+
+@dataclass
+class ImageAnalysis:
+    """Результат анализа одного изображения."""
+    index: int
+    is_valid: bool
+    digest: str = ""
+    phash: int = 0
+    dhash: int = 0
+    info: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        if not self.is_valid:
+            return {"index": self.index, "is_valid": False, "error": self.error}
+
+        return {
+            "index": self.index,
+            **self.info,
+            "phash": f"{self.phash:016x}",
+            "dhash": f"{self.dhash:016x}",
+            "is_valid": True,
+        }
+
+
+def _image_digest(image: str) -> str:
+    return hashlib.blake2b(image.encode() if isinstance(image, str) else image, digest_size=16).hexdigest()
+
+
+def _analyze_one(index: int, image: str, digest: str) -> ImageAnalysis:
+    """Декодирует изображение один раз и считает все признаки."""
+    try:
+        img_bytes = base64.b64decode(image) if isinstance(image, str) else image
+        img = Image.open(BytesIO(img_bytes))
+        img.load()
+
+        gray = img.convert('L')
+        info = {
+            "size": img.size,
+            "mode": img.mode,
+            "format": img.format,
+            "file_size": len(img_bytes),
+            "aspect_ratio": img.size[0] / img.size[1],
+            "pixel_count": img.size[0] * img.size[1],
+        }
+        info.update(compute_quality_features(img, len(img_bytes)))
+
+        return ImageAnalysis(
+            index=index,
+            is_valid=True,
+            digest=digest,
+            phash=compute_phash(gray),
+            dhash=compute_dhash(gray),
+            info=info,
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при анализе изображения {index}: {e}")
+        return ImageAnalysis(index=index, is_valid=False, digest=digest, error=str(e))
+
+
+class ImageAnalyzer:
+    """
+    Анализирует изображения в пуле потоков. Результаты кэшируются по
+    хэшу содержимого, поэтому повторный анализ тех же картинок
+    (выбор лучшего, проверка порога, поиск дублей) не декодирует их заново.
+    """
+
+    def __init__(self, max_workers: int = 4, cache_size: int = 256):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-analysis")
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, ImageAnalysis]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_cached(self, digest: str) -> Optional[ImageAnalysis]:
+        with self._lock:
+            analysis = self._cache.get(digest)
+            if analysis is not None:
+                self._cache.move_to_end(digest)
+            return analysis
+
+    def _put_cached(self, analysis: ImageAnalysis) -> None:
+        with self._lock:
+            self._cache[analysis.digest] = analysis
+            self._cache.move_to_end(analysis.digest)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    async def analyze(self, images: List[str]) -> List[ImageAnalysis]:
+        """
+        :param images: Список base64 изображений
+        :return: Анализ для каждого изображения в том же порядке
+        """
+        loop = asyncio.get_running_loop()
+        results: List[Optional[ImageAnalysis]] = [None] * len(images)
+        pending = {}
+
+        for i, image in enumerate(images):
+            digest = _image_digest(image)
+            cached = self._get_cached(digest)
+            if cached is not None:
+                results[i] = ImageAnalysis(**{**cached.__dict__, "index": i})
+            elif digest in pending:
+                pending[digest][1].append(i)
+            else:
+                pending[digest] = (loop.run_in_executor(self.executor, _analyze_one, i, image, digest), [i])
+
+        for digest, (future, indices) in pending.items():
+            analysis = await future
+            if analysis.is_valid:
+                self._put_cached(analysis)
+            for i in indices:
+                results[i] = ImageAnalysis(**{**analysis.__dict__, "index": i})
+
+        return results
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+class BKTree:
+    """
+    BK-дерево по расстоянию Хэмминга: поиск всех хэшей в радиусе r
+    без попарного сравнения со всей коллекцией.
+    """
+
+    def __init__(self):
+        # Узел: [hash, keys, {distance: child}]
+        self._root: Optional[list] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: int, key: Any) -> None:
+        self._size += 1
+        if self._root is None:
+            self._root = [value, [key], {}]
+            return
+
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(key)
+                return
+
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [key], {}]
+                return
+
+            node = child
+
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """
+        :return: Список (расстояние, ключ) для всех хэшей в радиусе max_distance
+        """
+        if self._root is None:
+            return []
+
+        found = []
+        stack = [self._root]
+        while stack:
+            node_value, keys, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= max_distance:
+                found.extend((distance, key) for key in keys)
+
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for d, child in children.items() if low <= d <= high)
+
+        return found
+
+
+class ImageHashIndex:
+    """
+    Индекс почти-дубликатов: BK-дерево по pHash, кандидаты подтверждаются
+    по dHash. Может жить для всей галереи персонажа и сохраняться на диск.
+    """
+
+    def __init__(self):
+        self._tree = BKTree()
+        self._hashes: Dict[Any, Tuple[int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._hashes
+
+    def keys(self) -> List[Any]:
+        return list(self._hashes)
+
+    def remove(self, key: Any) -> None:
+        """Удаляет ключ; узел BK-дерева остаётся, но в результаты поиска не попадает."""
+        self._hashes.pop(key, None)
+
+    def add(self, key: Any, phash: int, dhash: int) -> None:
+        if key in self._hashes:
+            return
+
+        self._hashes[key] = (phash, dhash)
+        self._tree.add(phash, key)
+
+    def find_similar(self, phash: int, dhash: int, max_distance: int = 6) -> List[Tuple[float, Any]]:
+        """
+        :return: Список (схожесть 0-1, ключ), отсортированный по убыванию схожести
+        """
+        matches = []
+        for distance, key in self._tree.search(phash, max_distance):
+            hashes = self._hashes.get(key)
+            if hashes is None:
+                continue
+            if hamming_distance(dhash, hashes[1]) <= max_distance * 2:
+                matches.append((hash_similarity(phash, dhash, *hashes), key))
+
+        matches.sort(key=lambda x: x[0], reverse=True)
+        return matches
+
+    def save(self, path: Path) -> None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {str(key): [f"{p:016x}", f"{d:016x}"] for key, (p, d) in self._hashes.items()}
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps(data), encoding="utf-8")
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "ImageHashIndex":
+        index = cls()
+        path = Path(path)
+        if path.exists():
+            try:
+                for key, (p, d) in json.loads(path.read_text(encoding="utf-8")).items():
+                    index.add(key, int(p, 16), int(d, 16))
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Не удалось загрузить индекс хэшей {path}: {e}")
+        return index
+
+
+def similarity_to_distance(similarity_threshold: float) -> int:
+    """Переводит порог схожести (0-1) в расстояние Хэмминга для 64-битных хэшей."""
+    return max(0, int(round((1.0 - similarity_threshold) * HASH_BITS)))
+
+
+GALLERY_IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
+
+_gallery_indexes: Dict[str, ImageHashIndex] = {}
+_gallery_lock = threading.Lock()
+_gallery_update_locks: Dict[str, asyncio.Lock] = {}
+
+
+def get_gallery_index(character_name: str, storage_dir: Optional[Path] = None) -> ImageHashIndex:
+    """
+    Возвращает общий индекс хэшей для галереи персонажа.
+
+    :param character_name: Имя персонажа
+    :param storage_dir: Папка для сохранения индекса (опционально)
+    :return: Экземпляр ImageHashIndex
+    """
+    key = character_name.lower()
+    with _gallery_lock:
+        index = _gallery_indexes.get(key)
+        if index is None:
+            index = ImageHashIndex.load(Path(storage_dir) / f"{key}.json") if storage_dir else ImageHashIndex()
+            _gallery_indexes[key] = index
+        return index
+
+
+def add_to_index(index: ImageHashIndex, analyses: Iterable[ImageAnalysis], keys: Optional[Iterable[Any]] = None) -> None:
+    """Добавляет валидные результаты анализа в индекс (ключи — по порядку analyses, по умолчанию digest)."""
+    analyses = list(analyses)
+    keys = list(keys) if keys is not None else [analysis.digest for analysis in analyses]
+    for analysis, key in zip(analyses, keys):
+        if analysis.is_valid:
+            index.add(key, analysis.phash, analysis.dhash)
+
+
+def sync_gallery_index(index: ImageHashIndex, gallery_dir: Path) -> bool:
+    """
+    Приводит индекс в соответствие с файлами галереи: добавляет файлы,
+    сохранённые в обход индекса, и убирает удалённые.
+
+    :return: True, если индекс изменился
+    """
+    gallery_dir = Path(gallery_dir)
+    files = {}
+    if gallery_dir.is_dir():
+        files = {p.name: p for p in gallery_dir.iterdir()
+                 if p.is_file() and p.suffix.lower() in GALLERY_IMAGE_EXTENSIONS}
+
+    changed = False
+    for key in index.keys():
+        if key not in files:
+            index.remove(key)
+            changed = True
+
+    for name, path in files.items():
+        if name in index:
+            continue
+        try:
+            analysis = _analyze_one(0, path.read_bytes(), "")
+        except OSError as e:
+            logger.warning(f"Не удалось прочитать {path}: {e}")
+            continue
+        if analysis.is_valid:
+            index.add(name, analysis.phash, analysis.dhash)
+            changed = True
+
+    return changed
+
+
+async def index_gallery_image(character_name: str, filename: str, image: bytes, gallery_dir: Path,
+                              storage_dir: Optional[Path] = None,
+                              similarity_threshold: float = 0.95) -> List[str]:
+    """
+    Добавляет уже сохранённое изображение в индекс галереи персонажа.
+
+    Изображение ничем не заменяется: почти-дубликаты только логируются.
+
+    :param filename: Имя, под которым изображение сохранено в gallery_dir
+    :return: Имена похожих изображений галереи (по убыванию схожести)
+    """
+    key = character_name.lower()
+    lock = _gallery_update_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        index = get_gallery_index(character_name, storage_dir)
+        changed = await asyncio.to_thread(sync_gallery_index, index, gallery_dir)
+
+        similar = []
+        analysis = (await get_image_analyzer().analyze([image]))[0]
+        if analysis.is_valid:
+            similar = [
+                match for similarity, match in
+                index.find_similar(analysis.phash, analysis.dhash, similarity_to_distance(similarity_threshold))
+                if similarity > similarity_threshold and match != filename
+            ]
+            if similar:
+                logger.info(f"Изображение {filename} похоже на {similar[0]} из галереи {key}")
+            if filename not in index:
+                index.add(filename, analysis.phash, analysis.dhash)
+                changed = True
+
+        if changed and storage_dir:
+            await asyncio.to_thread(index.save, Path(storage_dir) / f"{key}.json")
+        return similar
+
+
+_gallery_tasks: Set[asyncio.Task] = set()
+
+
+def schedule_gallery_indexing(*args, **kwargs) -> asyncio.Task:
+    """
+    Запускает index_gallery_image в фоне, чтобы синхронизация и хэширование
+    галереи не задерживали ответ; ошибки только логируются.
+    """
+    async def run():
+        try:
+            await index_gallery_image(*args, **kwargs)
+        except Exception as e:
+            logger.warning(f"Не удалось обновить индекс галереи: {e}")
+
+    task = asyncio.create_task(run())
+    _gallery_tasks.add(task)
+    task.add_done_callback(_gallery_tasks.discard)
+    return task
+
+
+_image_analyzer: Optional[ImageAnalyzer] = None
+
+
+def get_image_analyzer() -> ImageAnalyzer:
+    """Глобальный анализатор изображений."""
+    global _image_analyzer
+    if _image_analyzer is None:
+        _image_analyzer = ImageAnalyzer()
+    return _image_analyzer
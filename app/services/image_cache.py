@@ -0,0 +1,224 @@
+"""
+Дисковый кэш результатов генерации изображений.
+
+При фиксированном seed Stable Diffusion детерминирован: одинаковый
+итоговый payload (промпты, сэмплер, шаги, размер, CFG, hires.fix, LoRA,
+ADetailer) на том же чекпоинте даёт одну и ту же картинку. Ключ кэша —
+SHA-256 канонического JSON payload и имени чекпоинта, значение — ответ
+txt2img как есть. Запросы со случайным
+seed не кэшируются. Записи вытесняются по LRU при превышении лимита
+размера; порядок использования хранится во времени изменения файлов,
+поэтому переживает перезапуск.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Поля payload, которые не влияют на результат рендера
+IGNORED_PAYLOAD_KEYS = {
+    "use_cache", "character", "use_default_prompts", "send_images", "save_images", "force_task_id",
+}
+
+
+def is_deterministic(payload: Dict[str, Any]) -> bool:
+    """Даёт ли payload всегда одно и то же изображение (фиксированный seed и subseed)."""
+    seed = payload.get("seed")
+    if not isinstance(seed, int) or isinstance(seed, bool) or seed < 0:
+        return False
+    # Вариационный seed со случайным значением делает результат случайным
+    if payload.get("subseed_strength") and payload.get("subseed", -1) in (-1, None):
+        return False
+    return True
+
+
+def checkpoint_cache_name(name: Optional[str]) -> Optional[str]:
+    """
+    Имя чекпоинта в том виде, в каком SD пишет его в info.sd_model_name:
+    'sdxl/model.safetensors [6ce0161689]' -> 'sdxl_model'.
+    """
+    if not name:
+        return None
+    name = str(name).strip()
+    if name.endswith("]") and " [" in name:
+        name = name[:name.rindex(" [")]
+    name = os.path.splitext(name.replace("/", "_").replace("\\", "_"))[0]
+    return name or None
+
+
+def payload_checkpoint(payload: Dict[str, Any]) -> Optional[str]:
+    """Чекпоинт, закреплённый в самом payload через override_settings."""
+    return (payload.get("override_settings") or {}).get("sd_model_checkpoint")
+
+
+def response_checkpoint(response: Dict[str, Any]) -> Optional[str]:
+    """Чекпоинт, которым SD отрисовал ответ txt2img (info.sd_model_name)."""
+    try:
+        info = json.loads(response.get("info") or "{}")
+    except (TypeError, ValueError):
+        return None
+    return info.get("sd_model_name") if isinstance(info, dict) else None
+
+
+def payload_cache_key(payload: Dict[str, Any], model: Optional[str]) -> Optional[str]:
+    """
+    Канонический ключ payload или None, если результат недетерминирован.
+
+    model — чекпоинт, на котором выполняется (или выполнен) рендер: один и
+    тот же payload на другой модели даёт другое изображение, поэтому без
+    известной модели кэш не используется. Для поиска берётся чекпоинт,
+    загруженный в SD на момент запроса, а запись сохраняется под чекпоинтом
+    из ответа SD.
+    """
+    model = checkpoint_cache_name(model)
+    if not model or not is_deterministic(payload):
+        return None
+    canonical = {key: value for key, value in payload.items() if key not in IGNORED_PAYLOAD_KEYS}
+    data = json.dumps(
+        {"model": model, "payload": canonical},
+        sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ImageResultCache:
+    """LRU-кэш ответов txt2img в каталоге на диске с ограничением по размеру."""
+
+    def __init__(self, directory: str, max_bytes: int, enabled: bool = True):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.enabled = enabled and max_bytes > 0
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _load_index(self) -> None:
+        """Восстанавливает LRU-порядок по времени изменения файлов."""
+        if self._loaded:
+            return
+        self._loaded = True
+        self.directory.mkdir(parents=True, exist_ok=True)
+        files = []
+        for path in self.directory.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, key, size in sorted(files):
+            self._entries[key] = size
+            self._total_bytes += size
+        self._evict()
+
+    def _remove(self, key: str) -> None:
+        size = self._entries.pop(key, None)
+        if size is None:
+            return
+        self._total_bytes -= size
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        while self._entries and self._total_bytes > self.max_bytes:
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+    def get(self, key: Optional[str]) -> Optional[Dict[str, Any]]:
+        """Ответ txt2img из кэша; None — промах или кэш не применяется."""
+        if not self.enabled or key is None:
+            self.bypassed += 1
+            return None
+        with self._lock:
+            self._load_index()
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            path = self._path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    response = json.load(f)
+                os.utime(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"[WARNING] Повреждённая запись кэша изображений {key}: {e}")
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, key: Optional[str], response: Dict[str, Any]) -> None:
+        if not self.enabled or key is None or not response.get("images"):
+            return
+        data = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            self._load_index()
+            path = self._path(key)
+            tmp_path = path.with_suffix(f".tmp{threading.get_ident()}")
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"[WARNING] Не удалось сохранить результат в кэш изображений: {e}")
+                try:
+                    tmp_path.unlink()
+                except OSError:
+                    pass
+                return
+            self._total_bytes -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self.stores += 1
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._load_index()
+            for key in list(self._entries):
+                self._remove(key)
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "size_bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+image_result_cache = ImageResultCache(
+    directory=settings.IMAGE_CACHE_DIR,
+    max_bytes=settings.IMAGE_CACHE_MAX_MB * 1024 * 1024,
+    enabled=settings.IMAGE_CACHE_ENABLED,
+)
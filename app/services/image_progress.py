@@ -0,0 +1,137 @@
+"""
+Потоковая выдача генерации изображения (Server-Sent Events).
+
+Запрос txt2img помечается собственным task_id (force_task_id). Пока
+FaceRefinementService.generate_image ждёт ответа, поток опрашивает
+/internal/progress для этого task_id и отправляет клиенту прогресс с ETA и
+уменьшенные превью (не чаще раза в preview_interval), а по завершении —
+ссылку на готовое изображение. Прогресс и превью чужих задач клиент не
+видит. Если клиент отключился, задача отменяется, а генерация в SD
+прерывается через /sdapi/v1/interrupt — только если SD выполняет именно
+нашу задачу, чтобы брошенная задача не занимала GPU.
+
+События: queued, progress, preview, done, error.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+import time
+import uuid
+from io import BytesIO
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+from fastapi import Request
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Прерывания SD, запущенные после отключения клиента; ссылки держим, пока задачи не завершатся
+_abort_tasks: Set[asyncio.Task] = set()
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def make_preview(image_b64: str, max_side: int = 256, quality: int = 70) -> str:
+    """Уменьшенное JPEG-превью в виде data URL"""
+    if "," in image_b64[:64]:
+        image_b64 = image_b64.split(",", 1)[1]
+    image = Image.open(BytesIO(base64.b64decode(image_b64)))
+    image.thumbnail((max_side, max_side))
+    buffer = BytesIO()
+    image.convert("RGB").save(buffer, format="JPEG", quality=quality)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def new_task_id() -> str:
+    """Идентификатор задачи SD в формате, который использует сам webui"""
+    return f"task({uuid.uuid4().hex})"
+
+
+async def _abort_generation(service, task_id: str) -> None:
+    try:
+        progress = await service.get_progress(task_id)
+        if not progress.get("active"):
+            # Задача ещё в очереди или уже завершена: /interrupt прервал бы чужую
+            return
+        await service.interrupt()
+        logger.info("[OK] Клиент отключился, генерация в SD прервана")
+    except Exception as e:
+        logger.warning(f"[WARNING] Не удалось прервать генерацию в SD: {e}")
+
+
+async def stream_image_job(
+    service,
+    job: Awaitable[Any],
+    request: Request,
+    on_result: Callable[[Any], Awaitable[Dict[str, Any]]],
+    task_id: str,
+    poll_interval: float = 1.0,
+    preview_interval: float = 2.0,
+    preview_max_side: int = 256,
+) -> AsyncIterator[str]:
+    """
+    Выполняет job (вызов service.generate_image с task_id) и отдаёт SSE-события о его ходе.
+    on_result превращает результат в данные события done (сохранение файла, списание монет).
+    """
+    task = asyncio.ensure_future(job)
+    last_preview_at: Optional[float] = None
+    last_preview_id = -1
+
+    try:
+        yield sse_event("queued", {})
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                break
+            if await request.is_disconnected():
+                return
+
+            want_preview = last_preview_at is None or time.monotonic() - last_preview_at >= preview_interval
+            try:
+                progress = await service.get_progress(task_id, live_preview=want_preview, id_live_preview=last_preview_id)
+            except Exception as e:
+                logger.debug("Не удалось получить прогресс SD: %s", e)
+                continue
+
+            if task.done() or not progress.get("active"):
+                # Наша задача ещё в очереди SD за чужой
+                yield sse_event("queued", {})
+                continue
+
+            yield sse_event("progress", {
+                "progress": round(float(progress.get("progress") or 0.0), 3),
+                "eta": round(float(progress.get("eta") or 0.0), 1),
+            })
+
+            # SD возвращает превью, только если оно новее id_live_preview
+            image = progress.get("live_preview")
+            if want_preview and image:
+                last_preview_id = progress.get("id_live_preview", last_preview_id)
+                last_preview_at = time.monotonic()
+                try:
+                    preview = await asyncio.to_thread(make_preview, image, preview_max_side)
+                except Exception as e:
+                    logger.debug("Не удалось подготовить превью: %s", e)
+                else:
+                    yield sse_event("preview", {"image": preview})
+
+        try:
+            result = task.result()
+            data = await on_result(result)
+        except Exception as e:
+            logger.error(f"[ERROR] Ошибка потоковой генерации изображения: {e}")
+            yield sse_event("error", {"detail": getattr(e, "detail", None) or str(e)})
+            return
+        yield sse_event("done", data)
+    finally:
+        if not task.done():
+            # Клиент ушёл: отменяем ожидание и освобождаем GPU. Прерывание запускается
+            # отдельной задачей, т.к. await в отменённом генераторе может не выполниться
+            task.cancel()
+            abort = asyncio.ensure_future(_abort_generation(service, task_id))
+            _abort_tasks.add(abort)
+            abort.add_done_callback(_abort_tasks.discard)
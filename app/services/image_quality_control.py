@@ -1,17 +1,21 @@
 """
 Сервис для контроля качества и количества изображений
 """
-import base64
 import json
 import time
 from typing import List, Dict, Any, Optional, Tuple
-from io import BytesIO
-from PIL import Image
-import numpy as np
 import httpx
 from loguru import logger
 
 from app.config.generation_defaults import DEFAULT_GENERATION_PARAMS
+from app.services.image_analysis import (
+    ImageAnalysis,
+    ImageHashIndex,
+    add_to_index,
+    get_image_analyzer,
+    hash_similarity,
+    similarity_to_distance,
+)
 
 
 class ImageQualityControl:
@@ -34,83 +38,14 @@ class ImageQualityControl:
         :param images: Список base64 изображений
         :return: Список метаданных для каждого изображения
         """
-        results = []
-        
-        for i, img_base64 in enumerate(images):
-            try:
-                # Декодируем изображение
-                img_bytes = base64.b64decode(img_base64)
-                img = Image.open(BytesIO(img_bytes))
-                
-                # Базовый анализ
-                analysis = {
-                    "index": i,
-                    "size": img.size,
-                    "mode": img.mode,
-                    "format": img.format,
-                    "file_size": len(img_bytes),
-                    "aspect_ratio": img.size[0] / img.size[1],
-                    "pixel_count": img.size[0] * img.size[1],
-                    "is_valid": True
-                }
-                
-                # Дополнительные проверки
-                analysis.update(await self._perform_quality_checks(img, img_bytes))
-                
-                results.append(analysis)
-                
-            except Exception as e:
-                logger.error(f"Ошибка при анализе изображения {i}: {e}")
-                results.append({
-                    "index": i,
-                    "is_valid": False,
-                    "error": str(e)
-                })
-        
-        return results
+        return [analysis.to_dict() for analysis in await self._analyze(images)]
     
-    async def _perform_quality_checks(self, img: Image.Image, img_bytes: bytes) -> Dict[str, Any]:
+    async def _analyze(self, images: List[str]) -> List[ImageAnalysis]:
         """
-        Выполняет проверки качества изображения
-        
-        :param img: PIL Image объект
-        :param img_bytes: Байты изображения
-        :return: Словарь с результатами проверок
+        Декодирует каждое изображение один раз (в пуле потоков) и считает
+        хэши и признаки качества. Результаты кэшируются анализатором.
         """
-        checks = {}
-        
-        # Проверка на пустое изображение
-        img_array = np.array(img)
-        checks["is_empty"] = np.all(img_array == 0) or np.all(img_array == 255)
-        
-        # Проверка на монохромность
-        if img.mode in ['L', 'LA']:
-            checks["is_monochrome"] = True
-        else:
-            # Проверяем, есть ли цветовые различия
-            if len(img_array.shape) == 3:
-                color_variance = np.var(img_array, axis=(0, 1))
-                checks["is_monochrome"] = np.all(color_variance < 100)
-            else:
-                checks["is_monochrome"] = True
-        
-        # Проверка размера файла
-        checks["file_size_reasonable"] = 1000 < len(img_bytes) < 10000000  # 1KB - 10MB
-        
-        # Проверка разрешения
-        checks["resolution_ok"] = img.size[0] >= 64 and img.size[1] >= 64
-        
-        # Проверка на артефакты (простая проверка)
-        if len(img_array.shape) == 3:
-            # Проверяем на резкие переходы
-            gray = np.mean(img_array, axis=2)
-            gradient = np.gradient(gray)
-            gradient_magnitude = np.sqrt(gradient[0]**2 + gradient[1]**2)
-            checks["has_artifacts"] = np.max(gradient_magnitude) > 100
-        else:
-            checks["has_artifacts"] = False
-        
-        return checks
+        return await get_image_analyzer().analyze(images)
     
     async def filter_best_image(self, images: List[str], criteria: Optional[Dict[str, Any]] = None) -> Tuple[int, str]:
         """
@@ -128,6 +63,11 @@ class ImageQualityControl:
         
         # Анализируем все изображения
         analysis = await self.analyze_images(images)
+        return self._select_best(images, analysis, criteria)
+    
+    def _select_best(self, images: List[str], analysis: List[Dict[str, Any]],
+                     criteria: Optional[Dict[str, Any]] = None) -> Tuple[int, str]:
+        """Выбирает лучшее изображение по готовым результатам анализа."""
         
         # Фильтруем валидные изображения
         valid_images = [(i, analysis[i]) for i, data in enumerate(analysis) if data.get("is_valid", False)]
@@ -215,14 +155,15 @@ class ImageQualityControl:
         
         logger.info(f"Получено {len(images)} изображений, применяем фильтрацию")
         
+        analysis = await self.analyze_images(images)
+        
         if force_single:
             # Выбираем лучшее изображение
-            best_idx, best_image = await self.filter_best_image(images)
+            best_idx, best_image = self._select_best(images, analysis)
             
             # Проверяем качество
-            analysis = await self.analyze_images([best_image])
-            if analysis and analysis[0].get("is_valid", False):
-                quality_score = self._calculate_quality_score(analysis[0])
+            if analysis[best_idx].get("is_valid", False):
+                quality_score = self._calculate_quality_score(analysis[best_idx])
                 if quality_score >= quality_threshold:
                     logger.info(f"Возвращаем лучшее изображение (качество: {quality_score:.2f})")
                     return [best_image]
@@ -234,7 +175,6 @@ class ImageQualityControl:
         else:
             # Фильтруем по качеству, но можем вернуть несколько
             filtered_images = []
-            analysis = await self.analyze_images(images)
             
             for i, data in enumerate(analysis):
                 if data.get("is_valid", False):
@@ -245,64 +185,63 @@ class ImageQualityControl:
             
             return filtered_images if filtered_images else [images[0]]
     
-    async def detect_duplicates(self, images: List[str], similarity_threshold: float = 0.95) -> List[int]:
+    async def detect_duplicates(self, images: List[str], similarity_threshold: float = 0.95,
+                                index: Optional[ImageHashIndex] = None,
+                                keys: Optional[List[str]] = None) -> List[int]:
         """
-        Обнаруживает дублирующиеся изображения
+        Обнаруживает дублирующиеся изображения по перцептивным хэшам
         
         :param images: Список изображений
         :param similarity_threshold: Порог схожести
+        :param index: Индекс галереи (опционально) — изображения, похожие на
+                      уже сохранённые в нём, тоже считаются дубликатами
+        :param keys: Имена файлов, под которыми сохраняются images; только с
+                     ними уникальные изображения добавляются в index (индекс
+                     галереи хранит имена файлов, а не digest)
         :return: Индексы дублирующихся изображений
         """
-        if len(images) < 2:
+        if len(images) < 2 and index is None:
             return []
         
+        analyses = await self._analyze(images)
+        max_distance = similarity_to_distance(similarity_threshold)
+        local_index = ImageHashIndex()
         duplicates = []
         
-        for i in range(len(images)):
-            for j in range(i + 1, len(images)):
-                try:
-                    similarity = await self._calculate_similarity(images[i], images[j])
-                    if similarity > similarity_threshold:
-                        duplicates.append(j)
-                        logger.info(f"Обнаружен дубликат: изображения {i} и {j} (схожесть: {similarity:.3f})")
-                except Exception as e:
-                    logger.error(f"Ошибка при сравнении изображений {i} и {j}: {e}")
+        for analysis in analyses:
+            if not analysis.is_valid:
+                continue
+            
+            matches = local_index.find_similar(analysis.phash, analysis.dhash, max_distance)
+            if index is not None:
+                matches += index.find_similar(analysis.phash, analysis.dhash, max_distance)
+            
+            matches = [(similarity, key) for similarity, key in matches if similarity > similarity_threshold]
+            if matches:
+                duplicates.append(analysis.index)
+                logger.info(f"Обнаружен дубликат: изображения {matches[0][1]} и {analysis.index} (схожесть: {matches[0][0]:.3f})")
+            else:
+                local_index.add(analysis.index, analysis.phash, analysis.dhash)
+        
+        if index is not None and keys is not None:
+            unique = [a for a in analyses if a.index not in duplicates]
+            add_to_index(index, unique, [keys[a.index] for a in unique])
         
-        return list(set(duplicates))
+        return duplicates
     
     async def _calculate_similarity(self, img1_base64: str, img2_base64: str) -> float:
         """
-        Вычисляет схожесть между двумя изображениями
+        Вычисляет схожесть между двумя изображениями по pHash/dHash
         
         :param img1_base64: Первое изображение в base64
         :param img2_base64: Второе изображение в base64
         :return: Коэффициент схожести (0-1)
         """
-        try:
-            # Декодируем изображения
-            img1_bytes = base64.b64decode(img1_base64)
-            img2_bytes = base64.b64decode(img2_base64)
-            
-            img1 = Image.open(BytesIO(img1_bytes))
-            img2 = Image.open(BytesIO(img2_bytes))
-            
-            # Приводим к одинаковому размеру
-            size = (256, 256)  # Уменьшаем для быстрого сравнения
-            img1_resized = img1.resize(size)
-            img2_resized = img2.resize(size)
-            
-            # Конвертируем в numpy массивы
-            arr1 = np.array(img1_resized.convert('L'))  # В оттенки серого
-            arr2 = np.array(img2_resized.convert('L'))
-            
-            # Вычисляем корреляцию
-            correlation = np.corrcoef(arr1.flatten(), arr2.flatten())[0, 1]
-            
-            return max(0, correlation) if not np.isnan(correlation) else 0
-            
-        except Exception as e:
-            logger.error(f"Ошибка при вычислении схожести: {e}")
+        first, second = await self._analyze([img1_base64, img2_base64])
+        if not (first.is_valid and second.is_valid):
             return 0.0
+        
+        return hash_similarity(first.phash, first.dhash, second.phash, second.dhash)
     
     async def close(self):
         """Закрывает клиент"""
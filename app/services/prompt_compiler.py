@@ -0,0 +1,319 @@
+"""
+Сборка итогового промпта Stable Diffusion с учётом токенов CLIP.
+
+SD разбивает промпт на куски по 75 токенов CLIP, и каждый лишний кусок
+добавляет проход текстового энкодера и размывает внимание. Компилятор
+разбирает промпт на теги (с учётом скобок весов и тегов <lora:...>),
+убирает теги, равные по смыслу (регистр, подчёркивания, скобки весов;
+из дублей остаётся вариант с большим весом), и укладывает результат в
+бюджет кусков: теги персонажа и пользователя сохраняются всегда,
+дефолтные добавляются, пока помещаются. BREAK (закрывает текущий кусок) и
+AND (отдельный подпромпт) — структура промпта: они не удаляются как дубли,
+а счёт кусков после них начинается заново; дубли ищутся в пределах
+подпромпта AND.
+
+Токены считает локальный токенизатор CLIP (transformers, без скачивания);
+если его нет, используется приближённая оценка. Разбор строк (префиксы
+персонажей, дефолтные промпты) и длины тегов кэшируются.
+"""
+
+import logging
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 75
+# Как в SD WebUI (comma_padding_backtrack): тег короче этого переносится в следующий кусок целиком
+COMMA_BACKTRACK = 20
+LORA_RE = re.compile(r"^<\s*(lora|lyco|hypernet)\s*:\s*([^:>]+?)\s*(?::[^>]*)?>$", re.IGNORECASE)
+EXPLICIT_WEIGHT_RE = re.compile(r"^\((.*):\s*([0-9]*\.?[0-9]+)\s*\)$", re.DOTALL)
+WORD_RE = re.compile(r"[a-z]+|[0-9]|[^\sa-z0-9]+", re.IGNORECASE)
+# Как в SD WebUI: BREAK в разборе внимания, AND в get_multicond_prompt_list
+SEPARATOR_RE = re.compile(r"\s*\b(BREAK|AND)\b(?!_PERP|_SALT|_TOPK)\s*")
+
+
+@dataclass(frozen=True)
+class PromptTag:
+    text: str
+    key: str
+    weight: float
+    tokens: int
+    lora: Optional[str] = None
+    # "BREAK" или "AND"
+    separator: Optional[str] = None
+
+
+@dataclass
+class CompiledPrompt:
+    prompt: str
+    tokens: int
+    chunks: int
+    dropped: List[str] = field(default_factory=list)
+    duplicates: int = 0
+
+
+def split_tags(prompt: str) -> List[str]:
+    """
+    Делит промпт по запятым верхнего уровня (запятые внутри (), [] и <> не делят);
+    BREAK и AND возвращаются отдельными элементами.
+    """
+    tags, depth, current, escaped = [], 0, [], False
+    for char in prompt or "":
+        if escaped:
+            current.append(char)
+            escaped = False
+            continue
+        if char == "\\":
+            escaped = True
+        elif char in "([<":
+            depth += 1
+        elif char in ")]>":
+            depth = max(0, depth - 1)
+        elif char in ",\n" and depth == 0:
+            tags.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    tags.append("".join(current))
+    result = []
+    for tag in tags:
+        result.extend(part.strip() for part in SEPARATOR_RE.split(tag) if part.strip())
+    return result
+
+
+def _is_wrapped(text: str, opening: str, closing: str) -> bool:
+    """Скобки в начале и в конце — пара, а не '(a) и (b)'."""
+    if not (text.startswith(opening) and text.endswith(closing)):
+        return False
+    depth = 0
+    for i, char in enumerate(text):
+        if char == opening:
+            depth += 1
+        elif char == closing:
+            depth -= 1
+            if depth == 0 and i != len(text) - 1:
+                return False
+    return True
+
+
+def unwrap_weight(tag: str) -> Tuple[str, float]:
+    """'((x))' -> ('x', 1.21), '(x:1.3)' -> ('x', 1.3), '[x]' -> ('x', 0.909)"""
+    text, weight = tag.strip(), 1.0
+    while True:
+        match = EXPLICIT_WEIGHT_RE.match(text)
+        if match and _is_wrapped(text, "(", ")"):
+            text, weight = match.group(1).strip(), weight * float(match.group(2))
+        elif _is_wrapped(text, "(", ")"):
+            text, weight = text[1:-1].strip(), weight * 1.1
+        elif _is_wrapped(text, "[", "]"):
+            text, weight = text[1:-1].strip(), weight / 1.1
+        else:
+            return text, round(weight, 4)
+
+
+def tag_key(text: str) -> str:
+    """Ключ смыслового сравнения: без регистра, подчёркиваний, дефисов и лишних пробелов."""
+    text = text.replace("\\(", "(").replace("\\)", ")").lower()
+    return re.sub(r"[\s_\-]+", " ", text).strip(" .;")
+
+
+def estimate_clip_tokens(text: str) -> int:
+    """
+    Приближённое число токенов CLIP BPE: латинское слово — токен на каждые
+    ~7 букв, прочие символы (кириллица, эмодзи) — около токена на символ.
+    """
+    tokens = 0
+    for word in WORD_RE.findall(text):
+        if word.isascii() and word.isalpha():
+            tokens += 1 + (len(word) - 1) // 7
+        elif word.isascii():
+            tokens += len(word)
+        else:
+            tokens += len(word.encode("utf-8")) // 2 + 1
+    return tokens
+
+
+class ClipTokenCounter:
+    """Счётчик токенов CLIP с кэшем по тексту тега."""
+
+    def __init__(self, tokenizer_name: str):
+        self.tokenizer_name = tokenizer_name
+        self._tokenizer = None
+        self._loaded = False
+        self.count = lru_cache(maxsize=8192)(self._count)
+
+    def _load(self) -> None:
+        self._loaded = True
+        try:
+            from transformers import CLIPTokenizer
+            tokenizer = CLIPTokenizer.from_pretrained(self.tokenizer_name, local_files_only=True)
+            # Без файлов словаря новые версии transformers создают пустой токенизатор без ошибки
+            if len(tokenizer) < 1000:
+                raise ValueError(f"словарь токенизатора пуст ({len(tokenizer)} токенов)")
+            self._tokenizer = tokenizer
+            logger.info(f"[OK] Токенизатор CLIP загружен: {self.tokenizer_name}")
+        except Exception as e:
+            logger.warning(f"[WARNING] Токенизатор CLIP недоступен ({e}), длина промпта оценивается приближённо")
+
+    @property
+    def exact(self) -> bool:
+        if not self._loaded:
+            self._load()
+        return self._tokenizer is not None
+
+    def _count(self, text: str) -> int:
+        if not self._loaded:
+            self._load()
+        if self._tokenizer is None:
+            return estimate_clip_tokens(text)
+        return len(self._tokenizer(text, add_special_tokens=False, truncation=False)["input_ids"])
+
+
+def _add_to_chunks(chunks: int, used: int, cost: int, chunk_size: int) -> Tuple[int, int]:
+    """Добавляет тег длиной cost к (число кусков, заполнение последнего) — как SD WebUI"""
+    if chunks == 0:
+        chunks = 1
+    if used + cost <= chunk_size:
+        return chunks, used + cost
+    if cost <= COMMA_BACKTRACK and used > 0:
+        # Короткий тег не режется, а переносится в следующий кусок целиком
+        return chunks + 1, cost
+    used += cost
+    while used > chunk_size:
+        chunks += 1
+        used -= chunk_size
+    return chunks, used
+
+
+def count_chunks(costs: List[int], chunk_size: int = CHUNK_SIZE) -> int:
+    """Число кусков CLIP для последовательности длин тегов."""
+    chunks, used = 0, 0
+    for cost in costs:
+        chunks, used = _add_to_chunks(chunks, used, cost, chunk_size)
+    return chunks
+
+
+def _close_segment(chunks: int) -> int:
+    """Куски отрезка перед BREAK/AND: SD закрывает кусок, даже если он пуст."""
+    return max(chunks, 1)
+
+
+def count_prompt_chunks(tags: List[PromptTag], chunk_size: int = CHUNK_SIZE) -> int:
+    """Суммарное число кусков CLIP (проходов энкодера) с учётом BREAK и AND."""
+    closed, costs = 0, []
+    for tag in tags:
+        if tag.separator:
+            closed += _close_segment(count_chunks(costs, chunk_size))
+            costs = []
+        else:
+            costs.append(tag.tokens)
+    return closed + count_chunks(costs, chunk_size)
+
+
+def join_tags(tags: List[PromptTag]) -> str:
+    """Теги через запятую, BREAK и AND — через пробелы."""
+    parts, current = [], []
+    for tag in tags:
+        if tag.separator:
+            parts += [", ".join(current), tag.separator]
+            current = []
+        else:
+            current.append(tag.text)
+    parts.append(", ".join(current))
+    return " ".join(part for part in parts if part)
+
+
+class PromptCompiler:
+    def __init__(self, count_tokens: Callable[[str], int], max_chunks: int = 2, chunk_size: int = CHUNK_SIZE):
+        self.count_tokens = count_tokens
+        self.max_chunks = max_chunks
+        self.chunk_size = chunk_size
+        self.parse = lru_cache(maxsize=512)(self._parse)
+
+    def _parse(self, prompt: str) -> Tuple[PromptTag, ...]:
+        tags = []
+        for raw in split_tags(prompt):
+            if raw in ("BREAK", "AND"):
+                tags.append(PromptTag(raw, raw, 1.0, 0, separator=raw))
+                continue
+            lora = LORA_RE.match(raw)
+            if lora:
+                tags.append(PromptTag(raw, f"<{lora.group(1).lower()}:{lora.group(2).lower()}>", 1.0, 0, lora.group(2)))
+                continue
+            text, weight = unwrap_weight(raw)
+            key = tag_key(text)
+            if not key:
+                continue
+            # Скобки весов SD не токенизирует; +1 — запятая-разделитель
+            tags.append(PromptTag(raw, key, weight, self.count_tokens(text) + 1))
+        return tuple(tags)
+
+    def dedupe(self, prompt: str) -> str:
+        """Убирает равные по смыслу теги без ограничения длины."""
+        return self.compile(user=prompt, max_chunks=0).prompt
+
+    def compile(self, character: str = "", user: str = "", defaults: str = "",
+                max_chunks: Optional[int] = None) -> CompiledPrompt:
+        """
+        Собирает промпт в порядке приоритета: персонаж, пользователь, дефолтные теги.
+        max_chunks=0 — без ограничения.
+        """
+        max_chunks = self.max_chunks if max_chunks is None else max_chunks
+        sources = [(self.parse(character or ""), True), (self.parse(user or ""), True), (self.parse(defaults or ""), False)]
+
+        selected: List[PromptTag] = []
+        loras: List[PromptTag] = []
+        lora_keys = set()
+        positions = {}
+        duplicates = 0
+        dropped = []
+        # closed — куски отрезков до последнего BREAK/AND
+        closed, chunks, used = 0, 0, 0
+        for tags, required in sources:
+            for tag in tags:
+                if tag.separator:
+                    closed += _close_segment(chunks)
+                    chunks, used = 0, 0
+                    if tag.separator == "AND":
+                        # Подпромпт AND кодируется отдельно — повтор тега в нём не дубль
+                        positions = {}
+                    selected.append(tag)
+                    continue
+                if tag.lora is not None:
+                    if tag.key not in lora_keys:
+                        lora_keys.add(tag.key)
+                        loras.append(tag)
+                    else:
+                        duplicates += 1
+                    continue
+                position = positions.get(tag.key)
+                if position is not None:
+                    duplicates += 1
+                    # Из дублей остаётся вариант с большим весом на месте первого вхождения
+                    if tag.weight > selected[position].weight:
+                        selected[position] = tag
+                    continue
+                after = _add_to_chunks(chunks, used, tag.tokens, self.chunk_size)
+                if not required and max_chunks and closed + after[0] > max_chunks:
+                    dropped.append(tag.text)
+                    continue
+                chunks, used = after
+                positions[tag.key] = len(selected)
+                selected.append(tag)
+
+        return CompiledPrompt(
+            prompt=join_tags(selected + loras),
+            tokens=sum(tag.tokens for tag in selected),
+            chunks=count_prompt_chunks(selected, self.chunk_size),
+            dropped=dropped,
+            duplicates=duplicates,
+        )
+
+
+clip_token_counter = ClipTokenCounter(settings.CLIP_TOKENIZER)
+prompt_compiler = PromptCompiler(clip_token_counter.count, max_chunks=settings.PROMPT_MAX_CHUNKS)
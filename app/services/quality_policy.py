@@ -0,0 +1,138 @@
+"""
+Адаптивное качество генерации изображений.
+
+Для каждого запроса выбирается уровень качества (draft/standard/premium)
+по длине очереди к Stable Diffusion, подписке пользователя и подсказке
+клиента. Уровень меняет число шагов, hires.fix и ADetailer в итоговом
+payload. Под нагрузкой уровни понижаются: лучше отдать больше картинок
+чуть хуже, чем уронить всех по таймауту.
+"""
+
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Dict, Optional
+
+from app.config.generation_defaults import (
+    ADETAILER_FACE_PARAMS,
+    ADETAILER_HAND_PARAMS,
+    get_adetailer_params,
+)
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+DRAFT_STEPS = 12
+PREMIUM_SUBSCRIPTIONS = {"premium", "pro"}
+
+
+class QualityTier(str, Enum):
+    DRAFT = "draft"
+    STANDARD = "standard"
+    PREMIUM = "premium"
+
+
+# От дешёвого к дорогому
+TIERS = [QualityTier.DRAFT, QualityTier.STANDARD, QualityTier.PREMIUM]
+
+
+class SDQueue:
+    """Число запросов txt2img, которые сейчас ждут Stable Diffusion или выполняются."""
+
+    def __init__(self):
+        self.length = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        self.length += 1
+        try:
+            yield
+        finally:
+            self.length -= 1
+
+
+@dataclass
+class QualityDecision:
+    tier: QualityTier
+    reason: str
+
+
+def parse_tier(value: Optional[str]) -> Optional[QualityTier]:
+    try:
+        return QualityTier(str(value).lower()) if value else None
+    except ValueError:
+        return None
+
+
+class QualityPolicy:
+    """
+    Уровень по подписке: premium/pro — premium, остальные — standard.
+    Подсказка клиента может только понизить уровень. При длине очереди
+    от degrade_queue уровень понижается на один, от draft_queue — на два;
+    премиум-подписчикам понижение на один уровень меньше.
+    """
+
+    def __init__(self, degrade_queue: int = 3, draft_queue: int = 6):
+        self.degrade_queue = degrade_queue
+        self.draft_queue = draft_queue
+
+    def choose(
+        self,
+        queue_length: int,
+        subscription_type: Optional[str] = None,
+        hint: Optional[str] = None,
+    ) -> QualityDecision:
+        premium_user = (subscription_type or "").lower() in PREMIUM_SUBSCRIPTIONS
+        level = TIERS.index(QualityTier.PREMIUM if premium_user else QualityTier.STANDARD)
+        reasons = [f"subscription={subscription_type or 'none'}"]
+
+        requested = parse_tier(hint)
+        if requested is not None and TIERS.index(requested) < level:
+            level = TIERS.index(requested)
+            reasons.append(f"hint={requested.value}")
+
+        load_drop = 2 if queue_length >= self.draft_queue else 1 if queue_length >= self.degrade_queue else 0
+        if premium_user:
+            load_drop = max(0, load_drop - 1)
+        if load_drop:
+            level = max(0, level - load_drop)
+            reasons.append(f"queue={queue_length}")
+
+        return QualityDecision(TIERS[level], ", ".join(reasons))
+
+
+def _set_adetailer(payload: Dict[str, Any], enabled: bool) -> None:
+    # alwayson_scripts из get_generation_params может быть общим словарём — не меняем его на месте
+    scripts = dict(payload.get("alwayson_scripts") or {})
+    if enabled and "ADetailer" not in scripts:
+        scripts.update(get_adetailer_params(ADETAILER_FACE_PARAMS, ADETAILER_HAND_PARAMS))
+    elif not enabled:
+        scripts.pop("ADetailer", None)
+    payload["alwayson_scripts"] = scripts
+    payload["use_adetailer"] = enabled
+
+
+def apply_quality_tier(payload: Dict[str, Any], tier: QualityTier) -> Dict[str, Any]:
+    """
+    Подстраивает шаги, hires.fix и ADetailer итогового payload под уровень.
+    Standard — обычный конвейер без изменений; draft (под нагрузкой) убирает
+    hires.fix и ADetailer, premium включает их.
+    """
+    if tier == QualityTier.DRAFT:
+        payload["steps"] = min(payload.get("steps") or DRAFT_STEPS, DRAFT_STEPS)
+        payload["enable_hr"] = False
+        _set_adetailer(payload, False)
+    elif tier == QualityTier.STANDARD:
+        pass
+    else:
+        payload["enable_hr"] = True
+        _set_adetailer(payload, True)
+    return payload
+
+
+sd_queue = SDQueue()
+quality_policy = QualityPolicy(
+    degrade_queue=settings.QUALITY_DEGRADE_QUEUE,
+    draft_queue=settings.QUALITY_DRAFT_QUEUE,
+)
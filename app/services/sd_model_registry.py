@@ -0,0 +1,256 @@
+"""
+Реестр моделей Stable Diffusion: чекпоинт, VAE и доступные LoRA.
+
+Раньше информация о модели собиралась заново при каждой генерации через
+sys.path.insert(stable-diffusion-webui) и импорт model_config, а
+GenerationLogger на каждую запись проверял файлы LoRA на диске. Реестр
+собирает эти данные один раз и пересобирает их фоновой задачей, только
+когда /sdapi/v1/options сообщает о смене чекпоинта или VAE либо меняются
+каталоги моделей и model_config.py. Запросы к реестру — чтение готовых
+словарей.
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from app.config.paths import SD_MODELS_DIR, SD_VAE_DIR, SD_WEBUI_DIR
+from app.config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+MODEL_EXTENSIONS = (".safetensors", ".ckpt", ".pt")
+# Значения sd_vae, при которых используется VAE из чекпоинта
+BUILTIN_VAE = {"", "none", "automatic"}
+
+
+def strip_model_hash(title: Optional[str]) -> Optional[str]:
+    """'model.safetensors [6ce0161689]' -> 'model.safetensors'"""
+    if not title:
+        return None
+    title = str(title).strip()
+    if title.endswith("]") and " [" in title:
+        title = title[:title.rindex(" [")]
+    return title or None
+
+
+def lora_key(name: str) -> str:
+    """Ключ LoRA без регистра, каталога и расширения файла."""
+    name = os.path.basename(str(name).strip()).lower()
+    for extension in MODEL_EXTENSIONS:
+        if name.endswith(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def scan_model_files(directory: Path) -> Dict[str, Path]:
+    """Файлы моделей в каталоге (рекурсивно): имя файла -> путь."""
+    files = {}
+    if not directory.is_dir():
+        return files
+    for root, _, names in os.walk(directory):
+        for name in names:
+            if name.lower().endswith(MODEL_EXTENSIONS):
+                files.setdefault(name, Path(root) / name)
+    return files
+
+
+def load_model_config(path: Path) -> Dict[str, Any]:
+    """MODEL_NAME и VAE_NAME из stable-diffusion-webui/model_config.py без изменения sys.path."""
+    if not path.is_file():
+        return {}
+    spec = importlib.util.spec_from_file_location("sd_webui_model_config", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return {"name": getattr(module, "MODEL_NAME", None), "vae_name": getattr(module, "VAE_NAME", None)}
+
+
+class SDModelRegistry:
+    """Кэшированное состояние моделей SD с пересборкой по изменениям."""
+
+    def __init__(self, api_url: str, webui_dir: Path = SD_WEBUI_DIR, models_dir: Path = SD_MODELS_DIR,
+                 vae_dir: Path = SD_VAE_DIR, lora_dir: Optional[Path] = None,
+                 refresh_interval: float = 15.0, request_timeout: float = 3.0):
+        self.api_url = api_url.rstrip("/")
+        self.config_path = Path(webui_dir) / "model_config.py"
+        self.models_dir = Path(models_dir)
+        self.vae_dir = Path(vae_dir)
+        self.lora_dir = Path(lora_dir) if lora_dir is not None else Path(webui_dir) / "models" / "Lora"
+        self.refresh_interval = refresh_interval
+        self.request_timeout = request_timeout
+        self.rebuilds = 0
+        self.last_checked: Optional[float] = None
+        self._info: Optional[Dict[str, Any]] = None
+        self._loras: Dict[str, str] = {}
+        self._options: Optional[Tuple[Optional[str], Optional[str]]] = None
+        self._files_signature: Optional[Tuple] = None
+        self._built = False
+        self._lock = asyncio.Lock()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # --- Запросы -------------------------------------------------------------
+
+    def get_model_info(self) -> Optional[Dict[str, Any]]:
+        """name, size_mb, vae_name, available, source — или None, если модель неизвестна."""
+        return self._info
+
+    def is_model_available(self) -> bool:
+        return bool(self._info and self._info["available"])
+
+    def has_lora(self, name: str) -> bool:
+        return lora_key(name) in self._loras
+
+    def available_loras(self) -> List[str]:
+        return sorted(self._loras.values())
+
+    async def current_checkpoint(self) -> Optional[str]:
+        """
+        Чекпоинт, загруженный в SD прямо сейчас: /sdapi/v1/options запрашивается
+        в обход периодического обновления. None, если SD не ответил.
+        """
+        options = await self._fetch_options()
+        return options[0] if options is not None else None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "model": self._info,
+            "loras": len(self._loras),
+            "rebuilds": self.rebuilds,
+            "last_checked": self.last_checked,
+        }
+
+    # --- Обновление ----------------------------------------------------------
+
+    def _signature(self) -> Tuple:
+        """Время изменения каталогов моделей и model_config.py: меняется при добавлении и удалении файлов."""
+        signature = []
+        for path in (self.models_dir, self.vae_dir, self.lora_dir, self.config_path):
+            try:
+                signature.append(path.stat().st_mtime_ns)
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    async def _get_json(self, path: str) -> Any:
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.request_timeout))
+        async with self._session.get(self.api_url + path) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def _fetch_options(self) -> Optional[Tuple[Optional[str], Optional[str]]]:
+        try:
+            options = await self._get_json("/sdapi/v1/options")
+        except Exception as e:
+            logger.debug("Не удалось получить настройки SD: %s", e)
+            return None
+        return strip_model_hash(options.get("sd_model_checkpoint")), options.get("sd_vae")
+
+    async def _fetch_loras(self) -> List[str]:
+        try:
+            return [item["name"] for item in await self._get_json("/sdapi/v1/loras") if item.get("name")]
+        except Exception as e:
+            logger.debug("Не удалось получить список LoRA из SD: %s", e)
+            return []
+
+    def _rebuild(self, options: Optional[Tuple[Optional[str], Optional[str]]], api_loras: List[str]) -> None:
+        try:
+            config = load_model_config(self.config_path)
+        except Exception as e:
+            logger.warning(f"[WARNING] Не удалось прочитать {self.config_path}: {e}")
+            config = {}
+
+        checkpoints = scan_model_files(self.models_dir)
+        if options is not None and options[0]:
+            name, vae_name, source = options[0], options[1], "sd"
+        else:
+            name, vae_name, source = config.get("name"), config.get("vae_name"), "config"
+        if vae_name is not None and str(vae_name).lower() in BUILTIN_VAE:
+            vae_name = None
+
+        if name:
+            path = checkpoints.get(name) or checkpoints.get(os.path.basename(name))
+            self._info = {
+                "name": name,
+                "size_mb": round(path.stat().st_size / (1024 * 1024), 1) if path else 0,
+                "vae_name": vae_name,
+                # Чекпоинт, загруженный в SD, доступен, даже если SD работает на другой машине
+                "available": path is not None or source == "sd",
+                "source": source,
+            }
+        else:
+            self._info = None
+
+        loras = {lora_key(name): Path(name).stem for name in scan_model_files(self.lora_dir)}
+        for name in api_loras:
+            loras.setdefault(lora_key(name), name)
+        self._loras = loras
+        self.rebuilds += 1
+
+    async def refresh(self, force: bool = False) -> bool:
+        """Пересобирает состояние, если изменились настройки SD или файлы. True — была пересборка."""
+        async with self._lock:
+            options = await self._fetch_options()
+            signature = await asyncio.to_thread(self._signature)
+            self.last_checked = time.time()
+            # SD недоступен — опираемся на последние известные настройки
+            if options is None:
+                options = self._options
+            if self._built and not force and options == self._options and signature == self._files_signature:
+                return False
+
+            api_loras = await self._fetch_loras() if options is not None else []
+            await asyncio.to_thread(self._rebuild, options, api_loras)
+            self._options, self._files_signature, self._built = options, signature, True
+
+        if self._info:
+            logger.info(
+                f"[OK] Модель SD: {self._info['name']} ({self._info['size_mb']} MB), "
+                f"VAE: {self._info['vae_name'] or 'встроенный'}, LoRA: {len(self._loras)}"
+            )
+        else:
+            logger.warning("[WARNING] Модель SD не найдена или недоступна")
+        return True
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        # Первая сборка до приёма запросов, чтобы генерация и /health сразу видели модель
+        try:
+            await self.refresh(force=True)
+        except Exception as e:
+            logger.warning(f"[WARNING] Не удалось получить информацию о модели: {e}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"[ERROR] Ошибка обновления реестра моделей SD: {e}")
+
+
+sd_model_registry = SDModelRegistry(
+    api_url=settings.SD_API_URL,
+    refresh_interval=settings.SD_MODEL_REFRESH_INTERVAL,
+)
@@ -9,6 +9,8 @@ from pathlib import Path
 from typing import Dict, Any, Optional
 import time
 
+from app.services.sd_model_registry import sd_model_registry
+
 class GenerationLogger:
     """Логгер для генерации изображений."""
     
@@ -257,16 +259,5 @@ class GenerationLogger:
         if lora_weight <= 0:
             return False
             
-        # Проверяем, существует ли файл LoRA модели
-        lora_paths = [
-            f"stable-diffusion-webui/models/Lora/{lora_name}",
-            f"stable-diffusion-webui/models/Lora/{lora_name}.safetensors",
-            f"stable-diffusion-webui/models/Lora/{lora_name}.pt",
-            f"stable-diffusion-webui/models/Lora/{lora_name}.ckpt"
-        ]
-        
-        for path in lora_paths:
-            if os.path.exists(path):
-                return True
-                
-        return False
+        # Наличие файла LoRA проверяет реестр моделей SD, без обращения к диску
+        return sd_model_registry.has_lora(lora_name)
@@ -9,7 +9,6 @@ import logging
 
 # Настраиваем логирование
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
 
 class GenerationStats:
@@ -29,6 +28,7 @@ class GenerationStats:
             "by_steps": {},
             "by_resolution": {},
             "by_cfg_scale": {},
+            "by_quality_tier": {},
             "recent_generations": []
         }
         
@@ -62,10 +62,9 @@ class GenerationStats:
     def _save_stats(self) -> None:
         """Сохраняет статистику в файл"""
         try:
-            logger.info(f"Сохраняю статистику в файл: {self.stats_file}")
             with open(self.stats_file, 'w', encoding='utf-8') as f:
                 json.dump(self.stats, f, ensure_ascii=False, indent=2)
-            logger.info(f"Статистика успешно сохранена в {self.stats_file}")
+            logger.debug("Статистика сохранена в %s", self.stats_file)
         except Exception as e:
             logger.error(f"Ошибка сохранения статистики: {str(e)}")
             logger.error(f"Путь к файлу: {self.stats_file}")
@@ -80,29 +79,18 @@ class GenerationStats:
         :param result: результат генерации (info/result)
         :param detailed: расширенный объект (если есть)
         """
-        # Логируем только метаданные без base64 изображений
-        logger.info(
-            f"[add_generation] Входные параметры: params={params}, "
-            f"execution_time={execution_time}"
-        )
-        if result:
-            result_summary = {
-                "images_count": len(result.get("images", [])),
-                "info_keys": (
-                    list(result.keys()) if isinstance(result, dict) 
-                    else "not_dict"
-                )
-            }
-            logger.info(f"[add_generation] Результат: {result_summary}")
-        if detailed:
-            detailed_summary = {
-                "keys": (
-                    list(detailed.keys()) if isinstance(detailed, dict) 
-                    else "not_dict"
-                ),
-                "status": detailed.get("status", "unknown")
-            }
-            logger.info(f"[add_generation] Detailed: {detailed_summary}")
+        # Параметры передаются структурой: форматтер обрезает промпты и base64,
+        # а при уровне выше DEBUG запись вообще не формируется
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "[add_generation] Входные параметры",
+                extra={
+                    "params": params,
+                    "execution_time": execution_time,
+                    "images_count": len(result.get("images", [])) if isinstance(result, dict) else 0,
+                    "detailed_status": detailed.get("status", "unknown") if isinstance(detailed, dict) else None,
+                },
+            )
         
         # Фильтруем параметры, убирая изображения и большие данные
         filtered_params = self._filter_params(params)
@@ -211,6 +199,23 @@ class GenerationStats:
             )
         )
         
+        # Статистика по уровню качества (в старых файлах статистики раздела нет)
+        quality_tier = filtered_params.get("quality_tier")
+        if quality_tier:
+            by_tier = self.stats.setdefault("by_quality_tier", {})
+            if quality_tier not in by_tier:
+                by_tier[quality_tier] = {
+                    "count": 0,
+                    "total_time": self._format_time_for_json(0),
+                    "avg_time": self._format_time_for_json(0)
+                }
+            by_tier[quality_tier]["count"] += 1
+            current_total = by_tier[quality_tier]["total_time"]["total_seconds"] + execution_time
+            by_tier[quality_tier]["total_time"] = self._format_time_for_json(current_total)
+            by_tier[quality_tier]["avg_time"] = self._format_time_for_json(
+                current_total / by_tier[quality_tier]["count"]
+            )
+        
         # Добавляем упрощенную запись о последней генерации
         if "recent_generations" not in self.stats:
             self.stats["recent_generations"] = []
@@ -224,7 +229,8 @@ class GenerationStats:
             "sampler": filtered_params.get("sampler_name", "unknown"),
             "resolution": f"{filtered_params.get('width', 0)}x{filtered_params.get('height', 0)}",
             "cfg_scale": filtered_params.get("cfg_scale", 0),
-            "service": filtered_detailed.get("service", "unknown") if filtered_detailed else "unknown"
+            "service": filtered_detailed.get("service", "unknown") if filtered_detailed else "unknown",
+            "quality_tier": quality_tier
         }
         
         # Добавляем информацию об ADetailer если есть
@@ -236,7 +242,7 @@ class GenerationStats:
                 "steps": adetailer.get("steps", 0)
             }
         
-        logger.info(f"[add_generation] Формируемый упрощенный словарь: {gen_record}")
+        logger.debug("[add_generation] Запись статистики", extra={"record": gen_record})
         
         self.stats["recent_generations"].append(gen_record)
         
@@ -247,22 +253,8 @@ class GenerationStats:
             )
         
         # Сохраняем статистику
-        logger.info(f"[add_generation] Пытаюсь сохранить статистику в файл: {self.stats_file}")
         self._save_stats()
-        logger.info(
-            f"Статистика обновлена. "
-            f"Всего генераций: {self.stats['total_generations']}"
-        )
-        # Проверяем размер и часть содержимого файла
-        try:
-            if os.path.exists(self.stats_file):
-                with open(self.stats_file, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    logger.info(f"[add_generation] Файл {self.stats_file} успешно записан. Размер: {len(content)} байт. Первые 500 символов: {content[:500]}")
-            else:
-                logger.error(f"[add_generation] Файл {self.stats_file} не найден после записи!")
-        except Exception as e:
-            logger.error(f"[add_generation] Ошибка при проверке файла после записи: {e}")
+        logger.info("Статистика обновлена. Всего генераций: %s", self.stats['total_generations'])
     
     def get_stats_summary(self) -> Dict:
         """Возвращает краткую сводку статистики"""
@@ -276,6 +268,7 @@ class GenerationStats:
             "by_steps": self.stats["by_steps"],
             "by_resolution": self.stats["by_resolution"],
             "by_cfg_scale": self.stats["by_cfg_scale"],
+            "by_quality_tier": self.stats.get("by_quality_tier", {}),
             "recent_generations": self.stats["recent_generations"][-5:]  # Только последние 5
         }
     
@@ -293,6 +286,7 @@ class GenerationStats:
             "by_steps": {},
             "by_resolution": {},
             "by_cfg_scale": {},
+            "by_quality_tier": {},
             "recent_generations": []
         }
         self._save_stats()
@@ -0,0 +1,132 @@
+"""
+Тесты конвейера логирования: JSON-формат, обрезка полей, прореживание и очередь.
+"""
+
+import base64
+import json
+import logging
+import queue
+
+import pytest
+
+from app.config import logging_config
+from app.config.logging_config import (
+    JsonFormatter,
+    NonBlockingQueueHandler,
+    SamplingFilter,
+    parse_module_levels,
+    redact,
+    setup_logging,
+    shutdown_logging,
+)
+
+
+@pytest.fixture
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield
+    shutdown_logging()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    for name in ("tests.noisy", "tests.quiet"):
+        logging.getLogger(name).setLevel(logging.NOTSET)
+
+
+def make_record(msg="hello", level=logging.INFO, lineno=1, **extra):
+    record = logging.LogRecord("tests", level, __file__, lineno, msg, None, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_redact_truncates_base64_and_masks_secrets():
+    image = base64.b64encode(b"\x89PNG" * 1000).decode()
+    value = {
+        "prompt": "a" * 5000,
+        "init_images": [f"data:image/png;base64,{image}"],
+        "password": "hunter2",
+        "steps": 30,
+    }
+    redacted = redact(value, max_chars=100)
+
+    assert redacted["prompt"].startswith("a" * 100) and redacted["prompt"].endswith("<5000 chars>")
+    assert redacted["init_images"] == [f"<base64 {len('data:image/png;base64,') + len(image)} chars>"]
+    assert redacted["password"] == "***"
+    assert redacted["steps"] == 30
+
+
+def test_json_formatter_includes_redacted_extra():
+    line = JsonFormatter(max_field_chars=50).format(
+        make_record("generation done", payload={"prompt": "x" * 500, "token": "secret"}, user_id=7)
+    )
+    entry = json.loads(line)
+
+    assert entry["message"] == "generation done"
+    assert entry["level"] == "INFO"
+    assert entry["user_id"] == 7
+    assert entry["payload"]["token"] == "***"
+    assert entry["payload"]["prompt"].endswith("<500 chars>")
+
+
+def test_sampling_filter_thins_debug_per_call_site():
+    sampler = SamplingFilter(debug_every=10)
+
+    debug = [sampler.filter(make_record(level=logging.DEBUG, lineno=1)) for _ in range(100)]
+    other_site = sampler.filter(make_record(level=logging.DEBUG, lineno=2))
+    info = [sampler.filter(make_record(level=logging.INFO)) for _ in range(10)]
+    explicit = [sampler.filter(make_record(level=logging.INFO, lineno=3, sample_every=5)) for _ in range(10)]
+
+    assert sum(debug) == 10 and debug[0]
+    assert other_site
+    assert all(info)
+    assert sum(explicit) == 2
+    assert sampler.dropped == 90 + 8
+
+
+def test_queue_handler_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=2))
+    for i in range(5):
+        handler.handle(make_record(f"message {i}"))
+
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 3
+
+
+def test_parse_module_levels():
+    assert parse_module_levels("app.chat_bot=debug, uvicorn.access=WARNING,,broken") == {
+        "app.chat_bot": "DEBUG",
+        "uvicorn.access": "WARNING",
+    }
+
+
+def test_setup_logging_writes_json_lines_through_queue(tmp_path, restore_logging):
+    log_file = tmp_path / "app.log"
+    setup_logging(
+        level="INFO",
+        module_levels={"tests.noisy": "DEBUG", "tests.quiet": "ERROR"},
+        log_file=str(log_file),
+        debug_sample_every=2,
+    )
+    noisy = logging.getLogger("tests.noisy")
+    for i in range(4):
+        noisy.debug("debug %d", i)
+    logging.getLogger("tests.quiet").warning("hidden")
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logging.getLogger("tests.quiet").exception("failed", extra={"prompt": "p" * 3000})
+
+    from loguru import logger as loguru_logger
+    loguru_logger.info("from loguru")
+
+    assert logging_config.logging_stats()["dropped_sampled"] == 2
+    shutdown_logging()
+
+    entries = [json.loads(line) for line in log_file.read_text(encoding="utf-8").splitlines()]
+    messages = [entry["message"] for entry in entries]
+    assert messages == ["debug 0", "debug 2", "failed", "from loguru"]
+    assert "ValueError: boom" in entries[2]["exception"]
+    assert entries[2]["prompt"].endswith("<3000 chars>")
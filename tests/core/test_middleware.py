@@ -0,0 +1,118 @@
+"""
+Тесты ASGI-middleware: логирование запросов и сжатие ответов.
+"""
+
+import gzip
+import json
+import logging
+
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from app.core import middleware
+from app.core.middleware import CompressionMiddleware, RequestLoggingMiddleware
+
+LISTING = [{"id": i, "name": f"Персонаж {i}", "prompt": "длинное описание " * 5} for i in range(200)]
+
+
+async def listing(request):
+    return JSONResponse(LISTING)
+
+
+async def small(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def events(request):
+    async def stream():
+        for i in range(3):
+            yield f"data: {json.dumps({'chunk': 'x' * 600, 'i': i})}\n\n"
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+
+async def chunked_listing(request):
+    async def stream():
+        for item in LISTING:
+            yield json.dumps(item) + "\n"
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+async def image(request):
+    return Response(b"\x89PNG" + b"\0" * 5000, media_type="image/png")
+
+
+def make_client():
+    app = Starlette(routes=[
+        Route("/listing", listing),
+        Route("/small", small),
+        Route("/events", events),
+        Route("/chunked", chunked_listing),
+        Route("/image", image),
+    ])
+    app.add_middleware(RequestLoggingMiddleware)
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
+    return TestClient(app)
+
+
+def test_large_json_is_gzipped():
+    client = make_client()
+    response = client.get("/listing", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert int(response.headers["content-length"]) < len(json.dumps(LISTING).encode())
+    assert response.json() == LISTING
+
+
+def test_streaming_body_is_compressed_incrementally():
+    client = make_client()
+    response = client.get("/chunked", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert [json.loads(line) for line in response.text.splitlines()] == LISTING
+
+
+@pytest.mark.parametrize("path", ["/events", "/image", "/small"])
+def test_sse_images_and_small_responses_are_not_compressed(path):
+    client = make_client()
+    response = client.get(path, headers={"Accept-Encoding": "gzip, br"})
+
+    assert "content-encoding" not in response.headers
+
+
+def test_no_compression_without_accept_encoding():
+    client = make_client()
+    response = client.get("/listing", headers={"Accept-Encoding": "identity, gzip;q=0"})
+
+    assert "content-encoding" not in response.headers
+    assert response.json() == LISTING
+
+
+def test_brotli_is_preferred_when_available(monkeypatch):
+    brotli = pytest.importorskip("brotli")
+    monkeypatch.setattr(middleware, "brotli", brotli)
+    client = make_client()
+    response = client.get("/listing", headers={"Accept-Encoding": "gzip, br"})
+
+    assert response.headers["content-encoding"] == "br"
+    assert response.json() == LISTING
+
+
+def test_requests_and_statuses_are_logged(caplog):
+    client = make_client()
+    with caplog.at_level(logging.INFO, logger=middleware.__name__):
+        client.get("/small?x=1")
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert "Request: GET http://testserver/small?x=1" in messages
+    assert "Response: 200" in messages
+
+
+def test_gzip_payload_is_valid():
+    compressor = middleware._GzipCompressor(6)
+    data = compressor.compress(b"abc" * 1000) + compressor.finish()
+    assert gzip.decompress(data) == b"abc" * 1000
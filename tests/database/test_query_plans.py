@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Проверка планов горячих запросов чата и авторизации на PostgreSQL.
+
+Тест создаёт схему в отдельном namespace, применяет миграции с индексами,
+наполняет таблицы реалистичными объёмами и через EXPLAIN проверяет, что
+при обычных настройках планировщика ни один горячий запрос не читает
+таблицу последовательным сканированием и каждый использует свой индекс.
+
+База берётся из TEST_DATABASE_URL (postgresql://...), иначе поднимается
+локальный сервер через pgserver; если нет ни того, ни другого — тест пропускается.
+"""
+
+import importlib.util
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sa = pytest.importorskip("sqlalchemy")
+pytest.importorskip("psycopg2")
+pytest.importorskip("alembic")
+
+from alembic.migration import MigrationContext  # noqa: E402
+from alembic.operations import Operations  # noqa: E402
+
+VERSIONS_DIR = Path(__file__).parent.parent.parent / "alembic" / "versions"
+MIGRATIONS = [
+    "489a457bf5a1_add_chat_hot_query_indexes.py",
+    "88938a032d5f_unique_chat_session_per_character_user.py",
+    "5b2e7c91d4a3_refresh_token_indexes.py",
+]
+SCHEMA = "query_plan_check"
+
+# Схема таблиц на ревизии ae4bf9509a19 (только колонки, нужные запросам)
+BASE_SCHEMA = """
+CREATE TABLE characters (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR NOT NULL,
+    prompt TEXT
+);
+CREATE INDEX ix_characters_id ON characters (id);
+CREATE TABLE chat_sessions (
+    id SERIAL PRIMARY KEY,
+    character_id INTEGER NOT NULL REFERENCES characters (id),
+    user_id VARCHAR(64),
+    started_at TIMESTAMPTZ DEFAULT now(),
+    ended_at TIMESTAMPTZ
+);
+CREATE INDEX ix_chat_sessions_character_id ON chat_sessions (character_id);
+CREATE INDEX ix_chat_sessions_id ON chat_sessions (id);
+CREATE INDEX ix_chat_sessions_user_id ON chat_sessions (user_id);
+CREATE TABLE chat_messages (
+    id SERIAL PRIMARY KEY,
+    session_id INTEGER NOT NULL REFERENCES chat_sessions (id),
+    role VARCHAR(16) NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TIMESTAMPTZ DEFAULT now()
+);
+CREATE INDEX ix_chat_messages_session_id ON chat_messages (session_id);
+CREATE TABLE chat_history (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    character_name VARCHAR(100) NOT NULL,
+    session_id VARCHAR(100) NOT NULL,
+    message_type VARCHAR(20) NOT NULL,
+    message_content TEXT NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT now()
+);
+CREATE TABLE refresh_tokens (
+    id SERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    token_hash VARCHAR(255) NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    is_active BOOLEAN DEFAULT true,
+    created_at TIMESTAMP DEFAULT now()
+);
+CREATE INDEX ix_refresh_tokens_token_hash ON refresh_tokens (token_hash);
+"""
+
+SEED_DATA = """
+INSERT INTO characters (name, prompt)
+SELECT 'Character' || g, 'prompt' FROM generate_series(1, 2000) AS g;
+INSERT INTO chat_sessions (character_id, user_id)
+SELECT 1 + g % 2000, 'user_' || (g / 2000) FROM generate_series(0, 19999) AS g;
+-- Дубль, который мог создать параллельный get-or-create до миграции
+INSERT INTO chat_sessions (character_id, user_id) VALUES (1, 'user_0');
+INSERT INTO chat_messages (session_id, role, content, timestamp)
+SELECT 1 + g % 20001, 'user', 'message ' || g, now() - g * interval '1 second'
+FROM generate_series(1, 100000) AS g;
+-- Активный пользователь с длинной историей
+INSERT INTO chat_messages (session_id, role, content, timestamp)
+SELECT 42, 'assistant', 'reply ' || g, now() - g * interval '1 second'
+FROM generate_series(1, 5000) AS g;
+INSERT INTO chat_history (user_id, character_name, session_id, message_type, message_content, created_at)
+SELECT g % 500, 'Character' || (g % 50), 'session_' || (g % 7), 'user', 'message', now() - g * interval '1 second'
+FROM generate_series(1, 100000) AS g;
+-- Большинство токенов ротировано, часть уже истекла
+INSERT INTO refresh_tokens (user_id, token_hash, expires_at, is_active)
+SELECT g % 5000, md5(g::text), now() + (g % 14 - 7) * interval '1 day', g % 10 = 0
+FROM generate_series(1, 100000) AS g;
+-- Дубль хеша, который не позволил бы создать уникальный индекс
+INSERT INTO refresh_tokens (user_id, token_hash, expires_at) VALUES (1, md5('1'), now());
+ANALYZE;
+"""
+
+# Горячие запросы в том виде, в каком их выполняет приложение
+HOT_QUERIES = {
+    "character_by_name": "SELECT * FROM characters WHERE lower(name) = lower('character42')",
+    "session_get_or_create": "SELECT * FROM chat_sessions WHERE character_id = 42 AND user_id = 'user_3'",
+    "session_history": "SELECT * FROM chat_messages WHERE session_id = 42 ORDER BY timestamp ASC LIMIT 20",
+    "chat_history": (
+        "SELECT * FROM chat_history WHERE user_id = 42 AND character_name = 'Character42' "
+        "AND session_id = 'session_0' ORDER BY created_at ASC"
+    ),
+    "user_characters": "SELECT DISTINCT character_name FROM chat_history WHERE user_id = 42",
+    "refresh_token_lookup": "SELECT * FROM refresh_tokens WHERE token_hash = md5('42') FOR UPDATE",
+    "refresh_token_revoke_user": "UPDATE refresh_tokens SET is_active = false WHERE user_id = 42 AND is_active = true",
+    "refresh_token_compaction": (
+        "DELETE FROM refresh_tokens WHERE id = ANY(ARRAY("
+        "SELECT id FROM refresh_tokens WHERE expires_at < now() ORDER BY expires_at LIMIT 1000))"
+    ),
+}
+
+# Индекс из миграций, который планировщик должен выбрать для каждого запроса
+EXPECTED_INDEXES = {
+    "character_by_name": "ix_characters_name_lower",
+    "session_get_or_create": "uq_chat_sessions_character_id_user_id",
+    "session_history": "ix_chat_messages_session_id_timestamp",
+    "chat_history": "ix_chat_history_user_character_session_created",
+    "user_characters": "ix_chat_history_user_character_session_created",
+    "refresh_token_lookup": "uq_refresh_tokens_token_hash",
+    "refresh_token_revoke_user": "ix_refresh_tokens_active_user_id",
+    "refresh_token_compaction": "ix_refresh_tokens_expires_at",
+}
+
+
+@pytest.fixture(scope="module")
+def database_url():
+    url = os.environ.get("TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+
+    pgserver = pytest.importorskip("pgserver", reason="нужен TEST_DATABASE_URL или пакет pgserver")
+    with tempfile.TemporaryDirectory() as data_dir:
+        server = pgserver.get_server(data_dir, cleanup_mode="stop")
+        try:
+            yield server.get_uri()
+        finally:
+            server.cleanup()
+
+
+@pytest.fixture(scope="module")
+def engine(database_url):
+    url = sa.engine.make_url(database_url).set(drivername="postgresql+psycopg2")
+    admin = sa.create_engine(url, isolation_level="AUTOCOMMIT")
+    try:
+        with admin.connect() as conn:
+            conn.execute(sa.text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            conn.execute(sa.text(f"CREATE SCHEMA {SCHEMA}"))
+    except sa.exc.OperationalError as e:
+        pytest.skip(f"PostgreSQL недоступен: {e}")
+
+    engine = sa.create_engine(url, connect_args={"options": f"-csearch_path={SCHEMA}"})
+    with engine.begin() as conn:
+        cursor = conn.connection.cursor()
+        cursor.execute(BASE_SCHEMA)
+        cursor.execute(SEED_DATA)
+
+    with engine.connect() as conn:
+        context = MigrationContext.configure(conn)
+        with Operations.context(context), context.begin_transaction():
+            for filename in MIGRATIONS:
+                spec = importlib.util.spec_from_file_location(filename[:-3], VERSIONS_DIR / filename)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+                module.upgrade()
+
+    yield engine
+
+    engine.dispose()
+    with admin.connect() as conn:
+        conn.execute(sa.text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    admin.dispose()
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _plan_nodes(child)
+
+
+def explain(conn, query):
+    # Настройки планировщика не меняются: планы строятся по статистике реальных объёмов
+    result = conn.execute(sa.text(f"EXPLAIN (FORMAT JSON) {query}")).scalar()
+    return list(_plan_nodes(result[0]["Plan"]))
+
+
+@pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+def test_hot_query_uses_index(engine, name):
+    with engine.connect() as conn:
+        nodes = explain(conn, HOT_QUERIES[name])
+
+    seq_scans = [node["Relation Name"] for node in nodes if node["Node Type"] == "Seq Scan"]
+    assert not seq_scans, f"{name}: последовательное сканирование {seq_scans}"
+    indexes = {node["Index Name"] for node in nodes if "Index Name" in node}
+    assert EXPECTED_INDEXES[name] in indexes, f"{name}: выбраны индексы {indexes}"
+
+
+def test_history_is_read_in_index_order(engine):
+    # ORDER BY timestamp обслуживается составным индексом без отдельной сортировки
+    with engine.connect() as conn:
+        nodes = explain(conn, HOT_QUERIES["session_history"])
+    assert "Sort" not in {node["Node Type"] for node in nodes}
+
+
+def test_chat_sessions_are_unique_per_character_and_user(engine):
+    with engine.connect() as conn:
+        count = conn.execute(sa.text(
+            "SELECT count(*) FROM chat_sessions WHERE character_id = 1 AND user_id = 'user_0'"
+        )).scalar()
+        assert count == 1
+        # Сообщения удалённого дубля перенесены в оставшуюся сессию
+        orphaned = conn.execute(sa.text(
+            "SELECT count(*) FROM chat_messages m LEFT JOIN chat_sessions s ON s.id = m.session_id WHERE s.id IS NULL"
+        )).scalar()
+        assert orphaned == 0
+
+        with pytest.raises(sa.exc.IntegrityError):
+            conn.execute(sa.text("INSERT INTO chat_sessions (character_id, user_id) VALUES (1, 'user_0')"))
+
+
+def test_refresh_token_hash_is_unique(engine):
+    with engine.connect() as conn:
+        count = conn.execute(sa.text("SELECT count(*) FROM refresh_tokens WHERE token_hash = md5('1')")).scalar()
+        assert count == 1
+
+        with pytest.raises(sa.exc.IntegrityError):
+            conn.execute(sa.text(
+                "INSERT INTO refresh_tokens (user_id, token_hash, expires_at) VALUES (2, md5('2'), now())"
+            ))
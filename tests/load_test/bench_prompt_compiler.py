@@ -0,0 +1,152 @@
+"""
+Бенчмарк компилятора промптов на реальных промптах из generation_logs.
+
+Для каждой записи лога берётся итоговый промпт, ушедший в SD (старая
+склейка через ", ".join), и собирается заново компилятором: теги из
+дефолтного набора передаются как defaults, остальные — как промпт
+пользователя и персонажа. Печатаются токены CLIP и число кусков по 75
+токенов до и после, доля промптов сверх бюджета, число убранных дублей
+и отброшенных дефолтных тегов, а также время компиляции без кэша и с
+прогретым кэшем.
+
+Пример (из корня проекта):
+
+    python tests/load_test/bench_prompt_compiler.py
+    python tests/load_test/bench_prompt_compiler.py --max-chunks 3 --json result.json
+"""
+
+import argparse
+import glob
+import json
+import statistics
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Tuple
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from app.config.default_prompts import get_default_positive_prompts  # noqa: E402
+from app.services.prompt_compiler import (  # noqa: E402
+    PromptCompiler,
+    clip_token_counter,
+    count_chunks,
+)
+
+
+def read_records(pattern: str) -> Iterator[Dict[str, Any]]:
+    """Записи логов генерации: JSON-объекты подряд, в том числе многострочные."""
+    decoder = json.JSONDecoder()
+    for path in sorted(glob.glob(pattern)):
+        text = Path(path).read_text(encoding="utf-8")
+        position = 0
+        while True:
+            while position < len(text) and text[position].isspace():
+                position += 1
+            if position >= len(text):
+                break
+            try:
+                record, position = decoder.raw_decode(text, position)
+            except ValueError:
+                break
+            yield record
+
+
+def final_prompt(record: Dict[str, Any]) -> Tuple[str, bool]:
+    """Итоговый промпт записи и добавлялись ли к нему дефолтные теги."""
+    prompts = record.get("prompts") or {}
+    return prompts.get("enhanced_prompt") or record.get("prompt") or "", bool(prompts.get("uses_default_prompts"))
+
+
+def measure(compiler: PromptCompiler, prompts: List[Tuple[str, bool]], defaults: str, repeats: int) -> Dict[str, Any]:
+    default_keys = {tag.key for tag in compiler.parse(defaults)}
+    before_tokens, before_chunks, after_tokens, after_chunks = [], [], [], []
+    duplicates, dropped = 0, 0
+    jobs = []
+
+    for prompt, uses_defaults in prompts:
+        tags = compiler.parse(prompt)
+        costs = [tag.tokens for tag in tags]
+        before_tokens.append(sum(costs))
+        before_chunks.append(count_chunks(costs, compiler.chunk_size))
+
+        user = ", ".join(tag.text for tag in tags if tag.key not in default_keys)
+        jobs.append((user, defaults if uses_defaults else ""))
+        compiled = compiler.compile(user=user, defaults=jobs[-1][1])
+        after_tokens.append(compiled.tokens)
+        after_chunks.append(compiled.chunks)
+        duplicates += compiled.duplicates
+        dropped += len(compiled.dropped)
+
+    def timed(clear_cache: bool) -> float:
+        samples = []
+        for _ in range(repeats):
+            if clear_cache:
+                compiler.parse.cache_clear()
+                clip_token_counter.count.cache_clear()
+            started = time.perf_counter()
+            for user, job_defaults in jobs:
+                compiler.compile(user=user, defaults=job_defaults)
+            samples.append((time.perf_counter() - started) / max(1, len(jobs)))
+        return statistics.median(samples) * 1e6
+
+    def over_budget(chunks: List[int]) -> float:
+        return round(sum(1 for c in chunks if c > compiler.max_chunks) / max(1, len(chunks)), 3)
+
+    return {
+        "prompts": len(prompts),
+        "exact_tokenizer": clip_token_counter.exact,
+        "max_chunks": compiler.max_chunks,
+        "before": {
+            "tokens_mean": round(statistics.mean(before_tokens), 1),
+            "tokens_max": max(before_tokens),
+            "chunks": dict(sorted(Counter(before_chunks).items())),
+            "over_budget": over_budget(before_chunks),
+        },
+        "after": {
+            "tokens_mean": round(statistics.mean(after_tokens), 1),
+            "tokens_max": max(after_tokens),
+            "chunks": dict(sorted(Counter(after_chunks).items())),
+            "over_budget": over_budget(after_chunks),
+        },
+        "duplicates_removed": duplicates,
+        "default_tags_dropped": dropped,
+        "compile_us_cold": round(timed(clear_cache=True), 1),
+        "compile_us_warm": round(timed(clear_cache=False), 1),
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logs", default=str(PROJECT_ROOT / "generation_logs" / "*.jsonl"))
+    parser.add_argument("--max-chunks", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--json", help="Сохранить результат в файл")
+    args = parser.parse_args()
+
+    prompts = [item for item in (final_prompt(r) for r in read_records(args.logs)) if item[0]]
+    if not prompts:
+        print(f"Промпты не найдены: {args.logs}")
+        return 1
+
+    compiler = PromptCompiler(clip_token_counter.count, max_chunks=args.max_chunks)
+    result = measure(compiler, prompts, get_default_positive_prompts(), args.repeats)
+
+    print(f"Промптов: {result['prompts']}, токенизатор CLIP: "
+          f"{'точный' if result['exact_tokenizer'] else 'приближённая оценка'}, бюджет: {result['max_chunks']} куск.")
+    for label in ("before", "after"):
+        data = result[label]
+        print(f"  {label:<6} токенов в среднем {data['tokens_mean']}, максимум {data['tokens_max']}, "
+              f"куски {data['chunks']}, сверх бюджета {data['over_budget']:.1%}")
+    print(f"  дублей убрано: {result['duplicates_removed']}, дефолтных тегов отброшено: {result['default_tags_dropped']}")
+    print(f"  компиляция: {result['compile_us_cold']} мкс без кэша, {result['compile_us_warm']} мкс с кэшем")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
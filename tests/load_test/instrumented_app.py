@@ -0,0 +1,146 @@
+"""
+Обёртка над app.main:app для нагрузочного тестирования.
+
+Добавляет к приложению:
+- фоновый замер задержки event loop (насколько позже запланированного
+  просыпается asyncio.sleep);
+- служебный эндпоинт GET /__loadtest__/metrics с задержкой loop и памятью
+  процесса; параметр ?reset=1 сбрасывает накопленные замеры.
+
+Запуск (из корня проекта):
+
+    uvicorn tests.load_test.instrumented_app:create_app --factory --port 8000
+"""
+
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, Optional
+from urllib.parse import parse_qs
+
+project_root = Path(__file__).parent.parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+METRICS_PATH = "/__loadtest__/metrics"
+
+
+def get_rss_bytes() -> int:
+    """Текущий RSS процесса в байтах."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return get_peak_rss_bytes()
+
+
+def get_peak_rss_bytes() -> int:
+    """Пиковый RSS процесса в байтах."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class EventLoopLagMonitor:
+    """Периодически измеряет, насколько event loop опаздывает с пробуждением."""
+
+    def __init__(self, interval: float = 0.05, max_samples: int = 100_000):
+        self.interval = interval
+        self.samples = deque(maxlen=max_samples)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def reset(self) -> None:
+        self.samples.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        values = sorted(self.samples)
+        if not values:
+            return {"samples": 0, "mean_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        p99 = values[min(len(values) - 1, int(len(values) * 0.99))]
+        return {
+            "samples": len(values),
+            "mean_ms": sum(values) / len(values) * 1000,
+            "p99_ms": p99 * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+
+
+class LoadTestInstrumentation:
+    """ASGI-обёртка: мониторинг event loop и эндпоинт метрик."""
+
+    def __init__(self, app):
+        self.app = app
+        self.lag_monitor = EventLoopLagMonitor()
+        self.started_at = time.time()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(scope, receive, send)
+            return
+        if scope["type"] == "http" and scope["path"] == METRICS_PATH:
+            await self._send_metrics(scope, send)
+            return
+        # Монитор стартует при первом запросе, если сервер запущен без lifespan
+        self.lag_monitor.start()
+        await self.app(scope, receive, send)
+
+    async def _lifespan(self, scope, receive, send):
+        async def instrumented_send(message):
+            if message["type"] == "lifespan.startup.complete":
+                self.lag_monitor.start()
+            elif message["type"] == "lifespan.shutdown.complete":
+                await self.lag_monitor.stop()
+            await send(message)
+
+        await self.app(scope, receive, instrumented_send)
+
+    async def _send_metrics(self, scope, send):
+        query = parse_qs(scope.get("query_string", b"").decode())
+        body = {
+            "pid": os.getpid(),
+            "uptime": time.time() - self.started_at,
+            "event_loop_lag": self.lag_monitor.snapshot(),
+            "memory": {"rss_bytes": get_rss_bytes(), "peak_rss_bytes": get_peak_rss_bytes()},
+            "tasks": len(asyncio.all_tasks()),
+        }
+        if query.get("reset", ["0"])[0] == "1":
+            self.lag_monitor.reset()
+
+        payload = json.dumps(body).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(payload)).encode())],
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+
+def create_app():
+    """Фабрика для uvicorn --factory: приложение импортируется только в процессе сервера."""
+    from app.main import app as main_app
+    return LoadTestInstrumentation(main_app)
@@ -0,0 +1,319 @@
+"""
+Локальные заглушки внешних бэкендов для нагрузочного тестирования.
+
+- MockLLMServer повторяет OpenAI-совместимый API text-generation-webui
+  (/v1/models, /v1/model, /v1/model/load, /v1/chat/completions со стримингом)
+  с настраиваемыми TTFT и скоростью выдачи токенов.
+- MockSDServer повторяет /sdapi/v1/txt2img и служебные эндпоинты
+  Stable Diffusion WebUI с настраиваемой задержкой и размером ответа.
+
+Оба сервера работают в текущем event loop на aiohttp и не требуют GPU.
+Можно запустить отдельно:
+
+    python tests/load_test/mock_backends.py --llm-port 5000 --sd-port 7860
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+
+DEFAULT_WORDS = (
+    "she smiles softly and leans closer, her voice barely above a whisper "
+    "as the evening light fades behind the window and the city hums below"
+).split()
+
+
+@dataclass
+class MockLLMConfig:
+    """Параметры поведения заглушки LLM."""
+
+    ttft: float = 0.3                # задержка до первого токена, сек
+    tokens_per_second: float = 40.0  # скорость выдачи токенов
+    max_tokens: int = 120            # длина ответа, если клиент не задал меньше
+    jitter: float = 0.1              # относительный разброс задержек
+    model_name: str = "mock-llm.gguf"
+    seed: Optional[int] = None
+
+
+@dataclass
+class MockSDConfig:
+    """Параметры поведения заглушки Stable Diffusion."""
+
+    latency: float = 2.0          # время генерации одного изображения, сек
+    payload_bytes: int = 600_000  # размер изображения до base64-кодирования
+    jitter: float = 0.1
+    concurrency: int = 1          # SD WebUI обрабатывает запросы последовательно
+    seed: Optional[int] = None
+
+
+@dataclass
+class MockStats:
+    """Счётчики запросов к заглушке."""
+
+    requests: Dict[str, int] = field(default_factory=dict)
+    in_flight: int = 0
+    max_in_flight: int = 0
+
+    def enter(self, route: str) -> None:
+        self.requests[route] = self.requests.get(route, 0) + 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self) -> None:
+        self.in_flight -= 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "requests": dict(self.requests),
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+        }
+
+
+class _MockServer:
+    """Общая часть: запуск aiohttp-приложения на свободном порту."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.stats = MockStats()
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def create_app(self) -> web.Application:
+        raise NotImplementedError
+
+    async def start(self) -> "_MockServer":
+        app = self.create_app()
+        app.router.add_get("/__mock__/stats", self._handle_stats)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        # При port=0 ОС выдаёт свободный порт — узнаём его у сокета
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def _handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats.to_dict())
+
+
+class MockLLMServer(_MockServer):
+    """Заглушка OpenAI-совместимого API text-generation-webui."""
+
+    def __init__(self, config: Optional[MockLLMConfig] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.config = config or MockLLMConfig()
+        self._random = random.Random(self.config.seed)
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/v1/models", self._handle_models)
+        app.router.add_get("/v1/model", self._handle_model_info)
+        app.router.add_post("/v1/model/load", self._handle_model_load)
+        app.router.add_post("/v1/chat/completions", self._handle_chat_completions)
+        app.router.add_post("/v1/completions", self._handle_chat_completions)
+        return app
+
+    def _delay(self, base: float) -> float:
+        if base <= 0:
+            return 0.0
+        spread = base * self.config.jitter
+        return max(0.0, base + self._random.uniform(-spread, spread))
+
+    def _tokens(self, count: int) -> List[str]:
+        words = [self._random.choice(DEFAULT_WORDS) for _ in range(count)]
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    async def _handle_models(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "object": "list",
+            "data": [{"id": self.config.model_name, "object": "model", "owned_by": "mock"}],
+        })
+
+    async def _handle_model_info(self, request: web.Request) -> web.Response:
+        return web.json_response({"model_name": self.config.model_name, "lora_names": []})
+
+    async def _handle_model_load(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def _handle_chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.stats.enter(request.path)
+        try:
+            body = await request.json()
+            requested = body.get("max_tokens") or self.config.max_tokens
+            tokens = self._tokens(min(int(requested), self.config.max_tokens))
+            if body.get("stream"):
+                return await self._stream_tokens(request, tokens)
+
+            await asyncio.sleep(self._delay(self.config.ttft))
+            await asyncio.sleep(self._delay(len(tokens) / self.config.tokens_per_second))
+            return web.json_response({
+                "id": f"chatcmpl-{int(time.time() * 1000)}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": self.config.model_name,
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "length",
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                }],
+                "usage": {"completion_tokens": len(tokens)},
+            })
+        finally:
+            self.stats.leave()
+
+    async def _stream_tokens(self, request: web.Request, tokens: List[str]) -> web.StreamResponse:
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache",
+        })
+        await response.prepare(request)
+
+        created = int(time.time())
+        await asyncio.sleep(self._delay(self.config.ttft))
+        interval = 1.0 / self.config.tokens_per_second
+        for index, token in enumerate(tokens):
+            if index:
+                await asyncio.sleep(self._delay(interval))
+            chunk = {
+                "id": f"chatcmpl-{created}",
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": self.config.model_name,
+                "choices": [{"index": 0, "finish_reason": None, "delta": {"content": token}}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+class MockSDServer(_MockServer):
+    """Заглушка Stable Diffusion WebUI API."""
+
+    def __init__(self, config: Optional[MockSDConfig] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.config = config or MockSDConfig()
+        self._random = random.Random(self.config.seed)
+        self._slots = asyncio.Semaphore(max(1, self.config.concurrency))
+        self._queue_size = 0
+        # Изображение кодируется один раз: размер ответа важен, содержимое — нет
+        self._image = base64.b64encode(os.urandom(self.config.payload_bytes)).decode("ascii")
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/sdapi/v1/txt2img", self._handle_txt2img)
+        app.router.add_get("/sdapi/v1/progress", self._handle_progress)
+        app.router.add_get("/sdapi/v1/memory", self._handle_memory)
+        app.router.add_get("/sdapi/v1/options", self._handle_options)
+        app.router.add_post("/sdapi/v1/options", self._handle_ok)
+        app.router.add_post("/sdapi/v1/unload-checkpoint", self._handle_ok)
+        app.router.add_post("/sdapi/v1/reload-checkpoint", self._handle_ok)
+        app.router.add_post("/sdapi/v1/clear-cache", self._handle_ok)
+        return app
+
+    async def _handle_txt2img(self, request: web.Request) -> web.Response:
+        self.stats.enter(request.path)
+        self._queue_size += 1
+        try:
+            payload = await request.json()
+            async with self._slots:
+                latency = self.config.latency
+                spread = latency * self.config.jitter
+                await asyncio.sleep(max(0.0, latency + self._random.uniform(-spread, spread)))
+
+            info = {
+                "prompt": payload.get("prompt", ""),
+                "seed": payload.get("seed", -1),
+                "steps": payload.get("steps"),
+                "width": payload.get("width"),
+                "height": payload.get("height"),
+                "sampler_name": payload.get("sampler_name"),
+                "cfg_scale": payload.get("cfg_scale"),
+            }
+            return web.json_response({
+                "images": [self._image],
+                "parameters": payload,
+                "info": json.dumps(info),
+            })
+        finally:
+            self._queue_size -= 1
+            self.stats.leave()
+
+    async def _handle_progress(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "progress": 0.0,
+            "eta_relative": 0.0,
+            "state": {"job_count": self._queue_size},
+            "current_image": None,
+        })
+
+    async def _handle_memory(self, request: web.Request) -> web.Response:
+        return web.json_response({"ram": {}, "cuda": {}})
+
+    async def _handle_options(self, request: web.Request) -> web.Response:
+        return web.json_response({"sd_model_checkpoint": "mock.safetensors", "sd_vae": "Automatic"})
+
+    async def _handle_ok(self, request: web.Request) -> web.Response:
+        return web.json_response({})
+
+
+async def _serve_forever(args: argparse.Namespace) -> None:
+    llm = MockLLMServer(
+        MockLLMConfig(ttft=args.ttft, tokens_per_second=args.token_rate, max_tokens=args.max_tokens),
+        port=args.llm_port,
+    )
+    sd = MockSDServer(
+        MockSDConfig(latency=args.sd_latency, payload_bytes=args.sd_payload_bytes),
+        port=args.sd_port,
+    )
+    async with llm, sd:
+        print(f"LLM mock: {llm.url}")
+        print(f"SD mock:  {sd.url}")
+        await asyncio.Event().wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Заглушки text-generation-webui и Stable Diffusion WebUI")
+    parser.add_argument("--llm-port", type=int, default=5000)
+    parser.add_argument("--sd-port", type=int, default=7860)
+    parser.add_argument("--ttft", type=float, default=MockLLMConfig.ttft, help="Задержка до первого токена, сек")
+    parser.add_argument("--token-rate", type=float, default=MockLLMConfig.tokens_per_second, help="Токенов в секунду")
+    parser.add_argument("--max-tokens", type=int, default=MockLLMConfig.max_tokens)
+    parser.add_argument("--sd-latency", type=float, default=MockSDConfig.latency, help="Время генерации изображения, сек")
+    parser.add_argument("--sd-payload-bytes", type=int, default=MockSDConfig.payload_bytes)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(_serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+"""
+Нагрузочный тест FastAPI-приложения на локальных заглушках LLM и SD.
+
+Скрипт поднимает заглушки из mock_backends.py, запускает приложение через
+instrumented_app.py в отдельном процессе uvicorn (URL бэкендов передаются
+через CHAT_TEXTGEN_WEBUI_URL и APP_SD_API_URL), подаёт конкурентную
+нагрузку на /chat, стриминговый чат и /api/v1/generate-image/ и печатает
+p50/p95/p99 задержек, пропускную способность, задержку event loop и память.
+
+Примеры (из корня проекта):
+
+    python tests/load_test/run_benchmark.py --concurrency 16 --duration 30
+    python tests/load_test/run_benchmark.py --save-baseline tests/load_test/baselines/default.json
+    python tests/load_test/run_benchmark.py --baseline tests/load_test/baselines/default.json
+
+С --target нагрузка подаётся на уже запущенный сервер (заглушки и
+приложение не поднимаются, метрики event loop доступны, только если
+сервер запущен через instrumented_app).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from mock_backends import MockLLMConfig, MockLLMServer, MockSDConfig, MockSDServer  # noqa: E402
+from instrumented_app import METRICS_PATH  # noqa: E402
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+
+TEST_MESSAGES = [
+    "Hello, how are you today?",
+    "Tell me about yourself",
+    "What did you do this evening?",
+    "Describe the room you are in",
+    "continue the story",
+]
+
+# Метрики, по которым сравниваем с базовой линией: (путь, чем больше — тем хуже)
+COMPARED_METRICS = [
+    ("latency.p50", True),
+    ("latency.p95", True),
+    ("latency.p99", True),
+    ("ttfb.p95", True),
+    ("throughput", False),
+    ("error_rate", True),
+]
+
+
+@dataclass
+class RequestResult:
+    """Результат одного запроса."""
+
+    kind: str
+    ok: bool
+    status: int
+    latency: float
+    ttfb: float
+    bytes: int
+    started: float
+    error: str = ""
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль с линейной интерполяцией (q в диапазоне 0..100)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * q / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def summarize(results: List[RequestResult], elapsed: float) -> Dict[str, Any]:
+    """Сводка по группе запросов: перцентили в миллисекундах, RPS, доля ошибок."""
+    latencies = [r.latency * 1000 for r in results if r.ok]
+    ttfbs = [r.ttfb * 1000 for r in results if r.ok]
+    errors = [r for r in results if not r.ok]
+    return {
+        "requests": len(results),
+        "errors": len(errors),
+        "error_rate": len(errors) / len(results) if results else 0.0,
+        "throughput": (len(results) - len(errors)) / elapsed if elapsed > 0 else 0.0,
+        "latency": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies, default=0.0),
+        },
+        "ttfb": {
+            "p50": percentile(ttfbs, 50),
+            "p95": percentile(ttfbs, 95),
+        },
+        "sample_errors": sorted({r.error for r in errors})[:5],
+    }
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """Разбирает строку вида "chat=1,stream=2,image=1"."""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in LoadGenerator.SCENARIOS:
+            raise argparse.ArgumentTypeError(f"Неизвестный сценарий: {name}")
+        mix[name] = float(weight or 1)
+    if not any(mix.values()):
+        raise argparse.ArgumentTypeError("Все веса сценариев равны нулю")
+    return mix
+
+
+class LoadGenerator:
+    """Конкурентные виртуальные пользователи, выбирающие сценарии по весам."""
+
+    SCENARIOS = ("chat", "stream", "image")
+
+    def __init__(self, base_url: str, mix: Dict[str, float], character: str, seed: int = 0):
+        self.base_url = base_url.rstrip("/")
+        self.mix = mix
+        self.character = character
+        self._random = random.Random(seed)
+
+    def _pick(self) -> str:
+        names = list(self.mix)
+        return self._random.choices(names, weights=[self.mix[n] for n in names])[0]
+
+    async def run(self, concurrency: int, duration: float, max_requests: int = 0) -> List[RequestResult]:
+        results: List[RequestResult] = []
+        deadline = time.perf_counter() + duration
+        issued = 0
+
+        timeout = aiohttp.ClientTimeout(total=600)
+        connector = aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+
+            async def user(user_id: int):
+                nonlocal issued
+                while time.perf_counter() < deadline:
+                    if max_requests and issued >= max_requests:
+                        return
+                    issued += 1
+                    kind = self._pick()
+                    results.append(await self._request(session, kind, user_id, issued))
+
+            await asyncio.gather(*(user(i) for i in range(concurrency)))
+        return results
+
+    async def _request(self, session: aiohttp.ClientSession, kind: str, user_id: int, number: int) -> RequestResult:
+        message = TEST_MESSAGES[number % len(TEST_MESSAGES)]
+        if kind == "chat":
+            url = f"{self.base_url}/chat"
+            payload = {"message": message, "history": [], "session_id": f"load_{user_id}", "character": self.character}
+        elif kind == "stream":
+            url = f"{self.base_url}/api/v1/chat/stream/name/{self.character}"
+            payload = {"message": message, "history": []}
+        else:
+            url = f"{self.base_url}/api/v1/generate-image/"
+            payload = {"prompt": f"portrait, {message}", "character": self.character, "use_default_prompts": True}
+
+        started = time.perf_counter()
+        ttfb = 0.0
+        received = 0
+        try:
+            async with session.post(url, json=payload) as response:
+                async for chunk in response.content.iter_any():
+                    if not received:
+                        ttfb = time.perf_counter() - started
+                    received += len(chunk)
+                latency = time.perf_counter() - started
+                return RequestResult(
+                    kind=kind,
+                    ok=response.status == 200,
+                    status=response.status,
+                    latency=latency,
+                    ttfb=ttfb or latency,
+                    bytes=received,
+                    started=started,
+                    error="" if response.status == 200 else f"HTTP {response.status}",
+                )
+        except Exception as e:
+            return RequestResult(
+                kind=kind, ok=False, status=0, latency=time.perf_counter() - started,
+                ttfb=0.0, bytes=received, started=started, error=f"{type(e).__name__}: {e}",
+            )
+
+
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def fetch_json(url: str) -> Optional[Dict[str, Any]]:
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
+            async with session.get(url) as response:
+                if response.status == 200:
+                    return await response.json()
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        pass
+    return None
+
+
+def start_app_process(port: int, llm_url: str, sd_url: str, log_path: Path) -> subprocess.Popen:
+    """Запускает приложение в отдельном процессе uvicorn."""
+    env = dict(os.environ)
+    env.update({
+        "CHAT_TEXTGEN_WEBUI_URL": llm_url,
+        "APP_SD_API_URL": sd_url,
+        "APP_WEBUI_URL": sd_url,
+        "PYTHONPATH": os.pathsep.join(filter(None, [str(PROJECT_ROOT), env.get("PYTHONPATH")])),
+    })
+    log_file = open(log_path, "w", encoding="utf-8")
+    return subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "tests.load_test.instrumented_app:create_app", "--factory",
+            "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning", "--no-access-log",
+        ],
+        cwd=PROJECT_ROOT,
+        env=env,
+        stdout=log_file,
+        stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_for_app(base_url: str, process: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Приложение завершилось при старте с кодом {process.returncode}")
+        if await fetch_json(base_url + METRICS_PATH) is not None:
+            return
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"Приложение не запустилось за {timeout:.0f} сек")
+
+
+def _get_path(data: Dict[str, Any], path: str) -> Optional[float]:
+    for key in path.split("."):
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def compare_with_baseline(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Возвращает список регрессий относительно базовой линии."""
+    regressions = []
+    for kind, current in report["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(kind)
+        if not base:
+            continue
+        for path, higher_is_worse in COMPARED_METRICS:
+            old, new = _get_path(base, path), _get_path(current, path)
+            if old is None or new is None:
+                continue
+            if path == "error_rate":
+                # Доля ошибок сравнивается абсолютно: любые новые ошибки — регрессия
+                if new > old + 0.01:
+                    regressions.append(f"{kind}.{path}: {old:.3f} -> {new:.3f}")
+                continue
+            if old <= 0:
+                continue
+            change = (new - old) / old
+            if (higher_is_worse and change > tolerance) or (not higher_is_worse and change < -tolerance):
+                regressions.append(f"{kind}.{path}: {old:.2f} -> {new:.2f} ({change:+.1%})")
+
+    server, base_server = report.get("server") or {}, baseline.get("server") or {}
+    for path, floor in (("event_loop_lag.p99_ms", 5.0), ("memory.peak_rss_bytes", 0)):
+        old, new = _get_path(base_server, path), _get_path(server, path)
+        if old is None or new is None:
+            continue
+        # Малые значения задержки loop сильно шумят, поэтому сравниваем не ниже порога
+        if new > max(old, floor) * (1 + tolerance):
+            regressions.append(f"server.{path}: {old:.2f} -> {new:.2f}")
+    return regressions
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print("\n" + "=" * 88)
+    print(f"{'scenario':<10}{'req':>7}{'err':>6}{'rps':>9}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'ttfb p95':>11}")
+    print("-" * 88)
+    for kind, stats in report["scenarios"].items():
+        latency = stats["latency"]
+        print(
+            f"{kind:<10}{stats['requests']:>7}{stats['errors']:>6}{stats['throughput']:>9.2f}"
+            f"{latency['p50']:>11.1f}{latency['p95']:>11.1f}{latency['p99']:>11.1f}{stats['ttfb']['p95']:>11.1f}"
+        )
+    print("=" * 88)
+
+    server = report.get("server")
+    if server:
+        lag = server["event_loop_lag"]
+        memory = server["memory"]
+        print(
+            f"event loop lag: mean {lag['mean_ms']:.2f} ms, p99 {lag['p99_ms']:.2f} ms, max {lag['max_ms']:.2f} ms"
+        )
+        print(
+            f"memory: rss {memory['rss_before_bytes'] / 2**20:.1f} -> {memory['rss_bytes'] / 2**20:.1f} MiB, "
+            f"peak {memory['peak_rss_bytes'] / 2**20:.1f} MiB"
+        )
+    for name, stats in (report.get("mocks") or {}).items():
+        print(f"{name} mock: {stats}")
+    for kind, stats in report["scenarios"].items():
+        for error in stats["sample_errors"]:
+            print(f"[{kind}] {error}")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    llm = sd = process = None
+    base_url = args.target
+    try:
+        if not base_url:
+            llm = await MockLLMServer(MockLLMConfig(
+                ttft=args.ttft, tokens_per_second=args.token_rate, max_tokens=args.max_tokens, seed=args.seed,
+            )).start()
+            sd = await MockSDServer(MockSDConfig(
+                latency=args.sd_latency, payload_bytes=args.sd_payload_bytes,
+                concurrency=args.sd_concurrency, seed=args.seed,
+            )).start()
+            port = args.port or find_free_port()
+            base_url = f"http://127.0.0.1:{port}"
+            print(f"LLM mock {llm.url}, SD mock {sd.url}, app {base_url} (лог: {args.app_log})")
+            Path(args.app_log).parent.mkdir(parents=True, exist_ok=True)
+            process = start_app_process(port, llm.url, sd.url, Path(args.app_log))
+            await wait_for_app(base_url, process, args.startup_timeout)
+
+        generator = LoadGenerator(base_url, args.mix, args.character, seed=args.seed)
+        if args.warmup > 0:
+            print(f"Прогрев {args.warmup:.0f} сек...")
+            await generator.run(min(args.concurrency, 4), args.warmup)
+
+        before = await fetch_json(f"{base_url}{METRICS_PATH}?reset=1")
+        print(f"Нагрузка: {args.concurrency} пользователей, {args.duration:.0f} сек, сценарии {args.mix}")
+        started = time.perf_counter()
+        results = await generator.run(args.concurrency, args.duration, args.max_requests)
+        elapsed = time.perf_counter() - started
+        after = await fetch_json(base_url + METRICS_PATH)
+
+        report: Dict[str, Any] = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {k: v for k, v in vars(args).items() if k not in ("baseline", "save_baseline", "output")},
+            "elapsed": elapsed,
+            "scenarios": {},
+        }
+        for kind in LoadGenerator.SCENARIOS:
+            group = [r for r in results if r.kind == kind]
+            if group:
+                report["scenarios"][kind] = summarize(group, elapsed)
+        report["scenarios"]["total"] = summarize(results, elapsed)
+
+        if after:
+            after["memory"]["rss_before_bytes"] = (before or after)["memory"]["rss_bytes"]
+            report["server"] = after
+        if llm and sd:
+            report["mocks"] = {"llm": llm.stats.to_dict(), "sd": sd.stats.to_dict()}
+        if args.raw:
+            report["results"] = [asdict(r) for r in results]
+        return report
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if llm:
+            await llm.stop()
+        if sd:
+            await sd.stop()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест на локальных заглушках LLM и Stable Diffusion")
+    parser.add_argument("--target", help="URL уже запущенного сервера (заглушки не поднимаются)")
+    parser.add_argument("--port", type=int, default=0, help="Порт приложения (по умолчанию свободный)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30.0, help="Длительность нагрузки, сек")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Длительность прогрева, сек")
+    parser.add_argument("--max-requests", type=int, default=0, help="Ограничение числа запросов (0 — без ограничения)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("chat=1,stream=2,image=1"),
+                        help="Веса сценариев, например chat=1,stream=2,image=1")
+    parser.add_argument("--character", default="anna")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ttft", type=float, default=0.3, help="TTFT заглушки LLM, сек")
+    parser.add_argument("--token-rate", type=float, default=40.0, help="Токенов в секунду у заглушки LLM")
+    parser.add_argument("--max-tokens", type=int, default=120)
+    parser.add_argument("--sd-latency", type=float, default=2.0, help="Время генерации изображения заглушкой, сек")
+    parser.add_argument("--sd-payload-bytes", type=int, default=600_000)
+    parser.add_argument("--sd-concurrency", type=int, default=1)
+    parser.add_argument("--startup-timeout", type=float, default=60.0)
+    parser.add_argument("--app-log", default=str(PROJECT_ROOT / "logs" / "load_test_app.log"))
+    parser.add_argument("--output", help="Сохранить отчёт в JSON")
+    parser.add_argument("--raw", action="store_true", help="Добавить в отчёт результаты всех запросов")
+    parser.add_argument("--baseline", help="Сравнить с базовой линией из JSON")
+    parser.add_argument("--save-baseline", help="Сохранить отчёт как базовую линию")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Допустимое ухудшение метрик (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    for path in filter(None, (args.output, args.save_baseline)):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Отчёт сохранён: {path}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_with_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n[ERROR] Регрессии относительно {args.baseline}:")
+            for line in regressions:
+                print(f"  - {line}")
+            return 1
+        print(f"\n[OK] Регрессий относительно {args.baseline} не обнаружено")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
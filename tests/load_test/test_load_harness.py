@@ -0,0 +1,111 @@
+"""
+Тесты заглушек бэкендов и расчёта метрик нагрузочного теста.
+"""
+
+import asyncio
+import base64
+import json
+import sys
+import time
+from pathlib import Path
+
+import aiohttp
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from mock_backends import MockLLMConfig, MockLLMServer, MockSDConfig, MockSDServer  # noqa: E402
+from run_benchmark import compare_with_baseline, percentile  # noqa: E402
+
+
+def test_llm_mock_streams_with_configured_ttft_and_rate():
+    config = MockLLMConfig(ttft=0.2, tokens_per_second=100.0, max_tokens=20, jitter=0.0)
+
+    async def scenario():
+        async with MockLLMServer(config) as server, aiohttp.ClientSession() as session:
+            started = time.perf_counter()
+            first_token_at = None
+            tokens = []
+            payload = {"messages": [{"role": "user", "content": "hi"}], "stream": True}
+            async with session.post(f"{server.url}/v1/chat/completions", json=payload) as response:
+                assert response.headers["Content-Type"].startswith("text/event-stream")
+                async for line in response.content:
+                    line = line.decode().strip()
+                    if not line.startswith("data: "):
+                        continue
+                    if line == "data: [DONE]":
+                        break
+                    first_token_at = first_token_at or time.perf_counter()
+                    tokens.append(json.loads(line[6:])["choices"][0]["delta"]["content"])
+            return first_token_at - started, time.perf_counter() - started, tokens, server.stats.to_dict()
+
+    ttft, total, tokens, stats = asyncio.run(scenario())
+
+    assert len(tokens) == 20
+    assert 0.2 <= ttft < 0.4
+    # 19 межтокенных интервалов по 10 мс после TTFT
+    assert total >= 0.2 + 0.19
+    assert stats["requests"] == {"/v1/chat/completions": 1}
+
+
+def test_llm_mock_non_stream_response():
+    config = MockLLMConfig(ttft=0.0, tokens_per_second=1000.0, max_tokens=50, jitter=0.0)
+
+    async def scenario():
+        async with MockLLMServer(config) as server, aiohttp.ClientSession() as session:
+            payload = {"messages": [{"role": "user", "content": "hi"}], "max_tokens": 5}
+            async with session.post(f"{server.url}/v1/chat/completions", json=payload) as response:
+                return await response.json()
+
+    result = asyncio.run(scenario())
+    assert result["usage"]["completion_tokens"] == 5
+    assert result["choices"][0]["message"]["content"]
+
+
+def test_sd_mock_latency_payload_and_serialization():
+    config = MockSDConfig(latency=0.1, payload_bytes=1000, jitter=0.0, concurrency=1)
+
+    async def scenario():
+        async with MockSDServer(config) as server, aiohttp.ClientSession() as session:
+            async def generate():
+                async with session.post(f"{server.url}/sdapi/v1/txt2img", json={"prompt": "x", "steps": 5}) as response:
+                    return await response.json()
+
+            started = time.perf_counter()
+            results = await asyncio.gather(generate(), generate())
+            return time.perf_counter() - started, results
+
+    elapsed, results = asyncio.run(scenario())
+
+    # Один слот генерации: два запроса выполняются последовательно
+    assert elapsed >= 0.2
+    for result in results:
+        assert len(base64.b64decode(result["images"][0])) == 1000
+        assert json.loads(result["info"])["steps"] == 5
+
+
+def test_percentile_interpolation():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == 50.5
+    assert percentile(values, 99) == 99.01
+    assert percentile([], 95) == 0.0
+
+
+def test_compare_with_baseline_detects_regressions():
+    def report(p95, throughput, lag):
+        return {
+            "scenarios": {"stream": {
+                "latency": {"p50": 100.0, "p95": p95, "p99": p95},
+                "ttfb": {"p95": 50.0},
+                "throughput": throughput,
+                "error_rate": 0.0,
+            }},
+            "server": {"event_loop_lag": {"p99_ms": lag}, "memory": {"peak_rss_bytes": 100}},
+        }
+
+    baseline = report(200.0, 10.0, 1.0)
+    assert compare_with_baseline(report(210.0, 9.5, 4.0), baseline, 0.15) == []
+
+    regressions = compare_with_baseline(report(300.0, 5.0, 20.0), baseline, 0.15)
+    assert any(r.startswith("stream.latency.p95") for r in regressions)
+    assert any(r.startswith("stream.throughput") for r in regressions)
+    assert any(r.startswith("server.event_loop_lag.p99_ms") for r in regressions)
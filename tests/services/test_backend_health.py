@@ -0,0 +1,105 @@
+"""
+Тесты кэшированной проверки бэкендов и circuit breaker.
+"""
+
+import asyncio
+
+from aiohttp import web
+
+from app.services.backend_health import BackendHealthMonitor, CircuitBreaker, CircuitState
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_after_consecutive_failures_and_half_opens():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10.0, clock=clock)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+    assert breaker.retry_after == 10.0
+
+    clock.now = 10.0
+    assert breaker.state == CircuitState.HALF_OPEN
+    # В half-open пропускается только один пробный запрос
+    assert breaker.allow_request()
+    assert not breaker.allow_request()
+
+    # Неудачный пробный запрос снова размыкает breaker
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+
+    clock.now = 20.0
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.allow_request() and breaker.allow_request()
+
+
+def test_monitor_probes_backend_and_trips_breaker():
+    async def models(request):
+        return web.json_response({"data": [{"id": "model.gguf"}]})
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_get("/v1/models", models)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        monitor = BackendHealthMonitor(probe_timeout=1.0, failure_threshold=2, reset_timeout=0.2)
+        monitor.register("textgen", f"http://127.0.0.1:{port}", "/v1/models")
+        try:
+            assert await monitor.probe("textgen")
+            snapshot = monitor.snapshot()["textgen"]
+            assert snapshot["healthy"] is True
+            assert snapshot["models"] == 1
+
+            # Бэкенд перезапускается: две неудачные проверки размыкают breaker
+            await runner.cleanup()
+            assert not await monitor.probe("textgen")
+            assert monitor.is_available("textgen")
+            assert not await monitor.probe("textgen")
+            assert monitor.get("textgen").breaker.state == CircuitState.OPEN
+            assert not monitor.is_available("textgen")
+
+            # Бэкенд снова поднят: после reset_timeout проверка замыкает breaker
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+            await asyncio.sleep(0.25)
+            assert await monitor.probe("textgen")
+            assert monitor.get("textgen").breaker.state == CircuitState.CLOSED
+            assert monitor.is_available("textgen")
+        finally:
+            await monitor.stop()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+
+def test_passive_failures_fail_fast_without_network():
+    monitor = BackendHealthMonitor(failure_threshold=2, reset_timeout=60.0)
+    monitor.register("stable_diffusion", "http://127.0.0.1:9", "/sdapi/v1/progress")
+
+    monitor.record_failure("stable_diffusion", "ConnectError")
+    monitor.record_failure("stable_diffusion", "ConnectError")
+
+    assert not monitor.is_available("stable_diffusion")
+    assert monitor.snapshot()["stable_diffusion"]["circuit"] == "open"
+    assert monitor.snapshot()["stable_diffusion"]["last_error"] == "ConnectError"
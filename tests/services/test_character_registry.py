@@ -0,0 +1,84 @@
+"""
+Тесты ленивого реестра персонажей с манифестом.
+"""
+
+import os
+import sys
+
+from app.chat_bot.add_character.character_registry import CharacterRegistry
+
+CHARACTER_TEMPLATE = '''
+def get_character_data():
+    return {{
+        "name": "{name}",
+        "display_name": "{display}",
+        "character_appearance": "long hair",
+        "location": "{location}",
+    }}
+'''
+
+
+def write_character(directory, name, location="kitchen", display=None):
+    path = directory / f"{name}.py"
+    path.write_text(CHARACTER_TEMPLATE.format(name=name, display=display or name.title(), location=location),
+                    encoding="utf-8")
+    return path
+
+
+def test_characters_load_on_demand_with_lru(tmp_path):
+    for name in ("anna", "bella", "clara"):
+        write_character(tmp_path, name)
+    (tmp_path / "broken.py").write_text("def get_character_data():\n    return {'name': 'x'}\n", encoding="utf-8")
+    registry = CharacterRegistry(tmp_path, cache_size=2)
+
+    assert sorted(registry.get_character_names()) == ["anna", "bella", "broken", "clara"]
+    assert registry.loads == 0
+
+    assert registry.get_character("ANNA")["location"] == "kitchen"
+    registry.get_character("bella")
+    registry.get_character("clara")
+    assert registry.snapshot()["resident"] == 2
+    assert registry.get_character("broken") is None
+    assert registry.get_character("missing") is None
+    assert not any(name.startswith("app.chat_bot.models.characters.") for name in sys.modules)
+
+    loads = registry.loads
+    registry.get_character("clara")
+    assert registry.loads == loads
+    registry.get_character("anna")  # вытеснена из LRU — загружается снова
+    assert registry.loads == loads + 1
+
+
+def test_saved_manifest_lists_without_imports_and_reload_picks_changes(tmp_path):
+    characters_dir = tmp_path / "characters"
+    characters_dir.mkdir()
+    manifest = tmp_path / "manifest.json"
+    write_character(characters_dir, "anna", display="Anna K.")
+    write_character(characters_dir, "bella")
+
+    first = CharacterRegistry(characters_dir, manifest_path=manifest)
+    assert {c["display_name"] for c in first.get_character_list()} == {"Anna K.", "Bella"}
+    assert first.loads == 2
+
+    # Новый процесс: список строится из манифеста без импорта модулей
+    restarted = CharacterRegistry(characters_dir, manifest_path=manifest)
+    assert {c["name"] for c in restarted.get_character_list()} == {"anna", "bella"}
+    assert restarted.loads == 0
+    assert restarted.get_character("anna")["location"] == "kitchen"
+
+    path = write_character(characters_dir, "anna", location="beach")
+    os.utime(path, ns=(1, 1))
+    (characters_dir / "bella.py").unlink()
+    restarted.reload_characters()
+    assert restarted.get_character("anna")["location"] == "beach"
+    assert restarted.get_character("bella") is None
+    assert restarted.get_character_names() == ["anna"]
+
+
+def test_manual_characters(tmp_path):
+    registry = CharacterRegistry(tmp_path)
+    assert registry.add_character_manually("Test", {"name": "Test", "character_appearance": "a", "location": "b"})
+    assert not registry.add_character_manually("Bad", {"name": "Bad"})
+    assert registry.get_character("test")["location"] == "b"
+    assert registry.get_all_characters() == {"Test": {"name": "Test", "character_appearance": "a", "location": "b"}}
+    assert registry.get_character_list() == [{"name": "Test", "description": "", "display_name": "Test"}]
@@ -0,0 +1,180 @@
+"""
+Тесты очереди писем на локальном SMTP-сервере.
+"""
+
+import asyncio
+import json
+import socketserver
+import threading
+
+import pytest
+
+from app.mail_service.messages import verification_email
+from app.mail_service.queue import EmailQueue, OutgoingEmail, SMTPSettings
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """Минимальный SMTP-диалог: EHLO, MAIL, RCPT, DATA, RSET, NOOP, QUIT."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply("220 localhost ESMTP")
+        while True:
+            line = self.rfile.readline().decode().strip()
+            if not line:
+                return
+            command = line.split(" ", 1)[0].upper()
+            if command in ("EHLO", "HELO", "RSET", "NOOP"):
+                self.reply("250 OK")
+            elif command == "MAIL":
+                with server.lock:
+                    fail = server.temporary_failures > 0
+                    server.temporary_failures -= fail
+                self.reply("451 Try again later" if fail else "250 OK")
+            elif command == "RCPT":
+                address = line.split(":", 1)[1].strip("<> ")
+                self.reply("550 No such user" if address in server.rejected else "250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                lines = []
+                while (data := self.rfile.readline()) not in (b".\r\n", b""):
+                    lines.append(data.decode())
+                with server.lock:
+                    server.messages.append("".join(lines))
+                self.reply("250 Queued")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Not implemented")
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.messages = []
+        self.rejected = set()
+        self.temporary_failures = 0
+
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPStandIn()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_queue(server, tmp_path, **kwargs):
+    settings = SMTPSettings(host="127.0.0.1", port=server.server_address[1], use_tls=False, from_email="noreply@example.com")
+    return EmailQueue(lambda: settings, dead_letter_path=str(tmp_path / "dead.jsonl"), **kwargs)
+
+
+def dead_letters(tmp_path):
+    path = tmp_path / "dead.jsonl"
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()] if path.exists() else []
+
+
+def test_burst_is_sent_over_one_pooled_connection(smtp_server, tmp_path):
+    async def scenario():
+        queue = make_queue(smtp_server, tmp_path, workers=1, batch_size=5)
+        await queue.start()
+        for i in range(12):
+            queue.enqueue(verification_email(f"user{i}@example.com", f"{i:06d}"))
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(scenario())
+
+    assert queue.sent == 12
+    assert len(smtp_server.messages) == 12
+    assert smtp_server.connections == 1
+    assert "000007" in "".join(smtp_server.messages)
+    assert dead_letters(tmp_path) == []
+
+
+def test_enqueue_does_not_block_event_loop(smtp_server, tmp_path):
+    async def scenario():
+        queue = make_queue(smtp_server, tmp_path)
+        await queue.start()
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        for i in range(50):
+            queue.enqueue(OutgoingEmail(to=f"user{i}@example.com", subject="s", body="b"))
+        elapsed = loop.time() - started
+        await queue.stop()
+        return elapsed
+
+    assert asyncio.run(scenario()) < 0.05
+    assert len(smtp_server.messages) == 50
+
+
+def test_temporary_failures_are_retried_with_backoff(smtp_server, tmp_path):
+    smtp_server.temporary_failures = 2
+
+    async def scenario():
+        queue = make_queue(smtp_server, tmp_path, workers=1, backoff_base=0.05)
+        await queue.start()
+        queue.enqueue(OutgoingEmail(to="user@example.com", subject="s", body="b"))
+        for _ in range(100):
+            if queue.sent:
+                break
+            await asyncio.sleep(0.02)
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(scenario())
+
+    assert queue.sent == 1
+    assert len(smtp_server.messages) == 1
+    assert dead_letters(tmp_path) == []
+
+
+def test_rejected_recipient_goes_to_dead_letter_without_retry(smtp_server, tmp_path):
+    smtp_server.rejected.add("missing@example.com")
+
+    async def scenario():
+        queue = make_queue(smtp_server, tmp_path, workers=1, backoff_base=0.01)
+        await queue.start()
+        queue.enqueue(OutgoingEmail(to="missing@example.com", subject="s", body="b"))
+        queue.enqueue(OutgoingEmail(to="ok@example.com", subject="s", body="b"))
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(scenario())
+
+    assert queue.sent == 1
+    records = dead_letters(tmp_path)
+    assert [record["to"] for record in records] == ["missing@example.com"]
+    assert records[0]["attempts"] == 1
+    assert "PermanentEmailError" in records[0]["reason"]
+
+
+def test_pending_retries_are_saved_on_stop(smtp_server, tmp_path):
+    smtp_server.temporary_failures = 100
+
+    async def scenario():
+        queue = make_queue(smtp_server, tmp_path, workers=1, backoff_base=60.0)
+        await queue.start()
+        queue.enqueue(OutgoingEmail(to="user@example.com", subject="s", body="b"))
+        await asyncio.sleep(0.3)
+        assert queue.snapshot()["scheduled_retries"] == 1
+        await queue.stop()
+
+    asyncio.run(scenario())
+
+    records = dead_letters(tmp_path)
+    assert [record["to"] for record in records] == ["user@example.com"]
+    assert "451" in records[0]["reason"]
@@ -0,0 +1,26 @@
+"""
+Тесты экспорта префиксов промптов персонажей для text-generation-webui.
+"""
+
+import json
+
+from app.chat_bot.services.hot_prefixes import write_hot_prefixes
+from app.chat_bot.services.textgen_webui_service import TextGenWebUIService
+
+
+def test_prefix_is_the_start_of_every_character_prompt():
+    service = TextGenWebUIService()
+    history = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello"}]
+    for character_prompt in ("You are Anna.", "You are Bella.\n### Instruction:\n{user_message}\n### Response:\n"):
+        prefix = TextGenWebUIService.character_prompt_prefix(character_prompt)
+        prompt = service.build_character_prompt({"prompt": character_prompt}, "how are you?", history=history)
+        assert prompt.startswith(prefix) and prefix.strip()
+
+
+def test_write_skips_empty_prompts(tmp_path):
+    path = tmp_path / "textgen" / "hot_prefixes.json"
+    assert write_hot_prefixes(path, {"bella": "You are Bella.", "anna": "Ты Анна.", "empty": "", "none": None}) == 2
+
+    data = json.loads(path.read_text(encoding="utf-8"))
+    assert data == {"anna": "Ты Анна.\n\n", "bella": "You are Bella.\n\n"}
+    assert not path.with_suffix(".tmp").exists()
@@ -0,0 +1,129 @@
+"""
+Тесты перцептивных хэшей, BK-дерева и поиска дубликатов в галерее.
+"""
+
+import asyncio
+import base64
+import random
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from app.services.image_analysis import (
+    BKTree,
+    ImageHashIndex,
+    compute_dhash,
+    compute_phash,
+    get_gallery_index,
+    hamming_distance,
+    index_gallery_image,
+    sync_gallery_index,
+)
+from app.services.image_quality_control import ImageQualityControl
+
+
+def make_image(seed, size=256):
+    """Плавная случайная картинка: шум 8x8, растянутый до size."""
+    rng = np.random.default_rng(seed)
+    small = Image.fromarray(rng.integers(0, 256, (8, 8, 3), dtype=np.uint8))
+    return small.resize((size, size), Image.BICUBIC)
+
+
+def encode(image, fmt="PNG", **params):
+    buffer = BytesIO()
+    image.save(buffer, format=fmt, **params)
+    return buffer.getvalue()
+
+
+def hashes(image):
+    gray = image.convert("L")
+    return compute_phash(gray), compute_dhash(gray)
+
+
+def test_hashes_are_stable_under_resize_and_recompression():
+    image = make_image(1)
+    phash, dhash = hashes(image)
+    variants = [
+        image.resize((200, 200), Image.LANCZOS),
+        Image.open(BytesIO(encode(image, "JPEG", quality=70))),
+    ]
+    for variant in variants:
+        v_phash, v_dhash = hashes(variant)
+        assert hamming_distance(phash, v_phash) <= 4
+        assert hamming_distance(dhash, v_dhash) <= 6
+
+    other_phash, other_dhash = hashes(make_image(2))
+    assert hamming_distance(phash, other_phash) > 16
+    assert hamming_distance(dhash, other_dhash) > 16
+
+
+def test_bk_tree_search_matches_brute_force():
+    rng = random.Random(0)
+    values = [rng.getrandbits(64) for _ in range(300)]
+    # Близкие к первым значениям: 1-3 изменённых бита
+    values += [v ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for v in values[:50]]
+    tree = BKTree()
+    for key, value in enumerate(values):
+        tree.add(value, key)
+
+    assert len(tree) == len(values)
+    for query in values[:20] + [rng.getrandbits(64)]:
+        for radius in (0, 3, 12):
+            expected = {key for key, value in enumerate(values) if hamming_distance(query, value) <= radius}
+            assert {key for _, key in tree.search(query, radius)} == expected
+
+
+def test_detect_duplicates_within_batch_and_against_gallery_index():
+    quality_control = ImageQualityControl("http://sd")
+    first, second = make_image(1), make_image(2)
+    images = [
+        base64.b64encode(encode(first)).decode(),
+        base64.b64encode(encode(second)).decode(),
+        base64.b64encode(encode(first.resize((200, 200), Image.LANCZOS))).decode(),
+    ]
+    gallery = ImageHashIndex()
+    gallery.add("saved.png", *hashes(make_image(3)))
+
+    async def scenario():
+        assert await quality_control.detect_duplicates(images, similarity_threshold=0.9) == [2]
+        # Изображение, похожее на сохранённое в индексе, тоже дубликат; уникальные попадают в индекс
+        third = base64.b64encode(encode(make_image(3))).decode()
+        assert await quality_control.detect_duplicates([third, images[1]], 0.9, index=gallery) == [0]
+        assert gallery.keys() == ["saved.png"]
+        # Уникальные попадают в индекс под именами файлов, а не под digest
+        fourth = base64.b64encode(encode(make_image(4))).decode()
+        assert await quality_control.detect_duplicates([third, fourth], 0.9, index=gallery,
+                                                       keys=["c.png", "d.png"]) == [0]
+        assert sorted(gallery.keys()) == ["d.png", "saved.png"]
+        await quality_control.close()
+
+    asyncio.run(scenario())
+
+
+def test_gallery_indexing_never_replaces_the_new_image(tmp_path):
+    gallery_dir = tmp_path / "main_photos" / "anna"
+    gallery_dir.mkdir(parents=True)
+    storage = tmp_path / "index"
+    # Файл, сохранённый в обход индекса, подхватывается при первой индексации
+    (gallery_dir / "old.png").write_bytes(encode(make_image(1)))
+
+    async def save_and_index(filename, data):
+        (gallery_dir / filename).write_bytes(data)
+        return await index_gallery_image("Anna", filename, data, gallery_dir, storage, similarity_threshold=0.9)
+
+    async def scenario():
+        # Почти-дубликат только сообщается, новое изображение остаётся в галерее и в индексе
+        assert await save_and_index("new.jpg", encode(make_image(1), "JPEG", quality=80)) == ["old.png"]
+        assert await save_and_index("b.png", encode(make_image(2))) == []
+
+        # Удалённый из галереи файл больше не считается похожим
+        (gallery_dir / "old.png").unlink()
+        assert await save_and_index("c.png", encode(make_image(2), "JPEG", quality=80)) == ["b.png"]
+
+    asyncio.run(scenario())
+
+    saved = ImageHashIndex.load(storage / "anna.json")
+    assert sorted(saved.keys()) == ["b.png", "c.png", "new.jpg"]
+    assert not sync_gallery_index(saved, gallery_dir)
+    assert get_gallery_index("Anna", storage) is get_gallery_index("anna")
@@ -0,0 +1,114 @@
+"""
+Тесты дискового кэша результатов генерации изображений.
+"""
+
+import os
+
+from app.services.image_cache import ImageResultCache, payload_cache_key, response_checkpoint
+
+MODEL = "model.safetensors"
+
+
+def make_payload(**overrides):
+    payload = {
+        "prompt": "portrait, detailed face",
+        "negative_prompt": "blurry",
+        "seed": 42,
+        "steps": 30,
+        "width": 512,
+        "height": 768,
+        "cfg_scale": 7.0,
+        "sampler_name": "DPM++ 2M",
+        "enable_hr": True,
+        "hr_scale": 1.5,
+        "alwayson_scripts": {"ADetailer": {"args": [True, {"ad_model": "face_yolov8n.pt"}]}},
+    }
+    payload.update(overrides)
+    return payload
+
+
+def make_response(size=100):
+    return {"images": ["A" * size], "info": '{"seed": 42}', "parameters": {}}
+
+
+def test_key_is_canonical_and_ignores_non_render_fields():
+    key = payload_cache_key(make_payload(), MODEL)
+
+    reordered = dict(reversed(list(make_payload().items())))
+    assert payload_cache_key(reordered, MODEL) == key
+    assert payload_cache_key(make_payload(character="anna", use_cache=False, save_images=True), MODEL) == key
+
+    assert payload_cache_key(make_payload(steps=31), MODEL) != key
+    assert payload_cache_key(make_payload(hr_scale=2.0), MODEL) != key
+    assert payload_cache_key(make_payload(), "other.safetensors") != key
+
+
+def test_random_seed_is_not_cached():
+    assert payload_cache_key(make_payload(seed=-1), MODEL) is None
+    assert payload_cache_key(make_payload(seed=None), MODEL) is None
+    assert payload_cache_key(make_payload(subseed=-1, subseed_strength=0.3), MODEL) is None
+    assert payload_cache_key(make_payload(subseed=7, subseed_strength=0.3), MODEL) is not None
+
+
+def test_lookup_and_response_checkpoints_share_a_key():
+    # В /sdapi/v1/options SD отдаёт title чекпоинта, в info ответа — sd_model_name
+    key = payload_cache_key(make_payload(), "sdxl/model.safetensors [6ce0161689]")
+    response = {"images": [], "info": '{"seed": 42, "sd_model_name": "sdxl_model", "sd_model_hash": "6ce0161689"}'}
+    assert payload_cache_key(make_payload(), response_checkpoint(response)) == key
+    assert payload_cache_key(make_payload(), "model.safetensors") != key
+    assert response_checkpoint({"info": "not json"}) is None
+
+
+def test_unknown_model_is_not_cached():
+    # Без имени чекпоинта результат после смены модели нельзя отличить от прежнего
+    assert payload_cache_key(make_payload(), None) is None
+    assert payload_cache_key(make_payload(), "") is None
+
+
+def test_hit_miss_and_bypass_metrics(tmp_path):
+    cache = ImageResultCache(str(tmp_path), max_bytes=10_000)
+    key = payload_cache_key(make_payload(), MODEL)
+
+    assert cache.get(key) is None
+    cache.put(key, make_response())
+    assert cache.get(key) == make_response()
+    assert cache.get(None) is None
+
+    stats = cache.snapshot()
+    assert (stats["hits"], stats["misses"], stats["bypassed"], stats["stores"]) == (1, 1, 1, 1)
+    assert stats["entries"] == 1 and stats["hit_rate"] == 0.5
+
+
+def test_lru_eviction_by_size_survives_restart(tmp_path):
+    cache = ImageResultCache(str(tmp_path), max_bytes=1000)
+    keys = [payload_cache_key(make_payload(seed=seed), MODEL) for seed in range(4)]
+    for key in keys[:3]:
+        cache.put(key, make_response(250))
+    # Обращение к первой записи делает её самой свежей
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[3], make_response(250))
+
+    assert cache.evictions == 1
+    assert cache.get(keys[1]) is None
+    assert all(cache.get(key) is not None for key in (keys[0], keys[2], keys[3]))
+
+    # После перезапуска порядок восстанавливается по времени изменения файлов
+    for age, key in enumerate([keys[2], keys[3], keys[0]]):
+        os.utime(tmp_path / f"{key}.json", (1000 + age, 1000 + age))
+    restarted = ImageResultCache(str(tmp_path), max_bytes=700)
+    assert restarted.get(keys[2]) is None
+    assert restarted.get(keys[3]) is not None and restarted.get(keys[0]) is not None
+
+
+def test_disabled_cache_and_corrupted_entry(tmp_path):
+    key = payload_cache_key(make_payload(), MODEL)
+    disabled = ImageResultCache(str(tmp_path), max_bytes=10_000, enabled=False)
+    disabled.put(key, make_response())
+    assert disabled.get(key) is None
+    assert not list(tmp_path.iterdir())
+
+    cache = ImageResultCache(str(tmp_path), max_bytes=10_000)
+    cache.put(key, make_response())
+    (tmp_path / f"{key}.json").write_text("{broken", encoding="utf-8")
+    assert cache.get(key) is None
+    assert cache.snapshot()["entries"] == 0
@@ -0,0 +1,162 @@
+"""
+Тесты потоковой выдачи генерации изображения: прогресс, превью и отмена.
+"""
+
+import asyncio
+import base64
+import json
+from io import BytesIO
+
+from PIL import Image
+
+from app.services.image_progress import make_preview, new_task_id, stream_image_job
+
+
+def make_image(size=(512, 768), color=(200, 100, 50)):
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, format="PNG")
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+class FakeSD:
+    """SD выполняет задачи по одной; /internal/progress отвечает по id_task."""
+
+    def __init__(self, steps=6):
+        self.steps = steps
+        self.step = 0
+        self.queue = []
+        self.preview_requests = 0
+        self.interrupted = []
+        self.finished = asyncio.Event()
+
+    def progress(self, task_id, live_preview=False, id_live_preview=-1):
+        if not self.queue or task_id not in self.queue:
+            return {"active": False, "queued": False, "completed": True}
+        if task_id != self.queue[0]:
+            return {"active": False, "queued": True, "completed": False}
+
+        self.step += 1
+        if self.step >= self.steps:
+            self.finished.set()
+        response = {"active": True, "queued": False, "completed": False,
+                    "progress": self.step / self.steps, "eta": (self.steps - self.step) * 0.5}
+        if live_preview:
+            self.preview_requests += 1
+            if id_live_preview != self.step:
+                response["live_preview"] = "data:image/png;base64," + make_image(color=(self.step, 0, 0))
+                response["id_live_preview"] = self.step
+        return response
+
+    async def run(self, task_id):
+        self.queue.append(task_id)
+        while self.queue[0] != task_id:
+            await asyncio.sleep(0.005)
+        await self.finished.wait()
+        return "result"
+
+
+class FakeService:
+    def __init__(self, sd):
+        self.sd = sd
+
+    async def get_progress(self, task_id, live_preview=False, id_live_preview=-1):
+        return self.sd.progress(task_id, live_preview, id_live_preview)
+
+    async def interrupt(self):
+        self.sd.interrupted.append(self.sd.queue[0] if self.sd.queue else None)
+
+
+class FakeRequest:
+    def __init__(self, disconnect_after=None):
+        self.checks = 0
+        self.disconnect_after = disconnect_after
+
+    async def is_disconnected(self):
+        self.checks += 1
+        return self.disconnect_after is not None and self.checks > self.disconnect_after
+
+
+def parse(events):
+    parsed = []
+    for raw in events:
+        lines = raw.strip().split("\n")
+        parsed.append((lines[0][len("event: "):], json.loads(lines[1][len("data: "):])))
+    return parsed
+
+
+async def collect(service, request, task_id=None, **kwargs):
+    async def on_result(result):
+        return {"image_url": f"/static/{result}.png"}
+
+    task_id = task_id or new_task_id()
+    return [event async for event in stream_image_job(
+        service, service.sd.run(task_id), request, on_result, task_id, poll_interval=0.01, **kwargs
+    )]
+
+
+def test_stream_reports_progress_throttled_previews_and_result():
+    sd = FakeSD(steps=6)
+    events = parse(asyncio.run(collect(FakeService(sd), FakeRequest(), preview_interval=3600, preview_max_side=64)))
+    names = [name for name, _ in events]
+
+    assert names[0] == "queued" and names[-1] == "done"
+    assert events[-1][1] == {"image_url": "/static/result.png"}
+    progress = [data for name, data in events if name == "progress"]
+    assert progress[0]["eta"] == 2.5
+    assert [p["progress"] for p in progress] == sorted(p["progress"] for p in progress)
+
+    # Превью запрашивается у SD только раз в preview_interval
+    previews = [data for name, data in events if name == "preview"]
+    assert len(previews) == 1 and sd.preview_requests == 1
+    preview = Image.open(BytesIO(base64.b64decode(previews[0]["image"].split(",", 1)[1])))
+    assert max(preview.size) == 64 and preview.format == "JPEG"
+
+
+def test_disconnect_cancels_job_and_interrupts_own_task():
+    async def scenario():
+        sd = FakeSD(steps=1000)
+        task_id = new_task_id()
+        events = await collect(FakeService(sd), FakeRequest(disconnect_after=3), task_id=task_id)
+        await asyncio.sleep(0.01)
+        return sd, task_id, parse(events)
+
+    sd, task_id, events = asyncio.run(scenario())
+
+    assert "done" not in [name for name, _ in events]
+    assert sd.interrupted == [task_id]
+
+
+def test_concurrent_streams_see_only_their_own_task():
+    async def scenario():
+        sd = FakeSD(steps=1000)
+        service = FakeService(sd)
+        # Задача A уже выполняется в SD; поток B стоит за ней в очереди
+        running = asyncio.ensure_future(sd.run("task(a)"))
+        await asyncio.sleep(0.01)
+        events = await collect(service, FakeRequest(disconnect_after=3), task_id="task(b)", preview_interval=0)
+        await asyncio.sleep(0.01)
+        running.cancel()
+        return sd, parse(events)
+
+    sd, events = asyncio.run(scenario())
+
+    # B не получает ни прогресса, ни превью задачи A и не прерывает её
+    assert {name for name, _ in events} == {"queued"}
+    assert sd.interrupted == []
+
+
+def test_job_failure_is_reported_as_error_event():
+    class FailingSD(FakeSD):
+        async def run(self, task_id):
+            raise RuntimeError("SD вернул 500")
+
+    events = parse(asyncio.run(collect(FakeService(FailingSD()), FakeRequest())))
+    assert events[-1] == ("error", {"detail": "SD вернул 500"})
+
+
+def test_helpers():
+    assert new_task_id() != new_task_id() and new_task_id().startswith("task(")
+
+    preview = make_preview("data:image/png;base64," + make_image((300, 100)), max_side=120)
+    image = Image.open(BytesIO(base64.b64decode(preview.split(",", 1)[1])))
+    assert image.size == (120, 40)
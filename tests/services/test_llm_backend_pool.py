@@ -0,0 +1,143 @@
+"""
+Тесты пула серверов text-generation-webui на локальных заглушках.
+"""
+
+import asyncio
+import json
+import socket
+import sys
+from pathlib import Path
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "load_test"))
+
+from mock_backends import MockLLMConfig, MockLLMServer  # noqa: E402
+from app.chat_bot.services.llm_backend_pool import BackendResponseError, LLMBackendPool  # noqa: E402
+from app.services.backend_health import BackendHealthMonitor, BackendUnavailableError  # noqa: E402
+
+FAST_LLM = MockLLMConfig(ttft=0.05, tokens_per_second=500.0, max_tokens=5, jitter=0.0)
+PAYLOAD = {"messages": [{"role": "user", "content": "hi"}], "max_tokens": 5}
+
+
+def dead_url() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def make_pool(urls, **kwargs) -> LLMBackendPool:
+    return LLMBackendPool(urls, monitor=BackendHealthMonitor(failure_threshold=1, reset_timeout=60.0), **kwargs)
+
+
+async def complete(session: aiohttp.ClientSession, backend) -> str:
+    async with session.post(f"{backend.url}/v1/chat/completions", json=PAYLOAD) as response:
+        if response.status >= 500:
+            raise BackendResponseError(response.status, await response.text())
+        await response.json()
+        return backend.name
+
+
+async def stream_lines(session: aiohttp.ClientSession, backend):
+    async with session.post(f"{backend.url}/v1/chat/completions", json={**PAYLOAD, "stream": True}) as response:
+        if response.status >= 500:
+            raise BackendResponseError(response.status, await response.text())
+        async for line in response.content:
+            line = line.decode().strip()
+            if line.startswith("data: ") and line != "data: [DONE]":
+                yield json.loads(line[6:])["choices"][0]["delta"]["content"]
+
+
+def test_least_outstanding_and_session_affinity():
+    pool = make_pool(["http://a", "http://b", "http://c"], affinity_slack=1)
+    a, b, c = pool.backends
+
+    a.in_flight, b.in_flight, c.in_flight = 2, 0, 1
+    assert pool.select() is b
+
+    # Сессия закреплена за c и остаётся на нём, пока перегрузка не превышает slack
+    pool._bind("session", c)
+    assert pool.select("session") is c
+    c.in_flight = 2
+    assert pool.select("session") is b
+
+    # Выведенный из ротации сервер не выбирается, закрепления за ним сбрасываются
+    pool.drain(b.name)
+    assert pool.select("session") is c
+    assert pool.select(exclude=[c.name]) is a
+
+
+def test_concurrent_requests_are_spread_across_backends():
+    async def scenario():
+        async with MockLLMServer(FAST_LLM) as first, MockLLMServer(FAST_LLM) as second:
+            pool = make_pool([first.url, second.url])
+            async with aiohttp.ClientSession() as session:
+                names = await asyncio.gather(*(
+                    pool.run(lambda backend: complete(session, backend)) for _ in range(8)
+                ))
+            return names, first.stats.max_in_flight, second.stats.max_in_flight, pool
+
+    names, first_peak, second_peak, pool = asyncio.run(scenario())
+    assert sorted(names) == ["textgen"] * 4 + ["textgen-2"] * 4
+    assert first_peak == second_peak == 4
+    assert all(backend.in_flight == 0 for backend in pool.backends)
+
+
+def test_generation_is_retried_on_another_backend():
+    async def scenario():
+        async with MockLLMServer(FAST_LLM) as healthy:
+            pool = make_pool([dead_url(), healthy.url])
+            pool._bind("anna:1", pool.backends[0])
+            async with aiohttp.ClientSession() as session:
+                name = await pool.run(lambda backend: complete(session, backend), session_id="anna:1")
+                # Отказавший сервер разомкнут и больше не выбирается, сессия перезакреплена
+                again = await pool.run(lambda backend: complete(session, backend), session_id="anna:1")
+            return name, again, pool
+
+    name, again, pool = asyncio.run(scenario())
+    assert name == again == "textgen-2"
+    assert pool.snapshot()["textgen"]["circuit"] == "open"
+    assert pool.snapshot()["textgen"]["failed_requests"] == 1
+    assert pool._affinity["anna:1"] == "textgen-2"
+
+
+def test_stream_is_retried_before_first_chunk():
+    async def failing(request):
+        return web.Response(status=503, text="model loading")
+
+    async def scenario():
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", failing)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        broken_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+        try:
+            async with MockLLMServer(FAST_LLM) as healthy:
+                pool = make_pool([broken_url, healthy.url])
+                async with aiohttp.ClientSession() as session:
+                    chunks = [chunk async for chunk in pool.stream(lambda backend: stream_lines(session, backend))]
+                return chunks, pool
+        finally:
+            await runner.cleanup()
+
+    chunks, pool = asyncio.run(scenario())
+    assert len(chunks) == 5
+    assert pool.snapshot()["textgen"]["failed_requests"] == 1
+    assert pool.snapshot()["textgen-2"]["in_flight"] == 0
+
+
+def test_all_backends_down_fails_fast():
+    async def scenario():
+        pool = make_pool([dead_url(), dead_url()], max_retries=1)
+        async with aiohttp.ClientSession() as session:
+            with pytest.raises(aiohttp.ClientConnectionError):
+                await pool.run(lambda backend: complete(session, backend))
+            assert not pool.is_available()
+            with pytest.raises(BackendUnavailableError):
+                await pool.run(lambda backend: complete(session, backend))
+
+    asyncio.run(scenario())
@@ -0,0 +1,112 @@
+"""
+Тесты компилятора промптов с учётом токенов CLIP.
+"""
+
+from app.services.prompt_compiler import (
+    PromptCompiler,
+    count_chunks,
+    estimate_clip_tokens,
+    split_tags,
+    unwrap_weight,
+)
+
+
+def word_count(text):
+    return len(text.split())
+
+
+def test_split_respects_brackets_and_escapes():
+    prompt = "1girl, (red hair, blue eyes:1.2), <lora:detail:0.6>, \\(smile\\), [bokeh]"
+    assert split_tags(prompt) == ["1girl", "(red hair, blue eyes:1.2)", "<lora:detail:0.6>", "\\(smile\\)", "[bokeh]"]
+
+
+def test_unwrap_weight():
+    assert unwrap_weight("((photorealistic))") == ("photorealistic", 1.21)
+    assert unwrap_weight("(smile:1.3)") == ("smile", 1.3)
+    assert unwrap_weight("[bokeh]") == ("bokeh", 0.9091)
+    assert unwrap_weight("(a) and (b)") == ("(a) and (b)", 1.0)
+
+
+def test_semantic_duplicates_keep_first_position_and_stronger_weight():
+    compiler = PromptCompiler(word_count, max_chunks=0)
+    compiled = compiler.compile(
+        character="Blonde_Hair, smile",
+        user="blonde hair, ((smile)), beach",
+        defaults="BEACH, semi-realistic, semi realistic",
+    )
+    assert compiled.prompt == "Blonde_Hair, ((smile)), beach, semi-realistic"
+    assert compiled.duplicates == 4
+
+
+def test_lora_tags_are_deduped_by_name_and_cost_nothing():
+    compiler = PromptCompiler(word_count, max_chunks=1)
+    compiled = compiler.compile(user="<lora:detail:0.6>, portrait", defaults="<LORA:detail:1.0>, <lora:film:0.3>")
+    assert compiled.prompt == "portrait, <lora:detail:0.6>, <lora:film:0.3>"
+    assert compiled.tokens == 2
+
+
+def test_chunk_budget_drops_only_defaults():
+    compiler = PromptCompiler(word_count, max_chunks=1, chunk_size=10)
+    compiled = compiler.compile(
+        character="a b c",            # 4 токена с запятой
+        user="d e",                   # 3
+        defaults="f, g h, i",         # 2 + 3 + 2
+    )
+    assert compiled.prompt == "a b c, d e, f"
+    assert compiled.dropped == ["g h", "i"]
+    assert compiled.chunks == 1
+
+    # Теги персонажа и пользователя сохраняются даже сверх бюджета
+    over = compiler.compile(user="a b c d e f g h i j k l", defaults="m")
+    assert over.chunks == 2 and over.dropped == ["m"]
+
+
+def test_break_and_and_are_kept_and_start_new_chunks():
+    compiler = PromptCompiler(word_count, max_chunks=0)
+    assert split_tags("1girl, red eyes BREAK, smile") == ["1girl", "red eyes", "BREAK", "smile"]
+    assert split_tags("ANDROID, BREAKING news") == ["ANDROID", "BREAKING news"]
+
+    compiled = compiler.compile(user="1girl, red eyes BREAK, smile, BREAK, red eyes, blue sky")
+    assert compiled.prompt == "1girl, red eyes BREAK smile BREAK blue sky"
+    assert compiled.chunks == 3
+    assert compiled.duplicates == 1
+
+    # Пустой кусок между двумя BREAK SD тоже кодирует
+    assert compiler.compile(user="a BREAK BREAK b").chunks == 3
+
+    # Подпромпт AND кодируется отдельно: повтор тега в нём сохраняется
+    both = compiler.compile(user="cat, red eyes AND dog, red eyes", defaults="red eyes")
+    assert both.prompt == "cat, red eyes AND dog, red eyes"
+    assert both.chunks == 2 and both.duplicates == 1
+
+
+def test_chunk_budget_counts_chunks_before_break():
+    compiler = PromptCompiler(word_count, max_chunks=2, chunk_size=10)
+    compiled = compiler.compile(user="a b BREAK c", defaults="d, e f g h i j k l m")
+    assert compiled.prompt == "a b BREAK c, d"
+    assert compiled.dropped == ["e f g h i j k l m"]
+    assert compiled.chunks == 2
+
+
+def test_count_chunks_moves_short_tag_to_next_chunk():
+    assert count_chunks([]) == 0
+    assert count_chunks([70, 10]) == 2
+    assert count_chunks([70, 5]) == 1
+    assert count_chunks([60, 100]) == 3
+
+
+def test_parse_is_cached_and_fallback_estimate():
+    calls = []
+
+    def counting(text):
+        calls.append(text)
+        return 1
+
+    compiler = PromptCompiler(counting)
+    compiler.compile(character="long character prefix, red dress")
+    compiler.compile(character="long character prefix, red dress", user="smile")
+    assert calls.count("red dress") == 1
+
+    assert estimate_clip_tokens("1girl") == 2
+    assert estimate_clip_tokens("phosphorescent") == 2
+    assert estimate_clip_tokens("девушка") > 1
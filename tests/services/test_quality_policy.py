@@ -0,0 +1,93 @@
+"""
+Тесты выбора уровня качества генерации по нагрузке, подписке и подсказке клиента.
+"""
+
+import asyncio
+
+import pytest
+
+from app.config.generation_defaults import get_generation_params
+from app.services.quality_policy import (
+    QualityPolicy,
+    QualityTier,
+    SDQueue,
+    apply_quality_tier,
+    parse_tier,
+)
+
+
+@pytest.fixture
+def policy():
+    return QualityPolicy(degrade_queue=3, draft_queue=6)
+
+
+@pytest.mark.parametrize("queue_length, subscription, expected", [
+    (0, None, QualityTier.STANDARD),
+    (0, "base", QualityTier.STANDARD),
+    (0, "premium", QualityTier.PREMIUM),
+    (3, "base", QualityTier.DRAFT),
+    (3, "premium", QualityTier.PREMIUM),
+    (6, "base", QualityTier.DRAFT),
+    (6, "pro", QualityTier.STANDARD),
+])
+def test_tier_by_load_and_subscription(policy, queue_length, subscription, expected):
+    assert policy.choose(queue_length, subscription).tier == expected
+
+
+def test_client_hint_can_only_lower_tier(policy):
+    assert policy.choose(0, "premium", "draft").tier == QualityTier.DRAFT
+    assert policy.choose(0, "base", "premium").tier == QualityTier.STANDARD
+    assert policy.choose(0, "base", "ultra").tier == QualityTier.STANDARD
+
+    decision = policy.choose(7, "premium", "standard")
+    assert decision.tier == QualityTier.DRAFT
+    assert "hint=standard" in decision.reason and "queue=7" in decision.reason
+
+
+def test_apply_tier_adjusts_steps_hires_and_adetailer():
+    base = get_generation_params("default")
+    base["prompt"] = "landscape, mountains, river"
+    base["steps"] = 30
+
+    draft = apply_quality_tier(dict(base), QualityTier.DRAFT)
+    assert draft["steps"] == 12 and not draft["enable_hr"]
+    assert "ADetailer" not in draft["alwayson_scripts"]
+
+    premium = apply_quality_tier(dict(base, alwayson_scripts={}), QualityTier.PREMIUM)
+    assert premium["steps"] == 30 and premium["enable_hr"]
+    assert premium["alwayson_scripts"]["ADetailer"]["args"][0] is True
+
+    # Standard — обычный конвейер: ADetailer и hires.fix из настроек по умолчанию сохраняются
+    with_adetailer = dict(base, alwayson_scripts=dict(premium["alwayson_scripts"]), enable_hr=True)
+    standard = apply_quality_tier(dict(with_adetailer), QualityTier.STANDARD)
+    assert standard == with_adetailer
+
+    # Общие настройки по умолчанию не меняются
+    assert get_generation_params("default")["alwayson_scripts"] == base["alwayson_scripts"]
+
+
+def test_sd_queue_counts_in_flight_requests():
+    queue = SDQueue()
+
+    async def scenario():
+        release = asyncio.Event()
+
+        async def request():
+            async with queue.slot():
+                await release.wait()
+
+        tasks = [asyncio.create_task(request()) for _ in range(3)]
+        await asyncio.sleep(0)
+        in_flight = queue.length
+        release.set()
+        await asyncio.gather(*tasks)
+        return in_flight
+
+    assert asyncio.run(scenario()) == 3
+    assert queue.length == 0
+
+
+def test_parse_tier():
+    assert parse_tier("Premium") == QualityTier.PREMIUM
+    assert parse_tier(None) is None
+    assert parse_tier("best") is None
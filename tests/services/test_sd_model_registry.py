@@ -0,0 +1,105 @@
+"""
+Тесты реестра моделей Stable Diffusion.
+"""
+
+import asyncio
+import os
+import sys
+
+from app.services.sd_model_registry import SDModelRegistry, lora_key, strip_model_hash
+
+
+def make_webui(tmp_path):
+    webui = tmp_path / "stable-diffusion-webui"
+    for sub in ("Stable-diffusion", "VAE", "Lora"):
+        (webui / "models" / sub).mkdir(parents=True)
+    (webui / "models" / "Stable-diffusion" / "base.safetensors").write_bytes(b"0" * 2 * 1024 * 1024)
+    (webui / "models" / "Lora" / "add_detail.safetensors").write_bytes(b"0")
+    (webui / "model_config.py").write_text('MODEL_NAME = "base.safetensors"\nVAE_NAME = None\n', encoding="utf-8")
+    return webui
+
+
+def make_registry(webui, responses):
+    registry = SDModelRegistry(
+        "http://sd", webui_dir=webui,
+        models_dir=webui / "models" / "Stable-diffusion", vae_dir=webui / "models" / "VAE",
+    )
+    calls = []
+
+    async def fake_get_json(path):
+        calls.append(path)
+        value = responses.get(path)
+        if isinstance(value, Exception) or value is None:
+            raise value or ConnectionError(path)
+        return value
+
+    registry._get_json = fake_get_json
+    return registry, calls
+
+
+def test_names():
+    assert strip_model_hash("base.safetensors [6ce0161689]") == "base.safetensors"
+    assert strip_model_hash("base.safetensors") == "base.safetensors"
+    assert lora_key("Lora/Add_Detail.safetensors") == lora_key("add_detail") == "add_detail"
+
+
+def test_falls_back_to_model_config_without_touching_sys_path(tmp_path):
+    webui = make_webui(tmp_path)
+    registry, _ = make_registry(webui, {})
+    path_before = list(sys.path)
+
+    assert asyncio.run(registry.refresh()) is True
+    assert sys.path == path_before
+    info = registry.get_model_info()
+    assert (info["name"], info["size_mb"], info["vae_name"], info["source"]) == ("base.safetensors", 2.0, None, "config")
+    assert registry.is_model_available()
+    assert registry.has_lora("add_detail.safetensors") and not registry.has_lora("missing")
+
+
+def test_rebuilds_only_on_options_or_file_change(tmp_path):
+    webui = make_webui(tmp_path)
+    responses = {
+        "/sdapi/v1/options": {"sd_model_checkpoint": "remote.safetensors [abc]", "sd_vae": "Automatic"},
+        "/sdapi/v1/loras": [{"name": "film_grain"}],
+    }
+    registry, calls = make_registry(webui, responses)
+
+    async def scenario():
+        assert await registry.refresh() is True
+        assert await registry.refresh() is False
+        assert calls.count("/sdapi/v1/loras") == 1
+
+        responses["/sdapi/v1/options"] = {"sd_model_checkpoint": "base.safetensors [def]", "sd_vae": "vae.pt"}
+        assert await registry.refresh() is True
+
+        # SD недоступен: состояние сохраняется, пересборки нет
+        responses["/sdapi/v1/options"] = ConnectionError("down")
+        assert await registry.refresh() is False
+
+        lora = webui / "models" / "Lora" / "new_style.safetensors"
+        lora.write_bytes(b"0")
+        os.utime(lora.parent, ns=(1, 1))
+        assert await registry.refresh() is True
+
+    asyncio.run(scenario())
+    info = registry.get_model_info()
+    assert (info["name"], info["vae_name"], info["size_mb"], info["source"]) == ("base.safetensors", "vae.pt", 2.0, "sd")
+    assert registry.available_loras() == ["add_detail", "film_grain", "new_style"]
+    assert registry.rebuilds == 3
+
+
+def test_current_checkpoint_is_asked_from_sd_without_waiting_for_refresh(tmp_path):
+    responses = {"/sdapi/v1/options": {"sd_model_checkpoint": "base.safetensors [def]"}}
+    registry, _ = make_registry(make_webui(tmp_path), responses)
+
+    async def scenario():
+        await registry.refresh()
+        # Чекпоинт сменили в SD, реестр ещё не обновился
+        responses["/sdapi/v1/options"] = {"sd_model_checkpoint": "other.safetensors [abc]"}
+        assert registry.get_model_info()["name"] == "base.safetensors"
+        assert await registry.current_checkpoint() == "other.safetensors"
+
+        responses["/sdapi/v1/options"] = ConnectionError("down")
+        assert await registry.current_checkpoint() is None
+
+    asyncio.run(scenario())
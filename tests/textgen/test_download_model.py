@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Тесты параллельной и возобновляемой загрузки моделей (download-model.py)
+на локальном HTTP-сервере с поддержкой Range-запросов.
+"""
+
+import hashlib
+import importlib.util
+import os
+import threading
+import time
+from functools import partial
+from io import BytesIO
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+TEXTGEN_ROOT = Path(__file__).parent.parent.parent / "text-generation-webui"
+
+spec = importlib.util.spec_from_file_location("download_model", TEXTGEN_ROOT / "download-model.py")
+download_model = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(download_model)
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Минимальный файловый сервер с поддержкой заголовка Range."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_head(self):
+        path = Path(self.translate_path(self.path))
+        if not path.is_file():
+            self.send_error(404)
+            return None
+
+        data = path.read_bytes()
+        range_header = self.headers.get("Range")
+        if range_header:
+            start, end = range_header.replace("bytes=", "").split("-")
+            start = int(start)
+            end = int(end) if end else len(data) - 1
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            body = data
+            self.send_response(200)
+
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{hashlib.md5(data).hexdigest()}"')
+        self.end_headers()
+        self.server.requests_log.append((self.command, range_header))
+
+        return BytesIO(body)
+
+
+@pytest.fixture
+def http_server(tmp_path):
+    served = tmp_path / "served"
+    served.mkdir()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(RangeRequestHandler, directory=str(served)))
+    server.requests_log = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield served, f"http://127.0.0.1:{server.server_port}", server
+    server.shutdown()
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(download_model, "MIN_MULTIPART_SIZE", 1024)
+    monkeypatch.setattr(download_model, "CHUNK_SIZE", 4096)
+    monkeypatch.setattr(download_model, "BLOCK_SIZE", 1024)
+
+
+def test_multipart_download_is_verified(http_server, tmp_path, small_chunks):
+    served, url, server = http_server
+    content = os.urandom(50_000)
+    (served / "model.gguf").write_bytes(content)
+    output = tmp_path / "out"
+
+    downloader = download_model.ModelDownloader(max_retries=1, connections=4)
+    downloader.download_model_files(
+        "user/model", "main", [f"{url}/model.gguf"],
+        [["model.gguf", hashlib.sha256(content).hexdigest()]],
+        output, is_llamacpp=True
+    )
+
+    assert (output / "model.gguf").read_bytes() == content
+    assert not (output / "model.gguf.part").exists()
+    assert not (output / "model.gguf.part.json").exists()
+    ranged = [r for method, r in server.requests_log if method == "GET" and r]
+    assert len(ranged) == 13
+
+    status = downloader.progress.snapshot()
+    assert status["fraction"] == 1.0
+    assert status["files"]["model.gguf"]["status"] == "done"
+
+
+def test_download_resumes_from_manifest(http_server, tmp_path, small_chunks):
+    served, url, server = http_server
+    content = os.urandom(20_000)
+    (served / "model.gguf").write_bytes(content)
+    output = tmp_path / "out"
+    output.mkdir()
+
+    # Первые два чанка уже скачаны
+    etag = f'"{hashlib.md5(content).hexdigest()}"'
+    manifest = download_model.DownloadManifest.create(output / "model.gguf.part.json", f"{url}/model.gguf", len(content), etag, 4096, existing_bytes=8192)
+    manifest.save()
+    (output / "model.gguf.part").write_bytes(content[:8192] + b"\0" * (len(content) - 8192))
+
+    downloader = download_model.ModelDownloader(max_retries=1, connections=2)
+    downloader.download_model_files("user/model", "main", [f"{url}/model.gguf"], [], output, is_llamacpp=True)
+
+    assert (output / "model.gguf").read_bytes() == content
+    ranged = sorted(r for method, r in server.requests_log if method == "GET")
+    assert "bytes=0-4095" not in ranged
+    assert "bytes=8192-12287" in ranged
+
+
+def test_checksum_mismatch_removes_partial_file(http_server, tmp_path, small_chunks):
+    served, url, server = http_server
+    (served / "model.gguf").write_bytes(os.urandom(10_000))
+    output = tmp_path / "out"
+
+    downloader = download_model.ModelDownloader(max_retries=1)
+    with pytest.raises(download_model.ChecksumError):
+        downloader.download_model_files("user/model", "main", [f"{url}/model.gguf"], [["model.gguf", "0" * 64]], output, is_llamacpp=True)
+
+    assert not (output / "model.gguf").exists()
+    assert not (output / "model.gguf.part").exists()
+
+
+def test_bandwidth_scheduler_throttles():
+    scheduler = download_model.DownloadScheduler(max_connections=2, max_bandwidth=100_000)
+    start = time.monotonic()
+    for _ in range(4):
+        scheduler.throttle(50_000)
+
+    assert time.monotonic() - start >= 0.9
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Тесты векторизованного штрафа DRY (modules/sampler_hijack.py): результат
+совпадает с исходной построчной реализацией из benchmarks/dry_benchmark.py.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("gradio")
+pytest.importorskip("accelerate")
+
+TEXTGEN_ROOT = Path(__file__).parent.parent.parent / "text-generation-webui"
+sys.path.insert(0, str(TEXTGEN_ROOT))
+
+from benchmarks.dry_benchmark import ReferenceDRYLogitsProcessor, make_context  # noqa: E402
+from modules.sampler_hijack import DRYLogitsProcessor  # noqa: E402
+
+VOCAB_SIZE = 300
+
+
+def apply(processor, context, steps):
+    outputs = []
+    for end in range(context.shape[1] - steps, context.shape[1] + 1):
+        outputs.append(processor(context[:, :end], torch.zeros((context.shape[0], VOCAB_SIZE))))
+    return outputs
+
+
+@pytest.mark.parametrize("_range", [0, 64, 1024])
+@pytest.mark.parametrize("allowed_length", [1, 2, 4])
+def test_vectorized_penalty_matches_the_reference(_range, allowed_length):
+    # Повторяющиеся фразы дают совпадения разной длины, в том числе длиннее 50
+    context = make_context(batch=3, length=400, vocab_size=VOCAB_SIZE, seed=allowed_length)
+    context[1, 300:] = context[1, 50:150]
+    context[2, 340:] = context[2, 310:370].clone()
+    kwargs = dict(multiplier=0.8, base=1.75, allowed_length=allowed_length,
+                  sequence_breakers={1, 5, 17}, _range=_range)
+
+    expected = apply(ReferenceDRYLogitsProcessor(**kwargs), context, steps=40)
+    actual = apply(DRYLogitsProcessor(**kwargs), context, steps=40)
+
+    assert any(row.ne(0).any() for row in expected)
+    for reference, vectorized in zip(expected, actual):
+        assert torch.allclose(reference, vectorized)
+
+
+def test_breaker_as_last_token_leaves_scores_unchanged():
+    context = torch.tensor([[3, 4, 5, 3, 4, 5, 3, 4, 7]])
+    processor = DRYLogitsProcessor(multiplier=1.0, base=2.0, allowed_length=1, sequence_breakers={7}, _range=0)
+    assert processor(context, torch.zeros((1, 10))).eq(0).all()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Тесты оценки perplexity для llama.cpp (modules/evaluate.py) на локальном
+HTTP-сервере, который имитирует /completion llama-server с n_probs и logit_bias.
+"""
+
+import json
+import math
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("pandas")
+pytest.importorskip("gradio")
+pytest.importorskip("llama_cpp_binaries")
+
+TEXTGEN_ROOT = Path(__file__).parent.parent.parent / "text-generation-webui"
+sys.path.insert(0, str(TEXTGEN_ROOT))
+
+from modules import evaluate, shared  # noqa: E402
+from modules.llama_cpp_server import LlamaServer  # noqa: E402
+
+VOCAB_SIZE = 64
+N_PROBS = 8
+
+
+def next_token_logprobs(prompt):
+    """Игрушечная модель: распределение следующего токена зависит от двух последних."""
+    context = (prompt[-1] * 7 + (prompt[-2] if len(prompt) > 1 else 0)) % VOCAB_SIZE
+    logits = [-((token - context) % VOCAB_SIZE) / 4 for token in range(VOCAB_SIZE)]
+    norm = math.log(sum(math.exp(x) for x in logits))
+    return [x - norm for x in logits]
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests_log.append(payload)
+        prompts = payload["prompt"]
+        if prompts and isinstance(prompts[0], int):
+            prompts = [prompts]
+
+        results = []
+        for index, prompt in enumerate(prompts):
+            logprobs = next_token_logprobs(prompt)
+            top = sorted(range(VOCAB_SIZE), key=lambda t: -logprobs[t])[:payload["n_probs"]]
+            entry = {"top_logprobs": [{"id": t, "token": str(t), "logprob": logprobs[t]} for t in top]}
+            if payload["n_predict"] > 0:
+                forced = payload["logit_bias"][0][0]
+                entry.update({"id": forced, "token": str(forced), "logprob": logprobs[forced]})
+            results.append({"index": index, "completion_probabilities": [entry]})
+
+        # llama-server отдаёт результаты нескольких промптов в порядке завершения
+        body = json.dumps(results[::-1] if len(results) > 1 else results[0]).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def llama_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CompletionHandler)
+    server.requests_log = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    model = LlamaServer.__new__(LlamaServer)
+    model.port = server.server_port
+    model.process = None
+    model.session = __import__("requests").Session()
+    monkeypatch.setattr(shared, "model", model)
+    yield server
+    server.shutdown()
+
+
+def exact_window_nlls(token_ids, windows):
+    nlls = []
+    for begin, end, trg_len in windows:
+        targets = range(max(begin + 1, end - trg_len), end)
+        nlls.append(-sum(next_token_logprobs(token_ids[begin:i])[token_ids[i]] for i in targets) / len(targets))
+    return nlls
+
+
+def test_windows_cover_sequence_once():
+    windows = evaluate.get_windows(seq_len=100, stride=16, max_length=40)
+    assert windows[0] == (0, 40, 40)
+    assert windows[-1][1] == 100
+    assert sum(trg_len for _, _, trg_len in windows) == 100
+
+
+def test_llamacpp_nlls_match_exact_computation(llama_server):
+    token_ids = [(i * 13 + i // 5) % VOCAB_SIZE for i in range(120)]
+    windows = evaluate.get_windows(len(token_ids), stride=8, max_length=24)
+
+    nlls = list(evaluate.llamacpp_window_nlls(token_ids, windows, batch_size=20, n_probs=N_PROBS))
+
+    assert nlls == pytest.approx(exact_window_nlls(token_ids, windows))
+    batched = [p for p in llama_server.requests_log if p["n_predict"] == 0]
+    forced = [p for p in llama_server.requests_log if p["n_predict"] == 1]
+    # Окна по 8 позиций объединяются в запросы до 20 промптов
+    assert max(len(p["prompt"]) for p in batched) > 8
+    assert len(batched) < len(windows)
+    # Токены вне top-n_probs досчитываются отдельным запросом с logit_bias
+    assert forced
+
+
+def test_checkpoint_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(evaluate, "CHECKPOINT_DIR", tmp_path)
+    monkeypatch.setattr(shared, "lora_names", [])
+    path = evaluate.get_checkpoint_path("model.gguf", "wikitext", 512, 0, 1000)
+
+    assert evaluate.load_checkpoint(path) == []
+    evaluate.save_checkpoint(path, [1.5, 2.5])
+    assert evaluate.load_checkpoint(path) == [1.5, 2.5]
+    assert path != evaluate.get_checkpoint_path("model.gguf", "wikitext", 256, 0, 1000)
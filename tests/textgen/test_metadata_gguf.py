@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Тесты дискового кэша метаданных GGUF (modules/metadata_gguf.py): по одному
+файлу на модель, повторное чтение без разбора, сброс при изменении файла.
+"""
+
+import os
+import struct
+import sys
+from pathlib import Path
+
+import pytest
+
+TEXTGEN_ROOT = Path(__file__).parent.parent.parent / "text-generation-webui"
+sys.path.insert(0, str(TEXTGEN_ROOT))
+
+from modules import metadata_gguf  # noqa: E402
+from modules.metadata_gguf import GGUFArray, GGUFValueType  # noqa: E402
+
+
+def gguf_string(text):
+    data = text.encode()
+    return struct.pack("<Q", len(data)) + data
+
+
+def write_gguf(path, name, tokens):
+    """Минимальный GGUF v3: строка, число и массив строк."""
+    items = [
+        gguf_string("general.name") + struct.pack("<I", GGUFValueType.STRING) + gguf_string(name),
+        gguf_string("llama.context_length") + struct.pack("<II", GGUFValueType.UINT32, 4096),
+        gguf_string("tokenizer.ggml.tokens") + struct.pack("<IIQ", GGUFValueType.ARRAY, GGUFValueType.STRING, len(tokens))
+        + b"".join(gguf_string(t) for t in tokens),
+    ]
+    path.write_bytes(struct.pack("<IIQQ", 0x46554747, 3, 0, len(items)) + b"".join(items))
+
+
+@pytest.fixture
+def models(tmp_path):
+    tokens = [f"tok{i}" for i in range(metadata_gguf.LAZY_ARRAY_THRESHOLD + 10)]
+    first, second = tmp_path / "a.gguf", tmp_path / "b.gguf"
+    write_gguf(first, "a", tokens)
+    write_gguf(second, "b", tokens[:3])
+    return first, second, tmp_path / "cache"
+
+
+def test_each_model_gets_its_own_cache_file_and_hits_it(models, monkeypatch):
+    first, second, cache_dir = models
+    parsed = metadata_gguf.load_metadata_cached(first, cache_dir)
+    metadata_gguf.load_metadata_cached(second, cache_dir)
+    assert len(list(cache_dir.glob("*.json"))) == 2
+    assert not list(cache_dir.glob("*.tmp"))
+
+    # Повторное чтение не разбирает модель; большой массив читается из файла лениво
+    monkeypatch.setattr(metadata_gguf, "load_metadata", lambda fname: pytest.fail("cache miss"))
+    cached = metadata_gguf.load_metadata_cached(first, cache_dir)
+    assert cached["general.name"] == "a" and cached["llama.context_length"] == 4096
+    tokens = cached["tokenizer.ggml.tokens"]
+    assert isinstance(tokens, GGUFArray)
+    assert tokens[-1] == parsed["tokenizer.ggml.tokens"][-1] == f"tok{len(tokens) - 1}"
+    assert metadata_gguf.load_metadata_cached(second, cache_dir)["tokenizer.ggml.tokens"] == ["tok0", "tok1", "tok2"]
+
+
+def test_changed_model_file_is_parsed_again(models):
+    first, _, cache_dir = models
+    metadata_gguf.load_metadata_cached(first, cache_dir)
+
+    write_gguf(first, "a-v2", ["x"])
+    stat = first.stat()
+    os.utime(first, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert metadata_gguf.load_metadata_cached(first, cache_dir)["general.name"] == "a-v2"
+    # Запись для того же пути перезаписывается, а не накапливается
+    assert len(list(cache_dir.glob("*.json"))) == 1
+
+    # Повреждённый файл кэша — просто промах
+    next(cache_dir.glob("*.json")).write_text("{", encoding="utf-8")
+    assert metadata_gguf.load_metadata_cached(first, cache_dir)["tokenizer.ggml.tokens"] == ["x"]
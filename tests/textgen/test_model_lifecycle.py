@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Тесты горячей замены моделей llama.cpp (modules/model_lifecycle.py):
+новый сервер запускается рядом с текущим, shared.model переключается
+атомарно, а заменённые серверы остаются в LRU-пуле в пределах лимитов.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("gradio")
+
+TEXTGEN_ROOT = Path(__file__).parent.parent.parent / "text-generation-webui"
+sys.path.insert(0, str(TEXTGEN_ROOT))
+
+from modules import model_lifecycle, models, shared  # noqa: E402
+
+
+class LlamaServer:
+    """Сервер-заглушка; имя класса совпадает с настоящим LlamaServer."""
+
+    def __init__(self, model_path, size_mb=100):
+        self.model_path = model_path
+        self.size_mb = size_mb
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = model_lifecycle.ModelPool()
+    spawned = []
+
+    def spawn(model_name, metadata=None):
+        server = LlamaServer(model_name)
+        spawned.append(server)
+        pool.sizes[model_name] = server.size_mb
+        return server
+
+    monkeypatch.setattr(pool, "spawn", spawn)
+    monkeypatch.setattr(model_lifecycle, "model_pool", pool)
+    monkeypatch.setattr(model_lifecycle, "server_size_mb", lambda server: server.size_mb)
+    monkeypatch.setattr(models, "find_llama_cpp_model_file", lambda name: Path(name))
+    monkeypatch.setattr(models, "apply_loaded_model_settings", lambda metadata, loader: None)
+    monkeypatch.setattr(models, "unload_model", lambda: pytest.fail("hot switch must not unload"))
+    monkeypatch.setattr("modules.models_settings.get_model_metadata", lambda name: {"loader": "llama.cpp"})
+    monkeypatch.setattr("modules.models_settings.get_model_size_mb", lambda path: 100)
+    monkeypatch.setattr(shared, "model", None)
+    monkeypatch.setattr(shared, "tokenizer", None)
+    monkeypatch.setattr(shared, "model_name", "None")
+    monkeypatch.setattr(shared.args, "loader", None)
+    monkeypatch.setattr(shared.args, "model_pool_size", 1)
+    monkeypatch.setattr(shared.args, "model_pool_memory", 0)
+    pool.spawned = spawned
+    return pool
+
+
+def test_switch_parks_previous_server_and_reuses_it(pool):
+    first, _ = model_lifecycle.switch_model("a.gguf")
+    second, _ = model_lifecycle.switch_model("b.gguf")
+
+    assert shared.model is second and shared.model_name == "b.gguf"
+    assert list(pool.standby) == ["a.gguf"] and not first.stopped
+
+    # Возврат к модели из пула не запускает новый сервер
+    back, _ = model_lifecycle.switch_model("a.gguf")
+    assert back is first and len(pool.spawned) == 2
+    assert list(pool.standby) == ["b.gguf"]
+
+    model_lifecycle.switch_model("c.gguf")
+    assert list(pool.standby) == ["a.gguf"] and second.stopped
+
+
+def test_memory_budget_limits_standby_and_falls_back_to_reload(pool, monkeypatch):
+    monkeypatch.setattr(shared.args, "model_pool_size", 3)
+    monkeypatch.setattr(shared.args, "model_pool_memory", 250)
+    first, _ = model_lifecycle.switch_model("a.gguf")
+    model_lifecycle.switch_model("b.gguf")
+    assert list(pool.standby) == ["a.gguf"]
+
+    # Активная b, резервная a и новая c не помещаются в 250 MiB — a останавливается заранее
+    model_lifecycle.switch_model("c.gguf")
+    assert list(pool.standby) == ["b.gguf"] and first.stopped
+
+    monkeypatch.setattr(shared.args, "model_pool_memory", 150)
+    reloads = []
+    monkeypatch.setattr(models, "unload_model", lambda: reloads.append("unload"))
+    monkeypatch.setattr(models, "load_model", lambda name, loader: (reloads.append(name), ("cold", "cold"))[1])
+    assert model_lifecycle.switch_model("d.gguf") == ("cold", "cold")
+    assert reloads == ["unload", "d.gguf"] and not pool.standby
+
+
+def test_reloading_the_active_model_stops_the_replaced_server(pool):
+    first, _ = model_lifecycle.switch_model("a.gguf")
+    # Повторная загрузка той же модели (например, с другим ctx-size) идёт через горячую замену
+    second, _ = model_lifecycle.switch_model("a.gguf")
+
+    assert shared.model is second and second is not first
+    assert first.stopped and not pool.standby
+
+
+class WarmingServer:
+    def warm_up(self, prompts, add_bos_token=True):
+        self.prompts, self.add_bos_token = prompts, add_bos_token
+        return len(prompts)
+
+
+def test_warm_up_renders_prefixes_with_the_incoming_model_templates(tmp_path, monkeypatch):
+    hot_prefixes = tmp_path / "hot_prefixes.json"
+    hot_prefixes.write_text(json.dumps({"anna": "You are Anna.\n\n"}), encoding="utf-8")
+    monkeypatch.setattr(shared.args, "hot_prefixes", str(hot_prefixes))
+    monkeypatch.setattr(shared.args, "warmup_characters", None)
+    monkeypatch.setattr(model_lifecycle.utils, "get_available_characters", lambda: ["None"])
+    monkeypatch.setitem(shared.settings, "instruction_template_str", "OLD {{ messages[-1].content }}")
+    monkeypatch.setitem(shared.settings, "custom_system_message", "")
+    monkeypatch.setitem(shared.settings, "add_bos_token", True)
+
+    # Шаблон новой модели ещё не применён к shared.settings
+    metadata = {"instruction_template_str": "[INST] {{ messages[-1].content }} [/INST]", "add_bos_token": False}
+    server = WarmingServer()
+    model_lifecycle.warm_up(server, "b.gguf", metadata)
+
+    assert server.prompts == ["[INST] You are Anna.\n\n"]
+    assert server.add_bos_token is False
+    assert shared.settings["instruction_template_str"].startswith("OLD")
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Тесты снимков слотов llama.cpp (LlamaServer.warm_up с --slot-cache-dir):
+первый сервер вычисляет префиксы и сохраняет слоты, следующий для той же
+модели восстанавливает их без вычисления, устаревшие снимки удаляются.
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("llama_cpp_binaries")
+
+TEXTGEN_ROOT = Path(__file__).parent.parent.parent / "text-generation-webui"
+sys.path.insert(0, str(TEXTGEN_ROOT))
+
+from modules import shared  # noqa: E402
+from modules.llama_cpp_server import LlamaServer  # noqa: E402
+
+
+class Response:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeLlamaServerHTTP:
+    """/props, /completion и /slots поверх каталога снимков."""
+
+    def __init__(self, slot_dir, total_slots=2):
+        self.slot_dir = slot_dir
+        self.total_slots = total_slots
+        self.slots = {}
+        self.evaluated = []
+
+    def get(self, url):
+        assert url.endswith("/props")
+        return Response({"total_slots": self.total_slots})
+
+    def post(self, url, **kwargs):
+        payload = kwargs["json"]
+        path = url.split("127.0.0.1:", 1)[1].split("/", 1)[1]
+        if path == "completion":
+            assert payload["n_predict"] == 0
+            self.evaluated.append(payload["prompt"])
+            self.slots[payload["id_slot"]] = payload["prompt"]
+            return Response({})
+
+        slot_id, action = path[len("slots/"):].split("?action=")
+        file = self.slot_dir / payload["filename"]
+        if action == "save":
+            file.write_text(json.dumps(self.slots[int(slot_id)]))
+            return Response({"n_saved": len(self.slots[int(slot_id)])})
+
+        tokens = json.loads(file.read_text())
+        self.slots[int(slot_id)] = tokens
+        return Response({"n_restored": len(tokens)})
+
+
+def make_server(model_path, slot_dir):
+    server = LlamaServer.__new__(LlamaServer)
+    server.model_path = str(model_path)
+    server.port = 1
+    server.process = None
+    server.bos_token = "<s>"
+    server.session = FakeLlamaServerHTTP(slot_dir)
+    server.encode = lambda text, add_bos_token=False: text.split()
+    return server
+
+
+@pytest.fixture
+def model(tmp_path, monkeypatch):
+    slot_dir = tmp_path / "slots"
+    slot_dir.mkdir()
+    monkeypatch.setattr(shared.args, "slot_cache_dir", str(slot_dir))
+    path = tmp_path / "model.gguf"
+    path.write_bytes(b"gguf")
+    return path, slot_dir
+
+
+def test_snapshots_are_restored_by_the_next_server(model):
+    path, slot_dir = model
+    prompts = ["system prompt of anna", "system prompt of bella", "does not fit in the slots"]
+
+    first = make_server(path, slot_dir)
+    assert first.warm_up(prompts) == 2
+    assert len(first.session.evaluated) == 2
+    assert len(list(slot_dir.glob("*.bin"))) == 2
+
+    second = make_server(path, slot_dir)
+    assert second.warm_up(prompts) == 2
+    assert second.session.evaluated == []
+    assert second.session.slots == first.session.slots
+
+
+def test_changed_prefixes_and_cache_settings_are_evaluated_again(model, monkeypatch):
+    path, slot_dir = model
+    make_server(path, slot_dir).warm_up(["anna", "bella"])
+
+    # Снимок bella больше не нужен и удаляется
+    server = make_server(path, slot_dir)
+    server.warm_up(["anna", "clara"])
+    assert server.session.evaluated == [["clara"]]
+    assert len(list(slot_dir.glob("*.bin"))) == 2
+
+    monkeypatch.setattr(shared.args, "cache_type", "q8_0")
+    server = make_server(path, slot_dir)
+    server.warm_up(["anna", "clara"])
+    assert server.session.evaluated == [["anna"], ["clara"]]
+    # Снимки для прежнего типа кэша принадлежат другому ключу и не удаляются
+    assert len(list(slot_dir.glob("*.bin"))) == 4
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Тесты усечения промпта чата (modules/token_counting.py): точка отсечения
+вычисляется по закэшированным длинам сообщений, а шаблон рендерится
+и токенизируется целиком лишь несколько раз.
+"""
+
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("gradio")
+
+TEXTGEN_ROOT = Path(__file__).parent.parent.parent / "text-generation-webui"
+sys.path.insert(0, str(TEXTGEN_ROOT))
+
+from modules import chat, token_counting  # noqa: E402,F401
+
+
+class WordTokenizer:
+    """Токен — слово; BOS добавляется к полному промпту."""
+
+    def __init__(self):
+        self.fragments = 0
+        self.prompts = 0
+
+    def encode(self, text, add_special_tokens=True, add_bos_token=True):
+        self.fragments += 1
+        return [text.split()]
+
+    def prompt_length(self, prompt):
+        self.prompts += 1
+        return 1 + len(prompt.split())
+
+
+@pytest.fixture
+def tokenizer(monkeypatch):
+    tokenizer = WordTokenizer()
+    monkeypatch.setattr(token_counting, "encode", tokenizer.encode)
+    monkeypatch.setattr(token_counting, "get_encoded_length", tokenizer.prompt_length)
+    monkeypatch.setattr(token_counting, "apply_extensions", lambda typ, text: None)
+    token_counting.clear_cache()
+    yield tokenizer
+    token_counting.clear_cache()
+
+
+def render(messages):
+    # Каждое сообщение обёрнуто тегами шаблона, в конце — префикс ответа
+    body = " ".join(f"<|{m['role']}|> {m['content']} <|end|>" for m in messages)
+    return f"{body} <|assistant|>"
+
+
+def make_history(turns):
+    messages = [{"role": "system", "content": "You are a helpful assistant. " * 5}]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question {i} " + "word " * (i % 7 + 3)})
+        messages.append({"role": "assistant", "content": f"answer {i} " + "text " * (i % 11 + 5)})
+    messages.append({"role": "user", "content": "final question"})
+    return messages
+
+
+def render_role_tags(messages):
+    # Теги пользователя длиннее тегов ассистента
+    tags = {"system": "<|system|>", "user": "<|start|> <|user|> <|turn|>", "assistant": "<|assistant|>"}
+    body = " ".join(f"{tags[m['role']]} {m['content']} <|end|>" for m in messages)
+    return f"{body} <|assistant|>"
+
+
+def truncate_one_by_one(messages, max_length, render=render):
+    """Прежний алгоритм: удалять по одному сообщению и перетокенизировать промпт."""
+    messages = [dict(m) for m in messages]
+    while 1 + len(render(messages).split()) > max_length and len(messages) > 2:
+        messages.pop(1)
+    return messages
+
+
+@pytest.mark.parametrize("max_length", [60, 200, 777, 1500])
+def test_truncation_matches_one_by_one(tokenizer, max_length):
+    messages = make_history(200)
+    expected = truncate_one_by_one(messages, max_length)
+
+    renders = []
+
+    def make_prompt(msgs):
+        renders.append(len(msgs))
+        return render(msgs)
+
+    prompt, length = token_counting.truncate_messages(messages, make_prompt, max_length)
+
+    assert messages == expected
+    assert prompt == render(expected)
+    assert length == 1 + len(prompt.split())
+    # Вместо сотен перерендеров — единицы (последний — проверка, не вернуть ли сообщение)
+    assert len(renders) <= 4
+    assert tokenizer.prompts <= 4
+
+
+def test_truncation_with_unequal_role_overheads_keeps_as_many_messages(tokenizer):
+    rng = random.Random(0)
+    for _ in range(300):
+        messages = [{"role": "system", "content": "system " * rng.randint(1, 20)}]
+        for i in range(rng.randint(1, 40)):
+            role = "user" if i % 2 == 0 else "assistant"
+            messages.append({"role": role, "content": " ".join(f"w{role[0]}{i}" for _ in range(rng.randint(1, 15)))})
+        max_length = rng.randint(20, 400)
+        expected = truncate_one_by_one(messages, max_length, render_role_tags)
+
+        prompt, length = token_counting.truncate_messages(messages, render_role_tags, max_length)
+
+        assert messages == expected
+        assert prompt == render_role_tags(expected) and length == 1 + len(prompt.split())
+
+
+def test_message_counts_are_reused_across_turns(tokenizer):
+    history = make_history(100)
+    token_counting.truncate_messages([dict(m) for m in history], render, 300)
+    first_turn = tokenizer.fragments
+
+    # Следующий ход: добавились ответ и новый вопрос, старые сообщения уже посчитаны
+    history[-1:] = [
+        {"role": "user", "content": "final question"},
+        {"role": "assistant", "content": "new answer"},
+        {"role": "user", "content": "next question"},
+    ]
+    token_counting.truncate_messages([dict(m) for m in history], render, 300)
+
+    assert first_turn > 0
+    assert tokenizer.fragments - first_turn <= 2
+
+
+def test_fitting_prompt_is_not_rendered_again(tokenizer):
+    messages = make_history(3)
+    prompt = render(messages)
+    result = token_counting.truncate_messages(messages, render, 10_000, prompt, 1 + len(prompt.split()))
+
+    assert result == (prompt, 1 + len(prompt.split()))
+    assert tokenizer.prompts == 0 and tokenizer.fragments == 0
+
+
+def test_truncate_last_message_keeps_longest_fitting_prefix(tokenizer):
+    words = [f"w{i}" for i in range(500)]
+    messages = [{"role": "system", "content": "short system"}, {"role": "user", "content": " ".join(words)}]
+
+    prompt, length = token_counting.truncate_last_message(messages, render, 100)
+
+    assert length == 100
+    assert messages[-1]["content"].split() == words[:length - (1 + len(render([messages[0], {"role": "user", "content": ""}]).split()))]
+    assert prompt == render(messages)
+
+
+def test_truncate_last_message_reports_overflow_when_template_does_not_fit(tokenizer):
+    messages = [{"role": "system", "content": "system " * 50}, {"role": "user", "content": "hello"}]
+
+    prompt, length = token_counting.truncate_last_message(messages, render, 20)
+
+    assert length > 20
+    assert messages[-1]["content"] == ""
+
+
+def make_state(turns):
+    internal = [[f"question {i}", f"answer {i} " + "text " * 5] for i in range(turns)]
+    return {
+        "unique_id": "chat-1",
+        "mode": "instruct",
+        "history": {"internal": internal, "visible": internal, "metadata": {}},
+        "instruction_template_str": "template",
+        "truncation_length": 4096,
+    }
+
+
+def build_prompt_for(state, calls):
+    def build_prompt(user_input):
+        calls.append(user_input)
+        messages = []
+        for question, answer in state["history"]["internal"]:
+            messages += [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+        if user_input:
+            messages.append({"role": "user", "content": user_input})
+        return render(messages)
+
+    return build_prompt
+
+
+def test_live_counter_renders_history_once_per_turn(tokenizer):
+    state = make_state(50)
+    calls = []
+    build_prompt = build_prompt_for(state, calls)
+
+    for text in ["h", "hello", "hello there", "hello there my friend"]:
+        count = token_counting.count_prompt_with_input(state, [text, ""], build_prompt)
+        assert count == 1 + len(build_prompt(text).split())
+        calls.pop()
+
+    # История отрендерена дважды (без ввода и с заглушкой), дальше токенизируется только ввод
+    assert len(calls) == 2
+    assert token_counting.count_prompt_with_input(state, ["", ""], build_prompt) == 1 + len(build_prompt("").split())
+    calls.pop()
+    assert len(calls) == 2
+
+    # Новый ход меняет отпечаток истории — префикс пересчитывается
+    state["history"]["internal"].append(["hello there my friend", "hi"])
+    token_counting.count_prompt_with_input(state, ["next"], build_prompt)
+    assert len(calls) == 4
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Тесты подготовки сырого текстового датасета для обучения LoRA
+(modules/training_data.py): потоковое разбиение файлов, токенизация
+в нескольких процессах и повторное использование memmap-кэша токенов.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("torch")
+tokenizers = pytest.importorskip("tokenizers")
+transformers = pytest.importorskip("transformers")
+
+TEXTGEN_ROOT = Path(__file__).parent.parent.parent / "text-generation-webui"
+sys.path.insert(0, str(TEXTGEN_ROOT))
+
+from modules import training_data  # noqa: E402
+from modules.training_data import RawTextConfig  # noqa: E402
+
+CORPUS = [
+    "Первый файл.\nСтрока про обучение модели.\n\n\nВторой блок текста,\nв котором есть переносы строк.\r\n",
+    "Продолжение второго блока из следующего файла.\n\n\nКоротко\n\n\n"
+    + "Длинный блок, который режется на несколько окон с перекрытием. " * 20,
+]
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    backend = tokenizers.ByteLevelBPETokenizer()
+    backend.train_from_iterator(CORPUS * 10, vocab_size=400, special_tokens=["<pad>", "<s>", "</s>"])
+    tok = transformers.PreTrainedTokenizerFast(
+        tokenizer_object=backend._tokenizer, bos_token="<s>", eos_token="</s>", pad_token="<pad>",
+    )
+    tok.pad_token_id = 0
+    return tok
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i, text in enumerate(CORPUS):
+        path = tmp_path / f"part{i}.txt"
+        path.write_bytes(text.encode("utf-8"))
+        paths.append(path)
+    return paths
+
+
+@pytest.fixture
+def config():
+    return RawTextConfig(
+        cutoff_len=32, overlap_len=8, newline_favor_len=4, cut_string="\n\n\n",
+        train_only_after="", add_eos_token=True, min_chars=10,
+    )
+
+
+def reference_samples(file_paths, tokenizer, config):
+    """Прежний алгоритм do_train: весь текст в памяти и последовательная токенизация."""
+    raw_text = "".join(Path(p).read_text(encoding="utf-8").replace("\r", "") for p in file_paths)
+    samples = []
+    for text_part in raw_text.split(config.cut_string):
+        if len(text_part.strip()) <= config.min_chars:
+            continue
+        tokens = tokenizer.encode(text_part)
+        if config.add_eos_token:
+            tokens.append(tokenizer.eos_token_id)
+        for chunk in training_data.split_chunks(tokens, config.cutoff_len, config.cutoff_len - config.overlap_len):
+            text = training_data.cut_chunk_for_newline(tokenizer.decode(chunk), config.newline_favor_len)
+            samples.append(training_data.tokenize_sample(tokenizer, text, config.cutoff_len, config.train_only_after))
+    return samples
+
+
+@pytest.mark.parametrize("block_size", [1, 2, 7, 1 << 20])
+@pytest.mark.parametrize("cut_string", ["\n\n\n", "\n", "блок"])
+def test_streaming_split_matches_str_split(files, block_size, cut_string):
+    raw_text = "".join(p.read_text(encoding="utf-8") for p in files).replace("\r", "")
+    parts = list(training_data.iter_text_parts(files, cut_string, block_size=block_size))
+    assert parts == raw_text.split(cut_string)
+
+
+def test_samples_match_serial_preparation(files, tokenizer, config, tmp_path):
+    dataset = training_data.prepare_raw_text_dataset(files, tokenizer, config, num_workers=1, cache_dir=tmp_path / "cache")
+    expected = reference_samples(files, tokenizer, config)
+
+    assert len(dataset) == len(expected) > 3
+    for i, (input_ids, labels) in enumerate(expected):
+        sample = dataset[i]
+        assert sample["input_ids"].tolist() == input_ids
+        assert sample["labels"] == labels
+        assert sample["attention_mask"].tolist() == [t != tokenizer.pad_token_id for t in input_ids]
+
+
+def test_worker_processes_produce_same_cache(files, tokenizer, config, tmp_path):
+    serial = training_data.prepare_raw_text_dataset(files, tokenizer, config, num_workers=1, cache_dir=tmp_path / "a")
+    parallel = training_data.prepare_raw_text_dataset(files, tokenizer, config, num_workers=2, cache_dir=tmp_path / "b")
+
+    assert (serial.input_ids == parallel.input_ids).all()
+    assert (serial.train_mask == parallel.train_mask).all()
+
+
+def test_second_run_reuses_cache(files, tokenizer, config, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    first = training_data.prepare_raw_text_dataset(files, tokenizer, config, num_workers=1, cache_dir=cache_dir)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("dataset was tokenized again")
+
+    monkeypatch.setattr(training_data, "_iter_tokenized", fail)
+    second = training_data.prepare_raw_text_dataset(files, tokenizer, config, cache_dir=cache_dir)
+    assert (second.input_ids == first.input_ids).all()
+
+    # Изменение данных или настроек даёт другой ключ кэша
+    monkeypatch.undo()
+    files[0].write_text("Изменённый файл с новым содержимым.", encoding="utf-8")
+    changed = training_data.prepare_raw_text_dataset(files, tokenizer, config, num_workers=1, cache_dir=cache_dir)
+    other = training_data.prepare_raw_text_dataset(
+        files, tokenizer, RawTextConfig(**{**config.__dict__, "cutoff_len": 48}), num_workers=1, cache_dir=cache_dir,
+    )
+    assert len(list(cache_dir.iterdir())) == 3
+    assert other.input_ids.shape[1] == 48
+    assert len(changed) != len(first)
+
+
+def test_overlap_must_be_smaller_than_cutoff(files, tokenizer, tmp_path):
+    config = RawTextConfig(16, 16, 0, "\n\n\n", "", False, 0)
+    with pytest.raises(ValueError):
+        training_data.prepare_raw_text_dataset(files, tokenizer, config, cache_dir=tmp_path)
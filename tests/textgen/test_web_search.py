@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Тесты загрузки страниц для веб-поиска (modules/web_search.py):
+дисковый кэш с условными запросами и усечение по токенам за один проход.
+"""
+
+import hashlib
+import sys
+import threading
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("html2text")
+pytest.importorskip("gradio")
+
+TEXTGEN_ROOT = Path(__file__).parent.parent.parent / "text-generation-webui"
+sys.path.insert(0, str(TEXTGEN_ROOT))
+
+from modules import shared, web_search  # noqa: E402
+
+PAGE = "<html><body><h1>Заголовок</h1><p>Текст страницы</p></body></html>"
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """Отдаёт одну HTML-страницу с ETag и отвечает 304 на If-None-Match."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = PAGE.encode("utf-8")
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        self.server.requests_log.append(self.headers.get("If-None-Match"))
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def page_server(tmp_path, monkeypatch):
+    monkeypatch.setattr(shared.args, "disk_cache_dir", str(tmp_path / "cache"))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(PageHandler))
+    server.requests_log = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/page", server
+    server.shutdown()
+
+
+def test_page_is_served_from_cache_within_ttl(page_server):
+    url, server = page_server
+
+    first = web_search.download_web_page(url)
+    second = web_search.download_web_page(url)
+
+    assert "Текст страницы" in first
+    assert second == first
+    assert server.requests_log == [None]
+
+
+def test_stale_page_is_revalidated(page_server, monkeypatch):
+    url, server = page_server
+    first = web_search.download_web_page(url)
+
+    monkeypatch.setattr(web_search, "PAGE_CACHE_TTL", 0)
+    second = web_search.download_web_page(url)
+
+    assert second == first
+    assert len(server.requests_log) == 2
+    assert server.requests_log[1] is not None  # отправлен If-None-Match, сервер ответил 304
+
+
+def test_stale_copy_is_used_when_server_is_down(page_server, monkeypatch):
+    url, server = page_server
+    first = web_search.download_web_page(url)
+    server.shutdown()
+    server.server_close()
+
+    monkeypatch.setattr(web_search, "PAGE_CACHE_TTL", 0)
+    assert web_search.download_web_page(url, timeout=1) == first
+
+
+class OffsetTokenizer:
+    """Посимвольный токенизатор с offset mapping, как у быстрых токенизаторов HF."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, text, add_special_tokens=True, return_offsets_mapping=False):
+        self.calls += 1
+        return {"offset_mapping": [(i, i + 1) for i in range(len(text))]}
+
+
+class EncodeOnlyTokenizer:
+    """Токенизатор без offset mapping (как LlamaServer): только encode/decode."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, text):
+        self.calls += 1
+        return [ord(c) for c in text]
+
+    def decode(self, tokens, **kwargs):
+        return "".join(chr(t) for t in tokens)
+
+
+@pytest.mark.parametrize("tokenizer_class", [OffsetTokenizer, EncodeOnlyTokenizer])
+def test_truncation_uses_single_tokenizer_pass(monkeypatch, tokenizer_class):
+    tokenizer = tokenizer_class()
+    monkeypatch.setattr(shared, "tokenizer", tokenizer)
+    content = "абвгд" * 1000
+
+    assert web_search.truncate_content_by_tokens(content, max_tokens=1234) == content[:1234]
+    assert web_search.truncate_content_by_tokens("коротко", max_tokens=1234) == "коротко"
+    assert tokenizer.calls == 2
@@ -0,0 +1,143 @@
+'''
+Micro-benchmark for the DRY repetition penalty.
+
+Compares the vectorized DRYLogitsProcessor against the original per-row
+Python implementation, checks that both produce the same scores, and prints
+the average time per sampling step.
+
+Usage:
+python benchmarks/dry_benchmark.py --range 4096 --steps 64 --batch 1
+'''
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class ReferenceDRYLogitsProcessor:
+    '''
+    The original per-row, per-occurrence implementation, kept here as the
+    baseline for correctness and timing.
+    '''
+
+    def __init__(self, multiplier, base, allowed_length, sequence_breakers, _range):
+        self.multiplier = multiplier
+        self.base = base
+        self.allowed_length = allowed_length
+        self.sequence_breakers = sequence_breakers
+        self._range = _range
+
+    def __call__(self, input_ids, scores):
+        if self._range > 0:
+            input_ids = input_ids[:, -self._range:]
+
+        for input_ids_row, scores_row in zip(input_ids, scores):
+            input_ids = input_ids_row.tolist()
+
+            last_token = input_ids[-1]
+            if last_token in self.sequence_breakers:
+                continue
+
+            match_indices = [idx for idx, val in enumerate(input_ids[:-1]) if val == last_token]
+            match_lengths = {}
+            for i in match_indices:
+                next_token = input_ids[i + 1]
+                if next_token in self.sequence_breakers:
+                    continue
+
+                match_length = 1
+                while match_length < 50:
+                    j = i - match_length
+                    if j < 0:
+                        break
+
+                    previous_token = input_ids[-(match_length + 1)]
+                    if input_ids[j] != previous_token:
+                        break
+
+                    if previous_token in self.sequence_breakers:
+                        break
+
+                    match_length += 1
+
+                match_lengths[next_token] = max(match_length, match_lengths.get(next_token, 0))
+
+            for token, match_length in match_lengths.items():
+                if match_length >= self.allowed_length:
+                    scores_row[token] -= self.multiplier * self.base ** (match_length - self.allowed_length)
+
+        return scores
+
+
+def make_context(batch, length, vocab_size, seed):
+    '''
+    Builds a context that looks like text to the penalty: token frequencies
+    follow a Zipf distribution and phrases get repeated with some noise.
+    '''
+    generator = torch.Generator().manual_seed(seed)
+    zipf = 1.0 / torch.arange(1, vocab_size + 1, dtype=torch.float)
+    phrases = [torch.multinomial(zipf, int(n), replacement=True, generator=generator) for n in torch.randint(4, 40, (256,), generator=generator)]
+    rows = []
+    for _ in range(batch):
+        row = []
+        while len(row) < length:
+            row.extend(phrases[int(torch.randint(0, len(phrases), (1,), generator=generator))].tolist())
+            row.extend(torch.multinomial(zipf, 4, replacement=True, generator=generator).tolist())
+
+        rows.append(row[:length])
+
+    return torch.tensor(rows, dtype=torch.long)
+
+
+def run(processor_factory, context, prompt_length, vocab_size):
+    processor = processor_factory()
+    outputs = [torch.zeros((context.shape[0], vocab_size)) for _ in range(prompt_length, context.shape[1] + 1)]
+    start = time.perf_counter()
+    for scores, end in zip(outputs, range(prompt_length, context.shape[1] + 1)):
+        processor(context[:, :end], scores)
+
+    elapsed = time.perf_counter() - start
+    return elapsed, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch', type=int, default=1)
+    parser.add_argument('--range', type=int, default=4096, help='dry_penalty_last_n / repetition_penalty_range.')
+    parser.add_argument('--prompt-length', type=int, default=4096)
+    parser.add_argument('--steps', type=int, default=64, help='Number of generated tokens to simulate.')
+    parser.add_argument('--vocab-size', type=int, default=32000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # modules.shared parses sys.argv on import and does not know the options above
+    sys.argv = sys.argv[:1]
+    from modules.sampler_hijack import DRYLogitsProcessor
+
+    vocab_size = args.vocab_size
+    context = make_context(args.batch, args.prompt_length + args.steps, vocab_size, args.seed)
+    sequence_breakers = {token for token in (20, 21, 22, 23) if token < vocab_size}
+    kwargs = dict(multiplier=0.8, base=1.75, allowed_length=2, sequence_breakers=sequence_breakers, _range=args.range)
+
+    reference_time, reference_outputs = run(lambda: ReferenceDRYLogitsProcessor(**kwargs), context, args.prompt_length, vocab_size)
+    vectorized_time, vectorized_outputs = run(lambda: DRYLogitsProcessor(**kwargs), context, args.prompt_length, vocab_size)
+
+    for expected, actual in zip(reference_outputs, vectorized_outputs):
+        if not torch.allclose(expected, actual):
+            print('Mismatch between the reference and vectorized implementations.')
+            sys.exit(1)
+
+    steps = len(reference_outputs)
+    print(f'batch={args.batch} range={args.range} prompt_length={args.prompt_length} steps={steps}')
+    print(f'reference:  {1000 * reference_time / steps:.3f} ms/token')
+    print(f'vectorized: {1000 * vectorized_time / steps:.3f} ms/token')
+    print(f'speedup:    {reference_time / vectorized_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
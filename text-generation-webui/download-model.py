@@ -14,6 +14,9 @@ import json
 import os
 import re
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from multiprocessing import Array
 from pathlib import Path
 from time import sleep
@@ -26,13 +29,158 @@ from tqdm.contrib.concurrent import thread_map
 
 base = os.environ.get("HF_ENDPOINT") or "https://huggingface.co"
 
+# Files at least this large are fetched with several HTTP range requests
+MIN_MULTIPART_SIZE = 64 * 1024 ** 2
+CHUNK_SIZE = 32 * 1024 ** 2
+BLOCK_SIZE = 1024 * 1024
+
+# How often (in bytes per chunk) the sidecar manifest is persisted
+MANIFEST_FLUSH_INTERVAL = 16 * 1024 ** 2
+
+
+class ChecksumError(Exception):
+    pass
+
+
+class DownloadScheduler:
+    '''
+    Shared across all files of a download: caps the number of open
+    connections and the total bandwidth (token bucket, 0 = unlimited).
+    '''
+
+    def __init__(self, max_connections=8, max_bandwidth=0):
+        self.max_bandwidth = max_bandwidth
+        self._connections = threading.BoundedSemaphore(max_connections)
+        self._lock = threading.Lock()
+        self._allowance = float(max_bandwidth)
+        self._last_check = time.monotonic()
+
+    def connection(self):
+        return self._connections
+
+    def throttle(self, nbytes):
+        if self.max_bandwidth <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.max_bandwidth, self._allowance + (now - self._last_check) * self.max_bandwidth)
+            self._last_check = now
+            self._allowance -= nbytes
+            wait = -self._allowance / self.max_bandwidth if self._allowance < 0 else 0
+
+        if wait > 0:
+            sleep(wait)
+
+
+class DownloadProgress:
+    '''
+    Thread-safe byte counters for every file of a download. snapshot() is
+    meant to be polled from the UI.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}
+        self._started = time.monotonic()
+        self._session_bytes = 0
+
+    def set_file(self, filename, total, downloaded=0):
+        with self._lock:
+            self._files[filename] = {'total': total, 'downloaded': downloaded, 'status': 'downloading'}
+
+    def update(self, filename, nbytes):
+        with self._lock:
+            self._files[filename]['downloaded'] += nbytes
+            self._session_bytes += nbytes
+
+    def set_status(self, filename, status):
+        with self._lock:
+            if filename in self._files:
+                self._files[filename]['status'] = status
+
+    def snapshot(self):
+        with self._lock:
+            files = {k: dict(v) for k, v in self._files.items()}
+            elapsed = max(time.monotonic() - self._started, 1e-6)
+            speed = self._session_bytes / elapsed
+
+        total = sum(f['total'] for f in files.values())
+        downloaded = sum(f['downloaded'] for f in files.values())
+        return {
+            'files': files,
+            'total_bytes': total,
+            'downloaded_bytes': downloaded,
+            'fraction': downloaded / total if total > 0 else 0.0,
+            'speed': speed,
+            'eta': (total - downloaded) / speed if speed > 0 else None,
+        }
+
+
+class DownloadManifest:
+    '''
+    Sidecar file (<name>.part.json) next to a partial download that records
+    how many bytes of each chunk are already on disk, so that interrupted
+    downloads resume where they stopped.
+    '''
+
+    def __init__(self, path, url, size, etag, chunks):
+        self.path = path
+        self.url = url
+        self.size = size
+        self.etag = etag
+        self.chunks = chunks  # list of [start, end, downloaded]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, path, url, size, etag, chunk_size, existing_bytes=0):
+        chunks = []
+        for start in range(0, max(size, 1), chunk_size):
+            end = min(start + chunk_size, size)
+            chunks.append([start, end, min(max(existing_bytes - start, 0), end - start)])
+
+        return cls(path, url, size, etag, chunks)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            data = json.loads(path.read_text())
+            return cls(path, data['url'], data['size'], data.get('etag'), data['chunks'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def matches(self, size, etag):
+        return self.size == size and (self.etag is None or etag is None or self.etag == etag)
+
+    def advance(self, index, nbytes):
+        with self._lock:
+            self.chunks[index][2] += nbytes
+
+    def pending_chunks(self):
+        # A zero-length chunk stands for a file of unknown size
+        return [i for i, (start, end, downloaded) in enumerate(self.chunks) if start + downloaded < end or (end == 0 and downloaded == 0)]
+
+    def downloaded_bytes(self):
+        return sum(chunk[2] for chunk in self.chunks)
+
+    def save(self):
+        with self._lock:
+            temp_path = self.path.with_suffix('.tmp')
+            temp_path.write_text(json.dumps({'url': self.url, 'size': self.size, 'etag': self.etag, 'chunks': self.chunks}))
+            os.replace(temp_path, self.path)
+
 
 class ModelDownloader:
-    def __init__(self, max_retries=7):
+    def __init__(self, max_retries=7, connections=4, max_bandwidth=0):
         self.max_retries = max_retries
+        self.connections = connections
+        self.max_bandwidth = max_bandwidth
         self.session = self.get_session()
         self._progress_bar_slots = None
         self.progress_queue = None
+        self.progress = DownloadProgress()
+        self.scheduler = None
+        self.expected_sha256 = {}
 
     def get_session(self):
         session = requests.Session()
@@ -222,81 +370,159 @@ class ModelDownloader:
         with self.progress_bar_slots.get_lock():
             self.progress_bar_slots[slot] = 0
 
+    def get_remote_file_info(self, url):
+        '''
+        Returns (size, etag, accepts_ranges) for the final (redirected) URL.
+        '''
+        r = self.session.head(url, timeout=20, allow_redirects=True)
+        r.raise_for_status()
+        size = int(r.headers.get('content-length', 0))
+        etag = r.headers.get('x-linked-etag') or r.headers.get('etag')
+        accepts_ranges = r.headers.get('accept-ranges', '').lower() == 'bytes'
+        return size, etag, accepts_ranges
+
+    def download_chunk(self, url, part_path, manifest, index, filename, progress_bar):
+        start, end, downloaded = manifest.chunks[index]
+        headers = {'Range': f'bytes={start + downloaded}-{end - 1}'} if end > 0 else {}
+        since_flush = 0
+
+        with self.scheduler.connection():
+            with self.session.get(url, stream=True, headers=headers, timeout=30) as r:
+                r.raise_for_status()
+                if headers and r.status_code != 206:
+                    if start + downloaded > 0:
+                        raise RequestException(f"The server ignored the range request for {filename}.")
+
+                with open(part_path, 'r+b') as f:
+                    f.seek(start + downloaded)
+                    for data in r.iter_content(BLOCK_SIZE):
+                        data = data[:end - start - manifest.chunks[index][2]] if end > 0 else data
+                        if not data:
+                            break
+
+                        self.scheduler.throttle(len(data))
+                        f.write(data)
+                        manifest.advance(index, len(data))
+                        self.progress.update(filename, len(data))
+                        progress_bar.update(len(data))
+                        if self.progress_queue is not None:
+                            self.progress_queue.put((self.progress.snapshot()['fraction'], filename))
+
+                        since_flush += len(data)
+                        if since_flush >= MANIFEST_FLUSH_INTERVAL:
+                            f.flush()
+                            manifest.save()
+                            since_flush = 0
+
+                    f.flush()
+
+        manifest.save()
+        if manifest.chunks[index][2] < end - start:
+            raise RequestException(f"Connection closed before chunk {index} of {filename} was complete.")
+
+    def verify_file(self, path, filename):
+        expected = self.expected_sha256.get(filename)
+        if expected is None:
+            return
+
+        self.progress.set_status(filename, 'verifying')
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(BLOCK_SIZE * 8), b''):
+                sha.update(data)
+
+        if sha.hexdigest() != expected:
+            raise ChecksumError(f'Checksum failed: {filename}  {expected}')
+
     def get_single_file(self, url, output_folder, start_from_scratch=False):
         filename = Path(url.rsplit('/', 1)[1])
+        filename_str = str(filename)
         output_path = output_folder / filename
+        part_path = output_folder / f'{filename}.part'
+        manifest_path = output_folder / f'{filename}.part.json'
         progress_bar_position = self.get_progress_bar_position()
 
         max_retries = self.max_retries
         attempt = 0
-        file_downloaded_count_for_progress = 0
 
         try:
             while attempt < max_retries:
                 attempt += 1
-                session = self.session
-                headers = {}
-                mode = 'wb'
-                current_file_size_on_disk = 0
 
                 try:
+                    total_size, etag, accepts_ranges = self.get_remote_file_info(url)
+
                     if output_path.exists() and not start_from_scratch:
-                        current_file_size_on_disk = output_path.stat().st_size
-                        r_head = session.head(url, timeout=20)
-                        r_head.raise_for_status()
-                        total_size = int(r_head.headers.get('content-length', 0))
-
-                        if current_file_size_on_disk >= total_size and total_size > 0:
-                            if self.progress_queue is not None and total_size > 0:
-                                self.progress_queue.put((1.0, str(filename)))
+                        if output_path.stat().st_size >= total_size and total_size > 0:
+                            self.progress.set_file(filename_str, total_size, total_size)
+                            self.progress.set_status(filename_str, 'done')
+                            if self.progress_queue is not None:
+                                self.progress_queue.put((self.progress.snapshot()['fraction'], filename_str))
                             return
 
-                        headers = {'Range': f'bytes={current_file_size_on_disk}-'}
-                        mode = 'ab'
-
-                    with session.get(url, stream=True, headers=headers, timeout=30) as r:
-                        r.raise_for_status()
-                        total_size_from_stream = int(r.headers.get('content-length', 0))
-                        if mode == 'ab':
-                            effective_total_size = current_file_size_on_disk + total_size_from_stream
-                        else:
-                            effective_total_size = total_size_from_stream
-
-                        block_size = 1024 * 1024
-                        filename_str = str(filename)
-
-                        tqdm_kwargs = {
-                            'total': effective_total_size,
-                            'initial': current_file_size_on_disk if mode == 'ab' else 0,
-                            'unit': 'B',
-                            'unit_scale': True,
-                            'unit_divisor': 1024,
-                            'bar_format': '{desc}{percentage:3.0f}%|{bar:50}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]',
-                            'desc': f"{filename_str}: ",
-                            'position': progress_bar_position,
-                            'leave': False
-                        }
-
-                        if 'COLAB_GPU' in os.environ:
-                            tqdm_kwargs.update({
-                                'position': 0,
-                                'leave': True
-                            })
-
-                        with open(output_path, mode) as f:
-                            if mode == 'ab':
-                                f.seek(current_file_size_on_disk)
-
-                            with tqdm.tqdm(**tqdm_kwargs) as t:
-                                file_downloaded_count_for_progress = current_file_size_on_disk
-                                for data in r.iter_content(block_size):
-                                    f.write(data)
-                                    t.update(len(data))
-                                    if effective_total_size != 0 and self.progress_queue is not None:
-                                        file_downloaded_count_for_progress += len(data)
-                                        progress_fraction = float(file_downloaded_count_for_progress) / float(effective_total_size)
-                                        self.progress_queue.put((progress_fraction, filename_str))
-                        break
+                        # Partial file from an older, single-stream download: keep its bytes
+                        if not part_path.exists():
+                            os.replace(output_path, part_path)
+                            manifest_path.unlink(missing_ok=True)
+
+                    if start_from_scratch:
+                        part_path.unlink(missing_ok=True)
+                        manifest_path.unlink(missing_ok=True)
+
+                    manifest = DownloadManifest.load(manifest_path) if part_path.exists() else None
+                    if not accepts_ranges or total_size == 0:
+                        # No way to resume or split the file: restart from zero
+                        manifest = DownloadManifest.create(manifest_path, url, total_size, etag, max(total_size, 1))
+                    elif manifest is None or not manifest.matches(total_size, etag):
+                        # A .part file without a manifest is the prefix of a single-stream download
+                        existing_bytes = part_path.stat().st_size if part_path.exists() and manifest is None else 0
+                        chunk_size = CHUNK_SIZE if total_size >= MIN_MULTIPART_SIZE else total_size
+                        manifest = DownloadManifest.create(manifest_path, url, total_size, etag, chunk_size, existing_bytes=existing_bytes)
+
+                    with open(part_path, 'r+b' if part_path.exists() else 'wb') as f:
+                        f.truncate(total_size)
+
+                    manifest.save()
+                    self.progress.set_file(filename_str, total_size, manifest.downloaded_bytes())
+
+                    tqdm_kwargs = {
+                        'total': total_size,
+                        'initial': manifest.downloaded_bytes(),
+                        'unit': 'B',
+                        'unit_scale': True,
+                        'unit_divisor': 1024,
+                        'bar_format': '{desc}{percentage:3.0f}%|{bar:50}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}]',
+                        'desc': f"{filename_str}: ",
+                        'position': progress_bar_position,
+                        'leave': False
+                    }
+
+                    if 'COLAB_GPU' in os.environ:
+                        tqdm_kwargs.update({
+                            'position': 0,
+                            'leave': True
+                        })
+
+                    with tqdm.tqdm(**tqdm_kwargs) as t:
+                        pending = manifest.pending_chunks()
+                        with ThreadPoolExecutor(max_workers=max(1, min(self.connections, len(pending)))) as executor:
+                            futures = [executor.submit(self.download_chunk, url, part_path, manifest, i, filename_str, t) for i in pending]
+                            for future in futures:
+                                future.result()
+
+                    self.verify_file(part_path, filename_str)
+                    os.replace(part_path, output_path)
+                    manifest_path.unlink(missing_ok=True)
+                    self.progress.set_status(filename_str, 'done')
+                    break
+
+                except ChecksumError as e:
+                    print(f"{e}. The file will be downloaded again.")
+                    part_path.unlink(missing_ok=True)
+                    manifest_path.unlink(missing_ok=True)
+                    self.progress.set_status(filename_str, 'failed')
+                    if attempt >= max_retries:
+                        raise
 
                 except (RequestException, ConnectionError, Timeout) as e:
                     print(f"Error downloading {filename}: {e}.")
@@ -305,12 +531,14 @@ class ModelDownloader:
                         print(f"Retry begins in {2 ** attempt} seconds.")
                         sleep(2 ** attempt)
                     else:
+                        self.progress.set_status(filename_str, 'failed')
                         print("Failed to download after the maximum number of attempts.")
         finally:
             self.release_progress_bar_position(progress_bar_position)
 
     def start_download_threads(self, file_list, output_folder, start_from_scratch=False, threads=4):
         self.initialize_progress_bar_slots(threads)
+        self.scheduler = DownloadScheduler(max_connections=max(threads, self.connections), max_bandwidth=self.max_bandwidth)
         tqdm.tqdm.set_lock(tqdm.tqdm.get_lock())
         try:
             thread_map(
@@ -324,6 +552,7 @@ class ModelDownloader:
 
     def download_model_files(self, model, branch, links, sha256, output_folder, progress_queue=None, start_from_scratch=False, threads=4, specific_file=None, is_llamacpp=False):
         self.progress_queue = progress_queue
+        self.expected_sha256 = {Path(item[0]).name: item[1] for item in sha256}
 
         output_folder.mkdir(parents=True, exist_ok=True)
 
@@ -358,8 +587,11 @@ class ModelDownloader:
                 continue
 
             with open(output_folder / sha256[i][0], "rb") as f:
-                bytes = f.read()
-                file_hash = hashlib.sha256(bytes).hexdigest()
+                sha = hashlib.sha256()
+                for data in iter(lambda: f.read(BLOCK_SIZE * 8), b''):
+                    sha.update(data)
+
+                file_hash = sha.hexdigest()
                 if file_hash != sha256[i][1]:
                     print(f'Checksum failed: {sha256[i][0]}  {sha256[i][1]}')
                     validated = False
@@ -378,6 +610,8 @@ if __name__ == '__main__':
     parser.add_argument('MODEL', type=str, default=None, nargs='?')
     parser.add_argument('--branch', type=str, default='main', help='Name of the Git branch to download from.')
     parser.add_argument('--threads', type=int, default=4, help='Number of files to download simultaneously.')
+    parser.add_argument('--connections', type=int, default=4, help='Number of parallel range requests per large file.')
+    parser.add_argument('--max-bandwidth', type=float, default=0, help='Total bandwidth limit in MB/s across all files (0 = unlimited).')
     parser.add_argument('--text-only', action='store_true', help='Only download text files (txt/json).')
     parser.add_argument('--specific-file', type=str, default=None, help='Name of the specific file to download (if not provided, downloads all).')
     parser.add_argument('--exclude-pattern', type=str, default=None, help='Regex pattern to exclude files from download.')
@@ -397,7 +631,7 @@ if __name__ == '__main__':
         print("Error: Please specify the model you'd like to download (e.g. 'python download-model.py facebook/opt-1.3b').")
         sys.exit()
 
-    downloader = ModelDownloader(max_retries=args.max_retries)
+    downloader = ModelDownloader(max_retries=args.max_retries, connections=args.connections, max_bandwidth=int(args.max_bandwidth * 1024 ** 2))
     # Clean up the model/branch names
     try:
         model, branch = downloader.sanitize_model_and_branch_names(model, branch)
@@ -3,6 +3,7 @@ import copy
 import functools
 import html
 import json
+import os
 import pprint
 import re
 import time
@@ -30,6 +31,12 @@ from modules.text_generation import (
     get_encoded_length,
     get_max_prompt_length
 )
+from modules.token_counting import (
+    count_prompt_with_input,
+    count_tokens,
+    truncate_last_message,
+    truncate_messages
+)
 from modules.utils import delete_file, get_available_characters, save_file
 from modules.web_search import add_web_search_attachments
 
@@ -154,6 +161,23 @@ def get_thinking_suppression_string(template):
     return without_thinking[i:len(without_thinking) - j if j else None]
 
 
+def format_attachments(attachments):
+    """Attachment block appended to a user message ('' if there are no attachments)"""
+    attachments_text = ""
+    for attachment in attachments:
+        filename = attachment.get("name", "file")
+        content = attachment.get("content", "")
+        if attachment.get("type") == "text/html" and attachment.get("url"):
+            attachments_text += f"\nName: {filename}\nURL: {attachment['url']}\nContents:\n\n=====\n{content}\n=====\n\n"
+        else:
+            attachments_text += f"\nName: {filename}\nContents:\n\n=====\n{content}\n=====\n\n"
+
+    if not attachments_text:
+        return ""
+
+    return f"\n\nATTACHMENTS:\n{attachments_text}"
+
+
 def generate_chat_prompt(user_input, state, **kwargs):
     impersonate = kwargs.get('impersonate', False)
     _continue = kwargs.get('_continue', False)
@@ -270,17 +294,9 @@ def generate_chat_prompt(user_input, state, **kwargs):
 
             # Add attachment content if present AND if past attachments are enabled
             if (state.get('include_past_attachments', True) and user_key in metadata and "attachments" in metadata[user_key]):
-                attachments_text = ""
-                for attachment in metadata[user_key]["attachments"]:
-                    filename = attachment.get("name", "file")
-                    content = attachment.get("content", "")
-                    if attachment.get("type") == "text/html" and attachment.get("url"):
-                        attachments_text += f"\nName: {filename}\nURL: {attachment['url']}\nContents:\n\n=====\n{content}\n=====\n\n"
-                    else:
-                        attachments_text += f"\nName: {filename}\nContents:\n\n=====\n{content}\n=====\n\n"
-
+                attachments_text = format_attachments(metadata[user_key]["attachments"])
                 if attachments_text:
-                    enhanced_user_msg = f"{user_msg}\n\nATTACHMENTS:\n{attachments_text}"
+                    enhanced_user_msg = f"{user_msg}{attachments_text}"
 
             messages.insert(insert_pos, {"role": "user", "content": enhanced_user_msg})
 
@@ -300,17 +316,9 @@ def generate_chat_prompt(user_input, state, **kwargs):
             user_key = f"user_{current_row_idx}"
 
             if user_key in metadata and "attachments" in metadata[user_key]:
-                attachments_text = ""
-                for attachment in metadata[user_key]["attachments"]:
-                    filename = attachment.get("name", "file")
-                    content = attachment.get("content", "")
-                    if attachment.get("type") == "text/html" and attachment.get("url"):
-                        attachments_text += f"\nName: {filename}\nURL: {attachment['url']}\nContents:\n\n=====\n{content}\n=====\n\n"
-                    else:
-                        attachments_text += f"\nName: {filename}\nContents:\n\n=====\n{content}\n=====\n\n"
-
+                attachments_text = format_attachments(metadata[user_key]["attachments"])
                 if attachments_text:
-                    user_input = f"{user_input}\n\nATTACHMENTS:\n{attachments_text}"
+                    user_input = f"{user_input}{attachments_text}"
 
         messages.append({"role": "user", "content": user_input})
 
@@ -394,57 +402,29 @@ def generate_chat_prompt(user_input, state, **kwargs):
     if shared.tokenizer is not None:
         max_length = get_max_prompt_length(state)
         encoded_length = get_encoded_length(prompt)
-        while len(messages) > 0 and encoded_length > max_length:
-
-            # Remove old message, save system message
-            if len(messages) > 2 and messages[0]['role'] == 'system':
-                messages.pop(1)
-
-            # Remove old message when no system message is present
-            elif len(messages) > 1 and messages[0]['role'] != 'system':
-                messages.pop(0)
 
-            # Resort to truncating the user input
+        # Remove old messages, save system message and the last message
+        if encoded_length > max_length:
+            prompt, encoded_length = truncate_messages(messages, make_prompt, max_length, prompt, encoded_length)
+
+        # Resort to truncating the user input
+        if encoded_length > max_length and len(messages) > 0:
+            user_message = messages[-1]['content']
+            prompt, encoded_length = truncate_last_message(messages, make_prompt, max_length)
+            if encoded_length > max_length:
+                logger.error(f"Failed to build the chat prompt. The input is too long for the available context length.\n\nTruncation length: {state['truncation_length']}\nmax_new_tokens: {state['max_new_tokens']} (is it too high?)\nAvailable context length: {max_length}\n")
+                raise ValueError
             else:
-                user_message = messages[-1]['content']
+                # Calculate token counts for the log message
+                original_user_tokens = count_tokens(user_message)
+                truncated_user_tokens = count_tokens(messages[-1]['content'])
+                total_context = max_length + state['max_new_tokens']
 
-                # Bisect the truncation point
-                left, right = 0, len(user_message)
-
-                while left < right:
-                    mid = (left + right + 1) // 2
-
-                    messages[-1]['content'] = user_message[:mid]
-                    prompt = make_prompt(messages)
-                    encoded_length = get_encoded_length(prompt)
-
-                    if encoded_length <= max_length:
-                        left = mid
-                    else:
-                        right = mid - 1
-
-                messages[-1]['content'] = user_message[:left]
-                prompt = make_prompt(messages)
-                encoded_length = get_encoded_length(prompt)
-                if encoded_length > max_length:
-                    logger.error(f"Failed to build the chat prompt. The input is too long for the available context length.\n\nTruncation length: {state['truncation_length']}\nmax_new_tokens: {state['max_new_tokens']} (is it too high?)\nAvailable context length: {max_length}\n")
-                    raise ValueError
-                else:
-                    # Calculate token counts for the log message
-                    original_user_tokens = get_encoded_length(user_message)
-                    truncated_user_tokens = get_encoded_length(user_message[:left])
-                    total_context = max_length + state['max_new_tokens']
-
-                    logger.warning(
-                        f"User message truncated from {original_user_tokens} to {truncated_user_tokens} tokens. "
-                        f"Context full: {max_length} input tokens ({total_context} total, {state['max_new_tokens']} for output). "
-                        f"Increase ctx-size while loading the model to avoid truncation."
-                    )
-
-                    break
-
-            prompt = make_prompt(messages)
-            encoded_length = get_encoded_length(prompt)
+                logger.warning(
+                    f"User message truncated from {original_user_tokens} to {truncated_user_tokens} tokens. "
+                    f"Context full: {max_length} input tokens ({total_context} total, {state['max_new_tokens']} for output). "
+                    f"Increase ctx-size while loading the model to avoid truncation."
+                )
 
     if also_return_rows:
         return prompt, [message['content'] for message in messages]
@@ -467,25 +447,15 @@ def count_prompt_tokens(text_input, state):
             text = text_input
             files = []
 
-        # Create temporary history copy to add attachments
-        temp_history = copy.deepcopy(state['history'])
-        if 'metadata' not in temp_history:
-            temp_history['metadata'] = {}
-
-        # Process attachments if any
-        if files:
-            row_idx = len(temp_history['internal'])
-            for file_path in files:
-                add_message_attachment(temp_history, row_idx, file_path, is_user=True)
-
-        # Create temp state with modified history
-        temp_state = copy.deepcopy(state)
-        temp_state['history'] = temp_history
-
-        # Build prompt using existing logic
-        prompt = generate_chat_prompt(text, temp_state)
-        current_tokens = get_encoded_length(prompt)
-        max_tokens = temp_state['truncation_length']
+        # The history part is tokenized once per chat turn; while typing,
+        # only the new input and the attachments are tokenized
+        attachments = [attachment for attachment in map(read_attachment_cached, files) if attachment is not None]
+        current_tokens = count_prompt_with_input(
+            state,
+            [text.strip(), format_attachments(attachments)],
+            lambda user_input: generate_chat_prompt(user_input, state)
+        )
+        max_tokens = state['truncation_length']
 
         percentage = (current_tokens / max_tokens) * 100 if max_tokens > 0 else 0
 
@@ -588,6 +558,16 @@ def add_message_attachment(history, row_idx, file_path, is_user=True):
     if "attachments" not in history['metadata'][key]:
         history['metadata'][key]["attachments"] = []
 
+    attachment = read_attachment(file_path)
+    if attachment is None:
+        return None
+
+    history['metadata'][key]["attachments"].append(attachment)
+    return attachment["content"]  # Return the content for reuse
+
+
+def read_attachment(file_path):
+    """Read a file into an attachment dict (None if it can't be read)"""
     # Get file info using pathlib
     path = Path(file_path)
     filename = path.name
@@ -608,20 +588,32 @@ def add_message_attachment(history, row_idx, file_path, is_user=True):
                 content = f.read()
             file_type = "text/plain"
 
-        # Add attachment
-        attachment = {
+        return {
             "name": filename,
             "type": file_type,
             "content": content,
         }
-
-        history['metadata'][key]["attachments"].append(attachment)
-        return content  # Return the content for reuse
     except Exception as e:
         logger.error(f"Error processing attachment {filename}: {e}")
         return None
 
 
+@functools.lru_cache(maxsize=32)
+def _read_attachment_version(file_path, mtime, size):
+    return read_attachment(file_path)
+
+
+def read_attachment_cached(file_path):
+    """read_attachment() that re-reads the file only when it changes on disk"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return read_attachment(file_path)
+
+    attachment = _read_attachment_version(str(file_path), stat.st_mtime_ns, stat.st_size)
+    return dict(attachment) if attachment is not None else None
+
+
 def extract_pdf_text(pdf_path):
     """Extract text from a PDF file"""
     import PyPDF2
@@ -1348,11 +1340,7 @@ def generate_pfp_cache(character):
     return None
 
 
-def load_character(character, name1, name2):
-    context = greeting = ""
-    greeting_field = 'greeting'
-    picture = None
-
+def read_character_file(character):
     filepath = None
     for extension in ["yml", "yaml", "json"]:
         filepath = Path(f'user_data/characters/{character}.{extension}')
@@ -1364,14 +1352,13 @@ def load_character(character, name1, name2):
         raise ValueError
 
     file_contents = open(filepath, 'r', encoding='utf-8').read()
-    data = json.loads(file_contents) if extension == "json" else yaml.safe_load(file_contents)
-    cache_folder = Path(shared.args.disk_cache_dir)
+    return json.loads(file_contents) if extension == "json" else yaml.safe_load(file_contents)
 
-    for path in [Path(f"{cache_folder}/pfp_character.png"), Path(f"{cache_folder}/pfp_character_thumb.png")]:
-        if path.exists():
-            path.unlink()
 
-    picture = generate_pfp_cache(character)
+def character_fields(data, name1, name2):
+    """Returns (name1, name2, greeting, context) for a parsed character file"""
+    context = greeting = ""
+    greeting_field = 'greeting'
 
     # Finding the bot's name
     for k in ['name', 'bot', '<|bot|>', 'char_name']:
@@ -1392,9 +1379,78 @@ def load_character(character, name1, name2):
         greeting_field = 'char_greeting'
 
     greeting = data.get(greeting_field, greeting)
+    return name1, name2, greeting, context
+
+
+def load_character(character, name1, name2):
+    data = read_character_file(character)
+    cache_folder = Path(shared.args.disk_cache_dir)
+
+    for path in [Path(f"{cache_folder}/pfp_character.png"), Path(f"{cache_folder}/pfp_character_thumb.png")]:
+        if path.exists():
+            path.unlink()
+
+    picture = generate_pfp_cache(character)
+    name1, name2, greeting, context = character_fields(data, name1, name2)
     return name1, name2, picture, greeting, context
 
 
+def character_prompt_prefix(character, state=None):
+    """
+    The beginning shared by every chat prompt for this character: the rendered
+    context, wrapped in the chat-instruct command if that mode is active.
+    Returns '' in instruct mode, where the character is not part of the prompt.
+    """
+    state = state or shared.settings
+    if state['mode'] == 'instruct':
+        return ''
+
+    name1, name2, _, context = character_fields(read_character_file(character), state['name1'], state['name2'])
+    if context.strip() == '' and state['user_bio'].strip() == '':
+        return ''
+
+    chat_template = jinja_env.from_string(replace_character_names(state['chat_template_str'], name1, name2))
+    prefix = chat_template.render(
+        messages=[{"role": "system", "content": replace_character_names(context, name1, name2)}],
+        add_generation_prompt=False,
+        name1=name1,
+        name2=name2,
+        user_bio=replace_character_names(state['user_bio'], name1, name2),
+    )
+
+    if state['mode'] == 'chat-instruct':
+        # The chat prompt is embedded in the chat-instruct command
+        command = state['chat-instruct_command'].replace('<|character|>', name2).split('<|prompt|>')[0]
+        prefix = user_message_prefix(replace_character_names(command, name1, name2) + prefix, state)
+
+    return prefix
+
+
+def user_message_prefix(text, state=None):
+    """
+    The beginning of an instruct-mode prompt whose user message starts with
+    text, i.e. everything the instruction template renders before the rest
+    of that message.
+    """
+    state = state or shared.settings
+    marker = '<<|prefix-end|>>'
+    messages = []
+    if state['custom_system_message'].strip() != '':
+        messages.append({"role": "system", "content": state['custom_system_message']})
+
+    messages.append({"role": "user", "content": text + marker})
+    rendered = jinja_env.from_string(state['instruction_template_str']).render(
+        messages=messages,
+        builtin_tools=None,
+        tools=None,
+        tools_in_user_message=False,
+        add_generation_prompt=False,
+        reasoning_effort=state['reasoning_effort']
+    )
+
+    return rendered.split(marker)[0]
+
+
 def restore_character_for_ui(state):
     """Reset character fields to the currently loaded character's saved values"""
     if state['character_menu'] and state['character_menu'] != 'None':
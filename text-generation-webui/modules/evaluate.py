@@ -1,4 +1,8 @@
 import datetime
+import hashlib
+import json
+import math
+import time
 from pathlib import Path
 
 import pandas as pd
@@ -10,6 +14,13 @@ from modules.models import load_model, unload_model
 from modules.models_settings import get_model_metadata, update_model_parameters
 from modules.text_generation import encode
 
+CHECKPOINT_DIR = Path('user_data/logs/evaluations')
+CHECKPOINT_INTERVAL = 30  # seconds
+
+# llama.cpp: prompts per /completion request and number of top candidates returned per position
+LLAMACPP_BATCH_SIZE = 32
+LLAMACPP_N_PROBS = 100
+
 
 def load_past_evaluations():
     if Path('user_data/logs/evaluations.csv').exists():
@@ -37,20 +48,13 @@ def calculate_perplexity(models, input_dataset, stride, _max_length):
     https://huggingface.co/docs/transformers/perplexity#calculating-ppl-with-fixedlength-models
     '''
 
-    import torch
     from datasets import load_dataset
 
-    from modules.torch_utils import clear_torch_cache
-
-    if shared.args.loader == "llama.cpp":
-        logger.error("Perplexity evaluation is not implemented for the llama.cpp loader.")
-        raise ValueError
-
     if shared.args.loader == "ExLlamav2":
         logger.error("ExLlamav2_HF is required for perplexity evaluation with EXL2 models. Please reload the model with ExLlamav2_HF instead of ExLlamav2.")
         raise ValueError
 
-    if not shared.args.no_use_fast:
+    if not shared.args.no_use_fast and shared.args.loader != "llama.cpp":
         logger.warning("--no_use_fast is not set. If tokenizing the input dataset takes a long time, try reloading the model with that option set/checked.")
 
     global past_evaluations
@@ -93,50 +97,160 @@ def calculate_perplexity(models, input_dataset, stride, _max_length):
 
         cumulative_log += f"Processing `{shared.model_name}`...\n\n"
         yield cumulative_log + "Tokenizing the input dataset...\n\n"
-        encodings = encode(text, add_special_tokens=False)
+        is_llamacpp = shared.model.__class__.__name__ == 'LlamaServer'
+        encodings = encode(text, add_special_tokens=False, add_bos_token=not is_llamacpp)
         seq_len = encodings.shape[1]
         if _max_length:
             max_length = _max_length
+        elif is_llamacpp:
+            max_length = shared.args.ctx_size
         elif hasattr(shared.model.config, 'max_position_embeddings'):
             max_length = shared.model.config.max_position_embeddings
         else:
             max_length = 2048
 
-        nlls = []
-        prev_end_loc = 0
-        for begin_loc in tqdm(range(0, seq_len, stride)):
-            yield cumulative_log + f"Evaluating... {100*begin_loc/seq_len:.2f}%"
-            end_loc = min(begin_loc + max_length, seq_len)
-            trg_len = end_loc - prev_end_loc  # may be different from stride on last loop
-            input_ids = encodings[:, begin_loc:end_loc]
-            target_ids = input_ids.clone()
-            target_ids[:, :-trg_len] = -100
-            clear_torch_cache()
-            with torch.no_grad():
-                outputs = shared.model(input_ids=input_ids, labels=target_ids)
-
-                # loss is calculated using CrossEntropyLoss which averages over valid labels
-                # N.B. the model only calculates loss over trg_len - 1 labels, because it internally shifts the labels
-                # to the left by 1.
-                neg_log_likelihood = outputs.loss
-
-            nlls.append(neg_log_likelihood)
-            prev_end_loc = end_loc
-            if end_loc == seq_len:
-                break
-
-        ppl = torch.exp(torch.stack(nlls).mean())
-
-        add_entry_to_past_evaluations(float(ppl), shared.model_name, input_dataset, stride, _max_length)
+        windows = get_windows(seq_len, stride, max_length)
+        checkpoint_path = get_checkpoint_path(shared.model_name, input_dataset, stride, _max_length, seq_len)
+        nlls = load_checkpoint(checkpoint_path)
+        if nlls:
+            cumulative_log += f"Resuming from checkpoint: {len(nlls)}/{len(windows)} windows already evaluated.\n\n"
+            yield cumulative_log
+
+        if is_llamacpp:
+            window_nlls = llamacpp_window_nlls(encodings[0].tolist(), windows[len(nlls):])
+        else:
+            window_nlls = hf_window_nlls(encodings, windows[len(nlls):])
+
+        # Partial results are saved periodically and when the evaluation is interrupted
+        last_saved = time.time()
+        try:
+            for nll in tqdm(window_nlls, total=len(windows), initial=len(nlls)):
+                nlls.append(nll)
+                yield cumulative_log + f"Evaluating... {100 * len(nlls) / len(windows):.2f}%"
+                if time.time() - last_saved > CHECKPOINT_INTERVAL:
+                    save_checkpoint(checkpoint_path, nlls)
+                    last_saved = time.time()
+        finally:
+            if len(nlls) < len(windows):
+                save_checkpoint(checkpoint_path, nlls)
+
+        ppl = math.exp(sum(nlls) / len(nlls))
+
+        add_entry_to_past_evaluations(ppl, shared.model_name, input_dataset, stride, _max_length)
         save_past_evaluations(past_evaluations)
+        checkpoint_path.unlink(missing_ok=True)
 
-        message = f"The perplexity for `{shared.model_name}` is: {float(ppl)}"
+        message = f"The perplexity for `{shared.model_name}` is: {ppl}"
         logger.info(message)
 
         cumulative_log += f"{message}\n\n"
         yield cumulative_log
 
 
+def get_windows(seq_len, stride, max_length):
+    '''
+    Splits the sequence into (begin, end, trg_len) windows: each window
+    scores its last trg_len tokens, using the rest of it as context.
+    '''
+    windows = []
+    prev_end_loc = 0
+    for begin_loc in range(0, seq_len, stride):
+        end_loc = min(begin_loc + max_length, seq_len)
+        windows.append((begin_loc, end_loc, end_loc - prev_end_loc))  # trg_len may be different from stride on last loop
+        prev_end_loc = end_loc
+        if end_loc == seq_len:
+            break
+
+    return windows
+
+
+def hf_window_nlls(encodings, windows):
+    import torch
+
+    from modules.torch_utils import clear_torch_cache
+
+    for begin_loc, end_loc, trg_len in windows:
+        input_ids = encodings[:, begin_loc:end_loc]
+        target_ids = input_ids.clone()
+        target_ids[:, :-trg_len] = -100
+        clear_torch_cache()
+        with torch.no_grad():
+            outputs = shared.model(input_ids=input_ids, labels=target_ids)
+
+            # loss is calculated using CrossEntropyLoss which averages over valid labels
+            # N.B. the model only calculates loss over trg_len - 1 labels, because it internally shifts the labels
+            # to the left by 1.
+            neg_log_likelihood = outputs.loss
+
+        yield float(neg_log_likelihood)
+
+
+def llamacpp_window_nlls(token_ids, windows, batch_size=LLAMACPP_BATCH_SIZE, n_probs=LLAMACPP_N_PROBS):
+    '''
+    Same windows as hf_window_nlls, scored through the llama.cpp server.
+    Every scored position becomes a prompt ending right before it; prompts
+    from consecutive windows are sent together, batch_size per request.
+    Positions whose token is not among the top n_probs candidates are
+    scored exactly with a second request.
+    '''
+    def positions(window):
+        begin_loc, end_loc, trg_len = window
+        # As with HF, the first token of a window is never a target
+        return [(begin_loc, i) for i in range(max(begin_loc + 1, end_loc - trg_len), end_loc)]
+
+    def score(jobs):
+        logprobs = []
+        for i in range(0, len(jobs), batch_size):
+            batch = jobs[i:i + batch_size]
+            prompts = [token_ids[begin:pos] for begin, pos in batch]
+            for prompt, (begin, pos), top in zip(prompts, batch, shared.model.get_next_token_logprobs(prompts, n_probs=n_probs)):
+                target = token_ids[pos]
+                logprob = next((x['logprob'] for x in top if x['id'] == target), None)
+                if logprob is None:
+                    logprob = shared.model.get_token_logprob(prompt, target)
+
+                logprobs.append(logprob)
+
+        return logprobs
+
+    group = []
+    for n, window in enumerate(windows):
+        group.append(window)
+        if sum(len(positions(w)) for w in group) < batch_size and n < len(windows) - 1:
+            continue
+
+        jobs = [positions(w) for w in group]
+        logprobs = score([job for window_jobs in jobs for job in window_jobs])
+        for window_jobs in jobs:
+            window_logprobs, logprobs = logprobs[:len(window_jobs)], logprobs[len(window_jobs):]
+            yield -sum(window_logprobs) / max(len(window_logprobs), 1)
+
+        group = []
+
+
+def get_checkpoint_path(model, dataset, stride, max_length, seq_len):
+    key = json.dumps([model, ', '.join(shared.lora_names), dataset, stride, max_length, seq_len])
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+    return CHECKPOINT_DIR / f'{digest}.json'
+
+
+def load_checkpoint(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)['nlls']
+    except (OSError, ValueError, KeyError):
+        return []
+
+
+def save_checkpoint(path, nlls):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'nlls': nlls}, f)
+
+    tmp_path.replace(path)
+
+
 def add_entry_to_past_evaluations(perplexity, model, dataset, stride, max_length):
     global past_evaluations
     entry = {
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 import pprint
@@ -7,6 +8,7 @@ import subprocess
 import sys
 import threading
 import time
+from collections import OrderedDict
 from pathlib import Path
 
 import llama_cpp_binaries
@@ -17,6 +19,10 @@ from modules.logging_colors import logger
 
 llamacpp_valid_cache_types = {"fp16", "q8_0", "q4_0"}
 
+# Recently tokenized texts; the live token counter and prompt truncation
+# tokenize the same fragments over and over
+ENCODE_CACHE_SIZE = 1024
+
 
 class LlamaServer:
     def __init__(self, model_path, server_path=None):
@@ -31,6 +37,8 @@ class LlamaServer:
         self.vocabulary_size = None
         self.bos_token = "<s>"
         self.last_prompt_token_count = 0
+        self._encode_cache = OrderedDict()
+        self._encode_cache_lock = threading.Lock()
 
         # Start the server
         self._start_server()
@@ -39,6 +47,13 @@ class LlamaServer:
         if self.bos_token and text.startswith(self.bos_token):
             add_bos_token = False
 
+        key = (hashlib.sha1(text.encode('utf-8', 'surrogatepass')).digest(), bool(add_bos_token))
+        with self._encode_cache_lock:
+            tokens = self._encode_cache.get(key)
+            if tokens is not None:
+                self._encode_cache.move_to_end(key)
+                return list(tokens)
+
         url = f"http://127.0.0.1:{self.port}/tokenize"
         payload = {
             "content": text,
@@ -47,7 +62,16 @@ class LlamaServer:
 
         response = self.session.post(url, json=payload)
         result = response.json()
-        return result.get("tokens", [])
+        tokens = result.get("tokens", [])
+        if "tokens" not in result:
+            return tokens
+
+        with self._encode_cache_lock:
+            self._encode_cache[key] = tuple(tokens)
+            while len(self._encode_cache) > ENCODE_CACHE_SIZE:
+                self._encode_cache.popitem(last=False)
+
+        return tokens
 
     def decode(self, token_ids, **kwargs):
         url = f"http://127.0.0.1:{self.port}/detokenize"
@@ -229,6 +253,151 @@ class LlamaServer:
         else:
             raise Exception(f"Unexpected response format: 'completion_probabilities' not found in {result}")
 
+    def get_next_token_logprobs(self, prompts, n_probs=100):
+        """
+        Get the top log-probabilities of the next token after each of the
+        given tokenized prompts, using a single request for all of them.
+        """
+        url = f"http://127.0.0.1:{self.port}/completion"
+        payload = {
+            "prompt": prompts,
+            "n_predict": 0,
+            "logprobs": True,
+            "n_probs": n_probs,
+            "stream": False,
+            "post_sampling_probs": False,
+            "cache_prompt": True,
+        }
+
+        response = self.session.post(url, json=payload)
+        response.raise_for_status()
+        result = response.json()
+
+        # A single prompt returns an object, several prompts return a list in arbitrary order
+        results = result if isinstance(result, list) else [result]
+        results = sorted(results, key=lambda x: x.get("index", 0))
+        if len(results) != len(prompts) or any("completion_probabilities" not in x for x in results):
+            raise Exception(f"Unexpected response format: expected {len(prompts)} results with 'completion_probabilities'")
+
+        return [x["completion_probabilities"][0]["top_logprobs"] for x in results]
+
+    def get_token_logprob(self, prompt_ids, token_id):
+        """
+        Get the log-probability of a specific next token, even if it is not
+        among the top candidates. The token is forced with logit_bias; the
+        reported probability is taken from the logits before sampling.
+        """
+        url = f"http://127.0.0.1:{self.port}/completion"
+        payload = {
+            "prompt": prompt_ids,
+            "n_predict": 1,
+            "temperature": 0,
+            "logit_bias": [[token_id, 1000]],
+            "logprobs": True,
+            "n_probs": 1,
+            "stream": False,
+            "post_sampling_probs": False,
+            "cache_prompt": True,
+        }
+
+        response = self.session.post(url, json=payload)
+        response.raise_for_status()
+        probs = response.json()["completion_probabilities"][0]
+        if probs["id"] != token_id:
+            raise Exception(f"Could not force token {token_id}, got {probs['id']}")
+
+        return probs["logprob"]
+
+    def warm_up(self, prompts, add_bos_token=True):
+        """
+        Evaluate prompts into the prompt cache without generating tokens, one
+        server slot per prompt, so later requests sharing these prefixes skip
+        their prompt processing. With --slot-cache-dir, evaluated slots are
+        saved to disk and restored by later servers for the same model and
+        cache settings. Returns the number of prompts cached.
+        """
+        url = f"http://127.0.0.1:{self.port}/completion"
+        try:
+            total_slots = self.session.get(f"http://127.0.0.1:{self.port}/props").json().get("total_slots", 1)
+        except Exception:
+            total_slots = 1
+
+        warmed = restored = 0
+        snapshots = set()
+        for prompt in [p for p in prompts if p][:total_slots]:
+            tokens = self.encode(prompt, add_bos_token=add_bos_token)
+            filename = self._slot_snapshot_name(tokens) if shared.args.slot_cache_dir else None
+            if filename is not None:
+                snapshots.add(filename)
+
+            if filename is not None and self._restore_slot(warmed, filename, len(tokens)):
+                restored += 1
+            else:
+                payload = {
+                    "prompt": tokens,
+                    "n_predict": 0,
+                    "cache_prompt": True,
+                    "id_slot": warmed,
+                }
+                response = self.session.post(url, json=payload)
+                response.raise_for_status()
+                if filename is not None:
+                    self._save_slot(warmed, filename)
+
+            warmed += 1
+
+        if shared.args.slot_cache_dir:
+            if restored:
+                logger.info(f"Restored {restored} of {warmed} prompt prefixes from slot snapshots.")
+
+            self._prune_slot_snapshots(snapshots)
+
+        return warmed
+
+    def _slot_snapshot_key(self):
+        """Identifies the model and the settings that determine the KV cache layout"""
+        stat = Path(self.model_path).stat()
+        identity = [
+            Path(self.model_path).name, stat.st_size, stat.st_mtime_ns,
+            shared.args.ctx_size, shared.args.cache_type, shared.args.flash_attn, shared.args.extra_flags,
+        ]
+
+        return hashlib.sha1(json.dumps(identity).encode()).hexdigest()[:12]
+
+    def _slot_snapshot_name(self, tokens):
+        prefix_key = hashlib.sha1(json.dumps(tokens).encode()).hexdigest()[:16]
+        return f"{self._slot_snapshot_key()}-{prefix_key}.bin"
+
+    def _save_slot(self, slot_id, filename):
+        url = f"http://127.0.0.1:{self.port}/slots/{slot_id}?action=save"
+        try:
+            response = self.session.post(url, json={"filename": filename})
+            response.raise_for_status()
+            return True
+        except Exception as e:
+            logger.warning(f"Could not save slot {slot_id} to \"{filename}\": {e}")
+            return False
+
+    def _restore_slot(self, slot_id, filename, n_tokens):
+        """Load a saved slot; a missing, stale or incompatible snapshot returns False"""
+        if not (Path(shared.args.slot_cache_dir) / filename).is_file():
+            return False
+
+        url = f"http://127.0.0.1:{self.port}/slots/{slot_id}?action=restore"
+        try:
+            response = self.session.post(url, json={"filename": filename})
+            response.raise_for_status()
+            return response.json().get("n_restored") == n_tokens
+        except Exception as e:
+            logger.warning(f"Could not restore slot {slot_id} from \"{filename}\": {e}")
+            return False
+
+    def _prune_slot_snapshots(self, keep):
+        """Remove this model's snapshots of prefixes that are no longer warmed up"""
+        for path in Path(shared.args.slot_cache_dir).glob(f"{self._slot_snapshot_key()}-*.bin"):
+            if path.name not in keep:
+                path.unlink(missing_ok=True)
+
     def _get_vocabulary_size(self):
         """Get and store the model's maximum context length."""
         url = f"http://127.0.0.1:{self.port}/v1/models"
@@ -316,6 +485,10 @@ class LlamaServer:
                 cmd += ["--ctx-size-draft", str(shared.args.ctx_size_draft)]
         if shared.args.streaming_llm:
             cmd += ["--cache-reuse", "1"]
+        if shared.args.slot_cache_dir:
+            slot_cache_dir = Path(shared.args.slot_cache_dir).resolve()
+            slot_cache_dir.mkdir(parents=True, exist_ok=True)
+            cmd += ["--slot-save-path", str(slot_cache_dir)]
         if shared.args.extra_flags:
             # Clean up the input
             extra_flags = shared.args.extra_flags.strip()
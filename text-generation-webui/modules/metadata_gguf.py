@@ -1,5 +1,13 @@
+import hashlib
+import json
+import mmap
+import os
 import struct
+import tempfile
+from array import array
+from collections.abc import Sequence
 from enum import IntEnum
+from pathlib import Path
 
 
 class GGUFValueType(IntEnum):
@@ -47,46 +55,260 @@ value_type_info = {
 }
 
 
-def get_single(value_type, file):
+# Arrays with more elements than this (e.g. tokenizer.ggml.tokens) are
+# returned as lazy GGUFArray views instead of Python lists
+LAZY_ARRAY_THRESHOLD = 1024
+
+# Bump when the layout of the on-disk metadata cache changes
+CACHE_VERSION = 2
+
+
+def _decode_string(value):
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value
+
+
+def _read_single(value_type, buffer, offset):
+    """
+    Reads one value at `offset` and returns (value, new_offset).
+    """
     if value_type == GGUFValueType.STRING:
-        value_length = struct.unpack("<Q", file.read(8))[0]
-        value = file.read(value_length)
-        try:
-            value = value.decode('utf-8')
-        except:
-            pass
+        value_length = struct.unpack_from("<Q", buffer, offset)[0]
+        offset += 8
+        return _decode_string(bytes(buffer[offset:offset + value_length])), offset + value_length
+
+    value = struct.unpack_from(_simple_value_packing[value_type], buffer, offset)[0]
+    return value, offset + value_type_info[value_type]
+
+
+class GGUFArray(Sequence):
+    """
+    Read-only, lazily decoded view of a GGUF array.
+
+    Only the raw bytes of the array are kept; elements are decoded on access.
+    The bytes are read from the model file on first access when the array
+    comes from the on-disk metadata cache.
+    """
+
+    def __init__(self, path, value_type, length, offset, nbytes, buffer=None, string_offsets=None):
+        self.path = str(path)
+        self.value_type = GGUFValueType(value_type)
+        self.length = length
+        self.offset = offset
+        self.nbytes = nbytes
+        self._buffer = buffer
+        self._string_offsets = string_offsets
+
+    def _get_buffer(self):
+        if self._buffer is None:
+            with open(self.path, 'rb') as file:
+                file.seek(self.offset)
+                self._buffer = file.read(self.nbytes)
+
+        return self._buffer
+
+    def _get_string_offsets(self):
+        if self._string_offsets is None:
+            buffer = self._get_buffer()
+            offsets = array('Q')
+            position = 0
+            for _ in range(self.length):
+                offsets.append(position)
+                position += 8 + struct.unpack_from("<Q", buffer, position)[0]
+
+            self._string_offsets = offsets
+
+        return self._string_offsets
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+
+        if index < 0:
+            index += self.length
+
+        if not 0 <= index < self.length:
+            raise IndexError('GGUFArray index out of range')
+
+        if self.value_type == GGUFValueType.STRING:
+            return _read_single(self.value_type, self._get_buffer(), self._get_string_offsets()[index])[0]
+
+        return _read_single(self.value_type, self._get_buffer(), index * value_type_info[self.value_type])[0]
+
+    def __iter__(self):
+        buffer = self._get_buffer()
+        position = 0
+        for _ in range(self.length):
+            value, position = _read_single(self.value_type, buffer, position)
+            yield value
+
+    def __repr__(self):
+        return f'GGUFArray({self.value_type.name}, length={self.length})'
+
+    def to_cache(self):
+        return {'__gguf_array__': [int(self.value_type), self.length, self.offset, self.nbytes]}
+
+    @classmethod
+    def from_cache(cls, path, value):
+        value_type, length, offset, nbytes = value['__gguf_array__']
+        return cls(path, value_type, length, offset, nbytes)
+
+
+def _read_array(path, buffer, offset, value_type, length):
+    """
+    Returns (value, new_offset). Small arrays are decoded into lists; large
+    ones become GGUFArray views over a copy of their raw bytes.
+    """
+    if length <= LAZY_ARRAY_THRESHOLD:
+        values = []
+        for _ in range(length):
+            value, offset = _read_single(value_type, buffer, offset)
+            values.append(value)
+
+        return values, offset
+
+    start = offset
+    string_offsets = None
+    if value_type == GGUFValueType.STRING:
+        # The lengths have to be walked to find the end of the array anyway,
+        # so keep the element positions for O(1) random access later
+        string_offsets = array('Q')
+        for _ in range(length):
+            string_offsets.append(offset - start)
+            offset += 8 + struct.unpack_from("<Q", buffer, offset)[0]
+    elif value_type in value_type_info:
+        offset += length * value_type_info[value_type]
     else:
-        type_str = _simple_value_packing.get(value_type)
-        bytes_length = value_type_info.get(value_type)
-        value = struct.unpack(type_str, file.read(bytes_length))[0]
+        # Nested arrays are rare enough to be decoded eagerly
+        values = []
+        for _ in range(length):
+            value, offset = _read_value(path, buffer, offset, value_type)
+            values.append(value)
 
-    return value
+        return values, offset
+
+    view = GGUFArray(path, value_type, length, start, offset - start, buffer=bytes(buffer[start:offset]), string_offsets=string_offsets)
+    return view, offset
+
+
+def _read_value(path, buffer, offset, value_type):
+    if value_type == GGUFValueType.ARRAY:
+        ltype = GGUFValueType(struct.unpack_from("<I", buffer, offset)[0])
+        length = struct.unpack_from("<Q", buffer, offset + 4)[0]
+        return _read_array(path, buffer, offset + 12, ltype, length)
+
+    return _read_single(value_type, buffer, offset)
 
 
 def load_metadata(fname):
+    """
+    Parses the key/value section of a GGUF file through mmap. Scalars are
+    returned eagerly, large arrays as lazy GGUFArray views.
+    """
     metadata = {}
-    with open(fname, 'rb') as file:
-        GGUF_MAGIC = struct.unpack("<I", file.read(4))[0]
-        GGUF_VERSION = struct.unpack("<I", file.read(4))[0]
-        ti_data_count = struct.unpack("<Q", file.read(8))[0]
-        kv_data_count = struct.unpack("<Q", file.read(8))[0]
+    with open(fname, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        GGUF_MAGIC, GGUF_VERSION, ti_data_count, kv_data_count = struct.unpack_from("<IIQQ", buffer, 0)
+        offset = 24
 
         if GGUF_VERSION == 1:
             raise Exception('You are using an outdated GGUF, please download a new one.')
 
         for i in range(kv_data_count):
-            key_length = struct.unpack("<Q", file.read(8))[0]
-            key = file.read(key_length)
-
-            value_type = GGUFValueType(struct.unpack("<I", file.read(4))[0])
-            if value_type == GGUFValueType.ARRAY:
-                ltype = GGUFValueType(struct.unpack("<I", file.read(4))[0])
-                length = struct.unpack("<Q", file.read(8))[0]
-
-                arr = [get_single(ltype, file) for _ in range(length)]
-                metadata[key.decode()] = arr
-            else:
-                value = get_single(value_type, file)
-                metadata[key.decode()] = value
+            key_length = struct.unpack_from("<Q", buffer, offset)[0]
+            offset += 8
+            key = bytes(buffer[offset:offset + key_length]).decode()
+            offset += key_length
+
+            value_type = GGUFValueType(struct.unpack_from("<I", buffer, offset)[0])
+            metadata[key], offset = _read_value(fname, buffer, offset + 4, value_type)
+
+    return metadata
+
+
+def _to_cache_value(value):
+    if isinstance(value, GGUFArray):
+        return value.to_cache()
+    elif isinstance(value, bytes):
+        return {'__gguf_bytes__': value.hex()}
+    elif isinstance(value, list):
+        return [_to_cache_value(v) for v in value]
+
+    return value
+
+
+def _from_cache_value(path, value):
+    if isinstance(value, dict):
+        if '__gguf_array__' in value:
+            return GGUFArray.from_cache(path, value)
+
+        return bytes.fromhex(value['__gguf_bytes__'])
+    elif isinstance(value, list):
+        return [_from_cache_value(path, v) for v in value]
+
+    return value
+
+
+def _cache_file(cache_dir, path):
+    # One file per model, named after its resolved path
+    return Path(cache_dir) / f'{hashlib.sha256(path.encode()).hexdigest()[:32]}.json'
+
+
+def _read_cache(cache_file, path, stat):
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if (entry.get('version'), entry.get('path'), entry.get('size'), entry.get('mtime_ns')) != (CACHE_VERSION, path, stat.st_size, stat.st_mtime_ns):
+        return None
+
+    return entry['metadata']
+
+
+def _write_cache(cache_file, entry):
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=cache_file.parent, suffix='.tmp', delete=False) as f:
+        json.dump(entry, f)
+
+    try:
+        os.replace(f.name, cache_file)
+    except OSError:
+        os.unlink(f.name)
+        raise
+
+
+def load_metadata_cached(fname, cache_dir):
+    """
+    Same as load_metadata, but backed by a persistent JSON cache with one
+    file per model, keyed by (path, size, mtime), so that unchanged files
+    are never parsed twice.
+    """
+    path = str(Path(fname).resolve())
+    stat = os.stat(path)
+    cache_file = _cache_file(cache_dir, path)
+
+    cached = _read_cache(cache_file, path, stat)
+    if cached is not None:
+        return {k: _from_cache_value(path, v) for k, v in cached.items()}
+
+    metadata = load_metadata(path)
+    entry = {
+        'version': CACHE_VERSION,
+        'path': path,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'metadata': {k: _to_cache_value(v) for k, v in metadata.items()},
+    }
+
+    try:
+        _write_cache(cache_file, entry)
+    except OSError:
+        pass
 
     return metadata
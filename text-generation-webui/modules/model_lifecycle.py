@@ -0,0 +1,241 @@
+"""
+Hot-standby lifecycle for llama.cpp models.
+
+Switching models normally stops the running llama-server and cold-starts a
+new one, so chat is unavailable for the whole load. With --model-pool-size
+above 0 the new server is started on its own port while the current one
+keeps serving, its prompt cache is warmed with the hot and character
+prefixes (restored from slot snapshots with --slot-cache-dir), and
+shared.model is flipped between two generations. Replaced servers stay in a
+small LRU standby pool (bounded by --model-pool-size and
+--model-pool-memory) so switching back is instant.
+"""
+
+import json
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from pathlib import Path
+
+import modules.shared as shared
+from modules import utils
+from modules.logging_colors import logger
+
+
+def is_llama_server(model):
+    return model is not None and model.__class__.__name__ == 'LlamaServer'
+
+
+def server_size_mb(server):
+    from modules.models_settings import get_model_size_mb
+
+    try:
+        return get_model_size_mb(Path(server.model_path))
+    except OSError:
+        return 0.0
+
+
+def load_hot_prefixes():
+    """Prefixes from the --hot-prefixes JSON file: a list of strings or an object of name -> string"""
+    if not shared.args.hot_prefixes:
+        return []
+
+    try:
+        with open(shared.args.hot_prefixes, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read the hot prefixes from \"{shared.args.hot_prefixes}\": {e}")
+        return []
+
+    values = data.values() if isinstance(data, dict) else data
+    return [value for value in values if isinstance(value, str) and value.strip()]
+
+
+def model_state(metadata):
+    """shared.settings as they will be once the model with this metadata is loaded"""
+    return dict(shared.settings, **{k: v for k, v in metadata.items() if k in shared.settings})
+
+
+def warmup_prompts(state=None):
+    """
+    Prompt prefixes to keep warm: the --hot-prefixes entries, then the
+    characters listed in --warmup-characters (default: all)
+    """
+    from modules.chat import character_prompt_prefix, user_message_prefix
+
+    state = state or shared.settings
+    prompts = []
+    for text in load_hot_prefixes():
+        prefix = user_message_prefix(text, state)
+        if prefix not in prompts:
+            prompts.append(prefix)
+
+    characters = shared.args.warmup_characters or [c for c in utils.get_available_characters() if c != 'None']
+    for character in characters:
+        try:
+            prefix = character_prompt_prefix(character, state)
+        except Exception as e:
+            logger.warning(f"Could not build the warm-up prompt for \"{character}\": {e}")
+            continue
+
+        if prefix and prefix not in prompts:
+            prompts.append(prefix)
+
+    return prompts
+
+
+def warm_up(server, model_name, metadata=None):
+    """
+    Fill the prompt cache of a new server; failures only cost the first
+    requests their speed. The prefixes are rendered with the templates of
+    model_name, which are not in shared.settings until the switch.
+    """
+    try:
+        from modules.models_settings import get_model_metadata
+
+        state = model_state(metadata or get_model_metadata(model_name))
+        warmed = server.warm_up(warmup_prompts(state), add_bos_token=state['add_bos_token'])
+        if warmed:
+            logger.info(f"Warmed up \"{model_name}\" with {warmed} prompt prefix(es).")
+    except Exception as e:
+        logger.warning(f"Warm-up of \"{model_name}\" failed: {e}")
+
+
+class ModelPool:
+    def __init__(self):
+        self.standby = OrderedDict()  # model name -> LlamaServer, least recently used first
+        self.sizes = {}
+        self.lock = threading.RLock()
+
+    @property
+    def enabled(self):
+        return shared.args.model_pool_size > 0
+
+    def active_mb(self):
+        if not is_llama_server(shared.model):
+            return 0.0
+
+        with self.lock:
+            if shared.model_name not in self.sizes:
+                self.sizes[shared.model_name] = server_size_mb(shared.model)
+
+            return self.sizes[shared.model_name]
+
+    def used_mb(self):
+        with self.lock:
+            return self.active_mb() + sum(self.sizes.get(name, 0.0) for name in self.standby)
+
+    def _trim(self, reserve_mb=0.0):
+        """Stop least recently used standby servers until the pool fits its limits"""
+        budget = shared.args.model_pool_memory
+        with self.lock:
+            while self.standby and (
+                len(self.standby) > shared.args.model_pool_size
+                or (budget > 0 and self.used_mb() + reserve_mb > budget)
+            ):
+                name, server = self.standby.popitem(last=False)
+                logger.info(f"Stopping standby model \"{name}\".")
+                server.stop()
+
+    def fits(self, size_mb):
+        """Whether a new server fits next to the active one within the memory budget"""
+        budget = shared.args.model_pool_memory
+        return budget <= 0 or self.active_mb() + size_mb <= budget
+
+    def spawn(self, model_name, metadata=None):
+        """Start and warm up a server for model_name without touching shared.model"""
+        from modules.llama_cpp_server import LlamaServer
+        from modules.models import find_llama_cpp_model_file
+
+        server = LlamaServer(find_llama_cpp_model_file(model_name))
+        with self.lock:
+            self.sizes[model_name] = server_size_mb(server)
+
+        warm_up(server, model_name, metadata)
+        return server
+
+    def park(self, model_name, server):
+        """Keep a replaced server in standby, or stop it if the pool has no room"""
+        if not self.enabled or not is_llama_server(server):
+            if server is not None and is_llama_server(server):
+                server.stop()
+            return
+
+        with self.lock:
+            self.sizes.setdefault(model_name, server_size_mb(server))
+            self.standby[model_name] = server
+            self.standby.move_to_end(model_name)
+            self._trim()
+
+    def take(self, model_name):
+        """Remove and return the standby server for model_name"""
+        with self.lock:
+            return self.standby.pop(model_name, None)
+
+    def release_standby(self):
+        with self.lock:
+            while self.standby:
+                name, server = self.standby.popitem(last=False)
+                logger.info(f"Stopping standby model \"{name}\".")
+                server.stop()
+
+
+model_pool = ModelPool()
+
+
+def switch_model(model_name, loader=None):
+    """
+    Make model_name the active model. llama.cpp models are started next to the
+    current one and swapped in between generations; other loaders, a disabled
+    pool or a model that would not fit the memory budget use a regular reload.
+    """
+    from modules.models import load_model, unload_model
+    from modules.models_settings import get_model_metadata
+
+    metadata = get_model_metadata(model_name)
+    loader = loader or shared.args.loader or metadata['loader']
+    hot = model_pool.enabled and loader == 'llama.cpp' and (shared.model is None or is_llama_server(shared.model))
+
+    server = model_pool.take(model_name) if hot else None
+    if hot and server is None:
+        from modules.models import find_llama_cpp_model_file
+        from modules.models_settings import get_model_size_mb
+
+        try:
+            size_mb = get_model_size_mb(find_llama_cpp_model_file(model_name))
+        except (FileNotFoundError, OSError):
+            size_mb = 0.0
+
+        model_pool._trim(reserve_mb=size_mb)
+        if not model_pool.fits(size_mb):
+            logger.info(f"\"{model_name}\" does not fit next to the active model, switching with a reload.")
+            hot = False
+        else:
+            logger.info(f"Starting \"{model_name}\" while the current model keeps serving.")
+            server = model_pool.spawn(model_name, metadata)
+
+    if not hot:
+        unload_model()
+        shared.model, shared.tokenizer = load_model(model_name, loader)
+        return shared.model, shared.tokenizer
+
+    from modules.models import apply_loaded_model_settings
+
+    lock = shared.generation_lock or nullcontext()
+    with lock:
+        old_name, old_model = shared.model_name, shared.model
+        shared.model = shared.tokenizer = server
+        shared.model_name = model_name
+        shared.is_seq2seq = False
+        shared.args.loader = 'llama.cpp'
+        apply_loaded_model_settings(metadata, 'llama.cpp')
+
+    logger.info(f"Switched to \"{model_name}\".")
+    if old_model is not None and old_name != model_name:
+        model_pool.park(old_name, old_model)
+    elif is_llama_server(old_model):
+        # Reloading the active model (e.g. with a new ctx-size): the replaced
+        # server has nothing to stand by for
+        old_model.stop()
+
+    return server, server
@@ -59,10 +59,7 @@ def load_model(model_name, loader=None):
         logger.error(f"Error loading model '{model_name}' with loader '{loader}': {str(e)}")
         raise
 
-    shared.settings.update({k: v for k, v in metadata.items() if k in shared.settings})
-    if loader.lower().startswith('exllama') or loader.lower().startswith('tensorrt') or loader == 'llama.cpp':
-        shared.settings['truncation_length'] = shared.args.ctx_size
-
+    apply_loaded_model_settings(metadata, loader)
     logger.info(f"Loaded \"{model_name}\" in {(time.time()-t0):.2f} seconds.")
     logger.info(f"LOADER: \"{loader}\"")
     logger.info(f"TRUNCATION LENGTH: {shared.settings['truncation_length']}")
@@ -70,9 +67,13 @@ def load_model(model_name, loader=None):
     return model, tokenizer
 
 
-def llama_cpp_server_loader(model_name):
-    from modules.llama_cpp_server import LlamaServer
+def apply_loaded_model_settings(metadata, loader):
+    shared.settings.update({k: v for k, v in metadata.items() if k in shared.settings})
+    if loader.lower().startswith('exllama') or loader.lower().startswith('tensorrt') or loader == 'llama.cpp':
+        shared.settings['truncation_length'] = shared.args.ctx_size
+
 
+def find_llama_cpp_model_file(model_name):
     # Сначала проверяем, является ли model_name полным путем к файлу
     path = Path(model_name)
     if path.is_file():
@@ -107,13 +108,33 @@ def llama_cpp_server_loader(model_name):
         if model_file is None:
             raise FileNotFoundError(f"Model file not found for '{model_name}'. Searched in: {[str(p) for p in possible_paths]}")
 
+    return model_file
+
+
+def llama_cpp_server_loader(model_name):
+    from modules.llama_cpp_server import LlamaServer
+    from modules.model_lifecycle import model_pool, warm_up
+
+    # A warm standby server from the model pool is reused as is
+    model = model_pool.take(model_name)
+    if model is not None:
+        logger.info(f"Reusing the standby server for \"{model_name}\".")
+        return model, model
+
+    model_file = find_llama_cpp_model_file(model_name)
     try:
         model = LlamaServer(model_file)
-        return model, model
     except Exception as e:
         logger.error(f"Error loading the model with llama.cpp: {str(e)}")
         raise
 
+    # Restore the saved prompt prefixes so the first messages after a reload skip their evaluation.
+    # warm_up renders them with this model's templates; load_model applies its settings only afterwards.
+    if shared.args.slot_cache_dir:
+        warm_up(model, model_name)
+
+    return model, model
+
 
 def transformers_loader(model_name):
     from modules.transformers_loader import load_model_HF
@@ -176,6 +197,7 @@ def reload_model():
 
 def unload_model_if_idle():
     global last_generation_time
+    from modules.model_lifecycle import model_pool
 
     logger.info(f"Setting a timeout of {shared.args.idle_timeout} minutes to unload the model in case of inactivity.")
 
@@ -183,7 +205,11 @@ def unload_model_if_idle():
         shared.generation_lock.acquire()
         try:
             if time.time() - last_generation_time > shared.args.idle_timeout * 60:
-                if shared.model is not None:
+                if model_pool.enabled and model_pool.standby:
+                    # With a model pool the active model stays loaded and only standby models are released
+                    logger.info("Releasing standby models for inactivity.")
+                    model_pool.release_standby()
+                elif shared.model is not None and not model_pool.enabled:
                     logger.info("Unloading the model for inactivity.")
                     unload_model(keep_model_name=True)
         finally:
@@ -388,9 +388,15 @@ def save_instruction_template(model, template):
         yield (f"Instruction template for `{model}` saved to `{p}` as `{template}`.")
 
 
-@functools.lru_cache(maxsize=1)
 def load_gguf_metadata_with_cache(model_file):
-    return metadata_gguf.load_metadata(model_file)
+    stat = Path(model_file).stat()
+    return _load_gguf_metadata(str(model_file), stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=64)
+def _load_gguf_metadata(model_file, size, mtime_ns):
+    # size and mtime_ns are part of the key so that replaced files get re-read
+    return metadata_gguf.load_metadata_cached(model_file, Path(shared.args.disk_cache_dir) / 'gguf_metadata')
 
 
 def get_model_size_mb(model_file: Path) -> float:
@@ -283,73 +283,148 @@ class XTCLogitsWarper(LogitsProcessor):
 
 
 class DRYLogitsProcessor(LogitsProcessor):
+    '''
+    Vectorized DRY ("Don't Repeat Yourself") penalty.
+
+    For every position i of the context, the processor keeps the length of the
+    common suffix of input_ids[:i + 1] and input_ids (Z-array style). When a
+    single token is appended between calls, the whole state is advanced with
+    one shifted tensor comparison instead of re-scanning the context, and all
+    batch rows are handled in the same pass.
+    '''
+
+    # Matches are capped to prevent exponent overflow at penalty calculation
+    max_match_length = 50
+
     def __init__(self, multiplier: float, base: float, allowed_length: int, sequence_breakers: set[int], _range: int):
         self.multiplier = multiplier
         self.base = base
         self.allowed_length = allowed_length
         self.sequence_breakers = sequence_breakers
         self._range = _range
-
-    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        self._breaker_table = None
+        self._range_caps = None
+
+        # Incremental state: match lengths for the candidate positions of the
+        # previous call, plus what is needed to check that the new input_ids
+        # extend the previous ones by exactly one token.
+        self._match_lengths = None
+        self._seq_len = 0
+        self._last_tokens = None
+
+    def _build_breaker_table(self, vocab_size: int, device: torch.device):
+        # Boolean lookup table indexed by token id, cheaper than torch.isin per call
+        size = max([vocab_size] + [token + 1 for token in self.sequence_breakers])
+        self._breaker_table = torch.zeros(size, dtype=torch.bool, device=device)
+        if self.sequence_breakers:
+            self._breaker_table[torch.tensor(sorted(self.sequence_breakers), device=device)] = True
+
+    def _is_breaker(self, tokens: torch.LongTensor) -> torch.BoolTensor:
+        return self._breaker_table[tokens]
+
+    def _num_candidates(self, seq_len: int) -> int:
+        # Candidates are the positions whose next token is still inside the range
         if self._range > 0:
-            input_ids = input_ids[:, -self._range:]
+            return max(min(seq_len - 1, self._range - 1), 0)
+
+        return max(seq_len - 1, 0)
+
+    def _compute_match_lengths(self, input_ids: torch.LongTensor, num_candidates: int) -> torch.LongTensor:
+        '''
+        Computes the match lengths from scratch, extending all candidate
+        positions backwards at once (at most max_match_length tensor ops).
+        '''
+        seq_len = input_ids.shape[1]
+        positions = torch.arange(seq_len - 1 - num_candidates, seq_len - 1, device=input_ids.device)
+        last_tokens = input_ids[:, -1]
+
+        active = (input_ids[:, positions] == last_tokens.unsqueeze(1)) & ~self._is_breaker(last_tokens).unsqueeze(1)
+        match_lengths = active.long()
+        for offset in range(1, self.max_match_length):
+            previous_positions = positions - offset
+            valid = previous_positions >= 0
+            if not active.any() or not valid.any():
+                break
 
-        for input_ids_row, scores_row in zip(input_ids, scores):
-            # Use normal Python data types for improved performance
-            input_ids = input_ids_row.tolist()
+            previous_tokens = input_ids[:, seq_len - 1 - offset]
+            active = (
+                active
+                & valid
+                & (input_ids[:, previous_positions.clamp(min=0)] == previous_tokens.unsqueeze(1))
+                & ~self._is_breaker(previous_tokens).unsqueeze(1)
+            )
 
-            last_token = input_ids[-1]
-            if last_token in self.sequence_breakers:
-                continue
+            match_lengths += active
 
-            # Exclude the last token as it always matches.
-            match_indices = []
-            for idx, val in enumerate(input_ids[:-1]):
-                if val == last_token:
-                    match_indices.append(idx)
+        return match_lengths
 
-            # Stores the maximum matching sequence length
-            # for each token immediately following the sequence in the input.
-            match_lengths = {}
+    def _advance_match_lengths(self, input_ids: torch.LongTensor, num_candidates: int) -> torch.LongTensor:
+        '''
+        Advances the previous match lengths by the newly appended token:
+        length[i] = length_prev[i - 1] + 1 if input_ids[i] == new_token else 0.
+        '''
+        previous = self._match_lengths
+        if previous.shape[1] < num_candidates:
+            previous = torch.nn.functional.pad(previous, (num_candidates - previous.shape[1], 0))
 
-            for i in match_indices:
-                next_token = input_ids[i + 1]
+        previous = previous[:, previous.shape[1] - num_candidates:]
+        seq_len = input_ids.shape[1]
+        last_tokens = input_ids[:, -1]
 
-                if next_token in self.sequence_breakers:
-                    continue
+        matches = (input_ids[:, seq_len - 1 - num_candidates:seq_len - 1] == last_tokens.unsqueeze(1)) & ~self._is_breaker(last_tokens).unsqueeze(1)
+        return torch.where(matches, (previous + 1).clamp(max=self.max_match_length), torch.zeros_like(previous))
 
-                # We have already found that `last_token` matches at this index,
-                # so the match is at least of length 1.
-                match_length = 1
+    def _can_advance(self, input_ids: torch.LongTensor) -> bool:
+        return (
+            self._match_lengths is not None
+            and input_ids.shape[1] == self._seq_len + 1
+            and input_ids.shape[0] == self._last_tokens.shape[0]
+            and torch.equal(input_ids[:, -2], self._last_tokens)
+        )
 
-                # Extend the match backwards (at most to 50 to prevent exponent overflow at penalty calculation) (this cap also improves performance on worst case)
-                while match_length < 50:
-                    j = i - match_length
-                    if j < 0:
-                        # Start of input reached.
-                        break
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self._breaker_table is None or self._breaker_table.device != input_ids.device:
+            self._build_breaker_table(scores.shape[1], input_ids.device)
 
-                    previous_token = input_ids[-(match_length + 1)]
-                    if input_ids[j] != previous_token:
-                        # Start of match reached.
-                        break
+        seq_len = input_ids.shape[1]
+        num_candidates = self._num_candidates(seq_len)
 
-                    if previous_token in self.sequence_breakers:
-                        # Sequence-breaking token reached.
-                        break
+        if self._can_advance(input_ids):
+            match_lengths = self._advance_match_lengths(input_ids, num_candidates)
+        else:
+            match_lengths = self._compute_match_lengths(input_ids, num_candidates)
 
-                    match_length += 1
+        self._match_lengths = match_lengths
+        self._seq_len = seq_len
+        self._last_tokens = input_ids[:, -1].clone()
 
-                if next_token in match_lengths:
-                    match_lengths[next_token] = max(match_length, match_lengths[next_token])
-                else:
-                    match_lengths[next_token] = match_length
+        if num_candidates == 0:
+            return scores
+
+        # A match can't extend past the start of the range
+        if self._range_caps is None or self._range_caps.shape[0] < num_candidates or self._range_caps.device != input_ids.device:
+            self._range_caps = torch.arange(1, num_candidates + 1, device=input_ids.device)
+
+        match_lengths = torch.minimum(match_lengths, self._range_caps[:num_candidates])
+
+        next_tokens = input_ids[:, seq_len - num_candidates:]
+        match_lengths = match_lengths.masked_fill(self._is_breaker(next_tokens), 0)
+
+        # Only the (usually few) matches that are long enough get penalized
+        rows, columns = torch.nonzero(match_lengths >= self.allowed_length, as_tuple=True)
+        if rows.numel() == 0:
+            return scores
+
+        # Maximum matching sequence length for each token that could continue a match
+        keys = rows * scores.shape[1] + next_tokens[rows, columns]
+        unique_keys, inverse = torch.unique(keys, return_inverse=True)
+        max_lengths = torch.zeros(unique_keys.shape, dtype=torch.long, device=keys.device)
+        max_lengths.scatter_reduce_(0, inverse, match_lengths[rows, columns], reduce='amax')
 
-            # Apply penalties.
-            for token, match_length in match_lengths.items():
-                if match_length >= self.allowed_length:
-                    penalty = self.multiplier * self.base ** (match_length - self.allowed_length)
-                    scores_row[token] -= penalty
+        exponents = (max_lengths - self.allowed_length).to(device=scores.device, dtype=scores.dtype)
+        penalties = self.multiplier * torch.pow(torch.tensor(self.base, dtype=scores.dtype, device=scores.device), exponents)
+        unique_keys = unique_keys.to(scores.device)
+        scores[unique_keys // scores.shape[1], unique_keys % scores.shape[1]] -= penalties
 
         return scores
 
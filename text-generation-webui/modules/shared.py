@@ -85,6 +85,11 @@ group.add_argument('--no-kv-offload', action='store_true', help='Do not offload
 group.add_argument('--row-split', action='store_true', help='Split the model by rows across GPUs. This may improve multi-gpu performance.')
 group.add_argument('--extra-flags', type=str, default=None, help='Extra flags to pass to llama-server. Format: "flag1=value1,flag2,flag3=value3". Example: "override-tensor=exps=CPU"')
 group.add_argument('--streaming-llm', action='store_true', help='Activate StreamingLLM to avoid re-evaluating the entire prompt when old messages are removed.')
+group.add_argument('--model-pool-size', type=int, default=0, help='Number of llama.cpp models kept running in standby next to the active one. When above 0, switching models starts the new server while the old one keeps serving, and the idle timeout only releases standby models.')
+group.add_argument('--model-pool-memory', type=int, default=0, help='Memory budget in MiB for the active and standby llama.cpp models, measured by model file size. 0 means no limit.')
+group.add_argument('--warmup-characters', type=str, nargs='+', help='Characters whose prompt prefix is evaluated into the cache of every new llama.cpp server, one per server slot. Defaults to all characters.')
+group.add_argument('--hot-prefixes', type=str, default=None, help='JSON file with prompt prefixes to keep warm in new llama.cpp servers before the character prompts: a list of strings or an object of name -> string. Each is treated as the start of an instruct-mode user message.')
+group.add_argument('--slot-cache-dir', type=str, default=None, help='Directory for llama.cpp slot snapshots of the warm-up prefixes. Every new llama.cpp server restores them instead of evaluating the prefixes again, also after a reload or idle unload.')
 
 # Cache
 group = parser.add_argument_group('Context and cache')
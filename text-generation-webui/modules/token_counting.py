@@ -0,0 +1,225 @@
+'''
+Token accounting for chat prompts.
+
+Token counts of message contents are memoized by content hash, so a chat that
+hits the context limit tokenizes each message once (and on later turns only
+the new ones) instead of re-tokenizing the whole rendered prompt after every
+dropped message. The live counter of the chat input reuses the token count
+of the rendered history and only tokenizes what was typed.
+'''
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from modules import shared
+from modules.extensions import apply_extensions
+from modules.text_generation import encode, get_encoded_length
+
+MESSAGE_CACHE_SIZE = 8192
+HISTORY_CACHE_SIZE = 32
+
+# Settings that change how the history is rendered into a prompt
+PROMPT_STATE_KEYS = (
+    'mode', 'name1', 'name2', 'context', 'greeting', 'user_bio', 'custom_system_message',
+    'chat_template_str', 'instruction_template_str', 'chat-instruct_command',
+    'truncation_length', 'max_new_tokens', 'include_past_attachments',
+    'reasoning_effort', 'enable_thinking', 'tools',
+)
+
+_lock = threading.Lock()
+_message_tokens = OrderedDict()
+_history_tokens = OrderedDict()
+
+
+def _content_key(text):
+    return (shared.model_name, hashlib.sha1(text.encode('utf-8', 'surrogatepass')).hexdigest())
+
+
+def _fragment_length(text):
+    length = apply_extensions('tokenized_length', text)
+    if length is not None:
+        return length
+
+    return len(encode(text, add_special_tokens=False, add_bos_token=False)[0])
+
+
+def count_tokens(text):
+    """Token count of a prompt fragment (without BOS), memoized by content hash."""
+    if not text:
+        return 0
+
+    key = _content_key(text)
+    with _lock:
+        if key in _message_tokens:
+            _message_tokens.move_to_end(key)
+            return _message_tokens[key]
+
+    length = _fragment_length(text)
+    with _lock:
+        _message_tokens[key] = length
+        while len(_message_tokens) > MESSAGE_CACHE_SIZE:
+            _message_tokens.popitem(last=False)
+
+    return length
+
+
+def count_message_tokens(message):
+    return count_tokens(message.get('content', '')) + count_tokens(message.get('thinking', ''))
+
+
+def clear_cache():
+    with _lock:
+        _message_tokens.clear()
+        _history_tokens.clear()
+
+
+def _history_fingerprint(state):
+    history = state['history']
+    data = [shared.model_name, history.get('internal'), history.get('metadata')]
+    data += [state.get(key) for key in PROMPT_STATE_KEYS]
+    serialized = json.dumps(data, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(serialized.encode('utf-8', 'surrogatepass')).hexdigest()
+
+
+def history_token_counts(state, build_prompt):
+    '''
+    Returns (history_tokens, message_overhead): the length of the prompt built
+    without user input, and the tokens the template adds around a new user message.
+
+    build_prompt(user_input) renders the full prompt. The result is cached per chat
+    until the history or the prompt settings change, so while the user is typing
+    the template is not rendered again.
+    '''
+    chat_key = state.get('unique_id') or ''
+    fingerprint = _history_fingerprint(state)
+    with _lock:
+        cached = _history_tokens.get(chat_key)
+        if cached is not None and cached[0] == fingerprint:
+            _history_tokens.move_to_end(chat_key)
+            return cached[1:]
+
+    history_tokens = get_encoded_length(build_prompt(''))
+    placeholder = '.'
+    overhead = get_encoded_length(build_prompt(placeholder)) - history_tokens - count_tokens(placeholder)
+    overhead = max(0, overhead)
+
+    with _lock:
+        _history_tokens[chat_key] = (fingerprint, history_tokens, overhead)
+        _history_tokens.move_to_end(chat_key)
+        while len(_history_tokens) > HISTORY_CACHE_SIZE:
+            _history_tokens.popitem(last=False)
+
+    return history_tokens, overhead
+
+
+def count_prompt_with_input(state, fragments, build_prompt):
+    '''
+    Estimated length of the prompt once the fragments (typed text, attachments)
+    are sent as a new user message. Only the fragments are tokenized on each call.
+    '''
+    fragments = [fragment for fragment in fragments if fragment]
+    history_tokens, overhead = history_token_counts(state, build_prompt)
+    if not fragments:
+        return history_tokens
+
+    return history_tokens + overhead + sum(count_tokens(fragment) for fragment in fragments)
+
+
+def truncate_messages(messages, make_prompt, max_length, prompt=None, encoded_length=None):
+    '''
+    Drops the oldest messages, keeping the system message and the last message,
+    until the rendered prompt fits in max_length tokens. The cut point is computed
+    from the memoized per-message counts, so the template is usually rendered and
+    tokenized a few times regardless of the history length.
+
+    Modifies messages in place and returns (prompt, encoded_length).
+    '''
+    if prompt is None:
+        prompt = make_prompt(messages)
+    if encoded_length is None:
+        encoded_length = get_encoded_length(prompt)
+
+    start = 1 if len(messages) > 0 and messages[0]['role'] == 'system' else 0
+    if encoded_length <= max_length or len(messages) - start <= 1:
+        return prompt, encoded_length
+
+    # Tokens the template adds around each message. The first estimate also spreads
+    # the fixed part of the template (BOS, generation prefix) over the messages, so
+    # it errs on the side of dropping too few; after the first cut it is measured.
+    content_total = sum(count_message_tokens(message) for message in messages)
+    overhead = max(0, -(-(encoded_length - content_total) // len(messages)))
+    removed = []
+    while encoded_length > max_length and len(messages) - start > 1:
+        excess = encoded_length - max_length
+        removable = len(messages) - start - 1
+
+        dropped = content_tokens = 0
+        while dropped < removable and content_tokens + overhead * dropped < excess:
+            content_tokens += count_message_tokens(messages[start + dropped])
+            dropped += 1
+
+        removed.extend(messages[start:start + dropped])
+        del messages[start:start + dropped]
+        previous_length = encoded_length
+        prompt = make_prompt(messages)
+        encoded_length = get_encoded_length(prompt)
+        overhead = max(0, (previous_length - encoded_length - content_tokens) // dropped)
+
+    # The overhead is an average, so with role-dependent tags the last pass can
+    # drop one message too many: put back the newest dropped messages that fit
+    while removed and encoded_length + count_message_tokens(removed[-1]) <= max_length:
+        candidate = messages[:start] + removed[-1:] + messages[start:]
+        candidate_prompt = make_prompt(candidate)
+        candidate_length = get_encoded_length(candidate_prompt)
+        if candidate_length > max_length:
+            break
+
+        messages.insert(start, removed.pop())
+        prompt, encoded_length = candidate_prompt, candidate_length
+
+    return prompt, encoded_length
+
+
+def _longest_prefix(text, budget):
+    '''Length in characters of the longest prefix of text that fits in budget tokens.'''
+    if _fragment_length(text) <= budget:
+        return len(text)
+
+    left, right = 0, len(text) - 1
+    while left < right:
+        mid = (left + right + 1) // 2
+        if _fragment_length(text[:mid]) <= budget:
+            left = mid
+        else:
+            right = mid - 1
+
+    return left
+
+
+def truncate_last_message(messages, make_prompt, max_length):
+    '''
+    Cuts the end of the last message so that the prompt fits in max_length tokens.
+    Only the message itself is re-tokenized while searching for the cut point;
+    the full prompt is rendered to measure the template and to verify the result.
+
+    Modifies messages in place and returns (prompt, encoded_length).
+    '''
+    content = messages[-1]['content']
+    messages[-1]['content'] = ''
+    prompt = make_prompt(messages)
+    encoded_length = get_encoded_length(prompt)
+
+    budget = max_length - encoded_length
+    while budget > 0:
+        messages[-1]['content'] = content[:_longest_prefix(content, budget)]
+        prompt = make_prompt(messages)
+        encoded_length = get_encoded_length(prompt)
+        if encoded_length <= max_length:
+            break
+
+        # Tokens can merge across the boundary between the message and the template
+        budget -= encoded_length - max_length
+
+    return prompt, encoded_length
@@ -24,6 +24,11 @@ from modules.evaluate import (
 )
 from modules.logging_colors import logger
 from modules.models import reload_model
+from modules.training_data import (
+    RawTextConfig,
+    prepare_raw_text_dataset,
+    tokenize_sample
+)
 from modules.utils import natural_keys
 
 PARAMETERS = ["lora_name", "always_override", "q_proj_en", "v_proj_en", "k_proj_en", "o_proj_en", "gate_proj_en", "down_proj_en", "up_proj_en", "save_steps", "micro_batch_size", "batch_size", "epochs", "learning_rate", "lr_scheduler_type", "lora_rank", "lora_alpha", "lora_dropout", "cutoff_len", "dataset", "eval_dataset", "format", "eval_steps", "raw_text_file", "overlap_len", "newline_favor_len", "higher_rank_limit", "warmup_steps", "optimizer", "hard_cut_string", "train_only_after", "stop_at_loss", "add_eos_token", "min_chars", "report_to"]
@@ -278,7 +283,7 @@ def do_train(lora_name: str, always_override: bool, q_proj_en: bool, v_proj_en:
 
     import torch
     import transformers
-    from datasets import Dataset, load_dataset
+    from datasets import load_dataset
     from peft import (
         LoraConfig,
         get_peft_model,
@@ -351,44 +356,8 @@ def do_train(lora_name: str, always_override: bool, q_proj_en: bool, v_proj_en:
         target_mods = [f"{name}_proj" for name, enabled in available_modules.items() if enabled]
         return target_mods
 
-    def encode(text, add_bos_token):
-        result = shared.tokenizer.encode(text, truncation=True, max_length=cutoff_len)
-        # Check if the first two tokens are BOS
-        if len(result) >= 2 and result[:2] == [shared.tokenizer.bos_token_id, shared.tokenizer.bos_token_id]:
-            result = result[1:]
-
-        if not add_bos_token and result[0] == shared.tokenizer.bos_token_id:
-            result = result[1:]
-        return result
-
     def tokenize(prompt, append_eos_token=False):
-
-        if train_only_after == '' or train_only_after not in prompt:
-            input_ids = encode(prompt, True)
-
-            if append_eos_token and input_ids[-1] != shared.tokenizer.eos_token_id and len(input_ids) < cutoff_len:
-                input_ids.append(shared.tokenizer.eos_token_id)
-
-            input_ids = [shared.tokenizer.pad_token_id] * (cutoff_len - len(input_ids)) + input_ids
-            labels = [1] * len(input_ids)
-
-        else:
-            ind = prompt.index(train_only_after) + len(train_only_after)
-            before_tokens = encode(prompt[:ind], True)
-            after_tokens = encode(prompt[ind:], False)
-
-            if append_eos_token and after_tokens[-1] != shared.tokenizer.eos_token_id:
-                after_tokens.append(shared.tokenizer.eos_token_id)
-
-            full_length = len(after_tokens) + len(before_tokens)
-            if full_length > cutoff_len:
-                after_tokens = after_tokens[:cutoff_len - len(before_tokens)]
-            else:
-                before_tokens = [shared.tokenizer.pad_token_id] * (cutoff_len - full_length) + before_tokens
-
-            input_ids = before_tokens + after_tokens
-            labels = [-100] * len(before_tokens) + [1] * len(after_tokens)
-
+        input_ids, labels = tokenize_sample(shared.tokenizer, prompt, cutoff_len, train_only_after, append_eos_token)
         input_ids = torch.tensor(input_ids)
         return {
             "input_ids": input_ids,
@@ -406,48 +375,26 @@ def do_train(lora_name: str, always_override: bool, q_proj_en: bool, v_proj_en:
         fullpath = Path(fullpath)
         if fullpath.is_dir():
             logger.info('Training path directory {}'.format(raw_text_file))
-            raw_text = ""
-            file_paths = sorted(fullpath.glob('*.txt'), key=lambda path: natural_keys(path.name))
-            for file_path in file_paths:
-                if file_path.is_file():
-                    with file_path.open('r', encoding='utf-8') as file:
-                        raw_text += file.read().replace('\r', '')
-
-                    logger.info(f"Loaded training file: {file_path.name}")
+            file_paths = sorted((path for path in fullpath.glob('*.txt') if path.is_file()), key=lambda path: natural_keys(path.name))
         else:
-            with open(clean_path('user_data/training/datasets', f'{raw_text_file}.txt'), 'r', encoding='utf-8') as file:
-                raw_text = file.read().replace('\r', '')
-
-        cut_string = hard_cut_string.replace('\\n', '\n')
-        eos_added = 0
-        out_tokens = []
-        for text_part in raw_text.split(cut_string):
-            if len(text_part.strip()) <= min_chars:
-                continue
-
-            tokens = shared.tokenizer.encode(text_part)
-            if add_eos_token:
-                tokens.append(shared.tokenizer.eos_token_id)
-                eos_added += 1
-
-            step = cutoff_len - overlap_len
-            if step <= 0:
-                yield f"Error: overlap_len ({overlap_len}) cannot be greater than or equal to cutoff_len ({cutoff_len})"
-                return
-
-            out_tokens.extend(split_chunks(tokens, cutoff_len, step))
-
-        if eos_added > 0:
-            print(f"EOS added to {eos_added} text blocks")
+            file_paths = [Path(clean_path('user_data/training/datasets', f'{raw_text_file}.txt'))]
 
-        del raw_text  # Note: could be a gig for a large dataset, so delete redundant data as we go to be safe on RAM
-        text_chunks = [shared.tokenizer.decode(x) for x in out_tokens]
-        del out_tokens
-        if newline_favor_len > 0:
-            text_chunks = [cut_chunk_for_newline(x, newline_favor_len) for x in text_chunks]
+        if overlap_len >= cutoff_len:
+            yield f"Error: overlap_len ({overlap_len}) cannot be greater than or equal to cutoff_len ({cutoff_len})"
+            return
 
-        train_data = Dataset.from_list([tokenize(x) for x in text_chunks])
-        del text_chunks
+        yield "Tokenizing the dataset..."
+        raw_text_config = RawTextConfig(
+            cutoff_len=cutoff_len,
+            overlap_len=overlap_len,
+            newline_favor_len=newline_favor_len,
+            cut_string=hard_cut_string.replace('\\n', '\n'),
+            train_only_after=train_only_after,
+            add_eos_token=add_eos_token,
+            min_chars=min_chars,
+        )
+
+        train_data = prepare_raw_text_dataset(file_paths, shared.tokenizer, raw_text_config)
         eval_data = None
     else:
         if dataset in ['None', '']:
@@ -734,29 +681,6 @@ def do_train(lora_name: str, always_override: bool, q_proj_en: bool, v_proj_en:
         yield f"Done! LoRA saved to `{lora_file_path}`.\n\nBefore testing your new LoRA, make sure to first reload the model, as it is currently dirty from training."
 
 
-def split_chunks(arr, size, step):
-    for i in range(0, len(arr), step):
-        yield arr[i:i + size]
-
-
-def cut_chunk_for_newline(chunk: str, max_length: int):
-    if '\n' not in chunk:
-        return chunk
-
-    first_newline = chunk.index('\n')
-    if first_newline < max_length:
-        chunk = chunk[first_newline + 1:]
-
-    if '\n' not in chunk:
-        return chunk
-
-    last_newline = chunk.rindex('\n')
-    if len(chunk) - last_newline < max_length:
-        chunk = chunk[:last_newline]
-
-    return chunk
-
-
 def format_time(seconds: float):
     if seconds < 120:
         return f"`{seconds:.0f}` seconds"
@@ -0,0 +1,357 @@
+'''
+Raw text dataset preparation for LoRA training.
+
+Text files are streamed and split on the hard cut string without loading
+the whole corpus into memory, text blocks are tokenized in worker processes,
+and the samples are written to a memory-mapped token cache. The cache is keyed
+by the dataset contents, the tokenizer and every setting that affects the
+samples, so a second run with the same inputs skips tokenization entirely.
+'''
+
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import shutil
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import numpy as np
+
+from modules.logging_colors import logger
+
+CACHE_DIR = Path('user_data/training/cache')
+CACHE_VERSION = 1
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+BATCH_CHARS = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class RawTextConfig:
+    cutoff_len: int
+    overlap_len: int
+    newline_favor_len: int
+    cut_string: str
+    train_only_after: str
+    add_eos_token: bool
+    min_chars: int
+
+
+def split_chunks(arr, size, step):
+    for i in range(0, len(arr), step):
+        yield arr[i:i + size]
+
+
+def cut_chunk_for_newline(chunk: str, max_length: int):
+    if '\n' not in chunk:
+        return chunk
+
+    first_newline = chunk.index('\n')
+    if first_newline < max_length:
+        chunk = chunk[first_newline + 1:]
+
+    if '\n' not in chunk:
+        return chunk
+
+    last_newline = chunk.rindex('\n')
+    if len(chunk) - last_newline < max_length:
+        chunk = chunk[:last_newline]
+
+    return chunk
+
+
+def encode_sample(tokenizer, text, add_bos_token, cutoff_len):
+    result = tokenizer.encode(text, truncation=True, max_length=cutoff_len)
+    # Check if the first two tokens are BOS
+    if len(result) >= 2 and result[:2] == [tokenizer.bos_token_id, tokenizer.bos_token_id]:
+        result = result[1:]
+
+    if not add_bos_token and result[0] == tokenizer.bos_token_id:
+        result = result[1:]
+    return result
+
+
+def tokenize_sample(tokenizer, prompt, cutoff_len, train_only_after, append_eos_token=False):
+    '''
+    Returns (input_ids, labels), left-padded to cutoff_len.
+    '''
+    if train_only_after == '' or train_only_after not in prompt:
+        input_ids = encode_sample(tokenizer, prompt, True, cutoff_len)
+
+        if append_eos_token and input_ids[-1] != tokenizer.eos_token_id and len(input_ids) < cutoff_len:
+            input_ids.append(tokenizer.eos_token_id)
+
+        input_ids = [tokenizer.pad_token_id] * (cutoff_len - len(input_ids)) + input_ids
+        labels = [1] * len(input_ids)
+
+    else:
+        ind = prompt.index(train_only_after) + len(train_only_after)
+        before_tokens = encode_sample(tokenizer, prompt[:ind], True, cutoff_len)
+        after_tokens = encode_sample(tokenizer, prompt[ind:], False, cutoff_len)
+
+        if append_eos_token and after_tokens[-1] != tokenizer.eos_token_id:
+            after_tokens.append(tokenizer.eos_token_id)
+
+        full_length = len(after_tokens) + len(before_tokens)
+        if full_length > cutoff_len:
+            after_tokens = after_tokens[:cutoff_len - len(before_tokens)]
+        else:
+            before_tokens = [tokenizer.pad_token_id] * (cutoff_len - full_length) + before_tokens
+
+        input_ids = before_tokens + after_tokens
+        labels = [-100] * len(before_tokens) + [1] * len(after_tokens)
+
+    return input_ids, labels
+
+
+def iter_text_parts(file_paths, cut_string, block_size=READ_BLOCK_SIZE):
+    '''
+    Streaming equivalent of joining all files and calling .split(cut_string).
+    Only the text block currently being assembled is held in memory.
+    '''
+    # Anything shorter than the cut string at the end of a read may be the start of a cut
+    carry_len = max(len(cut_string) - 1, 0)
+    pending = []
+    carry = ''
+    for file_path in file_paths:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            while block := file.read(block_size):
+                text = carry + block.replace('\r', '')
+                start = 0
+                if cut_string:
+                    while (index := text.find(cut_string, start)) != -1:
+                        pending.append(text[start:index])
+                        yield ''.join(pending)
+                        pending = []
+                        start = index + len(cut_string)
+
+                keep = max(start, len(text) - carry_len) if cut_string else len(text)
+                pending.append(text[start:keep])
+                carry = text[keep:]
+
+        logger.info(f"Loaded training file: {Path(file_path).name}")
+
+    pending.append(carry)
+    yield ''.join(pending)
+
+
+def dataset_fingerprint(file_paths):
+    h = hashlib.sha256()
+    for file_path in file_paths:
+        h.update(Path(file_path).name.encode('utf-8') + b'\0')
+        with open(file_path, 'rb') as file:
+            while block := file.read(READ_BLOCK_SIZE):
+                h.update(block)
+
+        h.update(b'\0')
+
+    return h.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer):
+    h = hashlib.sha256(type(tokenizer).__name__.encode('utf-8'))
+    backend = getattr(tokenizer, 'backend_tokenizer', None)
+    if backend is not None:
+        h.update(backend.to_str().encode('utf-8'))
+    else:
+        h.update(f"{getattr(tokenizer, 'name_or_path', '')}:{len(tokenizer)}".encode('utf-8'))
+
+    special = [tokenizer.bos_token_id, tokenizer.eos_token_id, tokenizer.pad_token_id]
+    h.update(json.dumps(special).encode('utf-8'))
+    return h.hexdigest()
+
+
+def cache_key(dataset_hash, tokenizer_hash, config):
+    payload = json.dumps({
+        'version': CACHE_VERSION,
+        'dataset': dataset_hash,
+        'tokenizer': tokenizer_hash,
+        'config': asdict(config),
+    }, sort_keys=True)
+
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+class TokenCacheDataset:
+    '''
+    Map-style dataset over the memory-mapped token cache.
+    Samples are read from disk on access, so the corpus never sits in RAM.
+    '''
+
+    def __init__(self, path, num_samples, cutoff_len, pad_token_id):
+        self.path = Path(path)
+        self.pad_token_id = pad_token_id
+        shape = (num_samples, cutoff_len)
+        if num_samples == 0:
+            # Empty files cannot be memory-mapped
+            self.input_ids = np.zeros(shape, dtype=np.int32)
+            self.train_mask = np.zeros(shape, dtype=np.int8)
+        else:
+            self.input_ids = np.memmap(self.path / 'input_ids.bin', dtype=np.int32, mode='r', shape=shape)
+            self.train_mask = np.memmap(self.path / 'train_mask.bin', dtype=np.int8, mode='r', shape=shape)
+
+    def __len__(self):
+        return self.input_ids.shape[0]
+
+    def __getitem__(self, index):
+        import torch
+
+        input_ids = torch.from_numpy(self.input_ids[index].astype(np.int64))
+        return {
+            "input_ids": input_ids,
+            "labels": np.where(self.train_mask[index] != 0, 1, -100).tolist(),
+            "attention_mask": input_ids.ne(self.pad_token_id),
+        }
+
+
+# Per-process state of the tokenization workers
+_worker_tokenizer = None
+_worker_config = None
+
+
+def _init_worker(tokenizer, config):
+    global _worker_tokenizer, _worker_config
+    # Parallelism comes from the worker processes, not from the Rust tokenizer threads
+    os.environ['TOKENIZERS_PARALLELISM'] = 'false'
+    _worker_tokenizer = tokenizer
+    _worker_config = config
+
+
+def _tokenize_parts(parts):
+    '''
+    Turns a batch of text blocks into training samples.
+    Returns (input_ids, train_mask, eos_added) as numpy arrays of shape (n, cutoff_len).
+    '''
+    tokenizer, config = _worker_tokenizer, _worker_config
+    step = config.cutoff_len - config.overlap_len
+    rows, masks = [], []
+    eos_added = 0
+    for text_part in parts:
+        tokens = tokenizer.encode(text_part)
+        if config.add_eos_token:
+            tokens.append(tokenizer.eos_token_id)
+            eos_added += 1
+
+        for chunk in split_chunks(tokens, config.cutoff_len, step):
+            text = tokenizer.decode(chunk)
+            if config.newline_favor_len > 0:
+                text = cut_chunk_for_newline(text, config.newline_favor_len)
+
+            input_ids, labels = tokenize_sample(tokenizer, text, config.cutoff_len, config.train_only_after)
+            rows.append(input_ids)
+            masks.append([label != -100 for label in labels])
+
+    shape = (len(rows), config.cutoff_len)
+    input_ids = np.array(rows, dtype=np.int32).reshape(shape)
+    train_mask = np.array(masks, dtype=np.int8).reshape(shape)
+    return input_ids, train_mask, eos_added
+
+
+def _iter_batches(file_paths, config):
+    batch, size = [], 0
+    for text_part in iter_text_parts(file_paths, config.cut_string):
+        if len(text_part.strip()) <= config.min_chars:
+            continue
+
+        batch.append(text_part)
+        size += len(text_part)
+        if size >= BATCH_CHARS:
+            yield batch
+            batch, size = [], 0
+
+    if batch:
+        yield batch
+
+
+def _iter_tokenized(file_paths, tokenizer, config, num_workers):
+    '''
+    Tokenizes batches in worker processes and yields the results in input order.
+    Only a bounded number of batches is in flight, so memory stays flat.
+    '''
+    if num_workers <= 1:
+        _init_worker(tokenizer, config)
+        for batch in _iter_batches(file_paths, config):
+            yield _tokenize_parts(batch)
+
+        return
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, initializer=_init_worker, initargs=(tokenizer, config)) as executor:
+        in_flight = collections.deque()
+        for batch in _iter_batches(file_paths, config):
+            in_flight.append(executor.submit(_tokenize_parts, batch))
+            if len(in_flight) >= num_workers * 2:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
+
+
+def load_cached_dataset(path, pad_token_id):
+    try:
+        with open(Path(path) / 'meta.json', 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    return TokenCacheDataset(path, meta['num_samples'], meta['cutoff_len'], pad_token_id)
+
+
+def prepare_raw_text_dataset(file_paths, tokenizer, config, num_workers=None, cache_dir=CACHE_DIR):
+    '''
+    Returns a TokenCacheDataset for the given text files, building the token cache if needed.
+    '''
+    if config.cutoff_len - config.overlap_len <= 0:
+        raise ValueError(f"overlap_len ({config.overlap_len}) cannot be greater than or equal to cutoff_len ({config.cutoff_len})")
+
+    file_paths = [Path(p) for p in file_paths]
+    key = cache_key(dataset_fingerprint(file_paths), tokenizer_fingerprint(tokenizer), config)
+    cache_path = Path(cache_dir) / key
+
+    dataset = load_cached_dataset(cache_path, tokenizer.pad_token_id)
+    if dataset is not None:
+        logger.info(f"Using cached tokenized dataset ({len(dataset)} samples) from \"{cache_path}\"")
+        return dataset
+
+    if num_workers is None:
+        num_workers = min(8, max(1, (os.cpu_count() or 1) - 1))
+
+    # Build in a temporary folder; meta.json is written last and the folder renamed into place
+    started = time.time()
+    tmp_path = Path(cache_dir) / f'{key}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir(parents=True)
+    num_samples = 0
+    eos_added = 0
+    try:
+        with open(tmp_path / 'input_ids.bin', 'wb') as ids_file, open(tmp_path / 'train_mask.bin', 'wb') as mask_file:
+            for input_ids, train_mask, eos in _iter_tokenized(file_paths, tokenizer, config, num_workers):
+                ids_file.write(input_ids.tobytes())
+                mask_file.write(train_mask.tobytes())
+                num_samples += input_ids.shape[0]
+                eos_added += eos
+
+        with open(tmp_path / 'meta.json', 'w', encoding='utf-8') as file:
+            json.dump({
+                'version': CACHE_VERSION,
+                'num_samples': num_samples,
+                'cutoff_len': config.cutoff_len,
+                'eos_added': eos_added,
+                'files': [p.name for p in file_paths],
+                'config': asdict(config),
+            }, file, indent=2)
+
+        if cache_path.exists():
+            shutil.rmtree(cache_path)
+
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    if eos_added > 0:
+        print(f"EOS added to {eos_added} text blocks")
+
+    logger.info(f"Tokenized {num_samples} samples in {time.time() - started:.1f} seconds, cached to \"{cache_path}\"")
+    return load_cached_dataset(cache_path, tokenizer.pad_token_id)
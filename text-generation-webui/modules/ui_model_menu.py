@@ -11,7 +11,8 @@ import gradio as gr
 from modules import loaders, shared, ui, utils
 from modules.logging_colors import logger
 from modules.LoRA import add_lora_to_model
-from modules.models import load_model, unload_model
+from modules.model_lifecycle import switch_model
+from modules.models import unload_model
 from modules.models_settings import (
     apply_model_settings_to_state,
     get_model_metadata,
@@ -193,9 +194,10 @@ def load_model_wrapper(selected_model, loader, autoload=False):
     else:
         try:
             yield f"Loading `{selected_model}`..."
-            unload_model()
             if selected_model != '':
-                shared.model, shared.tokenizer = load_model(selected_model, loader)
+                shared.model, shared.tokenizer = switch_model(selected_model, loader)
+            else:
+                unload_model()
 
             if shared.model is not None:
                 yield f"Successfully loaded `{selected_model}`."
@@ -345,9 +347,12 @@ def download_model_wrapper(repo_id, specific_file, progress=gr.Progress(), retur
                     yield data
                     break
                 elif isinstance(msg_identifier, float):
-                    progress_value = msg_identifier
-                    description_str = data
-                    progress(progress_value, f"Downloading: {description_str}")
+                    status = downloader.progress.snapshot()
+                    description_str = f"Downloading: {data} ({format_file_size(int(status['speed']))}/s"
+                    if status['eta'] is not None:
+                        description_str += f", {status['eta']:.0f} s left"
+
+                    progress(status['fraction'], description_str + ")")
 
             except queue.Empty:
                 if not download_thread.is_alive():
@@ -1,100 +1,218 @@
 import concurrent.futures
+import hashlib
 import html
+import json
+import os
 import re
+import threading
+import time
 from concurrent.futures import as_completed
 from datetime import datetime
+from pathlib import Path
 from urllib.parse import quote_plus
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from modules import shared
 from modules.logging_colors import logger
 
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+SEARCH_URL = 'https://html.duckduckgo.com/html/?q={query}'
+
+# Pages are revalidated with a conditional request once they are older than this
+PAGE_CACHE_TTL = 6 * 60 * 60
+SEARCH_CACHE_TTL = 30 * 60
+
+FETCH_WORKERS = 8
+CONVERT_WORKERS = min(4, os.cpu_count() or 1)
+
+_lock = threading.Lock()
+_session = None
+_fetch_executor = None
+_convert_executor = None
+
 
 def get_current_timestamp():
     """Returns the current time in 24-hour format"""
     return datetime.now().strftime('%b %d, %Y %H:%M')
 
 
+def _get_session():
+    """Shared HTTP session, so repeated searches reuse keep-alive connections"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers['User-Agent'] = USER_AGENT
+            adapter = HTTPAdapter(pool_connections=FETCH_WORKERS, pool_maxsize=FETCH_WORKERS)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+
+        return _session
+
+
+def _get_fetch_executor(max_workers=FETCH_WORKERS):
+    global _fetch_executor
+    with _lock:
+        if _fetch_executor is None:
+            _fetch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='web_search')
+
+        return _fetch_executor
+
+
+def _get_convert_executor():
+    global _convert_executor
+    with _lock:
+        if _convert_executor is None:
+            _convert_executor = concurrent.futures.ThreadPoolExecutor(max_workers=CONVERT_WORKERS, thread_name_prefix='web_search_convert')
+
+        return _convert_executor
+
+
+def html_to_markdown(html_text):
+    """Convert HTML to Markdown"""
+    import html2text
+
+    h = html2text.HTML2Text()
+    h.body_width = 0
+    h.ignore_images = True
+    h.ignore_links = True
+    return h.handle(html_text)
+
+
+def _convert(html_text):
+    """
+    Pages are converted in a small thread pool shared by all searches. A
+    process pool would fork the webui process (threads, a loaded model,
+    CUDA state) or, with spawn, re-import the server and parse its argv.
+    """
+    return _get_convert_executor().submit(html_to_markdown, html_text).result()
+
+
+def _cache_path(key):
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return Path(shared.args.disk_cache_dir) / 'web_search' / f'{digest}.json'
+
+
+def _cache_load(key):
+    path = _cache_path(key)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    return entry if entry.get('key') == key else None
+
+
+def _cache_store(key, entry):
+    path = _cache_path(key)
+    entry = dict(entry, key=key)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Could not write web search cache entry for {key}: {e}")
+
+
 def download_web_page(url, timeout=10):
     """
     Download a web page and convert its HTML content to structured Markdown text.
+    Pages are cached on disk; stale entries are revalidated with ETag/Last-Modified.
     """
-    import html2text
+    cached = _cache_load(url)
+    if cached is not None and time.time() - cached['fetched_at'] < PAGE_CACHE_TTL:
+        return cached['content']
 
-    try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=timeout)
-        response.raise_for_status()  # Raise an exception for bad status codes
+    headers = {}
+    if cached is not None:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
 
-        # Initialize the HTML to Markdown converter
-        h = html2text.HTML2Text()
-        h.body_width = 0
-        h.ignore_images = True
-        h.ignore_links = True
+    try:
+        response = _get_session().get(url, headers=headers, timeout=timeout)
+        if response.status_code == 304 and cached is not None:
+            cached['fetched_at'] = time.time()
+            _cache_store(url, cached)
+            return cached['content']
 
-        # Convert the HTML to Markdown
-        markdown_text = h.handle(response.text)
+        response.raise_for_status()  # Raise an exception for bad status codes
+        markdown_text = _convert(response.text)
+        _cache_store(url, {
+            'fetched_at': time.time(),
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'content': markdown_text,
+        })
 
         return markdown_text
     except requests.exceptions.RequestException as e:
         logger.error(f"Error downloading {url}: {e}")
-        return ""
+        # A stale copy is better than no attachment at all
+        return cached['content'] if cached is not None else ""
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")
         return ""
 
 
+def _search_links(query, num_pages, timeout):
+    """Returns [(url, title)] for the top search results"""
+    cache_key = f'search:{query}'
+    cached = _cache_load(cache_key)
+    if cached is not None and time.time() - cached['fetched_at'] < SEARCH_CACHE_TTL and len(cached['links']) >= num_pages:
+        return [tuple(link) for link in cached['links'][:num_pages]]
+
+    # Use DuckDuckGo HTML search endpoint
+    response = _get_session().get(SEARCH_URL.format(query=quote_plus(query)), timeout=timeout)
+    response.raise_for_status()
+
+    # Extract results with regex
+    titles = re.findall(r'<a[^>]*class="[^"]*result__a[^"]*"[^>]*>(.*?)</a>', response.text, re.DOTALL)
+    urls = re.findall(r'<a[^>]*class="[^"]*result__url[^"]*"[^>]*>(.*?)</a>', response.text, re.DOTALL)
+
+    links = []
+    for url, title in zip(urls, titles):
+        title = html.unescape(re.sub(r'<[^>]+>', '', title).strip())
+        links.append((f"https://{url.strip()}", title))
+
+    _cache_store(cache_key, {'fetched_at': time.time(), 'links': links})
+    return links[:num_pages]
+
+
 def perform_web_search(query, num_pages=3, max_workers=5, timeout=10):
     """Perform web search and return results with content"""
     try:
-        # Use DuckDuckGo HTML search endpoint
-        search_url = f"https://html.duckduckgo.com/html/?q={quote_plus(query)}"
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
-
-        response = requests.get(search_url, headers=headers, timeout=timeout)
-        response.raise_for_status()
-
-        # Extract results with regex
-        titles = re.findall(r'<a[^>]*class="[^"]*result__a[^"]*"[^>]*>(.*?)</a>', response.text, re.DOTALL)
-        urls = re.findall(r'<a[^>]*class="[^"]*result__url[^"]*"[^>]*>(.*?)</a>', response.text, re.DOTALL)
-
-        # Prepare download tasks
-        download_tasks = []
-        for i in range(min(len(titles), len(urls), num_pages)):
-            url = f"https://{urls[i].strip()}"
-            title = re.sub(r'<[^>]+>', '', titles[i]).strip()
-            title = html.unescape(title)
-            download_tasks.append((url, title, i))
-
-        search_results = [None] * len(download_tasks)  # Pre-allocate to maintain order
-
-        # Download pages in parallel
-        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all download tasks
-            future_to_task = {
-                executor.submit(download_web_page, task[0]): task
-                for task in download_tasks
-            }
+        links = _search_links(query, num_pages, timeout)
+        search_results = [None] * len(links)  # Pre-allocate to maintain order
+
+        # Download pages in parallel on the shared pool
+        executor = _get_fetch_executor(max(max_workers, FETCH_WORKERS))
+        future_to_index = {
+            executor.submit(download_web_page, url, timeout): i
+            for i, (url, _) in enumerate(links)
+        }
 
-            # Collect results as they complete
-            for future in as_completed(future_to_task):
-                url, title, index = future_to_task[future]
-                try:
-                    content = future.result()
-                    search_results[index] = {
-                        'title': title,
-                        'url': url,
-                        'content': content
-                    }
-                except Exception:
-                    search_results[index] = {
-                        'title': title,
-                        'url': url,
-                        'content': ''
-                    }
+        # Collect results as they complete
+        for future in as_completed(future_to_index):
+            index = future_to_index[future]
+            url, title = links[index]
+            try:
+                content = future.result()
+            except Exception:
+                content = ''
+
+            search_results[index] = {
+                'title': title,
+                'url': url,
+                'content': content
+            }
 
         return search_results
 
@@ -104,19 +222,29 @@ def perform_web_search(query, num_pages=3, max_workers=5, timeout=10):
 
 
 def truncate_content_by_tokens(content, max_tokens=8192):
-    """Truncate content to fit within token limit using binary search"""
-    if len(shared.tokenizer.encode(content)) <= max_tokens:
-        return content
+    """Truncate content to fit within token limit with a single tokenizer pass"""
+    tokenizer = shared.tokenizer
+
+    # Fast HF tokenizers report the character span of every token
+    try:
+        offsets = tokenizer(content, add_special_tokens=False, return_offsets_mapping=True)['offset_mapping']
+    except (TypeError, NotImplementedError, KeyError):
+        offsets = None
 
-    left, right = 0, len(content)
-    while left < right:
-        mid = (left + right + 1) // 2
-        if len(shared.tokenizer.encode(content[:mid])) <= max_tokens:
-            left = mid
-        else:
-            right = mid - 1
+    if offsets is not None:
+        if len(offsets) <= max_tokens:
+            return content
+
+        return content[:offsets[max_tokens - 1][1]]
+
+    # Other backends (e.g. llama.cpp): encode once, decode the kept prefix
+    tokens = tokenizer.encode(content)
+    if len(tokens) <= max_tokens:
+        return content
 
-    return content[:left]
+    # Decoding may normalize whitespace, so only the prefix length is taken from it
+    prefix = tokenizer.decode(tokens[:max_tokens], skip_special_tokens=True)
+    return content[:len(prefix)]
 
 
 def add_web_search_attachments(history, row_idx, user_message, search_query, state):